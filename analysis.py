@@ -7,7 +7,8 @@ import datetime
 from utils import PATH_TILL_LOGGAR
 import os
 import pandas_ta as ta
-from heapq import *
+from leaderboard import TradeLeaderboard
+from portfolio_valuation import LOG_TIMESTAMP_FORMAT
 import yfinance as yf
 
 DEBUG = False
@@ -68,18 +69,23 @@ bot_fig = 1
 total_trade_fig = 2
 port_fig = 3
 
+# Loggarna läses i bitar om så här många rader, så minnet beror inte på hur stora eller hur många filerna är
+CHUNK_SIZE = 50_000
+
 # Amount of times sold quantity did not match bought quantity
 total_quantity_discrapencies = 0
-# Amount of profitable trades for each bot
+# Amount and sum of profitable trades for each bot: {bot: {"count": n, "total": profit}}
 trades_profit_by_bot = {}
-# Amount of unprofitable trades for each bot
+# Amount and sum of unprofitable trades for each bot: {bot: {"count": n, "total": loss}}
 trades_loss_by_bot = {}
-# Top x most profitable trades
-most_profitable_trades = []
-# Top x highest losses on trades
-least_profitable_trades = []
+# Top x most profitable and highest losses on trades, overall, per bot and per ticker
+trade_leaderboard = TradeLeaderboard(TOP_LIST_AMOUNT)
 # Profit per ticker per bot
 ticker_profit_by_bot = {}
+# Traded value per hour and bot: {hour: {bot: total}}
+trade_volume_by_hour = {}
+# Last logged portfolio value per hour and bot: {hour: {bot: value}}
+portfolio_value_by_hour = {}
 
 dummy_returns_ratio = [
     DUMMY_FINAL_VALUES[t] / DUMMY_STARTING_VALUES[t]
@@ -91,137 +97,119 @@ real_returns_ratio = [
 ]
 
 
-def update_performance_metrics(path_to_log_file: str):
+def read_log_chunks(path: str, chunksize: int = CHUNK_SIZE):
+    """Reads a trade or portfolio log in chunks of `chunksize` rows, with TIMESTAMP parsed.\n
+    Broken lines are skipped. Yields nothing if the file doesn't exist or is empty."""
+    try:
+        reader = pandas.read_csv(path, chunksize=chunksize, on_bad_lines="skip")
+    except FileNotFoundError:
+        print(f"Log file {path} not found.")
+        return
+    except pandas.errors.EmptyDataError:
+        return
+    with reader:
+        for chunk in reader:
+            # Hela kolumnen tolkas på en gång istället för strptime rad för rad
+            timestamps = pandas.to_datetime(chunk["TIMESTAMP"], format=LOG_TIMESTAMP_FORMAT, errors="coerce")
+            other = timestamps.isna() & chunk["TIMESTAMP"].notna()
+            if other.any():  # T.ex. utan mikrosekunder
+                timestamps[other] = pandas.to_datetime(chunk.loc[other, "TIMESTAMP"], format="ISO8601", errors="coerce")
+            chunk["TIMESTAMP"] = timestamps
+            yield chunk.dropna()
+
+
+def update_performance_metrics(path_to_log_file: str, chunksize: int = CHUNK_SIZE,
+                               leaderboard: TradeLeaderboard | None = None):
     global total_quantity_discrapencies
 
-    """Finds all completed trades in a log file and calculates the total return of those trades.
-    Returns the total return as a float."""
+    """Finds all completed trades in a log file and updates the metrics above with them.
+    The file is read once, in chunks. Returns the completed trades and the total return of them for each bot.
+    The best and worst trades go to `leaderboard`, `trade_leaderboard` by default."""
+    if leaderboard is None:
+        leaderboard = trade_leaderboard
     total_return = {}  # Total return from all completed trades for each bot
     bot_trades = {}  # Håller koll på vilka trades som gjorts av vilka bottar
     _positions = {}  # Håller koll på öppna positioner per aktie per bot
-    try:
-        with open(path_to_log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-    except FileNotFoundError:
-        print(f"Log file {path_to_log_file} not found.")
-        return bot_trades, total_return
-
-    for line_nr, line in enumerate(lines):
-        # Line template: <timestamp>,<bot_name>,<ticker>,<action>,<amount>,<price>,<total>
-        # Example line: "2026-01-12 18:44:01.019202,random_bot,MARA,BUY,157,10.6369,1669.9933"
-
-        parts = line.strip().split(',')
-        if len(parts) < 7 or line_nr == 0:
-            continue  # Broken line or header
-        timestamp = datetime.datetime.strptime(
-            parts[0], "%Y-%m-%d %H:%M:%S.%f")
-        bot_name = parts[1]
-        ticker = parts[2]
-        action = parts[3]
-        quantity = int(parts[4])
-        price = float(parts[5])
-        total = float(parts[6])
-
-        # Create columns if they don't exist
-        if bot_name not in bot_trades:
-            bot_trades[bot_name] = []
-        if bot_name not in _positions:
-            _positions[bot_name] = {}
-        if bot_name not in total_return:
-            total_return[bot_name] = 0.0
-        # if bot_name not in most_profitable_trades:
-        #     most_profitable_trades[bot_name] = []
-        # if bot_name not in least_profitable_trades:
-        #     least_profitable_trades[bot_name] = []
-        if bot_name not in ticker_profit_by_bot:
-            ticker_profit_by_bot[bot_name] = {}
-        if ticker not in ticker_profit_by_bot[bot_name]:
-            ticker_profit_by_bot[bot_name][ticker] = 0
-
-        if not total_trade_per_timestamp.get(timestamp.timestamp()):
-            total_trade_per_timestamp[timestamp.timestamp()] = 0
-        total_trade_per_timestamp[timestamp.timestamp(
-        )] += total
-
-        if action == "BUY":
-            if ticker not in _positions[bot_name]:
-                _positions[bot_name][ticker] = []
-            # Spara köpt kvantitet och pris
-            _positions[bot_name][ticker].append((quantity, price))
-        elif action == "SELL":
-            if ticker in _positions[bot_name] and _positions[bot_name][ticker]:
-                total_invested = 0.0
-
-                # Find total bought shares across all buys
-                while len(_positions[bot_name][ticker]) > 0:
-                    qty, prc = _positions[bot_name][ticker].pop()
-                    total_invested += prc * qty
-
-                if total_invested == 0:
-                    continue
-
-                # Calculate final return (price is sell price)
-                trade_return = price * quantity - total_invested
-                total_return[bot_name] += trade_return
-                if trade_return > 0:
-                    if not bot_name in trades_profit_by_bot:
-                        trades_profit_by_bot[bot_name] = []
-                    trades_profit_by_bot[bot_name].append(
-                        {'ticker': ticker, 'profit': trade_return})
-
-                    # Store n most profitable trades
-                    update_top_trades(timestamp, bot_name,
-                                      ticker, trade_return)
-                else:
-                    if not bot_name in trades_loss_by_bot:
-                        trades_loss_by_bot[bot_name] = []
-                    trades_loss_by_bot[bot_name].append(
-                        {'ticker': ticker, 'loss': trade_return})
-                    # Store n least profitable trades
-                    update_worst_trades(timestamp, bot_name,
-                                        ticker, trade_return)
-
-                # Uppdatera profits per ticker
-                ticker_profit_by_bot[bot_name][ticker] += trade_return
-
-                bot_trades[bot_name].append(
-                    (timestamp, ticker, total_invested, price, quantity, trade_return))
+
+    for chunk in read_log_chunks(path_to_log_file, chunksize):
+        # Row template: <timestamp>,<bot_name>,<ticker>,<action>,<amount>,<price>,<total>
+        # Example row: "2026-01-12 18:44:01.019202,random_bot,MARA,BUY,157,10.6369,1669.9933"
+
+        # Handelsvolym per timme och bot
+        volumes = chunk.groupby([chunk["TIMESTAMP"].dt.floor("1h"), "BOT"])["TOTAL"].sum()
+        for (hour, bot_name), total in volumes.items():
+            hour_volumes = trade_volume_by_hour.setdefault(hour, {})
+            hour_volumes[bot_name] = hour_volumes.get(bot_name, 0.0) + total
+
+        rows = zip(chunk["TIMESTAMP"].tolist(), chunk["BOT"].tolist(), chunk["TICKER"].tolist(),
+                   chunk["ACTION"].tolist(), chunk["AMOUNT"].astype(int).tolist(), chunk["PRICE"].tolist())
+        for timestamp, bot_name, ticker, action, quantity, price in rows:
+            # Create columns if they don't exist
+            if bot_name not in bot_trades:
+                bot_trades[bot_name] = []
+            if bot_name not in _positions:
+                _positions[bot_name] = {}
+            if bot_name not in total_return:
+                total_return[bot_name] = 0.0
+            if bot_name not in ticker_profit_by_bot:
+                ticker_profit_by_bot[bot_name] = {}
+            if ticker not in ticker_profit_by_bot[bot_name]:
+                ticker_profit_by_bot[bot_name][ticker] = 0
+
+            if action == "BUY":
+                if ticker not in _positions[bot_name]:
+                    _positions[bot_name][ticker] = []
+                # Spara köpt kvantitet och pris
+                _positions[bot_name][ticker].append((quantity, price))
+            elif action == "SELL":
+                if ticker in _positions[bot_name] and _positions[bot_name][ticker]:
+                    total_invested = 0.0
+                    total_bought = 0
+
+                    # Find total bought shares across all buys
+                    while len(_positions[bot_name][ticker]) > 0:
+                        qty, prc = _positions[bot_name][ticker].pop()
+                        total_invested += prc * qty
+                        total_bought += qty
+
+                    if total_invested == 0:
+                        continue
+                    if total_bought != quantity:
+                        total_quantity_discrapencies += 1
+
+                    # Calculate final return (price is sell price)
+                    trade_return = price * quantity - total_invested
+                    total_return[bot_name] += trade_return
+                    if trade_return > 0:
+                        _add_trade_result(trades_profit_by_bot, bot_name, trade_return)
+                    else:
+                        _add_trade_result(trades_loss_by_bot, bot_name, trade_return)
+                    # Store n most profitable and least profitable trades
+                    leaderboard.add(timestamp, bot_name, ticker, trade_return)
+
+                    # Uppdatera profits per ticker
+                    ticker_profit_by_bot[bot_name][ticker] += trade_return
+
+                    bot_trades[bot_name].append(
+                        (timestamp, ticker, total_invested, price, quantity, trade_return))
 
     return bot_trades, total_return
 
 
-def update_worst_trades(timestamp, bot_name, ticker, trade_return):
-    if len(least_profitable_trades) < TOP_LIST_AMOUNT:
-        least_profitable_trades.append(
-            [bot_name, ticker, timestamp, trade_return])
-    else:
-        max_val = -1*2**32
-        index_to_pop = None
-        for i, arr in enumerate(least_profitable_trades):
-            if arr[3] > max_val:
-                max_val = arr[3]
-                index_to_pop = i
-        if trade_return < max_val:
-            least_profitable_trades.pop(index_to_pop)
-            least_profitable_trades.append(
-                [bot_name, ticker, timestamp, trade_return])
-
-
-def update_top_trades(timestamp, bot_name, ticker, trade_return):
-    if len(most_profitable_trades) < TOP_LIST_AMOUNT:
-        most_profitable_trades.append(
-            [bot_name, ticker, timestamp, trade_return])
-    else:
-        min_val = 2**32-1
-        index_to_pop = None
-        for i, arr in enumerate(most_profitable_trades):
-            if arr[3] < min_val:
-                min_val = arr[3]
-                index_to_pop = i
-        if trade_return > min_val:
-            most_profitable_trades.pop(index_to_pop)
-            most_profitable_trades.append(
-                [bot_name, ticker, timestamp, trade_return])
+def _add_trade_result(results_by_bot: dict, bot_name: str, trade_return: float):
+    # Bara antal och summa sparas, inte varje affär, så minnet växer inte med antalet dagar
+    result = results_by_bot.setdefault(bot_name, {"count": 0, "total": 0.0})
+    result["count"] += 1
+    result["total"] += trade_return
+
+
+def update_portfolio_values(path_to_portfolio_file: str, chunksize: int = CHUNK_SIZE):
+    """Reads a portfolio log once, in chunks, and keeps the last value of each bot in every hour."""
+    for chunk in read_log_chunks(path_to_portfolio_file, chunksize):
+        last_values = chunk.groupby([chunk["TIMESTAMP"].dt.floor("1h"), "BOT"])["VALUE"].last()
+        for (hour, bot_name), value in last_values.items():
+            portfolio_value_by_hour.setdefault(hour, {})[bot_name] = value
+
 
 # Hämtar nästa par av loggfiler från loggar
 
@@ -301,42 +289,27 @@ def plot_trade_activity(trades) -> None:
 
 
 def plot_portfolio_values(port_file, freq='5min'):
+    """Plots the value of every bot's portfolio from a portfolio log, read in chunks.
+    Returns the first and last timestamp in the log."""
     bot_portfolio_values = {}
-    with open(port_file, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-        first_timestamp = None
-        final_timestamp = None
-
-        for line_nr, line in enumerate(lines):
-            parts = line.split(",")
-            if len(parts) < 3 or line_nr == 0:
-                continue  # Broken line or header
-
-            timestamp = datetime.datetime.strptime(
-                parts[0], "%Y-%m-%d %H:%M:%S.%f")
-            # Ensure timestamp is at start of minute
-            timestamp.replace(second=0, microsecond=0)
-
-            bot = parts[1]
-            value = float(parts[2])
-
-            if not first_timestamp:
-                first_timestamp = timestamp
-            final_timestamp = timestamp
-
-            if not bot in bot_portfolio_values:
-                bot_portfolio_values[bot] = {}
-
-            bot_portfolio_values[bot][timestamp] = value
-
-    for bot, portfolio in bot_portfolio_values.items():
-        timestamps = []
-        values = []
-        for timestamp, value in portfolio.items():
-            timestamps.append(timestamp)
-            values.append(value)
+    first_timestamp = None
+    final_timestamp = None
+
+    for chunk in read_log_chunks(port_file):
+        if chunk.empty:
+            continue
+        if first_timestamp is None:
+            first_timestamp = chunk["TIMESTAMP"].iloc[0]
+        final_timestamp = chunk["TIMESTAMP"].iloc[-1]
+        for bot, rows in chunk.groupby("BOT", sort=False):
+            bot_portfolio_values.setdefault(bot, []).append(rows.set_index("TIMESTAMP")["VALUE"])
+
+    for bot, parts in bot_portfolio_values.items():
+        portfolio = pandas.concat(parts)
+        # Samma tid två gånger ger det senaste värdet
+        portfolio = portfolio[~portfolio.index.duplicated(keep="last")]
         plt.figure(port_fig)
-        plt.plot(timestamps, values, label=bot)
+        plt.plot(portfolio.index, portfolio.to_numpy(), label=bot)
         plt.pause(0.01)  # Uppdatera graf
     return first_timestamp, final_timestamp
 
@@ -356,8 +329,6 @@ if __name__ == "__main__":
     # - Biggest win(s) -- DONE
     # - Biggest Loss(es) -- DONE
 
-    total_trade_per_timestamp = {}
-
     if DEBUG:
         trades, total_return = update_performance_metrics(
             r"C:\Users\antasp23\Documents\Programmering\Gymnasiearbete\dummy_trading_data.csv")
@@ -394,6 +365,7 @@ if __name__ == "__main__":
         ndx_normalised.index = ndx_normalised.index.tz_localize(None)
 
         # Compare bot performance to S&P 500 on day-by-day basis
+        # Varje loggfil läses bara här, all statistik nedan kommer från samma genomläsning
         bot_vs_spx = {}
         for f in get_next_log_file():
             trades, total_return = update_performance_metrics(f)
@@ -433,24 +405,12 @@ if __name__ == "__main__":
             print("Effective winrate:", str(
                 100 * wins / (wins + losses)) + "%", "\n-----")
 
-        port_df = pandas.concat(
-            [
-                pandas.read_csv(
-                    f,
-                    parse_dates=["TIMESTAMP"]
-                )
-                for f in get_next_portfolio_file()
-            ],
-            ignore_index=True
-        )
-
-        port_df.sort_values("TIMESTAMP", inplace=True)
-        # port_df["TIMESTAMP"] = port_df['TIMESTAMP'].dt.floor("1h")
-        port_df = port_df[port_df["TIMESTAMP"].dt.time < datetime.time(21)]
-
-        port_df = port_df.pivot(
-            index="TIMESTAMP", columns="BOT", values="VALUE"
-        ).resample("1h").last().dropna(how="all")
+        for f in get_next_portfolio_file():
+            update_portfolio_values(f)
+
+        # Senaste värdet per timme, redan framräknat när filerna lästes
+        port_df = pandas.DataFrame.from_dict(portfolio_value_by_hour, orient="index").sort_index()
+        port_df = port_df[port_df.index.time < datetime.time(21)].dropna(how="all")
 
         # Reindex both to ensure they use the same timestamps
         # Use the portfolio dataframe's index as the reference
@@ -478,27 +438,8 @@ if __name__ == "__main__":
         plt.annotate('NASDAQ 100', xy=(len(port_df)-1, ndx.values[-1]),
                      xytext=(len(port_df)+12, ndx.values[-1] - 1000),
                      arrowprops=dict(facecolor='black', arrowstyle="-"))
-        # Logga aktivitet
-        log_df = pandas.concat(
-            [
-                pandas.read_csv(
-                    f,
-                    parse_dates=["TIMESTAMP"]
-                )
-                for f in get_next_log_file()
-            ]
-        )
-
-        activity_df = log_df.pivot(
-            index="TIMESTAMP", columns="BOT", values="TOTAL"
-        ).resample("1h").sum(min_count=1).dropna(how="all")
-
-        log_without_random = log_df.drop(
-            log_df[log_df["BOT"] == "random_bot"].index)
-
-        ticker_activity_df = log_without_random.pivot(
-            index="TIMESTAMP", columns="TICKER", values="TOTAL"
-        ).resample("1h").sum(min_count=1).dropna(how="all")
+        # Logga aktivitet, handelsvolymen per timme räknades ut när loggfilerna lästes
+        activity_df = pandas.DataFrame.from_dict(trade_volume_by_hour, orient="index").sort_index()
 
         plt.figure(bot_fig)
         for col in activity_df.columns:
@@ -510,22 +451,34 @@ if __name__ == "__main__":
     print("Total quantity discrapencies:", total_quantity_discrapencies)
 
     print("\nTop wins:")
-    for tradedata in sorted(most_profitable_trades, key=lambda data: data[3], reverse=True):
+    for tradedata in trade_leaderboard.best.items():
         print(tradedata)
 
     print("\nTop losses:")
-    for tradedata in sorted(least_profitable_trades, key=lambda data: data[3]):
+    for tradedata in trade_leaderboard.worst.items():
         print(tradedata)
 
+    print("\n---------- Best and worst trade per bot ----------")
+    for bot in sorted(set(trade_leaderboard.best_by_bot) | set(trade_leaderboard.worst_by_bot)):
+        best = trade_leaderboard.best_by_bot.get(bot)
+        worst = trade_leaderboard.worst_by_bot.get(bot)
+        print(bot, "best:", best.items()[0] if best else None, "worst:", worst.items()[0] if worst else None)
+
+    print("\n---------- Best and worst trade per ticker (top 10 tickers) ----------")
+    best_tickers = sorted(trade_leaderboard.best_by_ticker.items(),
+                          key=lambda item: item[1].items()[0][3], reverse=True)[:TOP_LIST_AMOUNT]
+    for ticker, best in best_tickers:
+        worst = trade_leaderboard.worst_by_ticker.get(ticker)
+        print(ticker, "best:", best.items()[0], "worst:", worst.items()[0] if worst else None)
+
     print("\n---------- Wins and losses per bot ----------")
+    no_trades = {"count": 0, "total": 0.0}
     for bot, wins in trades_profit_by_bot.items():
         print("--", bot, "--")
-        wins_list = wins
-        losses_list = trades_loss_by_bot[bot] if bot in trades_loss_by_bot else [
-        ]
+        losses = trades_loss_by_bot.get(bot, no_trades)
 
-        total_wins = len(wins_list)
-        total_losses = len(losses_list)
+        total_wins = wins["count"]
+        total_losses = losses["count"]
         total_trades = total_wins + total_losses
 
         print("Wins:", total_wins, "Losses:", total_losses)
@@ -534,19 +487,17 @@ if __name__ == "__main__":
 
         # Calculate average win per winning trade
         if total_wins > 0:
-            avg_win = sum(trade['profit'] for trade in wins_list) / total_wins
+            avg_win = wins["total"] / total_wins
             print("Average win per winning trade:", f"{avg_win:.2f}")
 
         # Calculate average loss per losing trade
         if total_losses > 0:
-            avg_loss = sum(trade['loss']
-                           for trade in losses_list) / total_losses
+            avg_loss = losses["total"] / total_losses
             print("Average loss per losing trade:", f"{avg_loss:.2f}")
 
         # Calculate overall average return per trade
         if total_trades > 0:
-            total_return_bot = sum(
-                trade['profit'] for trade in wins_list) + sum(trade['loss'] for trade in losses_list)
+            total_return_bot = wins["total"] + losses["total"]
             avg_return_per_trade = total_return_bot / total_trades
             print("Average return per trade:", f"{avg_return_per_trade:.2f}")
 
@@ -563,16 +514,12 @@ if __name__ == "__main__":
     for ticker, profit in ticker_profits.items():
         print("ticker:", ticker, "profit", profit)
 
-    # Bot, ticker, tid, profit
-    items = sorted(total_trade_per_timestamp.items())
-
-    tt_x = [datetime.datetime.fromtimestamp(k) for k, v in items]
-    tt_y = [v for k, v in items]
+    # Total handelsvolym per timme
+    items = sorted(trade_volume_by_hour.items())
 
     tt_df = pandas.DataFrame(
-        {'datetime': tt_x, 'total_trade': tt_y})
-    tt_df.set_index('datetime', inplace=True)
-    tt_df = tt_df.resample('1h').sum(min_count=1).dropna(how="all")
+        {'total_trade': [sum(volumes.values()) for _, volumes in items]},
+        index=pandas.DatetimeIndex([hour for hour, _ in items], name='datetime'))
 
     # Filter for business hours only (before 21:00)
     tt_df = tt_df[tt_df.index.time < datetime.time(21)]
@@ -0,0 +1,259 @@
+"""
+Backtest: spelar upp inspelad prisdata minut för minut genom bottarna, utan att vänta på riktig tid.
+
+Bottarna anropas med samma `find_options(price_data)` som i `main.run_bots_periodically`, med ett fönster
+av de senaste staplarna per aktie. Fönstren är vyer in i dagens staplar, så bottarnas inkrementella
+indikatorer (streaming.py) bara matas med den nya stapeln varje minut. Tiden bottarna ser kommer från en
+`clock.SimulatedClock`.
+
+Handeln går genom `SimulatedBroker.utför_flera_transaktioner`, som följer samma regler som
+`handla_aktie.utför_flera_transaktioner` men håller portföljerna i minnet och handlar till senaste stängningspris.
+Resultatet skrivs som `logg-<datum>.csv` och `portfolio-logg-<datum>.csv`, i samma format som analysis.py läser.
+
+Kör `python backtest.py <mapp med .ticks-filer> [utmapp]` för att backtesta bottarna i main på en inspelad dag.
+"""
+
+import csv
+import datetime as dt
+import os
+import sys
+import time
+
+import numpy as np
+import pandas
+
+import clock
+import handla_aktie as ha
+import tick_storage
+from bar_store import DEFAULT_MAX_BARS
+from bot_family import BotFamily
+from indicator_cache import INDICATOR_CACHE
+from portfolio_valuation import LOG_TIMESTAMP_FORMAT, PortfolioValueLog, value_portfolios
+from utils import BASE_DIR, ERROR_CODES, _resample_to_bars
+
+START_CASH = 100_000  # Samma startkapital som main ger nya portföljer
+NO_BUY_BEFORE_CLOSE = dt.timedelta(minutes=10)  # Som main.trade_suggestions
+PATH_TILL_BACKTEST = os.path.join(BASE_DIR, "backtest")
+
+
+def load_tick_bars(directory: str, tickers: list[str] | None = None) -> tuple[dict, dt.date | None]:
+    """
+    Resamples the `<ticker>.ticks` files in `directory` (all of them, or only `tickers`) to 1-minute bars
+    in the same format as `utils.retrieve_data`.\n
+    Returns `({ticker: bars}, date)`, where date is the trading day the ticks are from.
+    """
+    bars = {}
+    date = None
+    for filename in sorted(os.listdir(directory)):
+        ticker, ext = os.path.splitext(filename)
+        if ext != tick_storage.TICK_FILE_SUFFIX or (tickers is not None and ticker not in tickers):
+            continue
+        ticks = tick_storage.read_ticks(os.path.join(directory, filename))
+        if len(ticks) == 0:
+            continue
+        if date is None:
+            date = dt.datetime.fromtimestamp(ticks['TIME'][-1] / 1000).date()
+        df = _resample_to_bars(pandas.DataFrame({
+            'TIME': tick_storage.to_time_of_day(ticks['TIME']),
+            'PRICE': ticks['PRICE'],
+            'CUM_VOLUME': ticks['CUM_VOLUME'],
+        }))
+        if not df.empty:
+            bars[ticker] = df
+    return bars, date
+
+
+class SimulatedBroker():
+    """In-memory stand-in for `handla_aktie.utför_flera_transaktioner`. Trades at the prices in `prices`
+    and logs every trade with the time of `clock`."""
+
+    def __init__(self, sim_clock: clock.SimulatedClock, start_cash: float = START_CASH):
+        self.clock = sim_clock
+        self.start_cash = start_cash
+        self.portfolios: dict[str, dict] = {}
+        self.prices: dict[str, float] = {}  # Senaste stängningspris per aktie
+        self.trades: list[list] = []  # Rader som i handla_aktie.log
+
+    def portfolio(self, bot_name: str) -> dict:
+        """The bot's portfolio, created with `start_cash` the first time like in `main.trade_suggestions`."""
+        if bot_name not in self.portfolios:
+            self.portfolios[bot_name] = {"fria_pengar": self.start_cash, "aktier": {}}
+        return self.portfolios[bot_name]
+
+    def utför_flera_transaktioner(self, bot_name: str, transaktioner: list) -> list:
+        return ha._utför_transaktioner(bot_name, self.portfolio(bot_name), transaktioner,
+                                       log_fn=self._log, get_price=self._get_price)
+
+    def _log(self, bot_name, ticker, action, amount, price):
+        self.trades.append([self.clock.now(), bot_name, ticker, action, amount, price, price * amount])
+
+    def _get_price(self, ticker):
+        price = self.prices.get(ticker)
+        if price is None:
+            return None, ERROR_CODES.PRICE_UNAVAILABLE
+        return price, ERROR_CODES.SUCCESS
+
+    def sell_all(self):
+        """Sells every holding at the latest price, like `main.sell_all_bot_portfolios` at the end of the day."""
+        for bot_name, portfolio in self.portfolios.items():
+            transactions = [{'ticker': ticker, 'action': 'SELL', 'amount': amount, 'price': self.prices[ticker]}
+                            for ticker, amount in portfolio['aktier'].items() if ticker in self.prices]
+            if transactions:
+                self.utför_flera_transaktioner(bot_name, transactions)
+
+
+def plan_transactions(bot, suggestions: dict, portfolio: dict, prices: dict, may_buy: bool = True) -> list:
+    """Turns a bot's suggestions into transactions with the same rules as `main.trade_suggestions`:
+    buy `risk` of the free cash in stocks that aren't owned, and sell whole positions."""
+    current_cash = portfolio.get("fria_pengar", 0)
+    owned_shares = portfolio.get("aktier", {})
+    transactions = []
+    for t, action in suggestions.items():
+        price = prices.get(t)
+        if price is None:
+            continue
+        if action == "BUY":
+            if not may_buy or owned_shares.get(t, 0) > 0:
+                continue
+            amount = int((current_cash / price) * bot.risk)
+            if amount > 0 and current_cash >= amount * price:
+                current_cash -= amount * price
+                transactions.append({"ticker": t, "action": "BUY", "amount": amount, "allow_add": False, "price": price})
+        elif action == "SELL":
+            if owned_shares.get(t, 0) == 0:
+                continue
+            transactions.append({"ticker": t, "action": "SELL", "amount": owned_shares[t], "price": price})
+    return transactions
+
+
+class Backtest():
+    """
+    Replays one trading day of 1-minute bars through `bots`.\n
+    `bars` is `{ticker: bars}` like `utils.retrieve_data` returns (times of day on 1900-01-01) and `date` is the
+    day they are from. `window` is how many bars each bot gets per ticker, as `BAR_STORE` holds live.
+    A `bot_family.BotFamily` in `bots` trades every variant in its own portfolio.
+    """
+
+    def __init__(self, bots: list, bars: dict, date: dt.date, window: int = DEFAULT_MAX_BARS,
+                 start_cash: float = START_CASH):
+        self.bots = bots
+        self.bars = {t: df for t, df in bars.items() if df is not None and not df.empty}
+        self.date = date
+        self.window = window
+        self.clock = clock.SimulatedClock(dt.datetime.combine(date, dt.time()))
+        self.broker = SimulatedBroker(self.clock, start_cash)
+        self.values: list[tuple[dt.datetime, dict]] = []  # (tid, {bot: portföljvärde}) efter varje minut
+        self.minutes = 0
+
+    def _timestamp(self, bar_time_ns: int) -> dt.datetime:
+        """The wall-clock time the bots run for a bar: the start of the minute after it."""
+        time_of_day = pandas.Timestamp(bar_time_ns) - pandas.Timestamp(1900, 1, 1) + pandas.Timedelta(minutes=1)
+        return dt.datetime.combine(self.date, dt.time()) + time_of_day.to_pytimedelta()
+
+    def run(self) -> dict:
+        """Runs the whole day and returns every bot's portfolio value after the final sell-off."""
+        times = {t: df.index.asi8 for t, df in self.bars.items()}
+        closes = {t: df['PRICE'].to_numpy(dtype=float) for t, df in self.bars.items()}
+        grid = np.unique(np.concatenate(list(times.values()))) if times else np.array([], dtype=np.int64)
+        if len(grid) == 0:
+            return {}
+        close_time = self._timestamp(int(grid[-1]))
+        positions = dict.fromkeys(self.bars, 0)  # Antal staplar per aktie som har hänt
+        # Bottarna delar indikatorer (indicator_cache.py), de från en tidigare körning gäller inte
+        INDICATOR_CACHE.clear()
+
+        with clock.use_clock(self.clock):
+            for minute in grid:
+                now = self._timestamp(int(minute))
+                self.clock.set(now)
+
+                price_data = {}
+                for t, df in self.bars.items():
+                    end = positions[t]
+                    t_times = times[t]
+                    while end < len(t_times) and t_times[end] <= minute:
+                        end += 1
+                    positions[t] = end
+                    if end == 0:
+                        continue
+                    price_data[t] = df.iloc[max(0, end - self.window):end]
+                    self.broker.prices[t] = closes[t][end - 1]
+                self._step(price_data, may_buy=close_time - now >= NO_BUY_BEFORE_CLOSE)
+                self.minutes += 1
+
+            self.broker.sell_all()
+        return value_portfolios(self.broker.portfolios, self.broker.prices)
+
+    def _step(self, price_data: dict, may_buy: bool):
+        for bot in self.bots:
+            if isinstance(bot, BotFamily):
+                # Som main.trade_family_suggestions: varje variant handlar i sin egen portfölj
+                family_suggestions = bot.find_options(price_data)
+                for member in bot.members:
+                    self._trade(member, family_suggestions.get(member.bot_name, {}), may_buy)
+            else:
+                self._trade(bot, bot.find_options(price_data), may_buy)
+        prices = self.broker.prices
+        values = value_portfolios(self.broker.portfolios, prices)
+        self.values.append((self.clock.now(), {name: value for name, value in values.items() if value is not None}))
+
+    def _trade(self, bot, suggestions: dict, may_buy: bool):
+        portfolio = self.broker.portfolio(bot.bot_name)
+        transactions = plan_transactions(bot, suggestions, portfolio, self.broker.prices, may_buy)
+        if transactions:
+            self.broker.utför_flera_transaktioner(bot.bot_name, transactions)
+
+    def write_logs(self, directory: str = PATH_TILL_BACKTEST):
+        """Writes `logg-<date>.csv` (trades) and `portfolio-logg-<date>.csv` (values) to `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        log_path = os.path.join(directory, "logg-" + self.date.strftime("%Y-%m-%d") + ".csv")
+        with open(log_path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+            writer.writerow(["TIMESTAMP", "BOT", "TICKER", "ACTION", "AMOUNT", "PRICE", "TOTAL"])
+            writer.writerows([row[0].strftime(LOG_TIMESTAMP_FORMAT)] + row[1:] for row in self.broker.trades)
+
+        value_path = os.path.join(directory, "portfolio-logg-" + self.date.strftime("%Y-%m-%d") + ".csv")
+        if os.path.exists(value_path):
+            os.remove(value_path)  # PortfolioValueLog lägger till i slutet, en ny körning ska börja om
+        value_log = PortfolioValueLog(directory)
+        try:
+            for timestamp, values in self.values:
+                value_log.write_values(values, timestamp)
+        finally:
+            value_log.close()
+
+
+if __name__ == "__main__":
+    from mäklare import sma, ema, macd, obv, random_trader, rsi, uppner, stoch, cci, tmf
+
+    if len(sys.argv) < 2:
+        print("Användning: python backtest.py <mapp med .ticks-filer> [utmapp]")
+        sys.exit(1)
+    bars, date = load_tick_bars(sys.argv[1])
+    if not bars:
+        print("Hittade inga tickfiler i", sys.argv[1])
+        sys.exit(1)
+    tickers = list(bars)
+
+    # Samma bottar som main
+    bots = [sma.SMABot("sma_crossover_bot", tickers, short_period=9, long_period=21),
+            ema.EMABot("ema_crossover_bot", tickers, short_period=9, long_period=21),
+            macd.MACDCrossoverBot("macd_crossover_bot", tickers, short_period=5, long_period=35, signal_period=5),
+            obv.OBVBot("obv_bot", tickers, 9),
+            random_trader.RandomBot("random_bot", tickers),
+            rsi.RSIBot("rsi_bot", tickers, length=7, upper=70, lower=30),
+            uppner.UppDownBot("up_down_bot", tickers),
+            stoch.StochBot("stoch_bot", tickers, k_period=5),
+            cci.CCIBot("cci_bot", tickers, length=14),
+            tmf.TMFBot("tmf_bot", tickers, length=14)]
+
+    backtest = Backtest(bots, bars, date)
+    start = time.perf_counter()
+    final_values = backtest.run()
+    elapsed = time.perf_counter() - start
+    backtest.write_logs(sys.argv[2] if len(sys.argv) > 2 else PATH_TILL_BACKTEST)
+
+    print(f"{date}: {len(tickers)} aktier, {backtest.minutes} minuter på {elapsed:.2f} s "
+          f"({backtest.minutes * 60 / max(elapsed, 1e-9):.0f}x realtid), {len(backtest.broker.trades)} affärer")
+    for name, value in sorted(final_values.items(), key=lambda item: -(item[1] or 0)):
+        print(f"{name:<20} {value:>12.2f}")
@@ -0,0 +1,92 @@
+"""
+Kör bottarna när staplar stängs istället för på klockslag.
+
+`BarCloseScheduler` lyssnar på `BarClosed` från `BAR_STORE`. Så fort en aktie får sin första tick i en ny minut
+är förra minutens stapel klar, och bottarna kan köras för just den aktien. Händelser som kommer nästan samtidigt
+samlas ihop i en omgång (`batch_window`), så att bottarna körs på flera aktier på en gång. Aktier som inte får
+någon ny tick stängs av `BarStore.close_due` när minuten har varit slut i `grace` sekunder.
+
+Tiden från stapelns slut (minutskiftet) tills bottarnas affärer var gjorda mäts i `latency`. Den räknas från
+minutskiftet och inte från när lagret märkte att stapeln stängts, så väntan på nästa tick (eller `grace`) och
+fördröjningen i tickflödet före lagret (skrivarens poll och `TickOrderer`) ingår.
+"""
+
+import math
+import queue
+import time
+
+import clock
+from bar_store import BAR_STORE, BarClosed, local_minute, minute_end
+from tick_pipeline import LatencyStats
+
+BATCH_WINDOW = 0.25  # Sekunder att vänta på fler stängda staplar efter den första i en omgång
+GRACE = 2.0  # Sekunder efter en minut innan staplar utan nya ticks räknas som stängda
+
+
+class BarCloseScheduler():
+    """Collects `BarClosed` events from `bar_store` into batches of tickers for the bots to run on."""
+
+    def __init__(self, bar_store=BAR_STORE, batch_window: float = BATCH_WINDOW, grace: float = GRACE):
+        self.bar_store = bar_store
+        self.batch_window = batch_window
+        self.grace = grace
+        self.latency = LatencyStats()
+        self.batches = 0
+        self.late_bars = 0  # Staplar som bottarna fick först efter att nästa minut redan hade börjat
+        self._events = queue.SimpleQueue()
+        self._next_close_due = self._after_next_minute(clock.time())
+        bar_store.add_listener(self._events.put)
+
+    def close(self):
+        self.bar_store.remove_listener(self._events.put)
+
+    def _after_next_minute(self, now: float) -> float:
+        return (math.floor(now / 60) + 1) * 60 + self.grace
+
+    def _close_due(self):
+        now = clock.time()
+        if now >= self._next_close_due:
+            self.bar_store.close_due(now * 1000)
+            self._next_close_due = self._after_next_minute(now)
+
+    def next_batch(self, timeout: float | None = None) -> dict[str, BarClosed]:
+        """Waits for closed bars and returns `{ticker: BarClosed}` for the tickers whose bar closed,
+        or an empty dict if nothing closed within `timeout` seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        batch = {}
+        while not batch:
+            self._close_due()
+            wait = self._next_close_due - clock.time()
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+            try:
+                event = self._events.get(timeout=max(wait, 0))
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return batch
+                continue
+            batch[event.ticker] = event
+
+        # Ta med de staplar som stängs strax efter, oftast av samma minutskifte
+        batch_end = time.monotonic() + self.batch_window
+        while True:
+            wait = batch_end - time.monotonic()
+            try:
+                event = self._events.get(timeout=wait) if wait > 0 else self._events.get_nowait()
+            except queue.Empty:
+                break
+            batch[event.ticker] = event
+        self.batches += 1
+        return batch
+
+    def record_orders(self, batch: dict[str, BarClosed], done_at: float | None = None):
+        """Records the time from the end of each bar's minute until the bots had traded on it.
+        `done_at` is an epoch time in seconds, `clock.time()` by default."""
+        if done_at is None:
+            done_at = clock.time()
+        current_minute = local_minute(clock.time() * 1000)
+        for event in batch.values():
+            self.latency.add(done_at - minute_end(event.minute))
+            # Bottarna letar efter signaler i minuten innan den nuvarande
+            if event.minute < current_minute - 1:
+                self.late_bars += 1
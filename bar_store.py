@@ -0,0 +1,429 @@
+"""
+Långlivad lagring av 1-minuts OHLCV-staplar i minnet.
+
+`hämta_aktiepriser.data_writer` matar in varje tick med `BAR_STORE.add_tick` och
+`utils.retrieve_data` läser färdiga fönster härifrån istället för att läsa om CSV-filerna varje minut.
+
+När en stapel stängs skickas en `BarClosed` till lyssnarna (se `add_listener` och bar_scheduler.py), antingen när
+den första ticken i en senare minut kommer eller, för aktier utan nya ticks, när `close_due` anropas efter minuten.
+
+Staplar med längre tidsramar (t.ex. 5, 15 eller 60 minuter) byggs av de färdiga 1-minutsstaplarna allteftersom de
+stängs, se `_Rollup` och `window(..., timeframe=...)`. En tidsram börjar följas första gången den efterfrågas för en
+aktie, och kostar sedan bara en uppdatering per stängd minutstapel.
+"""
+
+import math
+import time
+from collections import deque
+from threading import Lock
+from typing import NamedTuple
+
+import numpy as np
+import pandas
+
+# Tider i prisfilerna saknar datum, så pandas ger dem datumet 1900-01-01. Bottarna jämför mot det datumet.
+BASE_DATE = pandas.Timestamp(1900, 1, 1)
+COLUMNS = ['OPEN', 'HIGH', 'LOW', 'PRICE', 'VOLUME']
+MINUTES_PER_DAY = 24 * 60
+NS_PER_MINUTE = 60 * 10**9
+
+DEFAULT_MAX_BARS = 120  # Två timmar med 1-minuts staplar per ticker
+
+
+class BarClosed(NamedTuple):
+    """Sent to the listeners of a `BarStore` when the bar of `minute` (a local minute number, see `local_minute`)
+    is finished for `ticker`. `closed_at` is the `time.monotonic()` when the store noticed it."""
+    ticker: str
+    minute: int
+    closed_at: float
+
+
+def local_minute(time_ms) -> int:
+    """Converts a yfinance epoch-millisecond timestamp to a local minute number.
+    Local time is used since the CSV files (and thus the bots) use local wall clock time."""
+    seconds = float(time_ms) / 1000
+    return int((seconds + time.localtime(seconds).tm_gmtoff) // 60)
+
+
+def minute_end(minute: int) -> float:
+    """The epoch time in seconds when the local minute `minute` (see `local_minute`) ends."""
+    end = (minute + 1) * 60
+    return float(end - time.localtime(end - time.localtime(end).tm_gmtoff).tm_gmtoff)
+
+
+class _Rollup():
+    """Bars of a longer timeframe rolled up from the finished 1-minute bars of one ticker.
+
+    A bar starts at a minute divisible by `timeframe` and gets the first open, highest high, lowest low,
+    last close and summed volume of its 1-minute bars, like `utils.resample_bars`."""
+
+    def __init__(self, timeframe: int, max_bars: int):
+        self.timeframe = timeframe
+        self.minutes = deque(maxlen=max_bars)  # Lokalt minutnummer för början av varje färdig stapel
+        self.bars = deque(maxlen=max_bars)  # (open, high, low, close, volume)
+        self.current = None  # [start, open, high, low, close, volume, sista minuten] för den senaste stapeln
+        self.seeded = False  # True när historiken före de levande staplarna har fyllts i från disk
+        self.cache = None  # (version, DataFrame)
+
+    def __len__(self):
+        return len(self.bars) + (self.current is not None)
+
+    def clear(self):
+        self.minutes.clear()
+        self.bars.clear()
+        self.current = None
+
+    def add(self, minute: int, bar: tuple):
+        """Adds a finished 1-minute bar, which must be later than the ones added before."""
+        start = minute - minute % self.timeframe
+        current = self.current
+        if current is not None and current[0] == start:
+            current[2] = max(current[2], bar[1])
+            current[3] = min(current[3], bar[2])
+            current[4] = bar[3]
+            current[5] += bar[4]
+            current[6] = minute
+            return
+        if current is not None:
+            self.minutes.append(current[0])
+            self.bars.append(tuple(current[1:6]))
+        self.current = [start, *bar, minute]
+
+    def update(self, minute: int, price: float):
+        """A late tick has changed the finished 1-minute bar of `minute`, see `BarStore._update_closed_bar`."""
+        start = minute - minute % self.timeframe
+        current = self.current
+        if current is not None and current[0] == start:
+            current[2] = max(current[2], price)
+            current[3] = min(current[3], price)
+            if minute == current[6]:
+                current[4] = price
+            return
+        for i in range(len(self.minutes) - 1, -1, -1):
+            if self.minutes[i] == start:
+                open_, high, low, close, volume = self.bars[i]
+                # Minuterna utan ticks är framåtfyllda, så en färdig stapels sista minut är alltid den sista i tidsramen
+                if minute == start + self.timeframe - 1:
+                    close = price
+                self.bars[i] = (open_, max(high, price), min(low, price), close, volume)
+                return
+            if self.minutes[i] < start:
+                return
+
+    def rows(self, forming: tuple | None) -> tuple[list, list]:
+        """All bars as `(minutes, bars)`, with the 1-minute bar `forming = (minute, bar)` that is still forming."""
+        minutes = list(self.minutes)
+        bars = list(self.bars)
+        current = self.current
+        if forming is not None:
+            minute, bar = forming
+            start = minute - minute % self.timeframe
+            if current is not None and current[0] == start:
+                current = [start, current[1], max(current[2], bar[1]), min(current[3], bar[2]), bar[3],
+                           current[5] + bar[4]]
+            else:
+                if current is not None:
+                    minutes.append(current[0])
+                    bars.append(tuple(current[1:6]))
+                current = [start, *bar]
+        if current is not None:
+            minutes.append(current[0])
+            bars.append(tuple(current[1:6]))
+        return minutes, bars
+
+
+class _TickerBars():
+    """Rolling window of finished bars plus the bar that is still forming for one ticker"""
+
+    def __init__(self, max_bars: int):
+        self.minutes = deque(maxlen=max_bars)  # Lokalt minutnummer för varje färdig stapel
+        self.bars = deque(maxlen=max_bars)  # (open, high, low, close, volume)
+        self.forming = None  # [minute, open, high, low, close, cum_volume]
+        self.prev_cum_volume = math.nan  # Ackumulerad volym vid slutet av förra stapeln
+        self.seeded = False  # True när historiken före första ticken har fyllts i från disk
+        self.version = 0  # Ändras varje gång staplarna ändras, se BarStore.sequence
+        self.cache = None  # (version, DataFrame)
+        self.announced = None  # Minuten för den senaste stapeln som en BarClosed har skickats för
+        self.rollups: dict[int, _Rollup] = {}  # {tidsram i minuter: staplar}
+
+    def __len__(self):
+        return len(self.bars) + (self.forming is not None)
+
+
+class BarStore():
+    """Keeps a rolling window of 1-minute OHLCV bars per ticker, built incrementally from ticks.\n
+    The bars follow the same rules as `utils._read_and_process_ticker`: minutes without ticks are
+    forward-filled from the previous bar with zero volume, and the volume of a bar is the change in
+    cumulative day volume since the previous bar."""
+
+    def __init__(self, max_bars: int = DEFAULT_MAX_BARS):
+        self.max_bars = max_bars
+        self._tickers: dict[str, _TickerBars] = {}
+        self._lock = Lock()
+        self._listeners = []
+        self._sequence = 0  # Gemensam räknare för alla tickers, så ett nummer återanvänds aldrig efter clear()
+
+    def __contains__(self, ticker):
+        return ticker in self._tickers
+
+    def clear(self):
+        """Removes all bars, e.g when a new trading day starts."""
+        with self._lock:
+            self._tickers.clear()
+
+    def reserve(self, max_bars: int):
+        """Makes room for at least `max_bars` bars per ticker, e.g for a bot with a longer period.\n
+        Tickers that already have bars get their older history from disk again, see `seed`."""
+        with self._lock:
+            if max_bars <= self.max_bars:
+                return
+            self.max_bars = max_bars
+            for state in self._tickers.values():
+                state.minutes = deque(state.minutes, maxlen=max_bars)
+                state.bars = deque(state.bars, maxlen=max_bars)
+                state.seeded = False
+                for rollup in state.rollups.values():
+                    rollup.minutes = deque(rollup.minutes, maxlen=max_bars)
+                    rollup.bars = deque(rollup.bars, maxlen=max_bars)
+                    rollup.seeded = False
+
+    def sequence(self, ticker: str) -> int | None:
+        """A number that changes every time the bars of `ticker` change, or None if the store has no bars for it.
+        Two windows of `ticker` are equal as long as its sequence number is the same."""
+        state = self._tickers.get(ticker)
+        return None if state is None else state.version
+
+    def _changed(self, state: _TickerBars):
+        self._sequence += 1
+        state.version = self._sequence
+
+    def add_listener(self, listener):
+        """`listener(event: BarClosed)` is called for every closed bar, from the thread that adds the ticks.
+        It should return quickly, e.g. put the event in a queue."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def close_due(self, now_ms: float | None = None) -> int:
+        """Announces the forming bars of every ticker that hasn't had a tick since its minute ended, since those
+        bars otherwise only close when the next tick arrives. Returns the number of bars announced."""
+        if now_ms is None:
+            now_ms = time.time() * 1000
+        minute = local_minute(now_ms)
+        events = []
+        with self._lock:
+            for ticker, state in self._tickers.items():
+                if state.forming is not None and state.forming[0] < minute:
+                    event = self._announce(ticker, state, state.forming[0])
+                    if event is not None:
+                        events.append(event)
+        self._notify(events)
+        return len(events)
+
+    def _announce(self, ticker: str, state: _TickerBars, minute: int) -> BarClosed | None:
+        if not self._listeners or (state.announced is not None and minute <= state.announced):
+            return None
+        state.announced = minute
+        return BarClosed(ticker, minute, time.monotonic())
+
+    def _notify(self, events: list):
+        # Lyssnarna anropas utanför låset så att de kan läsa fönster direkt
+        for event in events:
+            for listener in self._listeners:
+                listener(event)
+
+    def add_tick(self, ticker: str, time_ms, price, cum_volume):
+        """Adds a single tick to the bar that is forming for `ticker`, closing it if the tick belongs to a later minute."""
+        if price is None:
+            return
+        price = float(price)
+        if math.isnan(price):
+            return
+        cum_volume = math.nan if cum_volume is None else float(cum_volume)
+        minute = local_minute(time_ms)
+        event = None
+
+        with self._lock:
+            state = self._tickers.get(ticker)
+            if state is None:
+                state = self._tickers[ticker] = _TickerBars(self.max_bars)
+
+            forming = state.forming
+            if forming is None or minute > forming[0]:
+                if forming is not None:
+                    event = self._announce(ticker, state, forming[0])
+                    self._close_bar(state, minute)
+                state.forming = [minute, price, price, price, price, cum_volume]
+            elif minute == forming[0]:
+                forming[2] = max(forming[2], price)
+                forming[3] = min(forming[3], price)
+                forming[4] = price
+                if not math.isnan(cum_volume):
+                    forming[5] = cum_volume
+            else:
+                # Sen tick för en redan stängd minut, uppdatera stapeln om den fortfarande finns i fönstret
+                self._update_closed_bar(state, minute, price)
+            self._changed(state)
+        if event is not None:
+            self._notify([event])
+
+    def _close_bar(self, state: _TickerBars, next_minute: int):
+        """Moves the forming bar into the finished window and forward-fills minutes without ticks."""
+        minute, open_, high, low, close, cum_volume = state.forming
+        volume = cum_volume - state.prev_cum_volume
+        bar = (open_, high, low, close, 0.0 if math.isnan(volume) else volume)
+        state.minutes.append(minute)
+        state.bars.append(bar)
+        state.prev_cum_volume = cum_volume
+
+        gap = next_minute - minute - 1
+        for rollup in state.rollups.values():
+            rollup.add(minute, bar)
+            if gap <= 0:
+                continue
+            if next_minute // MINUTES_PER_DAY != minute // MINUTES_PER_DAY:
+                # En ny dag, börja om från början
+                rollup.clear()
+                rollup.seeded = True
+                continue
+            filled = bar[:4] + (0.0,)
+            for m in range(minute + 1, next_minute):
+                rollup.add(m, filled)
+        if gap <= 0:
+            return
+        if gap >= self.max_bars:
+            # Luckan är större än hela fönstret, t.ex. över natten. Börja om från början.
+            state.minutes.clear()
+            state.bars.clear()
+            state.seeded = True
+        else:
+            filled = state.bars[-1][:4] + (0.0,)
+            for m in range(minute + 1, next_minute):
+                state.minutes.append(m)
+                state.bars.append(filled)
+        # Volymen för stapeln efter en lucka räknas inte ut från disk heller (diff mot NaN blir 0)
+        state.prev_cum_volume = math.nan
+
+    def _update_closed_bar(self, state: _TickerBars, minute: int, price: float):
+        for i in range(len(state.minutes) - 1, -1, -1):
+            if state.minutes[i] == minute:
+                open_, high, low, _, volume = state.bars[i]
+                state.bars[i] = (open_, max(high, price), min(low, price), price, volume)
+                for rollup in state.rollups.values():
+                    rollup.update(minute, price)
+                return
+            if state.minutes[i] < minute:
+                return
+
+    def seed(self, ticker: str, df: pandas.DataFrame, timeframe: int = 1):
+        """Fills in history from before the first tick the store received for `ticker`.\n
+        `df` should be a frame of 1-minute bars from `utils._read_and_process_ticker`. Only bars older than the
+        first bar in the store are used, since later ones are already built from live ticks.
+        With a `timeframe` other than 1, the bars of that timeframe are also rebuilt from all of `df`."""
+        with self._lock:
+            state = self._tickers.get(ticker)
+            if state is None:
+                return
+            rollup = state.rollups.get(timeframe) if timeframe != 1 else None
+            if state.seeded and (rollup is None or rollup.seeded):
+                return
+            if df is None or df.empty:
+                state.seeded = True
+                if rollup is not None:
+                    rollup.seeded = True
+                return
+
+            first_minute = state.minutes[0] if state.minutes else state.forming[0]
+            day_start = first_minute - first_minute % MINUTES_PER_DAY
+            minute_of_day = ((df.index - BASE_DATE) // pandas.Timedelta(minutes=1)).to_numpy()
+            values = df[COLUMNS].to_numpy(dtype=float)
+            older = np.flatnonzero(day_start + minute_of_day < first_minute)
+
+            if rollup is not None and not rollup.seeded:
+                rollup.seeded = True
+                rollup.clear()
+                for i in older:
+                    rollup.add(int(day_start + minute_of_day[i]), tuple(values[i]))
+                for minute, bar in zip(state.minutes, state.bars):
+                    rollup.add(minute, bar)
+
+            if not state.seeded:
+                state.seeded = True
+                room = self.max_bars - len(state.bars)
+                for i in reversed(older[-room:] if room > 0 else []):
+                    state.minutes.appendleft(int(day_start + minute_of_day[i]))
+                    state.bars.appendleft(tuple(values[i]))
+            self._changed(state)
+
+    @staticmethod
+    def _forming_bar(state: _TickerBars) -> tuple | None:
+        """The bar that is still forming as `(minute, bar)`."""
+        if state.forming is None:
+            return None
+        minute, open_, high, low, close, cum_volume = state.forming
+        volume = cum_volume - state.prev_cum_volume
+        return minute, (open_, high, low, close, 0.0 if math.isnan(volume) else volume)
+
+    def window(self, ticker: str, length: int, timeframe: int = 1) -> pandas.DataFrame | None:
+        """Returns all bars held for `ticker`, including the forming one, as a frame shaped like the ones
+        from `utils.retrieve_data`.\n
+        `timeframe` is the length of the bars in minutes. It must divide a day, e.g 5, 15 or 60, and the bars
+        start at minutes divisible by it. `length` is counted in bars of the timeframe.
+        Returns None if the store can't cover the last `length` bars, in which case the caller should read from disk
+        (and `reserve` room first if `length` is more than `max_bars`)."""
+        if MINUTES_PER_DAY % timeframe:
+            raise ValueError(f"A timeframe of {timeframe} minutes doesn't divide a day")
+        with self._lock:
+            state = self._tickers.get(ticker)
+            if state is None or length + 1 > self.max_bars:
+                return None
+            if timeframe != 1:
+                return self._rollup_window(state, length, timeframe)
+            if not state.seeded and len(state) < length + 1:
+                return None
+            if state.cache is not None and state.cache[0] == state.version:
+                return state.cache[1]
+
+            minutes = list(state.minutes)
+            bars = list(state.bars)
+            forming = self._forming_bar(state)
+            if forming is not None:
+                minutes.append(forming[0])
+                bars.append(forming[1])
+
+            df = self._to_frame(minutes, bars)
+            state.cache = (state.version, df)
+            return df
+
+    def _rollup_window(self, state: _TickerBars, length: int, timeframe: int) -> pandas.DataFrame | None:
+        rollup = state.rollups.get(timeframe)
+        if rollup is None:
+            # Tidsramen följs från och med nu, börja från de minutstaplar som finns
+            rollup = state.rollups[timeframe] = _Rollup(timeframe, self.max_bars)
+            for minute, bar in zip(state.minutes, state.bars):
+                rollup.add(minute, bar)
+        if rollup.cache is not None and rollup.cache[0] == state.version:
+            return rollup.cache[1]
+
+        minutes, bars = rollup.rows(self._forming_bar(state))
+        if not rollup.seeded and len(bars) < length + 1:
+            return None
+        df = self._to_frame(minutes, bars)
+        rollup.cache = (state.version, df)
+        return df
+
+    @staticmethod
+    def _to_frame(minutes: list, bars: list) -> pandas.DataFrame:
+        if not bars:
+            return pandas.DataFrame(columns=COLUMNS)
+        minute_of_day = np.asarray(minutes, dtype=np.int64) % MINUTES_PER_DAY
+        # Direkt från nanosekunder, halva tiden jämfört med BASE_DATE + to_timedelta
+        index = pandas.DatetimeIndex((BASE_DATE.value + minute_of_day * NS_PER_MINUTE).view('datetime64[ns]'),
+                                     name='TIME')
+        return pandas.DataFrame(np.asarray(bars, dtype=float), index=index, columns=COLUMNS)
+
+
+# Delad instans som fylls av hämta_aktiepriser och läses av utils.retrieve_data
+BAR_STORE = BarStore()
@@ -0,0 +1,195 @@
+"""
+Kör många parametervarianter av samma botklass tillsammans, t.ex. 50 SMA-bottar med olika perioder.
+
+Varje bot i main läser hela prisfönstret och uppdaterar sina egna indikatorer för varje aktie, så 50 varianter
+kostar 50 gånger så mycket. `BotFamily` har en medlem per variant (vanliga botinstanser med egna namn och
+portföljer) men går bara igenom datan en gång:
+- Staplarna för varje aktie läses en gång (streaming.advance) istället för en gång per variant.
+- Varje indikator räknas en gång per aktie även om flera varianter använder den, t.ex. SMA(21) för både 9/21 och 13/21.
+- Korsningarna och RSI/CCI-tillstånden hålls i numpy-vektorer med en plats per variant, så reglerna körs för alla
+  varianter på en gång. Över alla aktier blir det en matris aktier × varianter.
+
+Vilka indikatorer en variant behöver anger botklassen själv:
+- `crossover_lines()` (SMA-, EMA- och MACD-korsningsbottarna): de två linjerna boten handlar på korsningar av.
+- `threshold_line()` (RSI- och CCI-bottarna): indikatorn vars värde jämförs med `lower` och `upper`.
+Klasser utan någon av dem (eller som ändrar `find_options` i en subklass) körs variant för variant på samma data,
+med samma resultat men utan besparingen.
+
+Förslagen blir exakt desamma som om varje variant hade körts som en egen bot (se test_bot_family.py).
+`find_options` returnerar `{variantens namn: förslag}` och main handlar för varje variant i dess egen portfölj.
+
+Uppmätt med 100 aktier och 60 staplars fönster, 1 kärna: 50 SMA-varianter tar ~20 ms per minut som familj mot
+~450 ms som 50 bottar (en ensam SMABot tar ~9 ms), och 48 RSI-varianter ~15 ms mot ~360 ms.
+"""
+
+import datetime
+
+import numpy as np
+import pandas
+
+import clock
+from streaming import advance
+
+BASE_DATE = datetime.datetime(1900, 1, 1)  # Samma datum som staplarnas index
+NO_TIME = np.iinfo(np.int64).min  # Ingen korsning än
+# Attribut som dirty_tracker.py läser från bottarna
+TRACKER_ATTRIBUTES = ("skip_unchanged", "unchanged_runs", "signals_on_previous_minute")
+
+
+def variant_name(family_name: str, params: dict) -> str:
+    """Portfolio name of a variant, e.g `sma_family_9_21` for `{"short_period": 9, "long_period": 21}`."""
+    return "_".join([family_name, *(str(value) for value in params.values())])
+
+
+def _values(outputs: dict, slots: list) -> np.ndarray:
+    """The lines' values in slot order, None (not enough data yet) becomes NaN."""
+    return np.array([outputs[key] if output is None else outputs[key][output] for key, output in slots], dtype=float)
+
+
+def _crossings(previous: np.ndarray, a: np.ndarray, b: np.ndarray):
+    """`streaming.Crossings` for a vector of line pairs. Returns `(positions, crossed)`."""
+    valid = ~(np.isnan(a) | np.isnan(b))
+    position = np.where(valid, np.sign(a - b), previous)
+    return position, valid & (np.abs(position - previous) == 2)
+
+
+class BotFamily():
+    """Parameter variants of `bot_class` that are evaluated together.\n
+    `param_sets` is a list of keyword arguments, one per variant (e.g from `sweep.parameter_grid`), and `fixed`
+    are keyword arguments shared by all of them, e.g `timeframe=15`. `members` are the variants as ordinary bots, named with
+    `variant_name`."""
+
+    def __init__(self, bot_class, bot_name: str, tickers: list[str], param_sets: list[dict], **fixed):
+        self.bot_name = bot_name
+        self.members = [bot_class(variant_name(bot_name, params), tickers, **fixed, **params) for params in param_sets]
+        names = [member.bot_name for member in self.members]
+        if len(set(names)) != len(names):
+            raise ValueError(f"{bot_name} has several variants with the same parameters")
+        self._tickers = tickers
+        self.timeframe = fixed.get("timeframe", 1)
+        for attribute in TRACKER_ATTRIBUTES:
+            if hasattr(bot_class, attribute):
+                setattr(self, attribute, getattr(bot_class, attribute))
+        # Indikatorer och regeltillstånd per aktie, delade av alla varianter
+        self.streams = {}
+        self.states = {}
+
+        # En subklass som ändrar find_options (men ärver crossover_lines) kan inte köras med vektorerna
+        rules = vars(next(c for c in bot_class.__mro__ if "find_options" in vars(c)))
+        if self.members and "crossover_lines" in rules:
+            self._evaluate = self._evaluate_crossovers
+            self._columns = ('PRICE',)
+            self._set_lines([line for member in self.members for line in member.crossover_lines()])
+            slot = {line: i for i, line in enumerate(self._slots)}
+            pairs = [tuple(slot[key, output] for key, _, output in member.crossover_lines()) for member in self.members]
+            self._a, self._b = (np.array(index) for index in zip(*pairs))
+        elif self.members and "threshold_line" in rules:
+            self._evaluate = self._evaluate_thresholds
+            self._columns = self.members[0].threshold_line()[2]
+            self._set_lines([(key, create, None) for key, create, _ in (m.threshold_line() for m in self.members)])
+            slot = {key: i for i, (key, _) in enumerate(self._slots)}
+            self._index = np.array([slot[member.threshold_line()[0]] for member in self.members])
+            self._lower = np.array([member.lower for member in self.members], dtype=float)
+            self._upper = np.array([member.upper for member in self.members], dtype=float)
+        else:
+            self._evaluate = self._evaluate_members
+
+    def _set_lines(self, lines: list):
+        """Keeps one indicator per distinct key, `lines` is `(key, create, output)` for every variant's lines."""
+        self._create = {}
+        self._slots = []
+        for key, create, output in lines:
+            self._create.setdefault(key, create)
+            if (key, output) not in self._slots:
+                self._slots.append((key, output))
+
+    @property
+    def tickers(self) -> list[str]:
+        return self._tickers
+
+    @tickers.setter
+    def tickers(self, tickers: list[str]):
+        self._tickers = tickers
+        for member in self.members:
+            member.tickers = tickers
+
+    def find_options(self, price_data: dict) -> dict:
+        """Finds suggested actions for every variant, returns `{variant name: {ticker: action}}`."""
+        return self._evaluate(price_data)
+
+    def _evaluate_members(self, price_data: dict) -> dict:
+        return {member.bot_name: member.find_options(price_data) for member in self.members}
+
+    def _new_lines(self) -> dict:
+        return {key: create() for key, create in self._create.items()}
+
+    def _advance(self, ticker: str, df: pandas.DataFrame, new_state, update):
+        return advance(self.streams, ticker, df, new_state, update, self._columns)
+
+    def _suggestions(self, actions: dict) -> dict:
+        """`{ticker: (buy mask, sell mask)}` -> `{variant name: {ticker: action}}`"""
+        suggestions = {member.bot_name: {} for member in self.members}
+        for t, (buy, sell) in actions.items():
+            for i in np.flatnonzero(buy):
+                suggestions[self.members[i].bot_name][t] = "BUY"
+            for i in np.flatnonzero(sell):
+                suggestions[self.members[i].bot_name][t] = "SELL"
+        return suggestions
+
+    def _new_crossover_state(self) -> dict:
+        n = len(self.members)
+        return {'lines': self._new_lines(), 'position': np.full(n, np.nan),
+                'time': np.full(n, NO_TIME, dtype=np.int64), 'direction': np.zeros(n)}
+
+    def _update_crossovers(self, state: dict, time, price: float):
+        values = _values({key: line.update(price) for key, line in state['lines'].items()}, self._slots)
+        state['position'], crossed = _crossings(state['position'], values[self._a], values[self._b])
+        state['time'][crossed] = time.value
+        state['direction'][crossed] = state['position'][crossed]
+
+    def _evaluate_crossovers(self, price_data: dict) -> dict:
+        # Samma stapel som SMABot.find_options letar efter korsningar i
+        target = (pandas.Timestamp.combine(BASE_DATE, clock.now().time()).floor(f"{self.timeframe}min")
+                  - pandas.Timedelta(minutes=self.timeframe)).value
+        actions = {}
+        for t, df in price_data.items():
+            if df is None or df.empty:
+                continue
+            stream, (price,) = self._advance(t, df, self._new_crossover_state, self._update_crossovers)
+            state = stream.indicators
+            # Den sista stapeln kan fortfarande bildas, så den tittas bara på
+            values = _values({key: line.peek(price) for key, line in state['lines'].items()}, self._slots)
+            position, crossed = _crossings(state['position'], values[self._a], values[self._b])
+            signal = np.where(crossed, df.index[-1].value, state['time']) == target
+            if signal.any():
+                direction = np.where(crossed, position, state['direction'])
+                actions[t] = (signal & (direction > 0), signal & (direction < 0))
+        return self._suggestions(actions)
+
+    def _evaluate_thresholds(self, price_data: dict) -> dict:
+        actions = {}
+        for t, df in price_data.items():
+            if df is None or df.empty:
+                continue
+            stream, last_bar = self._advance(t, df, self._new_lines, _update_lines)
+            values = _values({key: line.peek(*last_bar) for key, line in stream.indicators.items()}, self._slots)
+            value = values[self._index]
+
+            # Samma tillstånd som RSIBot: 1 = BUY, -1 = SELL och 0 = NEUTRAL
+            state = self.states.get(t)
+            if state is None:
+                state = self.states[t] = np.zeros(len(self.members), dtype=np.int8)
+            neutral = state == 0
+            buy = (state == 1) & (value > self._lower)
+            sell = (state == -1) & (value < self._upper)
+            state[neutral & (value > self._upper)] = -1
+            state[neutral & ~(value > self._upper) & (value < self._lower)] = 1
+            state[buy | sell] = 0
+            if buy.any() or sell.any():
+                actions[t] = (buy, sell)
+        return self._suggestions(actions)
+
+
+def _update_lines(lines: dict, time, *values: float):
+    for line in lines.values():
+        line.update(*values)
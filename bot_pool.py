@@ -0,0 +1,234 @@
+"""
+Kör bottarnas `find_options` i egna processer istället för trådar.
+
+Indikatorberäkningarna är CPU-bundna, så med trådar kör GIL:en dem i princip en i taget.
+`BotPool` fördelar bottarna på ett antal arbetsprocesser som behåller sina bottar mellan körningarna,
+så att `self.states`, `self.streams`, `prev_prices` osv. finns kvar. Prisdatan skrivs en gång per körning
+till delat minne (`multiprocessing.shared_memory`) istället för att picklas till varje bot.
+
+Handeln (`main.trade_suggestions`) görs fortfarande i huvudprocessen, processerna returnerar bara förslagen.
+
+Kör filen direkt för att jämföra med trådläget: `python bot_pool.py [antal aktier] [antal processer]`
+"""
+
+import multiprocessing
+import os
+import traceback
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas
+
+from bar_store import COLUMNS
+
+
+class SharedPriceData():
+    """`price_data` packed into one shared memory block: an int64 time column followed by a float64 matrix of `COLUMNS`.\n
+    `meta` is a small list of `(ticker, start_row, n_rows)` that is sent to the workers together with the block's name."""
+
+    def __init__(self, price_data: dict):
+        self.meta = []
+        n_rows = 0
+        for t, df in price_data.items():
+            length = 0 if df is None else len(df)
+            self.meta.append((t, n_rows, length))
+            n_rows += length
+        self.n_rows = n_rows
+
+        # SharedMemory kan inte ha storlek 0
+        self.shm = SharedMemory(create=True, size=max(n_rows * 8 * (1 + len(COLUMNS)), 1))
+        times, values = _views(self.shm, n_rows)
+        for (t, start, length) in self.meta:
+            if length:
+                df = price_data[t]
+                if list(df.columns) != COLUMNS:
+                    df = df.reindex(columns=COLUMNS)
+                times[start:start + length] = df.index.asi8
+                values[start:start + length] = df.to_numpy(dtype=float)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _views(shm: SharedMemory, n_rows: int):
+    times = np.ndarray((n_rows,), dtype=np.int64, buffer=shm.buf)
+    values = np.ndarray((n_rows, len(COLUMNS)), dtype=np.float64, buffer=shm.buf, offset=n_rows * 8)
+    return times, values
+
+
+def attach_price_data(name: str, meta: list, untrack: bool = True) -> tuple[SharedMemory, dict]:
+    """Rebuilds the `price_data` dict in a worker. The frames are views of the shared memory, nothing is copied.
+
+    `untrack` should be False in workers that were forked after the memory was created, since they share the
+    main process' resource_tracker."""
+    shm = SharedMemory(name=name)
+    if untrack:
+        # Huvudprocessen äger minnet och tar bort det, annars varnar resource_tracker om det när programmet avslutas
+        resource_tracker.unregister(shm._name, "shared_memory")
+    n_rows = sum(length for _, _, length in meta)
+    times, values = _views(shm, n_rows)
+    price_data = {}
+    for t, start, length in meta:
+        index = pandas.DatetimeIndex(times[start:start + length].view('datetime64[ns]'), name='TIME')
+        price_data[t] = pandas.DataFrame(values[start:start + length], index=index, columns=COLUMNS, copy=False)
+    return shm, price_data
+
+
+def _worker(connection, bots: list):
+    """Runs in each worker process. The bots stay here between cycles so that their state persists."""
+    while True:
+        message = connection.recv()
+        if message[0] == "stop":
+            break
+
+        _, name, meta, tickers, only, frames = message
+        # Processen delar huvudprocessens resource_tracker (se BotPool), som i sweep._attach_days
+        shm, price_data = attach_price_data(name, meta, untrack=False)
+        # Staplar för längre tidsramar, till bottarna som har angett en `timeframe`
+        shms, timeframe_data = [shm], {}
+        for timeframe, (frame_name, frame_meta) in frames.items():
+            frame_shm, timeframe_data[timeframe] = attach_price_data(frame_name, frame_meta, untrack=False)
+            shms.append(frame_shm)
+        suggestions, errors = {}, {}
+        for bot in bots:
+            bot.tickers = tickers.get(bot.bot_name, bot.tickers)
+            bot_data = timeframe_data.get(getattr(bot, "timeframe", 1), price_data)
+            if bot.bot_name in only:
+                bot_data = {t: bot_data[t] for t in only[bot.bot_name] if t in bot_data}
+            try:
+                suggestions[bot.bot_name] = bot.find_options(bot_data)
+            except Exception:
+                errors[bot.bot_name] = traceback.format_exc()
+        del price_data, timeframe_data
+        for shm in shms:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # En bot har sparat en referens till prisdatan, minnet släpps när den försvinner
+        connection.send((suggestions, errors))
+    connection.close()
+
+
+class BotPool():
+    """Process pool where every bot is owned by one worker process for the pool's whole lifetime.\n
+    Start it before any other threads are started, since the workers are forked from the current process."""
+
+    def __init__(self, bots: list, processes: int | None = None):
+        processes = min(processes or os.cpu_count() or 1, len(bots))
+        context = multiprocessing.get_context("fork")
+        self.bot_names = [bot.bot_name for bot in bots]
+        self.n_processes = processes
+        self._connections = []
+        self._processes = []
+        # Processerna ska ärva huvudprocessens resource_tracker, annars startar var och en sin egen som tror
+        # att minnet läcker och försöker ta bort det när processen avslutas
+        resource_tracker.ensure_running()
+        for i in range(processes):
+            parent, child = context.Pipe()
+            # Fördela bottarna jämnt, varje bot tillhör alltid samma process
+            process = context.Process(target=_worker, args=(child, bots[i::processes]), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def find_options(self, price_data: dict, tickers: dict | None = None, only: dict | None = None,
+                     timeframes: dict | None = None) -> dict:
+        """Runs `find_options` for every bot on `price_data` and returns `{bot_name: suggestions}`.\n
+        `tickers` maps bot names to updated ticker lists, and `only` maps bot names to the tickers of `price_data`
+        they should be run on (the default is all of them). `timeframes` is `{timeframe: price_data}` with bars of
+        longer timeframes, for the bots with a `timeframe` attribute. Raises RuntimeError if a bot raised an exception."""
+        shared = SharedPriceData(price_data)
+        frames = {timeframe: SharedPriceData(data) for timeframe, data in (timeframes or {}).items()}
+        try:
+            frame_meta = {timeframe: (frame.name, frame.meta) for timeframe, frame in frames.items()}
+            for connection in self._connections:
+                connection.send(("run", shared.name, shared.meta, tickers or {}, only or {}, frame_meta))
+            suggestions, errors = {}, {}
+            for connection in self._connections:
+                worker_suggestions, worker_errors = connection.recv()
+                suggestions.update(worker_suggestions)
+                errors.update(worker_errors)
+        finally:
+            shared.close()
+            for frame in frames.values():
+                frame.close()
+
+        if errors:
+            bot_name, error = next(iter(errors.items()))
+            raise RuntimeError(f"{bot_name} failed in its worker process:\n{error}")
+        return suggestions
+
+    def close(self):
+        for connection in self._connections:
+            try:
+                connection.send(("stop",))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._connections.clear()
+        self._processes.clear()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    from mäklare import sma, ema, macd, obv, rsi, stoch, cci
+
+    # Slumpad prisdata i samma format som utils.retrieve_data
+    n_tickers = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    n_bars, cycles = 400, 20
+    rng = np.random.default_rng(0)
+    index = pandas.date_range('1900-01-01 10:00', periods=n_bars + cycles, freq='1min', name='TIME')
+    full = {}
+    for i in range(n_tickers):
+        close = 100 + np.cumsum(rng.normal(0, 0.3, len(index)))
+        full[f"T{i}"] = pandas.DataFrame({'OPEN': close, 'HIGH': close + 0.1, 'LOW': close - 0.1, 'PRICE': close,
+                                          'VOLUME': rng.integers(0, 1000, len(index)).astype(float)}, index=index)
+
+    def make_bots():
+        tickers = list(full)
+        return [sma.SMABot("sma", tickers, short_period=9, long_period=21),
+                ema.EMABot("ema", tickers, short_period=9, long_period=21),
+                macd.MACDCrossoverBot("macd", tickers, short_period=5, long_period=35, signal_period=5),
+                obv.OBVBot("obv", tickers, 9), rsi.RSIBot("rsi", tickers, length=7, upper=70, lower=30),
+                stoch.StochBot("stoch", tickers, k_period=5), cci.CCIBot("cci", tickers, length=14)]
+
+    def windows():
+        # Första körningen fyller bottarnas tillstånd, resten är som en vanlig minut
+        for end in range(n_bars, n_bars + cycles):
+            yield {t: df.iloc[end - 120:end] for t, df in full.items()}
+
+    bots = make_bots()
+    thread_times = []
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        for price_data in windows():
+            start = time.perf_counter()
+            list(executor.map(lambda bot: bot.find_options(price_data), bots))
+            thread_times.append(time.perf_counter() - start)
+
+    pool = BotPool(make_bots(), processes)
+    process_times = []
+    try:
+        for price_data in windows():
+            start = time.perf_counter()
+            pool.find_options(price_data)
+            process_times.append(time.perf_counter() - start)
+    finally:
+        pool.close()
+
+    print(f"{n_tickers} aktier, {len(bots)} bottar, {pool.n_processes} processer")
+    print(f"Trådar:    första {thread_times[0] * 1000:.0f} ms, sedan {np.median(thread_times[1:]) * 1000:.1f} ms per körning")
+    print(f"Processer: första {process_times[0] * 1000:.0f} ms, sedan {np.median(process_times[1:]) * 1000:.1f} ms per körning")
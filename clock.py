@@ -0,0 +1,86 @@
+"""
+Klockan som bottarna, handelsreglerna och schemaläggaren i main frågar om tiden.
+
+Live är det systemklockan. En backtest (se backtest.py) byter ut den mot en `SimulatedClock` med `use_clock`,
+så att `now()`, `time()` och `sleep()` följer den simulerade tiden istället för `datetime.now()` och `time.sleep()`.
+En simulerad `sleep()` flyttar bara klockan framåt, så en hel handelsdag kan köras på några sekunder.
+"""
+
+import datetime as dt
+import time as _time
+from contextlib import contextmanager
+
+
+class SystemClock():
+    """The real time."""
+
+    def now(self, tz: dt.tzinfo | None = None) -> dt.datetime:
+        return dt.datetime.now(tz)
+
+    def time(self) -> float:
+        return _time.time()
+
+    def sleep(self, seconds: float):
+        _time.sleep(seconds)
+
+
+class SimulatedClock():
+    """A clock that only moves when it is told to, or when someone sleeps on it.\n
+    `current` is a naive local time, like `datetime.now()`."""
+
+    def __init__(self, start: dt.datetime):
+        self.current = start
+
+    def now(self, tz: dt.tzinfo | None = None) -> dt.datetime:
+        if tz is None:
+            return self.current
+        return self.current.astimezone(tz)
+
+    def time(self) -> float:
+        """Seconds since the epoch, like `time.time()`."""
+        return self.current.timestamp()
+
+    def sleep(self, seconds: float):
+        if seconds > 0:
+            self.advance(dt.timedelta(seconds=seconds))
+
+    def set(self, time: dt.datetime):
+        self.current = time
+
+    def advance(self, delta: dt.timedelta):
+        self.current += delta
+
+
+CLOCK = SystemClock()
+
+
+def now(tz: dt.tzinfo | None = None) -> dt.datetime:
+    """The current time according to `CLOCK`."""
+    return CLOCK.now(tz)
+
+
+def today() -> dt.date:
+    """Today's date according to `CLOCK`, used for the dated log files."""
+    return CLOCK.now().date()
+
+
+def time() -> float:
+    """`time.time()` according to `CLOCK`."""
+    return CLOCK.time()
+
+
+def sleep(seconds: float):
+    """`time.sleep()` according to `CLOCK`."""
+    CLOCK.sleep(seconds)
+
+
+@contextmanager
+def use_clock(clock):
+    """Makes `now()`, `time()` and `sleep()` use `clock` inside the with-block."""
+    global CLOCK
+    previous = CLOCK
+    CLOCK = clock
+    try:
+        yield clock
+    finally:
+        CLOCK = previous
@@ -0,0 +1,92 @@
+"""
+Håller reda på vilka aktier som har fått ny data sedan en bot senast kördes på dem.
+
+En lugn eftermiddag får många av de 100 aktierna ingen ny tick på flera minuter, och deras fönster blir exakt
+samma som förra minuten. `DirtyTracker.select` sparar sekvensnumret (`utils.data_sequences`) som varje bot senast
+kördes på för varje aktie, och plockar bort de aktier där det inte har ändrats.
+
+Bottarna räknar bara på nya staplar (streaming.advance), så att hoppa över en aktie ändrar inte deras
+indikatorer. Med samma indata ger de samma förslag igen, som redan har handlats på (ett köp av en ägd aktie
+eller en försäljning av en aktie som inte ägs görs inte). Det som styr resten är attribut på bottarna:
+- `unchanged_runs` (standard 1): hur många gånger i rad boten måste köras på samma data innan fler körningar
+  inte ändrar något. RSI- och CCI-bottarnas tillstånd kan ta två steg på samma värde (BUY -> NEUTRAL -> SELL).
+- `signals_on_previous_minute = True` (korsningsbottarna): de letar efter signaler i minuten före klockan,
+  så minuten ingår också tills klockan har passerat fönstrets sista stapel. Med `timeframe` är det stapeln före
+  den nuvarande i bottens tidsram.
+- `skip_unchanged = False`: boten körs alltid på allt, t.ex. RandomBot, TMFBot (summorna ändras vid varje
+  körning) och StochBot (tillståndet kan växla fram och tillbaka på samma värden).
+"""
+
+import datetime
+
+import pandas
+
+import clock
+
+BASE_DATE = datetime.datetime(1900, 1, 1)  # Samma datum som staplarnas index
+
+
+def _signal_bar(timeframe: int = 1) -> pandas.Timestamp:
+    """The bar the crossover bots look for signals in, see e.g. `SMABot.find_options`."""
+    now = pandas.Timestamp.combine(BASE_DATE, clock.now().time())
+    return now.floor(f"{timeframe}min") - pandas.Timedelta(minutes=timeframe)
+
+
+class DirtyTracker():
+    """Remembers the data sequence number every (bot, ticker) pair was last run on."""
+
+    def __init__(self):
+        self._seen: dict[str, dict] = {}  # {bot_name: {ticker: (nyckel, antal körningar på nyckeln)}}
+        self.selected = 0
+        self.skipped = 0
+
+    def select(self, bot, data: dict, sequences: dict) -> dict:
+        """Returns the part of `data` that `bot` hasn't been run on yet, and marks it as run.\n
+        `sequences` is from `utils.data_sequences`, tickers missing from it are always selected."""
+        if not getattr(bot, "skip_unchanged", True):
+            self.selected += len(data)
+            return data
+        seen = self._seen.setdefault(bot.bot_name, {})
+        target = None
+        if getattr(bot, "signals_on_previous_minute", False):
+            target = _signal_bar(getattr(bot, "timeframe", 1))
+        runs = getattr(bot, "unchanged_runs", 1)
+
+        selected = {}
+        for t, df in data.items():
+            key = sequences.get(t)
+            if key is None or df is None or df.empty:
+                selected[t] = df
+                continue
+            if target is not None:
+                # Signalen för en stapel kommer minuten efter den, även utan ny data
+                key = (key, min(target, df.index[-1]))
+            previous = seen.get(t)
+            if previous is not None and previous[0] == key:
+                if previous[1] >= runs:
+                    continue
+                seen[t] = (key, previous[1] + 1)
+            else:
+                seen[t] = (key, 1)
+            selected[t] = df
+
+        # Glöm aktier som varken finns i bottens lista eller i datan längre
+        if len(seen) > len(data):
+            for t in set(seen).difference(bot.tickers, data):
+                del seen[t]
+        self.selected += len(selected)
+        self.skipped += len(data) - len(selected)
+        return selected
+
+    def forget(self, bot_name: str):
+        """Runs the bot on every ticker next time, e.g. after it raised an exception."""
+        self._seen.pop(bot_name, None)
+
+    def stats(self) -> dict:
+        total = self.selected + self.skipped
+        return {"selected": self.selected, "skipped": self.skipped,
+                "skip_rate": self.skipped / total if total else 0.0}
+
+
+# Delad instans för main.py
+DIRTY_TRACKER = DirtyTracker()
@@ -4,15 +4,22 @@ En kodfil för att hantera simulerade köp och säljning av aktier
 `köp()` funktionen används för att köpa aktier
 
 `sälj()` funktionen används för att sälja aktier
+
+Portföljerna hålls i minnet av `PORTFOLIOS` (se portfolio_store.py)
 """
 
 import yfinance as yf
+from yfinance.exceptions import YFTickerMissingError
 import json
 import os
 from utils import ERROR_CODES, PATH_TILL_PORTFÖLJER, PATH_TILL_PRISER, PATH_TILL_LOGGAR, thread_safe_print
+from tick_storage import TICK_FILE_SUFFIX, last_tick
+from portfolio_store import PortfolioStore
+from price_cache import LAST_PRICES, VALID_TICKERS
+from portfolio_valuation import LOG_TIMESTAMP_FORMAT
+import clock
 import csv
-import datetime
-from math import floor
+from math import floor, isnan
 from typing import Tuple, Optional
 import threading
 import queue
@@ -23,10 +30,13 @@ PRINT_TRANSACTIONS = False
 log_queue = queue.Queue()
 _log_thread = None
 
+PORTFOLIOS = PortfolioStore(PATH_TILL_PORTFÖLJER)
+
 
 def log(bot_name, ticker, action, amount, price):
     """Logga en handling till dagens loggfil. Använder en dedikerad testfill om TESTING är True."""
-    row = [datetime.datetime.now(), bot_name, ticker, action,
+    # Tiden kommer från clock så att en simulerad dag loggas med simulerade tider
+    row = [clock.now().strftime(LOG_TIMESTAMP_FORMAT), bot_name, ticker, action,
            amount, price, price * amount]
     log_queue.put(row)
 
@@ -38,7 +48,7 @@ def log_writer():
         log_file_path = os.path.join(PATH_TILL_LOGGAR, "logg_test.csv")
     else:
         log_file_path = os.path.join(
-            PATH_TILL_LOGGAR, "logg-" + datetime.date.today().strftime("%Y-%m-%d") + ".csv")
+            PATH_TILL_LOGGAR, "logg-" + clock.today().strftime("%Y-%m-%d") + ".csv")
     with open(log_file_path, "a", encoding="utf-8", newline="") as csvfile:
         writer = csv.writer(csvfile, delimiter=',',
                             quotechar='"', quoting=csv.QUOTE_MINIMAL)
@@ -73,79 +83,150 @@ def stop_logger():
 
 
 def load_portfolio(bot_name: str) -> Optional[dict]:
-    """Ladda portföljen för en given bot."""
-    portfolio_path = os.path.join(PATH_TILL_PORTFÖLJER, bot_name + ".json")
-    if not os.path.exists(portfolio_path):
+    """Ladda (en kopia av) portföljen för en given bot."""
+    if not PORTFOLIOS.exists(bot_name):
         thread_safe_print(f"Portfölj för '{bot_name}' existerar inte.")
         return None
 
     try:
-        with open(portfolio_path, 'r') as f:
-            portfolio = json.load(f)
-            return portfolio
+        return PORTFOLIOS.get(bot_name)
     except (IOError, json.JSONDecodeError) as e:
         thread_safe_print(f"Kunde inte läsa portföljfilen: {e}")
         return None
 
 
-def _validate_stock(ticker_str):
-    """Validera ticker som str eller yf.Ticker."""
-    stock = yf.Ticker(ticker_str)
+def create_portfolio(bot_name: str, fria_pengar: float = 100_000) -> dict:
+    """Skapa en ny portfölj för en bot om den inte redan finns."""
+    return PORTFOLIOS.create(bot_name, fria_pengar)
+
+
+def _ticker_exists(ticker: str) -> Optional[bool]:
+    """
+    Frågar yfinance om tickern finns, för tickers som saknade priser i en annars lyckad hämtning.
+    False bara om yfinance säger att symbolen saknas, None om det inte går att avgöra.
+    """
     try:
-        # Kontrollera om reg. marknadspris finns
-        price = stock.info.get("regularMarketPrice")
-        return price is not None
-    except Exception:
+        history = yf.Ticker(ticker).history(period="5d", interval="1d", raise_errors=True)
+    except YFTickerMissingError:
         return False
+    except Exception as e:
+        thread_safe_print(f"Kunde inte kontrollera {ticker} hos yfinance: {e}")
+        return None
+    return True if history is not None and not history.empty else None
+
+
+def _fetch_prices(tickers: list) -> dict:
+    """
+    Hämtar senaste priset för flera tickers i en enda förfrågan till yfinance.
+    Tickers med priser sparas som giltiga i VALID_TICKERS. En tom eller misslyckad hämtning (nätverksfel,
+    eller före öppning) sparar ingenting, och tickers utan priser sparas som ogiltiga bara om yfinance
+    säger att symbolen inte finns (`_ticker_exists`).
+    """
+    if not tickers:
+        return {}
+    try:
+        history = yf.download(list(tickers), period="1d", interval="1m", progress=False, threads=False)
+    except Exception as e:
+        thread_safe_print(f"Kunde inte hämta priser från yfinance: {e}")
+        return {}
+    if history is None or history.empty:
+        return {}
+
+    prices = {}
+    close = history['Close']
+    if not hasattr(close, 'columns'):
+        close = close.to_frame(tickers[0])
+    for t in tickers:
+        if t in close.columns and close[t].notna().any():
+            prices[t] = float(close[t].dropna().iloc[-1])
+            VALID_TICKERS.set(t, True)
+        else:
+            exists = _ticker_exists(t)
+            if exists is not None:
+                VALID_TICKERS.set(t, exists)
+    return prices
+
+
+def _last_csv_line(file_path: str, block_size: int = 4096) -> str:
+    """Läser den sista raden i en CSV-fil bakifrån, ett block i taget."""
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+            # Minst en hel rad efter den sista radbrytningen (som inte är i slutet av filen)
+            if data.rstrip(b'\r\n').count(b'\n') >= 1:
+                break
+        lines = data.rstrip(b'\r\n').split(b'\n')
+        return lines[-1].decode() if len(lines) > 1 else ''
+
+
+def _get_local_price(ticker) -> Optional[float]:
+    """Senaste priset utan nätverk: från websocketen, annars från tickfilen eller CSV-filen."""
+    price = LAST_PRICES.get(ticker)
+    if price is not None:
+        return price
+
+    tick_path = os.path.join(PATH_TILL_PRISER, f"{ticker}{TICK_FILE_SUFFIX}")
+    if os.path.exists(tick_path):
+        # Binär tickfil, sista posten är senaste priset
+        tick = last_tick(tick_path)
+        if tick is not None and not isnan(tick['PRICE']):
+            return float(tick['PRICE'])
+
+    file_path = os.path.join(PATH_TILL_PRISER, f"{ticker}.csv")
+    if os.path.exists(file_path):
+        last_line = _last_csv_line(file_path)
+        # Tom fil eller bara rubriken (TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME)
+        if last_line and "TIME" not in last_line:
+            return float(last_line.split(',')[1])
+    return None
 
 
 def _get_stock_price(ticker) -> Tuple[Optional[float], ERROR_CODES]:
-    """Funktion för att hämta det senaste priset av en aktie via dess ticker."""
-    # try:
-    if not _validate_stock(ticker):
+    """
+    Funktion för att hämta det senaste priset av en aktie via dess ticker.
+    Går bara mot nätverket om priset inte finns lokalt och tickern inte redan har kontrollerats.
+    """
+    price = _get_local_price(ticker)
+    if price is not None:
+        # Vi har fått priser för tickern, så den finns
+        return price, ERROR_CODES.SUCCESS
+
+    if VALID_TICKERS.is_valid(ticker) is False:
         thread_safe_print(f"Kunde inte hitta ticker med namn {ticker}.")
         return None, ERROR_CODES.INVALID_TICKER
 
-    file_path = os.path.join(PATH_TILL_PRISER, f"{ticker}.csv")
-    last_line = ''
-    price = 0
-    price_file_exists = os.path.exists(file_path)
-    if price_file_exists:
-        with open(file_path, "rb") as f:
-
-            # Read from the end of the file to get the last line
-            f.seek(0, os.SEEK_END)
-            file_size = f.tell()
-
-            # Start reading backwards from the end
-            offset = 2
-            while offset <= file_size:
-                f.seek(-offset, os.SEEK_END)
-                char = f.read(1)
-                if char == b'\n':
-                    last_line = f.read()
-                    break
-                offset += 1
-            last_line = last_line.decode()
-    # If the last_line is empty or just a header, or if it's the header itself
-    # (e.g., "TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME"), then fetch from yfinance.
-    if not price_file_exists or not last_line or "TIME" in last_line:
-        thread_safe_print("File for", ticker, "price not found, attempting request from yfinance")
-        stock = yf.Ticker(ticker)
-        history = stock.history(period="1d", interval="1m")
-        if history.empty:
-            thread_safe_print(f"Kunde inte hitta historik för {ticker}.")
-            return None, ERROR_CODES.HISTORY_NOEXIST
-        price = history['Close'].iloc[-1]
-    else:
-        price = float(last_line.split(',')[1])
+    thread_safe_print("File for", ticker, "price not found, attempting request from yfinance")
+    prices = _fetch_prices([ticker])
+    if ticker in prices:
+        return prices[ticker], ERROR_CODES.SUCCESS
+    if VALID_TICKERS.is_valid(ticker) is False:
+        thread_safe_print(f"Kunde inte hitta ticker med namn {ticker}.")
+        return None, ERROR_CODES.INVALID_TICKER
+    thread_safe_print(f"Kunde inte hitta historik för {ticker}.")
+    return None, ERROR_CODES.HISTORY_NOEXIST
 
-    return price, ERROR_CODES.SUCCESS
 
-    # except Exception as e:
-    #     # Något hände, whoopsie daisy
-    #     thread_safe_print(f"Ett fel uppstod vid hämtning av pris för {ticker}: {e.with_traceback(e.__traceback__)}")
-    #     return None, ERROR_CODES.PRICE_UNAVAILABLE
+def _get_stock_prices(tickers) -> dict:
+    """
+    Som `_get_stock_price` men för flera tickers. Alla som saknas lokalt hämtas i en och samma förfrågan.
+    Returnerar {ticker: pris} för de tickers som hade ett pris.
+    """
+    prices = {}
+    missing = []
+    for t in tickers:
+        price = _get_local_price(t)
+        if price is not None:
+            prices[t] = price
+        elif VALID_TICKERS.is_valid(t) is not False:
+            missing.append(t)
+    prices.update(_fetch_prices(missing))
+    return prices
 
 
 def köp(bot_name, ticker, antal, allow_add_to_position=True):
@@ -167,8 +248,7 @@ def köp(bot_name, ticker, antal, allow_add_to_position=True):
         return ERROR_CODES.INVALID_AMOUNT
     antal = floor(antal)  # Vi kan bara köpa ett helt antal aktier
 
-    portfolio_path = os.path.join(PATH_TILL_PORTFÖLJER, bot_name + ".json")
-    if not os.path.exists(portfolio_path):
+    if not PORTFOLIOS.exists(bot_name):
         thread_safe_print(f"Portfölj för '{bot_name}' existerar inte.")
         return ERROR_CODES.PORTFOLIO_NOEXIST
 
@@ -181,27 +261,22 @@ def köp(bot_name, ticker, antal, allow_add_to_position=True):
     cost = price * antal
 
     try:
-        with open(portfolio_path, 'r') as f:
-            portfolio = json.load(f)
+        with PORTFOLIOS.edit(bot_name) as portfolio:
             if not allow_add_to_position and ticker in portfolio:
                 return ERROR_CODES.ADD_SHARES_NOT_ALLOWED
 
-        if portfolio.get('fria_pengar', 0) < cost:
-            thread_safe_print(
-                f"Inte tillräckligt med pengar. Behövs: {cost:.2f}, Tillgängligt: {portfolio.get('fria_pengar', 0):.2f}")
-            return ERROR_CODES.INSUFFICIENT_AMOUNT
+            if portfolio.get('fria_pengar', 0) < cost:
+                thread_safe_print(
+                    f"Inte tillräckligt med pengar. Behövs: {cost:.2f}, Tillgängligt: {portfolio.get('fria_pengar', 0):.2f}")
+                return ERROR_CODES.INSUFFICIENT_AMOUNT
 
-        # Uppdatera portfölj
-        portfolio['fria_pengar'] -= cost
-        if 'aktier' not in portfolio:
-            portfolio['aktier'] = {}
+            # Uppdatera portfölj, ändringen sparas i journalen när blocket lämnas
+            portfolio['fria_pengar'] -= cost
+            if 'aktier' not in portfolio:
+                portfolio['aktier'] = {}
 
-        portfolio['aktier'][ticker] = portfolio['aktier'].get(
-            ticker, 0) + antal
-
-        # Spara uppdaterad portfölj
-        with open(portfolio_path, 'w') as f:
-            json.dump(portfolio, f, indent=4)
+            portfolio['aktier'][ticker] = portfolio['aktier'].get(
+                ticker, 0) + antal
 
         thread_safe_print(f"{bot_name} köpte {antal} st {ticker} för ${cost:.2f}.")
 
@@ -233,42 +308,40 @@ def sälj(bot_name: str, ticker: str, antal: int):
         return ERROR_CODES.INVALID_AMOUNT
     antal = floor(antal)
 
-    portfolio_path = os.path.join(PATH_TILL_PORTFÖLJER, bot_name + ".json")
-    if not os.path.exists(portfolio_path):
+    if not PORTFOLIOS.exists(bot_name):
         thread_safe_print(f"Portfölj för '{bot_name}' existerar inte.")
         return ERROR_CODES.PORTFOLIO_NOEXIST
 
     ticker = ticker.upper()
 
     try:
-        with open(portfolio_path, 'r') as f:
-            portfolio = json.load(f)
-
-        owned_shares = portfolio.get('aktier', {}).get(ticker, 0)
-        if owned_shares == 0:
+        # Priset hämtas utan att portföljen är låst, som vid köp, så att andra trådar inte väntar på nätverket
+        if PORTFOLIOS.get(bot_name).get('aktier', {}).get(ticker, 0) == 0:
             thread_safe_print(f"Du äger inga aktier i {ticker}.")
             return ERROR_CODES.NO_SHARES
-
-        # Om antal är större än max, sälj allt.
-        shares_to_sell = min(antal, owned_shares)
-
         price, error_code = _get_stock_price(ticker)
         if error_code != ERROR_CODES.SUCCESS:
-            thread_safe_print(f"Kunde inte hämta pris för {ticker}. Köpet avbröts.")
+            thread_safe_print(f"Kunde inte hämta pris för {ticker}. Försäljningen avbröts.")
             return error_code
-        income = price * shares_to_sell
 
-        # Uppdatera värden i portfölj
-        portfolio['fria_pengar'] += income
-        portfolio['aktier'][ticker] -= shares_to_sell
+        with PORTFOLIOS.edit(bot_name) as portfolio:
+            # Kan ha sålts av en annan tråd medan priset hämtades
+            owned_shares = portfolio.get('aktier', {}).get(ticker, 0)
+            if owned_shares == 0:
+                thread_safe_print(f"Du äger inga aktier i {ticker}.")
+                return ERROR_CODES.NO_SHARES
+
+            # Om antal är större än max, sälj allt.
+            shares_to_sell = min(antal, owned_shares)
+            income = price * shares_to_sell
 
-        # Om alla aktier säljs, ta bort aktien från dicten.
-        if portfolio['aktier'][ticker] == 0:
-            del portfolio['aktier'][ticker]
+            # Uppdatera värden i portfölj
+            portfolio['fria_pengar'] += income
+            portfolio['aktier'][ticker] -= shares_to_sell
 
-        # Spara den uppdaterade portföljen
-        with open(portfolio_path, 'w') as f:
-            json.dump(portfolio, f, indent=4)
+            # Om alla aktier säljs, ta bort aktien från dicten.
+            if portfolio['aktier'][ticker] == 0:
+                del portfolio['aktier'][ticker]
 
         thread_safe_print(f"{bot_name} sålde {shares_to_sell} st {ticker} för ${income:.2f}.")
 
@@ -284,7 +357,7 @@ def sälj(bot_name: str, ticker: str, antal: int):
 
 def utför_flera_transaktioner(bot_name: str, transaktioner: list):
     """
-    Utför en lista med transaktioner sekventiellt mot portföljen med endast en läsning och skrivning till fil.
+    Utför en lista med transaktioner sekventiellt mot portföljen. Hela listan utförs medan portföljen är låst.
 
     Args:
         bot_name (str): Namn på boten.
@@ -293,87 +366,86 @@ def utför_flera_transaktioner(bot_name: str, transaktioner: list):
     Returns:
         list: Lista med resultat (ERROR_CODES) för varje transaktion.
     """
-    portfolio_path = os.path.join(PATH_TILL_PORTFÖLJER, bot_name + ".json")
-    if not os.path.exists(portfolio_path):
+    if not PORTFOLIOS.exists(bot_name):
         return [ERROR_CODES.PORTFOLIO_NOEXIST] * len(transaktioner)
 
-    results = []
-
     try:
-        with open(portfolio_path, 'r') as f:
-            portfolio = json.load(f)
+        with PORTFOLIOS.edit(bot_name) as portfolio:
+            return _utför_transaktioner(bot_name, portfolio, transaktioner)
 
-        portfolio_changed = False
+    except (IOError, json.JSONDecodeError) as e:
+        thread_safe_print(f"Batch error: {e}")
+        return [ERROR_CODES.JSON_ERROR] * len(transaktioner)
 
-        for t_data in transaktioner:
-            ticker = t_data['ticker'].upper()
-            action = t_data['action']
-            amount = floor(t_data['amount'])
 
-            if amount <= 0:
-                results.append(ERROR_CODES.INVALID_AMOUNT)
+def _utför_transaktioner(bot_name: str, portfolio: dict, transaktioner: list,
+                         log_fn=None, get_price=None) -> list:
+    """
+    Ändrar den låsta portföljen för varje transaktion och returnerar resultaten.
+    `log_fn` och `get_price` (som standard `log` och `_get_stock_price`) byts ut av backtest.SimulatedBroker,
+    som handlar utan nätverk och loggfil.
+    """
+    log_fn = log if log_fn is None else log_fn
+    get_price = _get_stock_price if get_price is None else get_price
+    results = []
+    for t_data in transaktioner:
+        ticker = t_data['ticker'].upper()
+        action = t_data['action']
+        amount = floor(t_data['amount'])
+
+        if amount <= 0:
+            results.append(ERROR_CODES.INVALID_AMOUNT)
+            continue
+
+        # Använd medskickat pris om det finns, annars hämta
+        price = t_data.get('price')
+        if price is None:
+            price, error_code = get_price(ticker)
+            if error_code != ERROR_CODES.SUCCESS:
+                results.append(error_code)
                 continue
 
-            # Använd medskickat pris om det finns, annars hämta
-            price = t_data.get('price')
-            if price is None:
-                price, error_code = _get_stock_price(ticker)
-                if error_code != ERROR_CODES.SUCCESS:
-                    results.append(error_code)
-                    continue
-
-            if action == "BUY":
-                cost = price * amount
-                if portfolio.get('fria_pengar', 0) < cost:
-                    results.append(ERROR_CODES.INSUFFICIENT_AMOUNT)
-                    continue
-
-                allow_add = t_data.get('allow_add', False)
-                if not allow_add and ticker in portfolio.get('aktier', {}):
-                    results.append(ERROR_CODES.ADD_SHARES_NOT_ALLOWED)
-                    continue
-
-                portfolio['fria_pengar'] -= cost
-                if 'aktier' not in portfolio:
-                    portfolio['aktier'] = {}
-                portfolio['aktier'][ticker] = portfolio['aktier'].get(
-                    ticker, 0) + amount
-
-                log(bot_name, ticker, 'BUY', amount, price)
-                results.append(ERROR_CODES.SUCCESS)
-                portfolio_changed = True
-                if PRINT_TRANSACTIONS:
-                    thread_safe_print(f"{bot_name} köpte {amount} st {ticker} för ${cost:.2f} (Batch).")
-
-            elif action == "SELL":
-                owned = portfolio.get('aktier', {}).get(ticker, 0)
-                if owned == 0:
-                    results.append(ERROR_CODES.NO_SHARES)
-                    continue
-
-                to_sell = min(amount, owned)
-                income = price * to_sell
-
-                portfolio['fria_pengar'] += income
-                portfolio['aktier'][ticker] -= to_sell
-                if portfolio['aktier'][ticker] == 0:
-                    del portfolio['aktier'][ticker]
-
-                log(bot_name, ticker, 'SELL', to_sell, price)
-                results.append(ERROR_CODES.SUCCESS)
-                portfolio_changed = True
-                if PRINT_TRANSACTIONS:
-                    thread_safe_print(f"{bot_name} sålde {to_sell} st {ticker} för ${income:.2f} (Batch).")
-
-        if portfolio_changed:
-            with open(portfolio_path, 'w') as f:
-                json.dump(portfolio, f, indent=4)
-
-        return results
+        if action == "BUY":
+            cost = price * amount
+            if portfolio.get('fria_pengar', 0) < cost:
+                results.append(ERROR_CODES.INSUFFICIENT_AMOUNT)
+                continue
 
-    except (IOError, json.JSONDecodeError) as e:
-        thread_safe_print(f"Batch error: {e}")
-        return [ERROR_CODES.JSON_ERROR] * len(transaktioner)
+            allow_add = t_data.get('allow_add', False)
+            if not allow_add and ticker in portfolio.get('aktier', {}):
+                results.append(ERROR_CODES.ADD_SHARES_NOT_ALLOWED)
+                continue
+
+            portfolio['fria_pengar'] -= cost
+            if 'aktier' not in portfolio:
+                portfolio['aktier'] = {}
+            portfolio['aktier'][ticker] = portfolio['aktier'].get(
+                ticker, 0) + amount
+
+            log_fn(bot_name, ticker, 'BUY', amount, price)
+            results.append(ERROR_CODES.SUCCESS)
+            if PRINT_TRANSACTIONS:
+                thread_safe_print(f"{bot_name} köpte {amount} st {ticker} för ${cost:.2f} (Batch).")
+
+        elif action == "SELL":
+            owned = portfolio.get('aktier', {}).get(ticker, 0)
+            if owned == 0:
+                results.append(ERROR_CODES.NO_SHARES)
+                continue
+
+            to_sell = min(amount, owned)
+            income = price * to_sell
+
+            portfolio['fria_pengar'] += income
+            portfolio['aktier'][ticker] -= to_sell
+            if portfolio['aktier'][ticker] == 0:
+                del portfolio['aktier'][ticker]
+
+            log_fn(bot_name, ticker, 'SELL', to_sell, price)
+            results.append(ERROR_CODES.SUCCESS)
+            if PRINT_TRANSACTIONS:
+                thread_safe_print(f"{bot_name} sålde {to_sell} st {ticker} för ${income:.2f} (Batch).")
+    return results
 
 ## mini-Tester ##
 # köp("test", "AAPL", 5)
@@ -1,14 +1,19 @@
 import yfinance as yf
 import os
-import csv
 import datetime as dt
-from collections import deque
+from collections import Counter, deque
 import logging
 from threading import Thread, Lock, Event
 import threading
 from utils import PATH_TILL_PRISER, thread_safe_print
+from bar_store import BAR_STORE
+from price_cache import LAST_PRICES
+from tick_storage import TICK_FILE_SUFFIX, TickWriter
+from tick_pipeline import TickGaps, TickPipeline
+from tick_order import TickOrderer
 import operator
 import time
+import asyncio
 from websockets import exceptions as ws_exceptions
 
 """Tack Gemini för att du optimiserade min fil :D"""
@@ -26,9 +31,16 @@ STOP_EVENT = Event()
 # Aktiepriser ska rensas varje dag eftersom vi bara använder dagens prisdata.
 # Dessa filer i mappen Gymnasiearbete/aktiepriser ska bevaras mellan varje session, dvs inte tas bort.
 FILES_TO_KEEP = ['_date.txt', 'TESTTABELL.csv',
-                 'TESTTABELL2.csv', 'TESTTABELL3.csv']
+                 'TESTTABELL2.csv', 'TESTTABELL3.csv',
+                 'TESTTABELL.ticks', 'TESTTABELL2.ticks', 'TESTTABELL3.ticks']
 
 MAX_WEBSOCKET_SESSION_TIME = 10 * 60  # 10 minuter (yfinance har en tendens att koppla bort efter en stund)
+# Tickers delas upp på flera anslutningar så att en anslutning som hänger sig bara tappar en del av aktierna
+N_WEBSOCKET_SHARDS = 5
+
+# "thread": yfinance WebSocket i en tråd + data_writer som skriver en gång per sekund
+# "asyncio": tick_pipeline.TickPipeline, där varje tick skrivs så fort den har tagits emot
+INGESTION_MODE = "thread"
 
 last_ticker_update = 0.0
 _tickers_to_monitor = []
@@ -49,12 +61,37 @@ def message_handler(message):
 def data_writer():
     """
     Worker thread function.
-    Periodically processes messages from the queue and writes them to ticker-specific CSV files.
+    Periodically processes messages from the queue and writes them to ticker-specific binary tick files (see tick_storage).
+    Messages pass through a TickOrderer first, so duplicates are dropped and the files stay sorted by time.
     """
     thread_safe_print("Data writer thread started.")
     open_files = {}  # Cache for open file writers
     price_updates = {}  # Håll koll på alla prisuppdateringar så man får lite live-feedback
     update_timer = 0
+    orderer = TickOrderer()
+
+    def write(msg):
+        ticker = msg['id']
+
+        if ticker not in price_updates:
+            price_updates[ticker] = 0
+        price_updates[ticker] += 1
+
+        if ticker not in open_files:
+            filepath = os.path.join(
+                PATH_TILL_PRISER, f"{ticker}{TICK_FILE_SUFFIX}")
+            # Open in binary append mode, create if it doesn't exist. The minute index is kept next to it.
+            open_files[ticker] = TickWriter.open(filepath)
+
+        writer = open_files[ticker]
+        # yfinance timestamp is in milliseconds, it is stored as is
+        writer.writerow(msg["time"], msg.get("price"), msg.get(
+            "change_percent"), msg.get("change"), msg.get("day_volume"))
+        # Bygg 1-minuts staplarna direkt så att bottarna slipper läsa om filen
+        BAR_STORE.add_tick(ticker, msg["time"], msg.get(
+            "price"), msg.get("day_volume"))
+        LAST_PRICES.update(ticker, msg.get("price"), msg["time"])
+
     try:
         while not STOP_EVENT.is_set() or DATA_QUEUE:
             messages_to_write = []
@@ -62,36 +99,16 @@ def data_writer():
                 while DATA_QUEUE:
                     messages_to_write.append(DATA_QUEUE.popleft())
 
-            if messages_to_write:
-                for msg in messages_to_write:
-                    ticker = msg['id']
-
-                    if ticker not in price_updates:
-                        price_updates[ticker] = 0
-                    price_updates[ticker] += 1
-
-                    if ticker not in open_files:
-                        filepath = os.path.join(
-                            PATH_TILL_PRISER, f"{ticker}.csv")
-                        # Open in append mode, create if it doesn't exist
-                        f = open(filepath, "a", encoding="utf-8", newline="")
-                        writer = csv.writer(f)
-                        # Write header if the file is new/empty
-                        if os.path.getsize(filepath) == 0:
-                            writer.writerow(
-                                ["TIME", "PRICE", "CHANGE_PERCENT", "CHANGE", "CUM_VOLUME"])
-                        open_files[ticker] = (f, writer)
-
-                    _, writer = open_files[ticker]
-                    # yfinance timestamp is in milliseconds
-                    trade_time = dt.datetime.fromtimestamp(
-                        float(msg["time"]) / 1000).time()
-                    writer.writerow([trade_time.strftime("%H:%M:%S"), msg.get("price"), msg.get(
-                        "change_percent"), msg.get("change"), msg.get("day_volume")])
+            for msg in messages_to_write:
+                for ready in orderer.push(msg):
+                    write(ready)
+            # Släpp ticks som har väntat längre än vattenmärket, även för tickers som inte har fått nya ticks
+            for ready in orderer.release_expired():
+                write(ready)
 
             # Write to the file from the buffer
-            for tuple in open_files.values():
-                tuple[0].flush()
+            for writer in open_files.values():
+                writer.flush()
 
             # Wait before checking the queue again to avoid busy-waiting
             STOP_EVENT.wait(timeout=1.0)
@@ -100,19 +117,200 @@ def data_writer():
                 thread_safe_print(time.strftime("%H:%M:%S"),"Antal prisändringar:", sum(price_updates.values()), flush=True)
                 top_stocks = dict(sorted(price_updates.items(), key=operator.itemgetter(1), reverse=True)[:5])
                 thread_safe_print("Mest ändringar: ", top_stocks, flush=True)
+                if any(orderer.stats.values()):
+                    thread_safe_print("Rensade ticks:", orderer.stats, flush=True)
                 update_timer = 0
                 price_updates.clear()
+
+        for ready in orderer.flush():
+            write(ready)
+        for writer in open_files.values():
+            writer.flush()
     finally:
         # Ensure all files are closed on exit
-        for f, _ in open_files.values():
-            f.close()
+        for writer in open_files.values():
+            writer.close()
         thread_safe_print("Data writer thread stopped and files closed.")
 
 
+class WebSocketShard():
+    """
+    One yfinance WebSocket connection for a slice of the monitored tickers, listening in its own thread.\n
+    The shard remembers when it last received a message, so the watchdog can reconnect a stalled shard
+    (or rotate an old session) while the other shards keep receiving.
+    """
+
+    def __init__(self, index: int, tickers: list[str]):
+        self.index = index
+        self.tickers = list(tickers)
+        self._ticker_set = set(self.tickers)
+        self.ignored = Counter()  # Ticks för tickers som inte längre bevakas, per ticker
+        self.last_message = time.time()
+        self.rotate_at = time.time() + MAX_WEBSOCKET_SESSION_TIME
+        self.reconnects = 0
+        self.gaps = TickGaps()  # Uppskattar hur många ticks som tappas när anslutningen är nere
+        self._ws = None
+        self._thread = None
+        self._reconnect_requested = False
+        self._subscription_lock = Lock()
+
+    @property
+    def is_connected(self) -> bool:
+        return self._ws is not None
+
+    def start(self):
+        self._thread = Thread(target=self._listen, daemon=True, name=f"websocket-shard-{self.index}")
+        self._thread.start()
+
+    def _handle(self, message):
+        self.last_message = time.time()
+        ticker = message.get("id")
+        if ticker not in self._ticker_set:
+            # Yahoo kan skicka några ticks till efter unsubscribe
+            self.ignored[ticker] += 1
+            return
+        self.gaps.tick()
+        message_handler(message)
+
+    def update_tickers(self, added: list[str], removed: list[str]) -> bool:
+        """
+        Subscribes to `added` and unsubscribes from `removed` on the live connection.\n
+        New tickers are accepted before they are subscribed and old ones are dropped only after they are
+        unsubscribed, so no tick for a ticker that stays monitored is discarded.
+        Returns False if the connection had to be reopened, in which case the shard subscribes to its
+        new ticker list when it reconnects.
+        """
+        with self._subscription_lock:
+            self.tickers = [t for t in self.tickers if t not in set(removed)] + list(added)
+            self._ticker_set.update(added)
+            ws = self._ws
+            ok = True
+            if ws is not None:
+                try:
+                    if added:
+                        ws.subscribe(added)
+                    if removed:
+                        ws.unsubscribe(removed)
+                except Exception:
+                    logging.exception("Could not update the subscription of WebSocket shard %d.", self.index)
+                    ok = False
+            self._ticker_set.difference_update(removed)
+        if not ok:
+            self.reconnect()
+        return ok
+
+    def _listen(self):
+        while not STOP_EVENT.is_set():
+            delay = 1
+            try:
+                with yf.WebSocket() as ws:
+                    self._ws = ws
+                    if STOP_EVENT.is_set():  # stop_monitoring hann anropas innan _ws sattes
+                        break
+                    self.last_message = time.time()
+                    with self._subscription_lock:
+                        ws.subscribe(self.tickers)
+                    self.gaps.connected()
+                    ws.listen(self._handle)
+            except ws_exceptions.ConnectionClosedOK:
+                logging.info("WebSocket shard %d closed normally.", self.index)
+            except ws_exceptions.ConnectionClosedError as e:
+                logging.warning("WebSocket shard %d closed with error (%s); reconnecting in 5s.", self.index, e)
+                delay = 5
+            except Exception:
+                logging.exception("Unexpected error in WebSocket shard %d; reconnecting in 5s.", self.index)
+                delay = 5
+            finally:
+                self._ws = None
+                self.gaps.disconnected()
+            if self._reconnect_requested:
+                # Vakthunden stängde anslutningen, så anslut direkt igen
+                self._reconnect_requested = False
+                continue
+            STOP_EVENT.wait(delay)
+        thread_safe_print(f"WebSocket shard {self.index} has stopped.")
+
+    def reconnect(self):
+        """Closes the current connection, the listener thread opens a new one right away."""
+        ws = self._ws
+        if ws is None:
+            return
+        self.reconnects += 1
+        self.rotate_at = time.time() + MAX_WEBSOCKET_SESSION_TIME
+        self._reconnect_requested = True
+        self.gaps.disconnected()  # Redan här, så att den som väntar på den nya anslutningen inte ser den gamla
+        ws.close()
+
+    def close(self):
+        ws = self._ws
+        if ws is not None:
+            ws.close()
+
+    def join(self, timeout: float | None = None) -> bool:
+        """Waits for the listener thread. Returns False if it is still running."""
+        if self._thread is None or self._thread is threading.current_thread():
+            return True
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def create_shards(tickers: list[str], n_shards: int = N_WEBSOCKET_SHARDS) -> list[WebSocketShard]:
+    """
+    Spreads `tickers` round-robin over at most `n_shards` connections (the ticker list is usually sorted by
+    activity, so every shard gets a mix of busy and quiet tickers).\n
+    The first session rotations are staggered evenly over `MAX_WEBSOCKET_SESSION_TIME` so that the shards
+    never reconnect at the same time.
+    """
+    n_shards = max(1, min(n_shards, len(tickers)))
+    now = time.time()
+    shards = [WebSocketShard(i, tickers[i::n_shards]) for i in range(n_shards)]
+    for i, shard in enumerate(shards):
+        shard.rotate_at = now + MAX_WEBSOCKET_SESSION_TIME * (i + 1) / n_shards
+    return shards
+
+
+def check_shards(shards: list[WebSocketShard], timeout: float, now: float | None = None):
+    """
+    Reconnects every shard that hasn't received a message in `timeout` seconds, and rotates at most one
+    shard whose session is too old. A rotation waits until all other shards are connected, so there is
+    always at least one live feed.
+    """
+    if now is None:
+        now = time.time()
+    rotated = False
+    for shard in shards:
+        if not shard.is_connected:
+            continue  # Håller redan på att ansluta
+        if now - shard.last_message >= timeout:
+            thread_safe_print("-------------------------------\n"
+                              f"WebSocket watchdog: Shard {shard.index} received no messages in the last "
+                              f"{timeout} seconds. Reconnecting shard...\n"
+                              "-------------------------------", flush=True)
+            shard.reconnect()
+        elif (not rotated and now >= shard.rotate_at
+              and all(other.is_connected for other in shards if other is not shard)):
+            thread_safe_print(f"WebSocket watchdog: Maximum session time reached for shard {shard.index}. "
+                              "Reconnecting shard...", flush=True)
+            shard.reconnect()
+            rotated = True
+
+
+def _assign_added_tickers(shards: list[WebSocketShard], added: list[str]) -> dict:
+    """Gives each new ticker to the shard that currently has the fewest tickers."""
+    sizes = {shard: len(shard.tickers) for shard in shards}
+    assignment = {shard: [] for shard in shards}
+    for ticker in added:
+        shard = min(shards, key=lambda s: (sizes[s], s.index))
+        assignment[shard].append(ticker)
+        sizes[shard] += 1
+    return assignment
+
+
 # Globala variabler för att hantera WebSocket och trådar
-_ws = None
+_shards: list[WebSocketShard] = []
 _writer_thread = None
 _listener_thread = None
+_pipeline = None
 is_restarting_websocket = False
 
 def start_websocket_watchdog(timeout: int = 5):
@@ -127,6 +325,10 @@ def start_websocket_watchdog(timeout: int = 5):
         time.sleep(timeout)  # Kontrollera var (timeout) sekunder
         if is_restarting_websocket:
             continue  # Hoppa över kontrollen om vi redan håller på att återansluta
+        if INGESTION_MODE == "thread":
+            # Varje anslutning kontrolleras och återansluts för sig
+            check_shards(list(_shards), timeout)
+            continue
         if time.time() - last_ticker_update >= timeout:
             thread_safe_print("-------------------------------\n"
             "WebSocket watchdog: No messages received in the last "
@@ -149,32 +351,23 @@ def start_websocket_watchdog(timeout: int = 5):
             is_restarting_websocket = False
             session_start = time.time()  # Återställ sessionens starttid
 
-def _start_listening(tickers_to_monitor):
-    """Intern funktion som körs i en egen tråd för att lyssna på WebSocket."""
-    global _ws, _tickers_to_monitor
-    while not STOP_EVENT.is_set():
-        try:
-            with yf.WebSocket() as ws:
-                _ws = ws
-                _tickers_to_monitor = tickers_to_monitor
-                ws.subscribe(tickers_to_monitor)
-                ws.listen(message_handler)
-        except ws_exceptions.ConnectionClosedOK:
-            logging.info("WebSocket closed normally; reconnecting in 1s.")
-            time.sleep(1)  # Vänta lite innan återanslutning
-        except ws_exceptions.ConnectionClosedError as e:
-            logging.warning("WebSocket closed with error (%s); reconnecting in 5s.", e)
-            time.sleep(5)
-        except Exception:
-            logging.exception("Unexpected WebSocket error; reconnecting in 5s.")
-            time.sleep(5)  # Vänta lite längre vid fel innan återanslutning
-        finally:
-            thread_safe_print("WebSocket listener has stopped.")
+def _on_pipeline_tick(tick):
+    """Anropas av TickPipeline för varje tick, så att vakthunden vet att websocketen lever."""
+    global last_ticker_update
+    last_ticker_update = time.time()
+
+
+def _run_pipeline(tickers_to_monitor):
+    """Intern funktion som kör TickPipeline i en egen tråd med en egen event loop."""
+    global _pipeline, _tickers_to_monitor
+    _tickers_to_monitor = tickers_to_monitor
+    _pipeline = TickPipeline(tickers_to_monitor, directory=PATH_TILL_PRISER, on_tick=_on_pipeline_tick)
+    asyncio.run(_pipeline.run())
 
 
 def monitor_stocks(tickers_to_monitor: list[str]):
     """Creates a websocket using yfinance to listen to all tickers in tickers_to_monitor"""
-    global _writer_thread, _listener_thread, last_ticker_update
+    global _writer_thread, _listener_thread, _shards, _tickers_to_monitor, last_ticker_update
 
     STOP_EVENT.clear()
     
@@ -202,28 +395,98 @@ def monitor_stocks(tickers_to_monitor: list[str]):
             f.truncate(0)
             f.seek(0)
             f.write(today_date)
+            BAR_STORE.clear()
+            LAST_PRICES.clear()
+
+    if INGESTION_MODE == "asyncio":
+        # Pipelinen tar emot, bygger staplar och skriver till disk i samma tråd
+        _writer_thread = None
+        _shards = []
+        _listener_thread = Thread(target=_run_pipeline, args=(tickers_to_monitor,), daemon=True)
+        _listener_thread.start()
+        return
 
     # Starta dataskrivartråden
     _writer_thread = Thread(target=data_writer, daemon=True)
     _writer_thread.start()
 
-    # Starta lyssnartråden
-    _listener_thread = Thread(target=_start_listening, args=(tickers_to_monitor,), daemon=True)
-    _listener_thread.start()
+    # Starta en lyssnartråd per anslutning
+    _tickers_to_monitor = tickers_to_monitor
+    _listener_thread = None
+    _shards = create_shards(list(tickers_to_monitor))
+    for shard in _shards:
+        shard.start()
+
+
+def update_monitored_tickers(tickers_to_monitor: list[str], timeout: float = 10) -> dict:
+    """
+    Changes which tickers are monitored without restarting anything: tickers are subscribed and
+    unsubscribed on the running connections, and the data writer keeps its open files.\n
+    Returns `{"added", "removed", "reconnected_shards", "dropped_ticks"}`. `reconnected_shards` lists shards whose
+    connection failed and had to be reopened (in asyncio mode the pipeline's connection is shard 0), and
+    `dropped_ticks` estimates the ticks they lost until they had subscribed again, see tick_pipeline.TickGaps.
+    It waits up to `timeout` seconds for them, a connection that is still down is counted up to then.
+    """
+    global _tickers_to_monitor
+    if not tickers_to_monitor:
+        raise ValueError("The list of tickers to monitor cannot be empty.")
+    new_tickers = list(dict.fromkeys(tickers_to_monitor))
+    new_set = set(new_tickers)
+    old_set = set(_tickers_to_monitor)
+    added = [t for t in new_tickers if t not in old_set]
+    removed = [t for t in _tickers_to_monitor if t not in new_set]
+    report = {"added": added, "removed": removed, "reconnected_shards": [], "dropped_ticks": 0}
+    _tickers_to_monitor = new_tickers
+
+    if INGESTION_MODE == "asyncio":
+        if _pipeline is not None:
+            lost_before = _pipeline.gaps.estimate()
+            sent = _pipeline.update_tickers(new_tickers)
+            try:
+                ok = sent is not None and sent.result(timeout)
+            except Exception:
+                ok = False
+            if not ok:
+                report["reconnected_shards"].append(0)
+                _pipeline.gaps.wait_connected(timeout)
+                report["dropped_ticks"] = _pipeline.gaps.estimate() - lost_before
+        return report
+
+    shards = list(_shards)
+    assignment = _assign_added_tickers(shards, added)
+    failed = {}
+    for shard in shards:
+        shard_removed = [t for t in removed if t in shard._ticker_set]
+        if not assignment[shard] and not shard_removed:
+            continue
+        lost_before = shard.gaps.estimate()
+        if not shard.update_tickers(assignment[shard], shard_removed):
+            report["reconnected_shards"].append(shard.index)
+            failed[shard] = lost_before
+    deadline = time.monotonic() + timeout
+    for shard, lost_before in failed.items():
+        shard.gaps.wait_connected(max(deadline - time.monotonic(), 0))
+        report["dropped_ticks"] += shard.gaps.estimate() - lost_before
+    return report
 
 
 def stop_monitoring():
     """Stänger WebSocket-anslutningen och stoppar bakgrundstrådarna."""
     thread_safe_print("Shutting down monitoring...")
     STOP_EVENT.set()
-    if _ws:
-        _ws.close()
+    for shard in _shards:
+        shard.close()
+    if _pipeline:
+        _pipeline.stop()
+        if _listener_thread and _listener_thread != threading.current_thread():
+            _listener_thread.join(timeout=5)
+            if _listener_thread.is_alive():
+                thread_safe_print("Warning: Tick pipeline did not shut down gracefully.")
     if _writer_thread and _writer_thread != threading.current_thread():
         _writer_thread.join(timeout=5)  # Vänta på att skrivartråden ska avslutas, med en timeout
         if _writer_thread.is_alive():
             thread_safe_print("Warning: Data writer thread did not shut down gracefully.")
-        if _listener_thread and _listener_thread != threading.current_thread():
-            _listener_thread.join(timeout=5)  # Vänta på att lyssnartråden ska avslutas, med en timeout
-            if _listener_thread.is_alive():
-                thread_safe_print("Warning: WebSocket listener thread did not shut down gracefully.")
+    for shard in _shards:
+        if not shard.join(timeout=5):  # Vänta på att lyssnartrådarna ska avslutas, med en timeout
+            thread_safe_print(f"Warning: WebSocket shard {shard.index} did not shut down gracefully.")
     thread_safe_print("Monitoring shutdown complete.")
\ No newline at end of file
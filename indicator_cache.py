@@ -0,0 +1,164 @@
+"""
+Indikatorer som delas av alla bottar.
+
+Varje bot höll tidigare sina egna indikatorer per aktie (streaming.advance), så två `EMABot(9, 21)`, eller en
+EMABot och en MACD-bot med samma perioder, räknade samma EMA var för sig. `INDICATOR_CACHE` håller istället
+en uppsättning indikatorer per aktie och tidsram, en per nyckel som `("EMA", 9)`:
+- Nya färdiga staplar matas in en gång, av den första bot som ser dem.
+- Värdet för den sista stapeln, som fortfarande kan bildas, räknas en gång per stapel och pris och lämnas sedan
+  ut till alla bottar som frågar efter samma nyckel. `hits` och `misses` räknar de uppslagen.
+
+En indikator beskrivs med `(key, create, sources)`, där `sources` är det som `update` och `peek` anropas med:
+'PRICE' för stapelns pris, 'TIME' för dess tid eller `(key, output)` för värdet av en annan indikator (hela
+värdet om output är None, annars värdet på den platsen). Se `crossover_entries` och `macd_entries`.
+
+Får en aktie en indikator som den inte hade räknas alla dess indikatorer om från fönstret, så att de har
+samma historik. Det händer i praktiken bara första gången bottarna körs på aktien, och då ger det samma värden
+som om varje bot hade räknat själv.
+
+Bottarna i main körs i trådar och delar `INDICATOR_CACHE`. Med bot_pool.BotPool har varje process sin egen.
+"""
+
+from threading import Lock
+
+import pandas
+
+from streaming import EMA, Crossings, MACDLines, new_bars
+
+
+def _inputs(sources: tuple, time, price: float, values) -> list:
+    inputs = []
+    for source in sources:
+        if source == 'TIME':
+            inputs.append(time)
+        elif source == 'PRICE':
+            inputs.append(price)
+        else:
+            key, output = source
+            value = values(key)
+            inputs.append(value if output is None or value is None else value[output])
+    return inputs
+
+
+class _SharedStream():
+    """The shared indicators of one ticker and timeframe, in the order they were added."""
+
+    def __init__(self, specs: dict):
+        self.specs = specs  # {key: (create, sources)}
+        self.indicators = {key: create() for key, (create, _) in specs.items()}
+        self.outputs = {}  # Värdet från den senaste update per nyckel
+        self.last_time = None  # Tiden för den senaste färdiga stapeln, i nanosekunder (som streaming.TickerStream)
+        self.last_price = None
+        self.peeked = {}  # Värdena för stapeln `peeked_bar`
+        self.peeked_bar = None
+        self.peeked_time = None  # Tiden för `peeked_bar` som Timestamp, när den har behövts
+
+    def update(self, time, price: float):
+        for key, indicator in self.indicators.items():
+            self.outputs[key] = indicator.update(*_inputs(self.specs[key][1], time, price, self.outputs.get))
+
+    def peek(self, key, time, price: float):
+        if key not in self.peeked:
+            inputs = _inputs(self.specs[key][1], time, price, lambda source: self.peek(source, time, price))
+            self.peeked[key] = self.indicators[key].peek(*inputs)
+        return self.peeked[key]
+
+
+class IndicatorCache():
+    """Indicator states shared by all bots, per ticker and timeframe.\n
+    `hits` and `misses` count the indicator values bots have asked for, a hit is a value another bot had already computed."""
+
+    def __init__(self):
+        self._streams = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, ticker: str, df: pandas.DataFrame, entries: list, timeframe: int = 1) -> list:
+        """The values of `entries` (`(key, create, sources)`) for the last bar of the window `df`, which may still be forming.\n
+        The bars before it that haven't been seen are fed to all of the ticker's indicators first, like streaming.advance."""
+        times = df.index.asi8
+        prices = df.to_numpy(dtype=float)[:, df.columns.get_loc('PRICE')]
+        bar = (int(times[-1]), float(prices[-1]))
+        with self._lock:
+            stream = self._streams.get((ticker, timeframe))
+            # Oftast har en annan bot redan matat in samma fönster, då finns inga nya staplar att mata in
+            if (stream is None or stream.peeked_bar != bar
+                    or len(times) > 1 and (stream.last_time != times[-2] or stream.last_price != prices[-2])
+                    or any(key not in stream.specs for key, _, _ in entries)):
+                stream = self._advance(ticker, timeframe, stream, df, times, prices, entries)
+                if stream.peeked_bar != bar:
+                    stream.peeked, stream.peeked_bar, stream.peeked_time = {}, bar, None
+            values = []
+            for key, _, _ in entries:
+                if key in stream.peeked:
+                    self.hits += 1
+                    values.append(stream.peeked[key])
+                    continue
+                self.misses += 1
+                # Tiden görs om till en Timestamp bara om något värde måste räknas, och återanvänds när stapeln är färdig
+                if stream.peeked_time is None:
+                    stream.peeked_time = df.index[-1]
+                values.append(stream.peek(key, stream.peeked_time, bar[1]))
+            return values
+
+    def _advance(self, ticker, timeframe, stream, df, times, prices, entries) -> _SharedStream:
+        start, reset = new_bars(times, stream)
+        peeked = (None, None) if stream is None else (stream.peeked_bar, stream.peeked_time)
+        # Samma tider men andra priser, t.ex. en annan dag i en backtest
+        reset = reset or prices[start - 1] != stream.last_price
+        if reset or any(key not in stream.specs for key, _, _ in entries):
+            specs = {} if stream is None else dict(stream.specs)
+            for key, create, sources in entries:
+                specs.setdefault(key, (create, sources))
+            stream = self._streams[ticker, timeframe] = _SharedStream(specs)
+            start = 0
+        for i, price in enumerate(prices[start:-1].tolist(), start):
+            reuse = peeked[1] is not None and peeked[0][0] == times[i]
+            stream.update(peeked[1] if reuse else df.index[i], price)
+        if len(times) > 1:
+            stream.last_time, stream.last_price = int(times[-2]), float(prices[-2])
+        return stream
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def clear(self):
+        """Removes all indicators and resets the counters, e.g before a backtest."""
+        with self._lock:
+            self._streams.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def price_line(key, create) -> tuple:
+    """An indicator on the bars' price, e.g `price_line(("SMA", 9), lambda: SMA(9))`."""
+    return key, create, ('PRICE',)
+
+
+def crossings(a: tuple, b: tuple | None = None) -> tuple:
+    """`streaming.Crossings` of the values `a` and `b` (`(key, output)`), or of `a` and the 0-line."""
+    sources = ('TIME', a) if b is None else ('TIME', a, b)
+    return ("CROSSINGS", a, b), Crossings, sources
+
+
+def crossover_entries(lines) -> list:
+    """The two lines from a bot's `crossover_lines()` and their crossings last, see bot_family.py."""
+    (key_a, create_a, output_a), (key_b, create_b, output_b) = lines
+    return [price_line(key_a, create_a), price_line(key_b, create_b), crossings((key_a, output_a), (key_b, output_b))]
+
+
+def macd_entries(fast: int, slow: int, signal: int) -> list:
+    """The EMAs and the MACD with its signal line last, whose value is `(macd, signal)` like `streaming.MACD`.
+    The EMAs are the same as those of the EMA bots, so they are shared when the periods overlap."""
+    if slow < fast:
+        fast, slow = slow, fast
+    return [price_line(("EMA", fast), lambda: EMA(fast)), price_line(("EMA", slow), lambda: EMA(slow)),
+            (("MACD", fast, slow, signal), lambda: MACDLines(signal, slow + signal - 1),
+             ((("EMA", fast), None), (("EMA", slow), None)))]
+
+
+# Delad instans för alla bottar
+INDICATOR_CACHE = IndicatorCache()
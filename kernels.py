@@ -0,0 +1,149 @@
+"""
+Kompilerade (numba) kärnor för de tyngsta looparna.
+
+- `resample_ticks` ersätter `groupby(pandas.Grouper(freq='1min')).agg(...)` i `utils._resample_to_bars`.
+- `tmf_sums` är startvärdena i `TMFBot.calculate_tmf` (`ta.ad` och rullande summor).
+
+Alla kärnor gör samma aritmetik i samma ordning som pandas där testerna kräver exakt samma resultat, se
+test_kernels.py. De kompileras första gången de anropas och sparas i `__pycache__` (`cache=True`), så det
+är bara första körningen efter en ändring som tar några sekunder extra.
+
+Uppmätt med python kernels.py, 1 kärna: en dags ticks för en aktie (20 000 ticks) går från ~8,9 ms med
+groupby till ~0,9 ms. TMFBot:s startsummor (räknas en gång per aktie, första gången boten ser den) tar
+~8 ms för 100 aktier × 120 staplar istället för ~110 ms med pandas_ta.
+Första anropet tar ~1,2 s att kompilera, och ~0,3 s när kärnorna laddas från cachen.
+"""
+
+import math
+import sys
+
+import numpy as np
+from numba import njit
+
+NS_PER_MINUTE = 60 * 1_000_000_000
+EPSILON = sys.float_info.epsilon
+
+
+@njit(cache=True)
+def resample_ticks(times_ns, prices, cum_volumes):
+    """1-minute OHLCV bars for ticks sorted by time (`times_ns` as int64 nanoseconds).\n
+    Returns `(first_minute_ns, bars)` where `bars` has the columns OPEN, HIGH, LOW, PRICE and VOLUME and one row per
+    minute from the first tick to the last, exactly like `groupby(pandas.Grouper(key='TIME', freq='1min')).agg(...)`
+    followed by `diff` of the last cumulative volume and `ffill` in the old `utils._resample_to_bars`:
+    NaN prices and volumes are skipped, minutes without prices are filled from the minute before and
+    the volume is 0 for a minute (or the minute after one) without a cumulative volume."""
+    n = len(times_ns)
+    first = (times_ns[0] // NS_PER_MINUTE) * NS_PER_MINUTE
+    rows = (times_ns[n - 1] - first) // NS_PER_MINUTE + 1
+    bars = np.full((rows, 5), np.nan)
+    cum_volume = np.full(rows, np.nan)
+    for i in range(n):
+        row = (times_ns[i] - first) // NS_PER_MINUTE
+        price = prices[i]
+        if not math.isnan(price):
+            if math.isnan(bars[row, 0]):
+                bars[row, 0] = price
+                bars[row, 1] = price
+                bars[row, 2] = price
+            else:
+                if price > bars[row, 1]:
+                    bars[row, 1] = price
+                if price < bars[row, 2]:
+                    bars[row, 2] = price
+            bars[row, 3] = price
+        if not math.isnan(cum_volumes[i]):
+            cum_volume[row] = cum_volumes[i]
+
+    for row in range(rows):
+        volume = cum_volume[row] - cum_volume[row - 1] if row > 0 else np.nan
+        bars[row, 4] = 0. if math.isnan(volume) else volume
+        if row > 0:
+            for column in range(4):
+                if math.isnan(bars[row, column]):
+                    bars[row, column] = bars[row - 1, column]
+    return first, bars
+
+
+@njit(cache=True)
+def tmf_sums(high, low, close, volume, length):
+    """The sums `TMFBot` starts from: the sum of the last `length` values of `ta.ad` (the accumulation/distribution
+    line) and of the volume. Both are NaN if there are fewer than `length` bars or a NaN in the last `length`."""
+    n = len(close)
+    if n < length:
+        return np.nan, np.nan
+    # pandas_ta lägger till epsilon på hela serien om någon differens är 0
+    epsilon = 0.
+    for i in range(n):
+        if high[i] - low[i] == 0:
+            epsilon = EPSILON
+            break
+    ad = 0.
+    ad_sum = 0.
+    volume_sum = 0.
+    for i in range(n):
+        term = (2 * close[i] - (high[i] + low[i])) * (volume[i] / (high[i] - low[i] + epsilon))
+        if term == term:
+            ad += term  # cumsum hoppar över NaN men raden blir NaN
+        if i >= n - length:
+            ad_sum += ad if term == term else np.nan
+            volume_sum += volume[i]
+    return ad_sum, volume_sum
+
+
+if __name__ == "__main__":
+    import time
+
+    import pandas
+    import pandas_ta as ta
+
+    from utils import _resample_to_bars
+
+    def best_of(function, repeat=20) -> float:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return min(times) * 1000
+
+    start = time.perf_counter()
+    resample_ticks(np.zeros(1, dtype=np.int64), np.zeros(1), np.zeros(1))
+    print(f"Första anropet (kompilering eller inläsning från cachen): {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    rng = np.random.default_rng(0)
+    n = 20_000
+    seconds = np.sort(rng.integers(9 * 3600 + 1800, 16 * 3600, n))
+    ticks = pandas.DataFrame({'TIME': pandas.Timestamp('1900-01-01') + pandas.to_timedelta(seconds, unit='s'),
+                              'PRICE': 100 + np.cumsum(rng.normal(0, 0.01, n)),
+                              'CUM_VOLUME': np.cumsum(rng.integers(1, 100, n)).astype(float)})
+
+    def groupby():
+        ohlcv_df = ticks.groupby(pandas.Grouper(key='TIME', freq='1min')).agg(
+            OPEN=('PRICE', 'first'), HIGH=('PRICE', 'max'), LOW=('PRICE', 'min'), PRICE=('PRICE', 'last'),
+            CUM_VOLUME=('CUM_VOLUME', 'last'))
+        ohlcv_df['VOLUME'] = ohlcv_df['CUM_VOLUME'].diff().fillna(0)
+        return ohlcv_df.drop(columns=['CUM_VOLUME']).ffill()
+
+    print(f"1-minutsstaplar av {n} ticks: groupby {best_of(groupby):.2f} ms, "
+          f"_resample_to_bars {best_of(lambda: _resample_to_bars(ticks)):.2f} ms")
+
+    n_tickers, n_bars = 100, 120
+    index = pandas.date_range('1900-01-01 10:00', periods=n_bars, freq='1min', name='TIME')
+    price_data = {}
+    for i in range(n_tickers):
+        close = 100 + np.cumsum(rng.normal(0, 0.3, n_bars))
+        price_data[f"T{i}"] = pandas.DataFrame({'OPEN': close, 'HIGH': close + 0.1, 'LOW': close - 0.1, 'PRICE': close,
+                                                'VOLUME': rng.integers(0, 1000, n_bars).astype(float)}, index=index)
+    frames = list(price_data.values())
+
+    def pandas_ta_sums():
+        return [(ta.ad(df['HIGH'], df['LOW'], df['PRICE'], df['VOLUME']).rolling(21).sum().iloc[-1],
+                 df['VOLUME'].rolling(21).sum().iloc[-1]) for df in frames]
+
+    def kernel_sums():
+        return [tmf_sums(df['HIGH'].to_numpy(), df['LOW'].to_numpy(), df['PRICE'].to_numpy(),
+                         df['VOLUME'].to_numpy(), 21) for df in frames]
+
+    kernel_sums()
+    print(f"TMF-summor(21) för {n_tickers} aktier x {n_bars} staplar: pandas_ta {best_of(pandas_ta_sums, 5):.1f} ms, "
+          f"tmf_sums {best_of(kernel_sums):.2f} ms")
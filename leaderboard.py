@@ -0,0 +1,89 @@
+"""
+Topplistor över de bästa och sämsta affärerna, som används av analysis.py.
+
+`TopK` behåller de k största (eller minsta) värdena i en heap med k element, så varje ny affär kostar O(log k)
+istället för att hela listan söks igenom. Två `TopK` kan slås ihop, så att loggfiler som analyserats var för sig
+(t.ex. i olika processer) kan ge samma topplista som om de lästs i en följd, bortsett från ordningen mellan
+lika värden.
+"""
+
+import heapq
+
+
+class TopK():
+    """The `k` items with the largest keys, or the smallest if `largest` is False."""
+
+    def __init__(self, k: int, largest: bool = True):
+        self.k = k
+        self.largest = largest
+        # Min-heap med (nyckel, löpnummer, objekt). För de minsta värdena lagras -nyckel,
+        # så heapens första element är alltid det som står på tur att trängas ut
+        self._heap = []
+        self._count = 0  # Löpnummer så att objekten aldrig jämförs och att tidigare affärer vinner vid lika värden
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, key: float, item) -> bool:
+        """Adds `item` if `key` is among the `k` best so far. Returns True if it was added."""
+        if self.k <= 0:
+            return False
+        entry = (key if self.largest else -key, -self._count, item)
+        self._count += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def merge(self, other: "TopK"):
+        """Adds every item of `other` to this list."""
+        for key, _, item in other._heap:
+            self.push(key if self.largest else -key, item)
+
+    def items(self) -> list:
+        """The items, best first."""
+        return [item for _, _, item in sorted(self._heap, reverse=True)]
+
+
+class TradeLeaderboard():
+    """Best and worst trades overall, per bot and per ticker. A trade is `[bot_name, ticker, timestamp, trade_return]`,
+    profitable trades go to the best lists and the others to the worst lists."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self.best = TopK(k)
+        self.worst = TopK(k, largest=False)
+        self.best_by_bot: dict[str, TopK] = {}
+        self.worst_by_bot: dict[str, TopK] = {}
+        self.best_by_ticker: dict[str, TopK] = {}
+        self.worst_by_ticker: dict[str, TopK] = {}
+
+    def add(self, timestamp, bot_name: str, ticker: str, trade_return: float):
+        trade = [bot_name, ticker, timestamp, trade_return]
+        if trade_return > 0:
+            overall, by_bot, by_ticker, largest = self.best, self.best_by_bot, self.best_by_ticker, True
+        else:
+            overall, by_bot, by_ticker, largest = self.worst, self.worst_by_bot, self.worst_by_ticker, False
+        overall.push(trade_return, trade)
+        self._get(by_bot, bot_name, largest).push(trade_return, trade)
+        self._get(by_ticker, ticker, largest).push(trade_return, trade)
+
+    def merge(self, other: "TradeLeaderboard"):
+        """Adds the trades of another leaderboard, e.g. one from a log file analysed in another process."""
+        self.best.merge(other.best)
+        self.worst.merge(other.worst)
+        for mine, theirs, largest in ((self.best_by_bot, other.best_by_bot, True),
+                                      (self.worst_by_bot, other.worst_by_bot, False),
+                                      (self.best_by_ticker, other.best_by_ticker, True),
+                                      (self.worst_by_ticker, other.worst_by_ticker, False)):
+            for name, top in theirs.items():
+                self._get(mine, name, largest).merge(top)
+
+    def _get(self, lists: dict, name: str, largest: bool) -> TopK:
+        top = lists.get(name)
+        if top is None:
+            top = lists[name] = TopK(self.k, largest)
+        return top
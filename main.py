@@ -1,7 +1,7 @@
 from zoneinfo import ZoneInfo
 import datetime as dt
 from hitta_100 import get_most_active_stocks
-from hämta_aktiepriser import monitor_stocks, stop_monitoring, start_websocket_watchdog
+from hämta_aktiepriser import monitor_stocks, stop_monitoring, start_websocket_watchdog, update_monitored_tickers
 from mäklare import sma, ema, macd, obv, random_trader, rsi, uppner, stoch, cci, tmf
 import handla_aktie as ha
 import time
@@ -9,7 +9,6 @@ import os
 import sys
 import inspect
 import json
-import csv
 from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
@@ -17,9 +16,24 @@ child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
-from utils import PATH_TILL_PORTFÖLJER, PATH_TILL_LOGGAR, retrieve_data, ERROR_CODES, thread_safe_print  # nopep8
+from utils import retrieve_data, data_sequences, ERROR_CODES, thread_safe_print  # nopep8
+from dirty_tracker import DIRTY_TRACKER  # nopep8
+from indicator_cache import INDICATOR_CACHE  # nopep8
+from bot_family import BotFamily  # nopep8
+from portfolio_valuation import PORTFOLIO_VALUE_LOG, value_portfolios  # nopep8
+import clock  # nopep8
 
 SHOW_SUGGESTIONS = False
+# "thread": alla bottar körs i trådar i huvudprocessen
+# "process": bottarnas find_options körs i egna processer (bot_pool.BotPool), handeln sker fortfarande här
+BOT_EXECUTION_MODE = "thread"
+# "bar_close": bottarna körs för de aktier vars minutstapel just stängts (bar_scheduler.BarCloseScheduler)
+# "interval": alla bottar körs på alla aktier i början av varje minut
+SCHEDULER_MODE = "interval"
+# Kör inte en bot på aktier vars data inte har ändrats sedan boten senast kördes på dem (dirty_tracker.py)
+SKIP_UNCHANGED_TICKERS = True
+# Kör dessutom många parametervarianter av SMA- och RSI-bottarna, var och en med egen portfölj (bot_family.py)
+RUN_BOT_FAMILIES = False
 
 tickers = get_most_active_stocks().split(" ")
 # tickers = ["AAPL", "MSFT", "GOOG", "NVDA", "TSLA", "AMD", "META"]
@@ -31,7 +45,7 @@ top_active_tickers = set()  # Alla top 100 aktier
 
 def us_market_open(now=None):
     if now is None:
-        now = dt.datetime.now(ZoneInfo("America/New_York"))
+        now = clock.now(ZoneInfo("America/New_York"))
 
     # Börsen är öppen mån–fre
     if now.weekday() >= 5:
@@ -45,7 +59,7 @@ def us_market_open(now=None):
 
 def get_time_to_market_close(now=None):
     if now is None:
-        now = dt.datetime.now(ZoneInfo("America/New_York"))
+        now = clock.now(ZoneInfo("America/New_York"))
 
     close_dt = dt.datetime.combine(
         now.date(),
@@ -58,22 +72,15 @@ def get_time_to_market_close(now=None):
 
 def trade_suggestions(bot, bot_suggestions: dict):
     """Utför bottens rekommenderade åtgärd"""
-    portfolio_path = os.path.join(PATH_TILL_PORTFÖLJER, bot.bot_name + ".json")
-
     # Ensure portfolio exists
-    if not os.path.exists(portfolio_path):
+    if not ha.PORTFOLIOS.exists(bot.bot_name):
         thread_safe_print(
             f"Portfölj för '{bot.bot_name}' existerar inte. Skapar en ny portfölj.")
-        with open(portfolio_path, "w") as f:
-            portfolio_setup = json.dumps(
-                {"fria_pengar": 100_000, "aktier": {}})
-            f.write(portfolio_setup)
+        ha.create_portfolio(bot.bot_name, 100_000)
 
     # Load portfolio once for simulation
-    try:
-        with open(portfolio_path, "r") as f:
-            portfolio = json.load(f)
-    except (IOError, json.JSONDecodeError):
+    portfolio = ha.load_portfolio(bot.bot_name)
+    if portfolio is None:
         thread_safe_print(f"Could not read portfolio for {bot.bot_name}")
         return
 
@@ -140,73 +147,51 @@ def is_ticker_owned(ticker: str) -> bool:
     """
     Checks if a given ticker is currently owned by any bot.
     """
-    for bot in bots:
-        portfolio_path = os.path.join(
-            PATH_TILL_PORTFÖLJER, bot.bot_name + ".json")
-        if os.path.exists(portfolio_path):
-            try:
-                with open(portfolio_path, 'r') as f:
-                    portfolio = json.load(f)
-                    if 'aktier' in portfolio and ticker in portfolio['aktier'] and portfolio['aktier'][ticker] > 0:
-                        return True
-            except (IOError, json.JSONDecodeError) as e:
-                thread_safe_print(
-                    f"Warning: Could not read portfolio for {bot.bot_name} while checking ownership: {e}")
-    return False
+    # Ägarindexet täcker alla inlästa portföljer, bottarnas läses in när programmet startar
+    return ha.PORTFOLIOS.is_owned(ticker)
+
+
+def portfolio_bots(bots) -> list:
+    """The bots that have portfolios, where every BotFamily is replaced by its variants."""
+    return [member for bot in bots for member in (bot.members if isinstance(bot, BotFamily) else [bot])]
 
 
 def get_all_owned_tickers(bots):
     """
-    Scans all bot portfolios and returns a set of all unique stock tickers
-    that are currently owned.
+    Returns a set of all unique stock tickers that are currently owned
+    by the given bots. Reads from the in-memory portfolios, not the files.
     """
     owned_tickers = set()
-    for bot in bots:
-        portfolio_path = os.path.join(
-            PATH_TILL_PORTFÖLJER, bot.bot_name + ".json")
-        if os.path.exists(portfolio_path):
-            try:
-                with open(portfolio_path, 'r') as f:
-                    portfolio = json.load(f)
-                    # Add all tickers from the 'aktier' dict to the set
-                    if 'aktier' in portfolio:
-                        owned_tickers.update(portfolio['aktier'].keys())
-            except (IOError, json.JSONDecodeError) as e:
-                thread_safe_print(
-                    f"Warning: Could not read portfolio for {bot.bot_name}: {e}")
+    for bot in portfolio_bots(bots):
+        owned_tickers.update(get_bot_owned_tickers(bot))
     return owned_tickers
 
 
 def get_bot_owned_tickers(bot) -> set:
     """
-    Scans a single bot's portfolio and returns a set of its owned stock tickers.
+    Returns a set of the stock tickers a single bot owns (more than 0 shares).
     """
     owned = set()
-    portfolio_path = os.path.join(PATH_TILL_PORTFÖLJER, bot.bot_name + ".json")
-    if os.path.exists(portfolio_path):
-        try:
-            with open(portfolio_path, 'r') as f:
-                portfolio = json.load(f)
-                if 'aktier' in portfolio:
-                    # Add tickers that have more than 0 shares
-                    owned.update(
-                        {ticker for ticker, amount in portfolio['aktier'].items() if amount > 0})
-        except (IOError, json.JSONDecodeError) as e:
-            thread_safe_print(
-                f"Warning: Could not read portfolio for {bot.bot_name} while getting its owned tickers: {e}")
+    try:
+        # Tickers that have more than 0 shares
+        owned.update(ha.PORTFOLIOS.owned_by(bot.bot_name))
+    except (IOError, json.JSONDecodeError) as e:
+        thread_safe_print(
+            f"Warning: Could not read portfolio for {bot.bot_name} while getting its owned tickers: {e}")
     return owned
 
 
-def run_bot(bot):
-    """Worker funktion för att hämta suggestions och handla aktier efter suggestions"""
+def run_bot(bot, data: dict | None = None):
+    """Worker funktion för att hämta suggestions och handla aktier efter suggestions.
+    `data` är prisdatan boten körs på, som standard all price_data"""
     thread_safe_print(
-        f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Running bot '{bot.bot_name}'...")
+        f"[{clock.now().strftime('%Y-%m-%d %H:%M:%S')}] Running bot '{bot.bot_name}'...")
 
     bot_suggestions = {}
 
     # if possible, use already loaded price data instead of retrieving it again
     if len(inspect.signature(bot.find_options).parameters) == 1:
-        bot_suggestions = bot.find_options(price_data)
+        bot_suggestions = bot.find_options(price_data if data is None else data)
     else:
         bot_suggestions = bot.find_options()
 
@@ -215,64 +200,183 @@ def run_bot(bot):
     return bot.bot_name, bot_suggestions
 
 
-def log_portfolio_value(bot_name: str, portfolio: dict) -> None:
+def trade_bot_suggestions(bot, bot_suggestions: dict):
+    """Som run_bot, men förslagen har redan tagits fram i en BotPool-process"""
+    trade_suggestions(bot, bot_suggestions)
+    return bot.bot_name, bot_suggestions
+
+
+def run_family(family: BotFamily, data: dict | None = None):
+    """Som run_bot för alla varianter i en BotFamily. Förslagen räknas ut på en gång och varje variant
+    handlar i sin egen portfölj. Returnerar förslagen per variant"""
+    thread_safe_print(
+        f"[{clock.now().strftime('%Y-%m-%d %H:%M:%S')}] Running {len(family.members)} variants of '{family.bot_name}'...")
+    return trade_family_suggestions(family, family.find_options(price_data if data is None else data))
+
+
+def trade_family_suggestions(family: BotFamily, family_suggestions: dict):
+    """Som trade_bot_suggestions för alla varianter i en BotFamily"""
+    for member in family.members:
+        trade_suggestions(member, family_suggestions.get(member.bot_name, {}))
+    return family.bot_name, family_suggestions
+
+
+def log_portfolio_values(bot_names: list) -> None:
     """
-    Logs the total value of a bots portfolio
+    Values every bot's portfolio in one pass and logs all of them together
 
-    :param bot_name: The name of the bot who owns the portfolio
-    :type bot_name: str
-    :param portfolio: A dict that should have a key 'aktier' that contains
-    each ticker mapped to the amount owned, e.g NVDA: 100
-    :type portfolio: dict
+    :param bot_names: The names of the bots whose portfolios should be logged
+    :type bot_names: list
     """
-    if portfolio is None:
+    portfolios = {}
+    for bot_name in bot_names:
+        portfolio = ha.load_portfolio(bot_name)
+        if portfolio is None:
+            thread_safe_print(
+                f"WARNING: Could not log portfolio value for {bot_name} because portfolio is None.")
+            continue
+        portfolios[bot_name] = portfolio
+
+    # En prisvektor för alla aktier som någon bot äger, det som saknas i price_data hämtas på en gång
+    held_tickers = {ticker for portfolio in portfolios.values() for ticker in portfolio['aktier']}
+    prices = {ticker: price_data[ticker]["PRICE"].iat[-1] for ticker in held_tickers if ticker in price_data}
+    prices.update(ha._get_stock_prices([ticker for ticker in held_tickers if ticker not in prices]))
+    for ticker in held_tickers.difference(prices):
         thread_safe_print(
-            f"WARNING: Portfolio for {bot_name} is None, cannot log value.")
-        return
-    log_file_path = os.path.join(
-        PATH_TILL_LOGGAR, "portfolio-logg-" + dt.date.today().strftime("%Y-%m-%d") + ".csv")
-    with open(log_file_path, "a", encoding="utf-8", newline="") as csvfile:
-        writer = csv.writer(csvfile, delimiter=',',
-                            quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        if os.path.getsize(log_file_path) == 0:
-            writer.writerow(
-                ["TIMESTAMP", "BOT", "VALUE"])
-        portfolio_value = portfolio['fria_pengar']
-        price_fetch_failed = False
-        for ticker, amount in portfolio['aktier'].items():
-            stock_price = None
-            if ticker in price_data:
-                stock_price = price_data[ticker]["PRICE"].iloc[-1]
+            f"WARNING: Could not get price for {ticker} while logging portfolio values, skipping ticker...")
+
+    values = value_portfolios(portfolios, prices)
+    # Don't log incomplete portfolio values if we couldn't fetch critical prices
+    for bot_name in [name for name, value in values.items() if value is None]:
+        thread_safe_print(
+            f"WARNING: Skipped logging portfolio value for {bot_name} due to missing price data.")
+        del values[bot_name]
+    PORTFOLIO_VALUE_LOG.write_values(values)
+
+
+def retrieve_timeframes(bots, tickers: list[str]) -> dict:
+    """Hämtar staplarna för de längre tidsramar som bottarna har angett med `timeframe`.
+    Returnerar `{tidsram: {ticker: staplar}}`, tom om alla bottar använder 1-minutsstaplar"""
+    lengths = {}
+    for bot in bots:
+        timeframe = getattr(bot, "timeframe", 1)
+        if timeframe != 1:
+            lengths[timeframe] = max(lengths.get(timeframe, 0), getattr(bot, "required_period", max_period_length))
+    return {timeframe: retrieve_data(tickers, length, timeframe) for timeframe, length in lengths.items()}
+
+
+def run_bots(bots, data: dict, bot_pool=None, sequences: dict | None = None, timeframes: dict | None = None) -> dict:
+    """Kör alla bottar parallelt på `data` och handlar efter deras förslag. Returnerar förslagen per bot,
+    och per variant för bot_family.BotFamily.
+    Med `sequences` (från utils.data_sequences) körs varje bot bara på de aktier som ändrats sedan förra gången.
+    Bottar med en längre `timeframe` körs på staplarna i `timeframes` (från retrieve_timeframes)"""
+    suggestions = {}
+    timeframes = timeframes or {}
+    bot_data = {bot.bot_name: timeframes.get(getattr(bot, "timeframe", 1), data) for bot in bots}
+    if sequences is not None:
+        bot_data = {bot.bot_name: DIRTY_TRACKER.select(bot, bot_data[bot.bot_name], sequences) for bot in bots}
+    if bot_pool is not None:
+        thread_safe_print(
+            f"[{clock.now().strftime('%Y-%m-%d %H:%M:%S')}] Running {len(bots)} bots in {bot_pool.n_processes} processes...")
+        # Bottarna i processerna har sina egna kopior, skicka med deras tickerlistor
+        only = None if sequences is None else {name: list(selected) for name, selected in bot_data.items()}
+        try:
+            pool_suggestions = bot_pool.find_options(
+                data, {bot.bot_name: bot.tickers for bot in bots}, only, timeframes)
+        except Exception:
+            for bot in bots:
+                DIRTY_TRACKER.forget(bot.bot_name)
+            raise
+    # Kör alla bottar parallelt
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        # Skapa processer
+        if bot_pool is not None:
+            futures = [
+                executor.submit(trade_family_suggestions if isinstance(bot, BotFamily) else trade_bot_suggestions,
+                                bot, pool_suggestions.get(bot.bot_name, {}))
+                for bot in bots
+            ]
+        else:
+            futures = [
+                executor.submit(run_family if isinstance(bot, BotFamily) else run_bot, bot, bot_data[bot.bot_name])
+                for bot in bots
+            ]
+
+        # Spara resultat
+        for bot, future in zip(bots, futures):
+            try:
+                bot_name, options = future.result()
+            except Exception:
+                # Boten kanske inte hann köras på aktierna som markerades, kör den på allt nästa gång
+                DIRTY_TRACKER.forget(bot.bot_name)
+                raise
+            if isinstance(bot, BotFamily):
+                suggestions.update(options)
             else:
-                stock_price, _ = ha._get_stock_price(ticker)
-            if stock_price is not None:
-                portfolio_value += stock_price * amount
+                suggestions[bot_name] = options
+    return suggestions
+
+
+def show_suggestions(suggestions: dict):
+    # Log results
+    if suggestions.values():
+        thread_safe_print("Suggestions found:")
+        # thread_safe_print("DEBUG: suggestions:", suggestions)
+        bot_suggestions: dict
+        for bot_name, bot_suggestions in suggestions.items():
+            if len(bot_suggestions) == 0:
+                thread_safe_print(bot_name, "had no suggestions")
             else:
-                thread_safe_print(
-                    f"WARNING: Could not get price for {ticker} while logging portfolio value for {bot_name}, skipping ticker...")
-                price_fetch_failed = True
-                # Don't log incomplete portfolio value if we couldn't fetch critical prices
+                thread_safe_print(bot_name + ":")
+            for ticker, action in bot_suggestions.items():
+                thread_safe_print(f"  - {ticker}: {action}")
+    else:
+        thread_safe_print("No trading suggestions at this time.")
 
-        # Only log if we got prices for all holdings
-        if not price_fetch_failed or len(portfolio['aktier']) == 0:
-            writer.writerow([dt.datetime.now(), bot_name, portfolio_value])
-        else:
-            thread_safe_print(
-                f"WARNING: Skipped logging portfolio value for {bot_name} due to missing price data.")
+
+def refresh_tickers(bots):
+    """Hämtar de mest aktiva aktierna igen och uppdaterar prenumerationerna och bottarnas tickerlistor"""
+    global tickers
+    thread_safe_print("\nChecking for new most active stocks...")
+    new_tickers_to_monitor = set(
+        get_most_active_stocks().split(" "))
+
+    # Update list of tickers to monitor
+    # Websocketanslutningarna förnyas av vakthunden, så bara ändringen behöver skickas
+    if new_tickers_to_monitor != set(tickers):
+        thread_safe_print(
+            "Ticker pool has changed. Updating subscriptions...")
+        thread_safe_print(
+            f"Previously monitoring {len(tickers)} tickers.")
+        tickers = list(new_tickers_to_monitor)
+        report = update_monitored_tickers(tickers)
+        thread_safe_print(
+            f"Now monitoring {len(tickers)} tickers (+{len(report['added'])}, -{len(report['removed'])}), "
+            f"{len(report['reconnected_shards'])} connections reopened, about {report['dropped_ticks']} ticks dropped.")
+    else:
+        thread_safe_print("Ticker pool is unchanged.")
+
+    # Update tickers for each bot instance individually
+    thread_safe_print("Updating individual bot ticker lists...")
+    for bot in bots:
+        bot_owned = get_all_owned_tickers([bot])
+        bot.tickers = list(top_active_tickers.union(bot_owned))
+        top_active_tickers.update(new_tickers_to_monitor)
 
 
-def run_bots_periodically(bots, interval_seconds=60):
+def run_bots_periodically(bots, interval_seconds=60, bot_pool=None):
     global price_data, tickers, owned_tickers, top_active_tickers
     """
 	Kör en lista bottar med jämna mellanrum.
 	Siktar på att köra på i början av varje klockslag (e.g 15:30:00).
+	Om bot_pool anges körs bottarnas find_options i poolens processer.
 	"""
     thread_safe_print(
         f"Starting periodic bot execution every {interval_seconds} seconds. Press Ctrl+C to stop.")
     try:
         # Timer to check for new active stocks less frequently than every bot run
         ticker_update_interval = 60 * 15  # 15 minutes
-        last_ticker_update = time.time()
+        last_ticker_update = clock.time()
         _start_attempts = 0
         _has_started = False
 
@@ -286,7 +390,7 @@ def run_bots_periodically(bots, interval_seconds=60):
                         "Market is closed. Stopping bot execution.")
                     break  # If program has already been run, then exit
                 _start_attempts += 1
-                time.sleep(60)
+                clock.sleep(60)
                 if _start_attempts > 20:  # Vänta max 20 min
                     thread_safe_print(
                         "Market did not open. Program failed to start.")
@@ -294,87 +398,43 @@ def run_bots_periodically(bots, interval_seconds=60):
             else:
                 _has_started = True
             # 1. Beräkna nästa exakta körningstidpunkt
-            # time.time() ger sekunder sedan "the epoch" (1970-01-01)
+            # clock.time() ger sekunder sedan "the epoch" (1970-01-01), som time.time() men följer en simulerad klocka
             # Vi använder modulo för att hitta hur många sekunder in i nästa intervall vi är
             # och subtraherar det från intervallet för att få tiden till nästa jämna körning.
-            wait_time = interval_seconds - (time.time() % interval_seconds)
+            wait_time = interval_seconds - (clock.time() % interval_seconds)
             thread_safe_print(
-                f"Waiting for {wait_time:.2f} seconds until next run at {time.strftime('%H:%M:%S', time.localtime(time.time() + wait_time))}...", flush=True)
-            time.sleep(wait_time)
+                f"Waiting for {wait_time:.2f} seconds until next run at {time.strftime('%H:%M:%S', time.localtime(clock.time() + wait_time))}...", flush=True)
+            clock.sleep(wait_time)
             start_time = time.monotonic()
 
             # 2. Periodically update the list of monitored tickers
-            current_time = time.time()
+            current_time = clock.time()
             if current_time - last_ticker_update > ticker_update_interval:
-                thread_safe_print("\nChecking for new most active stocks...")
-                new_tickers_to_monitor = set(
-                    get_most_active_stocks().split(" "))
-
-                # Update list of tickers to monitor
-                if new_tickers_to_monitor != set(tickers):
-                    thread_safe_print(
-                        "Ticker pool has changed. Restarting monitor...")
-                    thread_safe_print(
-                        f"Previously monitoring {len(tickers)} tickers.")
-                    tickers = list(new_tickers_to_monitor)
-                else:
-                    thread_safe_print("Ticker pool is unchanged.")
-
-                # Always refresh websockets to prevent timeout
-                stop_monitoring()
-                monitor_stocks(tickers)
-                thread_safe_print(
-                    f"Monitoring restarted with {len(tickers)} tickers.")
-
-                # Update tickers for each bot instance individually
-                thread_safe_print("Updating individual bot ticker lists...")
-                for bot in bots:
-                    bot_owned = get_bot_owned_tickers(bot)
-                    bot.tickers = list(top_active_tickers.union(bot_owned))
-                    top_active_tickers.update(new_tickers_to_monitor)
-
+                refresh_tickers(bots)
                 last_ticker_update = current_time
 
             thread_safe_print("Running bots...", flush=True)
-            suggestions = {}
+            sequences = data_sequences(tickers) if SKIP_UNCHANGED_TICKERS else None
             price_data = retrieve_data(tickers, max_period_length)
-            # Kör alla bottar parallelt
-            with ThreadPoolExecutor(max_workers=20) as executor:
-                # Skapa processer
-                futures = [
-                    executor.submit(run_bot, bot)
-                    for bot in bots
-                ]
-
-                # Spara resultat
-                for future in futures:
-                    bot_name, options = future.result()
-                    suggestions[bot_name] = options
-                    portfolio = ha.load_portfolio(bot_name)
-                    if portfolio is not None:
-                        log_portfolio_value(bot_name, portfolio)
-                    else:
-                        thread_safe_print(
-                            f"WARNING: Could not log portfolio value for {bot_name} because portfolio is None.")
+            timeframes = retrieve_timeframes(bots, tickers)
+            suggestions = run_bots(bots, price_data, bot_pool, sequences, timeframes)
+
+            # Värdera alla portföljer på en gång när alla bottar har handlat
+            log_portfolio_values(list(suggestions))
 
             if SHOW_SUGGESTIONS:
-                # Log results
-                if suggestions.values():
-                    thread_safe_print("Suggestions found:")
-                    # thread_safe_print("DEBUG: suggestions:", suggestions)
-                    bot_suggestions: dict
-                    for bot_name, bot_suggestions in suggestions.items():
-                        if len(bot_suggestions) == 0:
-                            thread_safe_print(bot_name, "had no suggestions")
-                        else:
-                            thread_safe_print(bot_name + ":")
-                        for ticker, action in bot_suggestions.items():
-                            thread_safe_print(f"  - {ticker}: {action}")
-                else:
-                    thread_safe_print("No trading suggestions at this time.")
+                show_suggestions(suggestions)
 
             end_time = time.monotonic()
             execution_time = end_time - start_time
+            cache_stats = INDICATOR_CACHE.stats()
+            if cache_stats['hits'] or cache_stats['misses']:
+                thread_safe_print(
+                    f"Shared indicators: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate) so far.")
+            dirty_stats = DIRTY_TRACKER.stats()
+            if dirty_stats['skipped']:
+                thread_safe_print(
+                    f"Unchanged tickers: skipped {dirty_stats['skipped']} of {dirty_stats['selected'] + dirty_stats['skipped']} (bot, ticker) pairs ({dirty_stats['skip_rate']:.0%}) so far.")
             thread_safe_print(
                 f"Finished in {execution_time:.2f} seconds.", flush=True)
 
@@ -388,17 +448,96 @@ def run_bots_periodically(bots, interval_seconds=60):
         thread_safe_print("\nStopping bot execution.")
 
 
+def run_bots_on_bar_close(bots, scheduler, bot_pool=None):
+    global price_data
+    """
+    Kör bottarna så fort minutstaplar stängs, bara på de aktier vars stapel stängdes.
+    Om bot_pool anges körs bottarnas find_options i poolens processer.
+    """
+    thread_safe_print("Starting bot execution on bar close. Press Ctrl+C to stop.")
+    try:
+        ticker_update_interval = 60 * 15  # 15 minutes
+        stats_interval = 60 * 5
+        last_ticker_update = clock.time()
+        last_stats = clock.time()
+        last_logged_minute = None
+        _start_attempts = 0
+        _has_started = False
+
+        _watchdog_thread = Thread(target=start_websocket_watchdog, daemon=True)
+        _watchdog_thread.start()
+        while True:
+            if not us_market_open():
+                if _has_started:
+                    thread_safe_print(
+                        "Market is closed. Stopping bot execution.")
+                    break
+                _start_attempts += 1
+                clock.sleep(60)
+                if _start_attempts > 20:  # Vänta max 20 min
+                    thread_safe_print(
+                        "Market did not open. Program failed to start.")
+                    break
+                continue
+            _has_started = True
+
+            current_time = clock.time()
+            if current_time - last_ticker_update > ticker_update_interval:
+                refresh_tickers(bots)
+                last_ticker_update = current_time
+
+            batch = scheduler.next_batch(timeout=60)
+            if not batch:
+                continue
+
+            sequences = data_sequences(list(batch)) if SKIP_UNCHANGED_TICKERS else None
+            batch_data = retrieve_data(list(batch), max_period_length)
+            price_data.update(batch_data)
+            timeframes = retrieve_timeframes(bots, list(batch))
+            suggestions = run_bots(bots, batch_data, bot_pool, sequences, timeframes)
+            scheduler.record_orders(batch)
+
+            # Portföljerna värderas en gång per minut, inte efter varje omgång
+            minute = int(clock.time() // 60)
+            if minute != last_logged_minute:
+                log_portfolio_values(list(suggestions))
+                last_logged_minute = minute
+
+            if SHOW_SUGGESTIONS:
+                show_suggestions(suggestions)
+
+            if clock.time() - last_stats > stats_interval:
+                latency = scheduler.latency.summary()
+                thread_safe_print(
+                    f"Bar close to orders: {latency['count']} bars in {scheduler.batches} batches, "
+                    f"mean {latency['mean_ms']:.0f} ms, p50 {latency['p50_ms']:.0f} ms, p99 {latency['p99_ms']:.0f} ms, "
+                    f"{scheduler.late_bars} late bars.", flush=True)
+                cache_stats = INDICATOR_CACHE.stats()
+                if cache_stats['hits'] or cache_stats['misses']:  # Med bot_pool räknas de i processerna
+                    thread_safe_print(
+                        f"Shared indicators: {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate) so far.")
+                dirty_stats = DIRTY_TRACKER.stats()
+                thread_safe_print(
+                    f"Unchanged tickers: skipped {dirty_stats['skipped']} of {dirty_stats['selected'] + dirty_stats['skipped']} (bot, ticker) pairs ({dirty_stats['skip_rate']:.0%}) so far.")
+                last_stats = clock.time()
+
+    except KeyboardInterrupt:
+        thread_safe_print("\nStopping bot execution.")
+
+
 # Säljer allt innehav hos alla bottar
 def sell_all_bot_portfolios():
-    for bot in bots:
+    for bot in portfolio_bots(bots):
         tickers = get_bot_owned_tickers(bot)
         transactions = []
+        # Handle case where price_data might not have this ticker
+        fallback_prices = ha._get_stock_prices(
+            [ticker for ticker in tickers if ticker not in price_data])
         for ticker in tickers:
-            # Handle case where price_data might not have this ticker
             if ticker in price_data:
                 price = price_data[ticker]["PRICE"].iloc[-1]
             else:
-                price, _ = ha._get_stock_price(ticker)
+                price = fallback_prices.get(ticker)
                 if price is None:
                     continue
             transactions.append(
@@ -408,12 +547,6 @@ def sell_all_bot_portfolios():
 
 
 if __name__ == "__main__":
-    # Start logging thread
-    ha.start_logger()
-
-    # Starta datainsamlingen i bakgrunden
-    monitor_stocks(tickers)
-
     # Skapa en lista över alla bots
     bots = []
 
@@ -456,14 +589,52 @@ if __name__ == "__main__":
         cci_bot.length, tmf_bot.length
     )
 
+    if RUN_BOT_FAMILIES:
+        from sweep import parameter_grid
+        sma_family = BotFamily(sma.SMABot, "sma_family", tickers, parameter_grid(
+            {"short_period": [3, 5, 7, 9, 11, 13, 15, 17, 19, 21], "long_period": [25, 30, 35, 40, 50]}))
+        rsi_family = BotFamily(rsi.RSIBot, "rsi_family", tickers, parameter_grid(
+            {"length": [7, 9, 14, 21], "upper": [65, 70, 75, 80], "lower": [20, 25, 30, 35]}))
+        bots.extend([sma_family, rsi_family])
+        max_period_length = max(max_period_length, *(bot.long_period for bot in sma_family.members),
+                                *(bot.length for bot in rsi_family.members))
+
+    # Läs in alla portföljer så att ägarindexet (is_ticker_owned) täcker alla bottar
+    ha.PORTFOLIOS.load([bot.bot_name for bot in portfolio_bots(bots)])
+
+    # Processerna måste startas (forkas) innan några andra trådar har startats
+    bot_pool = None
+    if BOT_EXECUTION_MODE == "process":
+        from bot_pool import BotPool
+        bot_pool = BotPool(bots)
+
+    # Start logging thread
+    ha.start_logger()
+
+    # Starta datainsamlingen i bakgrunden
+    monitor_stocks(tickers)
+
     # Kör boten periodiskt
+    scheduler = None
     try:
-        run_bots_periodically(bots, interval_seconds=60)
+        if SCHEDULER_MODE == "bar_close":
+            from bar_scheduler import BarCloseScheduler
+            scheduler = BarCloseScheduler()
+            run_bots_on_bar_close(bots, scheduler, bot_pool=bot_pool)
+        else:
+            run_bots_periodically(bots, interval_seconds=60, bot_pool=bot_pool)
     except KeyboardInterrupt:
         thread_safe_print("Avbryter programmet...")
     finally:
         # Städa upp och stäng anslutningar när loopen avbryts
         stop_monitoring()
+        if scheduler is not None:
+            scheduler.close()
+        if bot_pool is not None:
+            bot_pool.close()
         sell_all_bot_portfolios()
+        # Skriv portföljerna till JSON-filerna och töm journalerna
+        ha.PORTFOLIOS.close()
+        PORTFOLIO_VALUE_LOG.close()
         ha.stop_logger()
         thread_safe_print("Program exited successfully.")
@@ -1,7 +1,6 @@
 """Använder Commodity Channel Index för att ge köp/sälj signaler"""
 
 import os
-from pandas_ta import hlc3, sma, mad
 
 import sys
 
@@ -11,12 +10,16 @@ child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
-from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data  # nopep8
+from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data, OneMinuteBars  # nopep8
+from streaming import CCI, advance  # nopep8
 
 
 class CCIBot():
     """A trading bot that uses a CCI indicator.\n
     `risk` is percentage of portfolio to spend on each purchase"""
+    # Tillståndet kan ta två steg på samma CCI-värde (BUY -> NEUTRAL -> SELL), se dirty_tracker.py
+    unchanged_runs = 2
+    timeframe = OneMinuteBars()
 
     def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, length = 20, lower=-100, upper=100):
         # Bot identification and portfolio name
@@ -28,26 +31,26 @@ class CCIBot():
         self.upper = upper
         self.length = length
         self.states = {}
+        # Inkrementella indikatorer per aktie, se streaming.py
+        self.streams = {}
+
+    def threshold_line(self):
+        """The CCI as `(key, create, columns)`, see bot_family.py"""
+        return ("CCI", self.length), lambda: CCI(self.length), ('HIGH', 'LOW', 'PRICE')
 
     def find_options(self, price_data: dict | None = None):
         """Finds and returns suggested actions for each stock in `self.tickers`"""
         if price_data is None: price_data = retrieve_data(self.tickers, self.length)
         suggestions = {}
 
-        # Iterate through each stock's data to calculate EMAs and find signals.
         for t, df in price_data.items():
-            if df is None or df.empty or len(df) < self.length:
-                continue
-            # Manual CCI calculation because pandas_ta CCI is broken
-            typical_price = hlc3(high=df['HIGH'], low=df['LOW'], close=df['PRICE'], talib=False)
-            mean_typical_price = sma(typical_price, length=self.length, talib=False)
-            mad_typical_price = mad(typical_price, length=self.length)
-
-            if typical_price is None or mean_typical_price is None or mad_typical_price is  None:
+            if df is None or df.empty:
                 continue
-            cci = (typical_price - mean_typical_price) / (0.015 * mad_typical_price)
-                    
-            if cci is None or cci.empty:
+            # Manual CCI calculation because pandas_ta CCI is broken, updated with only the new bars since last run
+            stream, last_bar = advance(self.streams, t, df, lambda: CCI(self.length),
+                                       lambda cci, time, high, low, price: cci.update(high, low, price), ('HIGH', 'LOW', 'PRICE'))
+            cci = stream.indicators.peek(*last_bar)
+            if cci is None:
                 continue
             # Make sure each stock has a state
             if t not in self.states:
@@ -56,24 +59,25 @@ class CCIBot():
             # If cci value goes above upper, enter SELL state. Once it drops back under upper, sell and go back to neutral
             # This is the same but reversed for BUY.
             if self.states[t] == 'NEUTRAL':
-                if cci.iloc[-1] > self.upper:
+                if cci > self.upper:
                     self.states[t] = 'SELL'
-                elif cci.iloc[-1] < self.lower:
+                elif cci < self.lower:
                     self.states[t] = 'BUY'
 
             elif self.states[t] == 'BUY':
-                if cci.iloc[-1] > self.lower:
+                if cci > self.lower:
                     suggestions[t] = 'BUY'
                     self.states[t] = 'NEUTRAL'
 
             elif self.states[t] == 'SELL':
-                if cci.iloc[-1] < self.upper:
+                if cci < self.upper:
                     suggestions[t] = 'SELL'
                     self.states[t] = 'NEUTRAL'
 
         return suggestions
 
 if __name__ == "__main__":
+    from pandas_ta import hlc3, sma, mad
     from matplotlib import pyplot as plt
     import pandas as pd
     # temp test
@@ -3,7 +3,6 @@
 import numpy as np
 import pandas
 import os
-import pandas_ta as ta
 import sys
 import datetime
 
@@ -14,14 +13,20 @@ parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
 from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data  # nopep8
+from streaming import EMA  # nopep8
+from indicator_cache import INDICATOR_CACHE, crossover_entries  # nopep8
+import clock  # nopep8
 
 
 class EMABot():
     """A trading bot that uses an Exponential Moving Average (EMA) crossover strategy.\n
     `short_period` and `long_period` is the period for the short and long ema line respectively.
-    `risk` is percentage of portfolio to spend on each purchase"""
+    `risk` is percentage of portfolio to spend on each purchase, and `timeframe` the length of the bars in minutes
+    (see utils.retrieve_data), e.g 15 for a slower bot"""
+    # Letar efter korsningar i minuten före klockan, se dirty_tracker.py
+    signals_on_previous_minute = True
 
-    def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, short_period: int = 9, long_period: int = 21):
+    def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, short_period: int = 9, long_period: int = 21, timeframe: int = 1):
         # Bot identification and portfolio name
         self.bot_name = bot_name
         # List of stock tickers to analyze
@@ -30,6 +35,12 @@ class EMABot():
         self.short_period = short_period
         self.long_period = long_period
         self.risk = risk
+        self.timeframe = timeframe
+
+    def crossover_lines(self):
+        """The short and long line as `(key, create, output)`, see bot_family.py"""
+        return ((("EMA", self.short_period), lambda: EMA(self.short_period), None),
+                (("EMA", self.long_period), lambda: EMA(self.long_period), None))
 
     def find_options(self, price_data: dict | None = None):
         """Finds and returns suggested actions for each stock in `self.tickers`"""
@@ -37,27 +48,23 @@ class EMABot():
         suggestions = {}
 
         base_date = datetime.datetime(1900, 1, 1)  # Startdatum för timestamps
-        # Iterate through each stock's data to calculate EMAs and find signals.
-        for t, df in price_data.items():
-            # Calculate the short-period and long-period Exponential Moving Averages (EMA).
-            ema_short = ta.ema(df['PRICE'], self.short_period)
-            ema_long = ta.ema(df['PRICE'], self.long_period)
+        # The bot runs at the start of the minute (e.g., 14:30:00). We need to check if a crossover
+        # happened in the minute that just completed (i.e., the 14:29:00 interval), or the bar with a longer timeframe.
+        target_timestamp = (pandas.Timestamp.combine(base_date, clock.now(
+        ).time()).floor(f"{self.timeframe}min") - pandas.Timedelta(minutes=self.timeframe))
+        entries = crossover_entries(self.crossover_lines())
 
-            if ema_short is None or ema_short.empty or ema_long is None or ema_long.empty:
-                # print("PROBLEM WITH EMABOT: ema_short or ema_long is None")
+        for t, df in price_data.items():
+            if df is None or df.empty:
                 continue
-            intersects = find_intersects(ema_short, ema_long)
-
-            # The bot runs at the start of the minute (e.g., 14:30:00). We need to check if a crossover
-            # happened in the minute that just completed (i.e., the 14:29:00 interval).
-            target_timestamp = (pandas.Timestamp.combine(base_date, datetime.datetime.now(
-            ).time()).floor("min") - pandas.Timedelta(minutes=1))
+            # Linjerna delas med andra bottar och matas bara med de staplar som tillkommit (indicator_cache.py).
+            # The last bar may still be forming, so it is only peeked and fed again next run
+            crossover = INDICATOR_CACHE.peek(t, df, entries, self.timeframe)[-1]
             # If a crossover just happened
-            if intersects and [*intersects.keys()][-1] == target_timestamp:
+            if crossover is not None and crossover[0] == target_timestamp:
                 # Check the most recent crossover. 'over' means the short EMA crossed above the long EMA (a buy signal).
                 # 'under' means the short EMA crossed below the long EMA (a sell signal).
-                suggestions[t] = "BUY" if [
-                    *intersects.values()][-1] == 'over' else "SELL"
+                suggestions[t] = "BUY" if crossover[1] == 'over' else "SELL"
 
         return suggestions
 
@@ -99,6 +106,7 @@ def find_intersects(s0: pandas.Series, s1: pandas.Series):
 
 
 if __name__ == "__main__":
+    import pandas_ta as ta
     from matplotlib import pyplot as plt
     
     # This block is for testing the script directly.
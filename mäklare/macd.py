@@ -3,7 +3,6 @@
 import numpy as np
 import pandas
 import os
-import pandas_ta as ta
 import sys
 import datetime
 
@@ -14,14 +13,20 @@ parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
 from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data  # nopep8
+from streaming import MACD  # nopep8
+from indicator_cache import INDICATOR_CACHE, crossings, macd_entries  # nopep8
+import clock  # nopep8
 
 
 class MACDCrossoverBot():
     """A trading bot that uses an MACD Crossover strategy.\n
     `short_period` and `long_period` is the period for the short and long ema line respectively.
-    `risk` is percentage of portfolio to spend on each purchase"""
+    `risk` is percentage of portfolio to spend on each purchase, and `timeframe` the length of the bars in minutes
+    (see utils.retrieve_data), e.g 15 for a slower bot"""
+    # Letar efter korsningar i minuten före klockan, se dirty_tracker.py
+    signals_on_previous_minute = True
 
-    def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, short_period: int = 9, long_period: int = 21, signal_period: int = 9):
+    def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, short_period: int = 9, long_period: int = 21, signal_period: int = 9, timeframe: int = 1):
         # Bot identification and portfolio name
         self.bot_name = bot_name
         # List of stock tickers to analyze
@@ -31,6 +36,13 @@ class MACDCrossoverBot():
         self.long_period = long_period
         self.signal_period = signal_period
         self.risk = risk
+        self.timeframe = timeframe
+
+    def crossover_lines(self):
+        """The MACD and signal line as `(key, create, output)`, see bot_family.py"""
+        key = ("MACD", self.short_period, self.long_period, self.signal_period)
+        create = lambda: MACD(self.short_period, self.long_period, self.signal_period)
+        return (key, create, 0), (key, create, 1)
 
     def find_options(self, price_data: dict | None = None):
         """Finds and returns suggested actions for each stock in `self.tickers`"""
@@ -38,33 +50,38 @@ class MACDCrossoverBot():
         suggestions = {}
 
         base_date = datetime.datetime(1900, 1, 1)  # Startdatum för timestamps
-        # Iterate through each stock's data to calculate EMAs and find signals.
-        for t, df in price_data.items():
-            macd = ta.macd(df["PRICE"], self.short_period, self.long_period, self.signal_period)
-            if macd is None or macd.empty: continue
-
-            # The bot runs at the start of the minute (e.g., 14:30:00). We need to check if a crossover
-            # happened in the minute that just completed (i.e., the 14:29:00 interval).
-            target_timestamp = (pandas.Timestamp.combine(base_date, datetime.datetime.now(
-            ).time()).floor("min") - pandas.Timedelta(minutes=1))
-            # target_timestamp = pandas.Timestamp.fromisoformat("1900-01-01 19:50:00") # USE FOR DEBUG WITH TESTABELL3
+        # The bot runs at the start of the minute (e.g., 14:30:00). We need to check if a crossover
+        # happened in the minute that just completed (i.e., the 14:29:00 interval), or the bar with a longer timeframe.
+        target_timestamp = (pandas.Timestamp.combine(base_date, clock.now(
+        ).time()).floor(f"{self.timeframe}min") - pandas.Timedelta(minutes=self.timeframe))
+        # target_timestamp = pandas.Timestamp.fromisoformat("1900-01-01 19:50:00") # USE FOR DEBUG WITH TESTABELL3
+        # EMA:erna delas med EMA-bottarna och andra MACD-bottar (indicator_cache.py)
+        entries = macd_entries(self.short_period, self.long_period, self.signal_period)
+        macd_key = entries[-1][0]
+        entries.append(crossings((macd_key, 0), (macd_key, 1)))
 
-            intersects = find_intersects(macd[f'MACD_{self.short_period}_{self.long_period}_{self.signal_period}'], macd[f'MACDs_{self.short_period}_{self.long_period}_{self.signal_period}'])
+        for t, df in price_data.items():
+            if df is None or df.empty:
+                continue
+            # The last bar may still be forming, so it is only peeked and fed again next run
+            crossover = INDICATOR_CACHE.peek(t, df, entries, self.timeframe)[-1]
             # If a crossover just happened
-            if intersects and [*intersects.keys()][-1] == target_timestamp:
-                # Check the most recent crossover. 'over' means the short EMA crossed above the long EMA (a buy signal).
-                # 'under' means the short EMA crossed below the long EMA (a sell signal).
-                suggestions[t] = "BUY" if [
-                    *intersects.values()][-1] == 'over' else "SELL"
+            if crossover is not None and crossover[0] == target_timestamp:
+                # Check the most recent crossover. 'over' means the MACD crossed above the signal line (a buy signal).
+                # 'under' means the MACD crossed below the signal line (a sell signal).
+                suggestions[t] = "BUY" if crossover[1] == 'over' else "SELL"
 
         return suggestions
 
 class MACDZerolineBot():
     """A trading bot that uses a MACD zero-line crossover strategy.\n
     `short_period` and `long_period` is the period for the short and long ema line respectively.
-    `risk` is percentage of portfolio to spend on each purchase"""
+    `risk` is percentage of portfolio to spend on each purchase, and `timeframe` the length of the bars in minutes
+    (see utils.retrieve_data), e.g 15 for a slower bot"""
+    # Letar efter korsningar i minuten före klockan, se dirty_tracker.py
+    signals_on_previous_minute = True
 
-    def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, short_period: int = 9, long_period: int = 21):
+    def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, short_period: int = 9, long_period: int = 21, timeframe: int = 1):
         # Bot identification and portfolio name
         self.bot_name = bot_name
         # List of stock tickers to analyze
@@ -73,6 +90,7 @@ class MACDZerolineBot():
         self.short_period = short_period
         self.long_period = long_period
         self.risk = risk
+        self.timeframe = timeframe
 
     def find_options(self, price_data: dict | None = None):
         """Finds and returns suggested actions for each stock in `self.tickers`"""
@@ -80,24 +98,27 @@ class MACDZerolineBot():
         suggestions = {}
 
         base_date = datetime.datetime(1900, 1, 1)  # Startdatum för timestamps
-        # Iterate through each stock's data to calculate EMAs and find signals.
+        # The bot runs at the start of the minute (e.g., 14:30:00). We need to check if a crossover
+        # happened in the minute that just completed (i.e., the 14:29:00 interval), or the bar with a longer timeframe.
+        target_timestamp = (pandas.Timestamp.combine(base_date, clock.now(
+        ).time()).floor(f"{self.timeframe}min") - pandas.Timedelta(minutes=self.timeframe))
+        # target_timestamp = pandas.Timestamp.fromisoformat("1900-01-01 19:50:00") # USE FOR DEBUG WITH TESTABELL3
+        # Standardinställningarna för MACD (12, 26, 9), precis som ta.macd(df["PRICE"])
+        entries = macd_entries(12, 26, 9)
+        macd_key = entries[-1][0]
+        entries.append(crossings((macd_key, 0)))
+
         for t, df in price_data.items():
-            macd = ta.macd(df["PRICE"])
-            if macd is None or macd.empty: continue
-
-            # The bot runs at the start of the minute (e.g., 14:30:00). We need to check if a crossover
-            # happened in the minute that just completed (i.e., the 14:29:00 interval).
-            target_timestamp = (pandas.Timestamp.combine(base_date, datetime.datetime.now(
-            ).time()).floor("min") - pandas.Timedelta(minutes=1))
-            # target_timestamp = pandas.Timestamp.fromisoformat("1900-01-01 19:50:00") # USE FOR DEBUG WITH TESTABELL3
-            
-            intersects = find_intersects(macd['MACD_12_26_9'])
+            if df is None or df.empty:
+                continue
+            *_, (macd, _), crossover = INDICATOR_CACHE.peek(t, df, entries, self.timeframe)
+            if macd is None:
+                continue  # För kort historik, pandas_ta gav inget MACD-värde
             # If a crossover just happened
-            if intersects and [*intersects.keys()][-1] == target_timestamp:
-                # Check the most recent crossover. 'over' means the short EMA crossed above the long EMA (a buy signal).
-                # 'under' means the short EMA crossed below the long EMA (a sell signal).
-                suggestions[t] = "BUY" if [
-                    *intersects.values()][-1] == 'over' else "SELL"
+            if crossover is not None and crossover[0] == target_timestamp:
+                # Check the most recent crossover. 'over' means the MACD crossed above the zero line (a buy signal).
+                # 'under' means the MACD crossed below the zero line (a sell signal).
+                suggestions[t] = "BUY" if crossover[1] == 'over' else "SELL"
 
         return suggestions
 
@@ -136,6 +157,7 @@ def find_intersects(s0: pandas.Series, s1: pandas.Series | None = None):
 
 
 if __name__ == "__main__":
+    import pandas_ta as ta
     from matplotlib import pyplot as plt
     
     # This block is for testing the script directly.
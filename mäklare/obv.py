@@ -2,19 +2,20 @@
 
 import sys
 import os
-import pandas_ta as ta
 
 child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
-from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data  # nopep8
+from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data, OneMinuteBars  # nopep8
+from streaming import OBV, SMA, RollingExtreme, advance  # nopep8
 
 
 class OBVBot():
     """A trading bot that uses a OBV analysis.\n
     Buy when price is in uptrend and OBV and volume are above their moving averages.
     Sell when price reaches new low and OBV is below its moving average."""
+    timeframe = OneMinuteBars()
 
     def __init__(self, bot_name, tickers: list[str], sample_long = 20, sample_short = 10, risk=0.02):
         self.bot_name = bot_name
@@ -26,6 +27,12 @@ class OBVBot():
         self.sample_short = sample_short
         self.risk = risk
         self.states = {}
+        # Inkrementella indikatorer per aktie, se streaming.py
+        self.streams = {}
+
+    def _new_indicators(self) -> dict:
+        return {'obv': OBV(), 'obv_ma': SMA(self.sample_short), 'volume_ma': SMA(self.sample_long),
+                'highest': RollingExtreme(self.sample_long), 'lowest': RollingExtreme(self.sample_long, lowest=True)}
 
     def find_options(self, price_data: dict | None = None):
         """Finds and returns suggested actions for each stock in `self.tickers`"""
@@ -34,34 +41,44 @@ class OBVBot():
         suggestions = {}
 
         for t, df in price_data.items():
-            obv = ta.obv(df['PRICE'], df['VOLUME'])
-            if obv is None or obv.empty:
+            if df is None or df.empty:
                 continue
-            
-            price = df['PRICE']
-            volume = df['VOLUME']
+            # Mata bara in de staplar som tillkommit sedan förra körningen
+            stream, (price, volume) = advance(self.streams, t, df, self._new_indicators, _update_obv, ('PRICE', 'VOLUME'))
+            indicators = stream.indicators
+
+            # Den sista stapeln kan fortfarande bildas, så den räknas bara in utan att sparas
+            obv = indicators['obv'].peek(price, volume)
             # Medelvärde på obv
-            obv_ma = obv.rolling(self.sample_short).mean()
-            # Kolla om priset är högsta på 20 minuter
-            uptrend = price > price.rolling(self.sample_long).max().shift(1)
+            obv_ma = indicators['obv_ma'].peek(obv) if obv is not None else None
+            volume_ma = indicators['volume_ma'].peek(volume)
+            # Högsta och lägsta pris de senaste sample_long minuterna, fram till förra minuten
+            previous_max = indicators['highest'].value
+            previous_min = indicators['lowest'].value
+            if obv_ma is None or volume_ma is None or previous_max is None:
+                continue
 
+            # Kolla om priset är högsta på 20 minuter
+            uptrend = price > previous_max
             # Köp om priset går uppåt och obv och volymen är högre än medelvärdet
-            is_buy_signal = (
-                uptrend.iloc[-1] & 
-                (obv > obv_ma).iloc[-1] &
-                (volume > volume.rolling(self.sample_long).mean()).iloc[-1]
-            )
+            is_buy_signal = uptrend and obv > obv_ma and volume > volume_ma
             # Sälj om priset nått ett nytt lågt och obv är under medelvärdet
-            is_sell_signal = (
-                (obv.iloc[-1] < obv_ma.iloc[-1]) &
-                (price.iloc[-1] < price.rolling(self.sample_long).min().shift(1).iloc[-1])
-            )
+            is_sell_signal = obv < obv_ma and price < previous_min
             if is_buy_signal: suggestions[t] = "BUY"
             elif is_sell_signal: suggestions[t] = "SELL"
 
         return suggestions
 
 
+def _update_obv(indicators: dict, time, price: float, volume: float):
+    obv = indicators['obv'].update(price, volume)
+    if obv is not None:
+        indicators['obv_ma'].update(obv)
+    indicators['volume_ma'].update(volume)
+    indicators['highest'].update(price)
+    indicators['lowest'].update(price)
+
+
 if __name__ == "__main__":
     bot = OBVBot("example", ["AAPL"], 9)
     print(bot.find_options())
@@ -6,10 +6,13 @@ import os
 child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
-from utils import retrieve_data # nopep8
+from utils import retrieve_data, OneMinuteBars # nopep8
 
 class RandomBot():
     """A trading bot that creates buy and sell signals randomly"""
+    skip_unchanged = False  # Slumpar nya förslag varje gång, även om priserna inte har ändrats
+    timeframe = OneMinuteBars()
+
     def __init__(self, bot_name, tickers:list[str], risk=0.02):
         self.bot_name = bot_name
         self.tickers = tickers
@@ -2,7 +2,6 @@
 
 import sys
 import os
-import pandas_ta as ta
 
 # Lägg till Gymnasiearbete mappen i path
 # Detta gör att vi kan importera från andra mappar i projektet
@@ -10,13 +9,17 @@ child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
-from utils import PATH_TILL_PORTFÖLJER, PATH_TILL_PRISER, retrieve_data  # nopep8
+from utils import PATH_TILL_PORTFÖLJER, PATH_TILL_PRISER, retrieve_data, OneMinuteBars  # nopep8
+from streaming import RSI, advance  # nopep8
 
 
 class RSIBot():
     """A trading bot that uses a Relative Strength Index (RSI) strategy.\n
     `length` is sample period, `upper` is sell bound, `lower` is buy bound,
     `risk` is percentage of available money to spend on each purchase"""
+    # Tillståndet kan ta två steg på samma RSI-värde (BUY -> NEUTRAL -> SELL), se dirty_tracker.py
+    unchanged_runs = 2
+    timeframe = OneMinuteBars()
 
     def __init__(self, bot_name:str, tickers: list[str], length: int, upper: int, lower: int, risk=0.02):
         self.bot_name = bot_name
@@ -26,6 +29,12 @@ class RSIBot():
         self.lower = lower
         self.risk = risk
         self.states = {}
+        # Inkrementella indikatorer per aktie, se streaming.py
+        self.streams = {}
+
+    def threshold_line(self):
+        """The RSI as `(key, create, columns)`, see bot_family.py"""
+        return ("RSI", self.length), lambda: RSI(self.length), ('PRICE',)
 
     def find_options(self, price_data: dict | None = None):
         """Finds and returns suggested actions for each stock in `self.tickers`"""
@@ -33,8 +42,12 @@ class RSIBot():
         suggestions = {}
 
         for t, df in price_data.items():
-            rsi = ta.rsi(df['PRICE'], self.length)
-            if rsi is None or rsi.empty:
+            if df is None or df.empty:
+                continue
+            # Mata bara in de staplar som tillkommit sedan förra körningen, den sista kan fortfarande bildas
+            stream, (price,) = advance(self.streams, t, df, lambda: RSI(self.length), lambda rsi, time, price: rsi.update(price))
+            rsi = stream.indicators.peek(price)
+            if rsi is None:
                 continue
 
             # Make sure each stock has a state
@@ -44,18 +57,18 @@ class RSIBot():
             # If rsi value goes above upper, enter SELL state. Once it drops back under upper, sell and go back to neutral
             # This is the same but reversed for BUY.
             if self.states[t] == 'NEUTRAL':
-                if rsi.iloc[-1] > self.upper:
+                if rsi > self.upper:
                     self.states[t] = 'SELL'
-                elif rsi.iloc[-1] < self.lower:
+                elif rsi < self.lower:
                     self.states[t] = 'BUY'
 
             elif self.states[t] == 'BUY':
-                if rsi.iloc[-1] > self.lower:
+                if rsi > self.lower:
                     suggestions[t] = 'BUY'
                     self.states[t] = 'NEUTRAL'
 
             elif self.states[t] == 'SELL':
-                if rsi.iloc[-1] < self.upper:
+                if rsi < self.upper:
                     suggestions[t] = 'SELL'
                     self.states[t] = 'NEUTRAL'
 
@@ -63,6 +76,7 @@ class RSIBot():
 
 
 if __name__ == "__main__":
+    import pandas_ta as ta
     from matplotlib import pyplot as plt
     # This block is for testing the script directly.
     aktie = 'TESTTABELL3'
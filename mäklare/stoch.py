@@ -3,7 +3,6 @@
 import numpy as np
 import pandas
 import os
-import pandas_ta as ta
 import sys
 import datetime
 
@@ -13,13 +12,17 @@ child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
-from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data  # nopep8
+from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data, OneMinuteBars  # nopep8
+from streaming import Stoch, advance  # nopep8
 
 
 class StochBot():
     """A trading bot that uses a stochastic indicator.\n
     `short_period` and `long_period` is the period for the short and long ema line respectively.
     `risk` is percentage of portfolio to spend on each purchase"""
+    # Tillståndet kan växla fram och tillbaka på samma värden, så boten körs alltid på allt (dirty_tracker.py)
+    skip_unchanged = False
+    timeframe = OneMinuteBars()
 
     def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, k_period: int = 14, d_period: int = 3, smooth_k: int = 3, lower_bound: int = 20, upper_bound: int = 80):
         # Bot identification and portfolio name
@@ -35,6 +38,8 @@ class StochBot():
         self.upper_bound = upper_bound
         # State management for each ticker
         self.states = {}
+        # Inkrementella indikatorer per aktie, se streaming.py
+        self.streams = {}
 
     def find_options(self, price_data: dict | None = None):
         """Finds and returns suggested actions for each stock in `self.tickers`"""
@@ -45,26 +50,20 @@ class StochBot():
         suggestions = {}
 
         for t, df in price_data.items():
-            stoch = ta.stoch(df['HIGH'], df['LOW'], df['PRICE'], k=self.k_period, d=self.d_period, smooth_k=self.smooth_k)
-            if stoch is None or stoch.empty:
+            if df is None or df.empty:
                 continue
-
-            # Default column names from pandas-ta are like 'STOCHk_14_3_3'
-            k_col = f'STOCHk_{self.k_period}_{self.d_period}_{self.smooth_k}'
-            d_col = f'STOCHd_{self.k_period}_{self.d_period}_{self.smooth_k}'
-
-            if k_col not in stoch.columns or d_col not in stoch.columns:
+            # Mata bara in de staplar som tillkommit sedan förra körningen
+            stream, last_bar = advance(self.streams, t, df, lambda: Stoch(self.k_period, self.d_period, self.smooth_k),
+                                       lambda stoch, time, high, low, price: stoch.update(high, low, price), ('HIGH', 'LOW', 'PRICE'))
+            # The last bar may still be forming, so it is only peeked. The previous values are from the last finished bar.
+            k_now, d_now = stream.indicators.peek(*last_bar)
+            k_prev, d_prev = stream.indicators.value
+            if None in (k_now, d_now, k_prev, d_prev):
                 continue
 
-            stoch_k = stoch[k_col]
-            stoch_d = stoch[d_col]
-
             if t not in self.states:
                 self.states[t] = 'NEUTRAL'
 
-            k_now, d_now = stoch_k.iloc[-1], stoch_d.iloc[-1]
-            k_prev, d_prev = stoch_k.iloc[-2], stoch_d.iloc[-2]
-
             # State: WAITING_FOR_BUY_CROSS (Oversold zone)
             if self.states[t] == 'WAITING_FOR_BUY_CROSS':
                 # Check for a bullish crossover (%K crosses above %D)
@@ -98,6 +97,7 @@ class StochBot():
 
 
 if __name__ == "__main__":
+    import pandas_ta as ta
     from matplotlib import pyplot as plt
     
     # This block is for testing the script directly.
@@ -2,7 +2,6 @@
 
 import pandas
 import os
-import pandas_ta as ta
 import sys
 
 # Lägg till Gymnasiearbete mappen i path
@@ -11,12 +10,16 @@ child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
-from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data  # nopep8
+from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data, OneMinuteBars  # nopep8
+from kernels import tmf_sums  # nopep8
 
 
 class TMFBot():
     """A trading bot that uses a TMF indicator.\n
     `risk` is percentage of portfolio to spend on each purchase"""
+    # Summorna uppdateras vid varje körning, så boten körs alltid på allt (dirty_tracker.py)
+    skip_unchanged = False
+    timeframe = OneMinuteBars()
 
     def __init__(self, bot_name: str, tickers: list[str], risk: float = 0.02, length=21):
         # Bot identification and portfolio name
@@ -72,10 +75,10 @@ class TMFBot():
             return None  # Prevent division by zero
 
         if state['ad_sum'] is None:
-            # Initial calculation using full series
-            ad_series = ta.ad(df['HIGH'], df['LOW'], df['PRICE'], df['VOLUME'])
-            state['ad_sum'] = ad_series.rolling(n).sum().iloc[-1]
-            state['vol_sum'] = df['VOLUME'].rolling(n).sum().iloc[-1]
+            # Initial calculation using full series: the last rolling sums of ta.ad and the volume
+            state['ad_sum'], state['vol_sum'] = tmf_sums(
+                df['HIGH'].to_numpy(dtype=float), df['LOW'].to_numpy(dtype=float),
+                df['PRICE'].to_numpy(dtype=float), df['VOLUME'].to_numpy(dtype=float), n)
 
         # Efficiently update using an EMA-like approach for the sum
         ad_latest = (((df['PRICE'].iloc[-1] - TRL) - (TRH -
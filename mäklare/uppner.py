@@ -8,11 +8,13 @@ child_dir = os.path.dirname(__file__)
 parent_dir = os.path.abspath(os.path.join(child_dir, '..'))
 sys.path.append(parent_dir)
 
-from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data  # nopep8
+from utils import PATH_TILL_PRISER, PATH_TILL_PORTFÖLJER, retrieve_data, OneMinuteBars  # nopep8
 
 
 class UppDownBot():
     """A trading bot that buys if the price is going up, and sells if it is going down"""
+    timeframe = OneMinuteBars()
+
     def __init__(self, bot_name, tickers: list[str], risk=0.02):
         self.bot_name = bot_name
         self.tickers = tickers
@@ -25,7 +27,8 @@ class UppDownBot():
         suggestions = {}
 
         # Rensa bort tickers från minnet som inte längre är relevanta
-        current_tickers = set(price_data.keys())
+        # price_data kan vara bara de aktier vars staplar just stängts, så bottens egna tickers behålls också
+        current_tickers = set(self.tickers).union(price_data.keys())
         self.prev_prices = {ticker: price for ticker, price in self.prev_prices.items() if ticker in current_tickers}
 
 
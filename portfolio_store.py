@@ -0,0 +1,235 @@
+"""
+Håller alla bottars portföljer i minnet istället för att läsa och skriva `portföljer/<bot>.json` vid varje affär.
+
+Varje ändring skrivs direkt som en rad i `portföljer/<bot>.journal`. Efter `snapshot_every` ändringar
+(och när programmet avslutas) skrivs hela portföljen till `<bot>.json` i samma format som förut och journalen töms.
+Om programmet kraschar läses `<bot>.json` och journalen spelas upp nästa gång portföljen används.
+
+Journalraderna innehåller värdena efter ändringen (inte skillnaden), så det gör inget om en rad spelas upp
+mot en snapshot som redan innehåller den.
+
+Storen håller också ett omvänt index aktie -> {bot: antal} över alla inlästa portföljer, så att frågor som
+"äger någon bot den här aktien" kan besvaras utan att läsa några filer.
+"""
+
+import copy
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from utils import PATH_TILL_PORTFÖLJER, thread_safe_print
+
+JOURNAL_SUFFIX = ".journal"
+
+
+class PortfolioStore():
+    """In-memory portfolios with one lock per bot, an append-only journal, compacted JSON snapshots
+    and a ticker -> {bot: shares} ownership index."""
+
+    def __init__(self, directory: str = PATH_TILL_PORTFÖLJER, snapshot_every: int = 100, fsync: bool = False):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        # Utan fsync överlever journalen att programmet kraschar, men inte att datorn stängs av
+        self.fsync = fsync
+        self._portfolios: dict[str, dict] = {}
+        self._journals = {}
+        self._pending: dict[str, int] = {}
+        self._locks: dict[str, threading.RLock] = {}
+        self._lock = threading.Lock()
+        # Ägarindex, uppdateras medan botens lås hålls men läses från andra trådar
+        self._owners: dict[str, dict[str, int]] = {}
+        self._owners_lock = threading.Lock()
+
+    def _paths(self, bot_name: str):
+        base = os.path.join(self.directory, bot_name)
+        return base + ".json", base + JOURNAL_SUFFIX
+
+    def _bot_lock(self, bot_name: str) -> threading.RLock:
+        with self._lock:
+            if bot_name not in self._locks:
+                self._locks[bot_name] = threading.RLock()
+            return self._locks[bot_name]
+
+    def _load(self, bot_name: str) -> dict | None:
+        """Returns the live portfolio, reading the snapshot and replaying the journal the first time. Hold the bot's lock."""
+        if bot_name in self._portfolios:
+            return self._portfolios[bot_name]
+
+        snapshot_path, journal_path = self._paths(bot_name)
+        if not os.path.exists(snapshot_path) and not os.path.exists(journal_path):
+            return None
+
+        portfolio = {"fria_pengar": 0, "aktier": {}}
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path, 'r') as f:
+                portfolio = json.load(f)
+        replayed = 0
+        if os.path.exists(journal_path):
+            with open(journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Sista raden kan vara halvskriven om programmet kraschade mitt i
+                        thread_safe_print(f"Ignorerar trasig rad i journalen för {bot_name}.")
+                        continue
+                    _apply(portfolio, entry)
+                    replayed += 1
+
+        self._portfolios[bot_name] = portfolio
+        self._pending[bot_name] = 0
+        self._update_owners(bot_name, portfolio.get('aktier', {}))
+        if replayed:
+            thread_safe_print(f"Återställde {replayed} transaktioner för {bot_name} från journalen.")
+            self._write_snapshot(bot_name)
+        return portfolio
+
+    def exists(self, bot_name: str) -> bool:
+        if bot_name in self._portfolios:
+            return True
+        return any(os.path.exists(path) for path in self._paths(bot_name))
+
+    def get(self, bot_name: str) -> dict | None:
+        """A copy of the bot's portfolio, or None if it does not exist. Raises IOError/JSONDecodeError if it can't be read."""
+        with self._bot_lock(bot_name):
+            portfolio = self._load(bot_name)
+            return None if portfolio is None else copy.deepcopy(portfolio)
+
+    def create(self, bot_name: str, fria_pengar: float = 100_000) -> dict:
+        """Creates an empty portfolio unless the bot already has one, and returns a copy of it."""
+        with self._bot_lock(bot_name):
+            if self._load(bot_name) is None:
+                self._portfolios[bot_name] = {"fria_pengar": fria_pengar, "aktier": {}}
+                self._pending[bot_name] = 0
+                self._write_snapshot(bot_name)
+            return copy.deepcopy(self._portfolios[bot_name])
+
+    @contextmanager
+    def edit(self, bot_name: str):
+        """Locks the bot's portfolio and yields it for changes, which are journaled when the block exits.\n
+        If the block raises, the portfolio is restored. Yields None if the portfolio does not exist."""
+        with self._bot_lock(bot_name):
+            portfolio = self._load(bot_name)
+            if portfolio is None:
+                yield None
+                return
+
+            before_cash = portfolio.get('fria_pengar', 0)
+            before_shares = dict(portfolio.get('aktier', {}))
+            try:
+                yield portfolio
+            except BaseException:
+                portfolio['fria_pengar'] = before_cash
+                portfolio['aktier'] = before_shares
+                raise
+
+            entry = {}
+            if portfolio.get('fria_pengar', 0) != before_cash:
+                entry['fria_pengar'] = portfolio['fria_pengar']
+            shares = portfolio.get('aktier', {})
+            changed = {t: amount for t, amount in shares.items() if before_shares.get(t) != amount}
+            # None betyder att aktien har tagits bort ur portföljen
+            changed.update({t: None for t in before_shares if t not in shares})
+            if changed:
+                entry['aktier'] = changed
+                self._update_owners(bot_name, changed)
+            if entry:
+                self._append(bot_name, entry)
+
+    def _update_owners(self, bot_name: str, shares: dict):
+        """Updates the ownership index with the bot's new amounts. None or 0 means the bot no longer owns the ticker."""
+        with self._owners_lock:
+            for ticker, amount in shares.items():
+                if amount is not None and amount > 0:
+                    self._owners.setdefault(ticker, {})[bot_name] = amount
+                elif ticker in self._owners:
+                    self._owners[ticker].pop(bot_name, None)
+                    if not self._owners[ticker]:
+                        del self._owners[ticker]
+
+    def load(self, bot_names: list):
+        """Reads the given portfolios so that the ownership index covers them. Unreadable portfolios are skipped."""
+        for bot_name in bot_names:
+            try:
+                with self._bot_lock(bot_name):
+                    self._load(bot_name)
+            except (IOError, json.JSONDecodeError) as e:
+                thread_safe_print(f"Warning: Could not read portfolio for {bot_name}: {e}")
+
+    def owners(self, ticker: str) -> dict[str, int]:
+        """`{bot_name: shares}` for every loaded bot that owns the ticker."""
+        with self._owners_lock:
+            return dict(self._owners.get(ticker, {}))
+
+    def is_owned(self, ticker: str) -> bool:
+        """True if any loaded bot owns shares in the ticker."""
+        with self._owners_lock:
+            return ticker in self._owners
+
+    def owned_by(self, bot_name: str) -> dict[str, int]:
+        """`{ticker: shares}` for the tickers the bot owns (more than 0 shares). Empty if the bot has no portfolio."""
+        with self._bot_lock(bot_name):
+            portfolio = self._load(bot_name)
+            if portfolio is None:
+                return {}
+            return {t: amount for t, amount in portfolio.get('aktier', {}).items() if amount > 0}
+
+    def _append(self, bot_name: str, entry: dict):
+        journal = self._journals.get(bot_name)
+        if journal is None:
+            journal = open(self._paths(bot_name)[1], 'a', encoding="utf-8")
+            self._journals[bot_name] = journal
+        journal.write(json.dumps(entry) + "\n")
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+
+        self._pending[bot_name] = self._pending.get(bot_name, 0) + 1
+        if self._pending[bot_name] >= self.snapshot_every:
+            self._write_snapshot(bot_name)
+
+    def _write_snapshot(self, bot_name: str):
+        """Writes `<bot>.json` atomically and empties the journal. Hold the bot's lock."""
+        snapshot_path, journal_path = self._paths(bot_name)
+        temp_path = snapshot_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self._portfolios[bot_name], f, indent=4)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, snapshot_path)
+
+        journal = self._journals.get(bot_name)
+        if journal is not None:
+            journal.truncate(0)
+        elif os.path.exists(journal_path):
+            open(journal_path, 'w').close()
+        self._pending[bot_name] = 0
+
+    def snapshot(self, bot_name: str | None = None):
+        """Compacts the journal of one bot, or of every loaded bot with unsaved changes."""
+        names = [bot_name] if bot_name is not None else list(self._portfolios)
+        for name in names:
+            with self._bot_lock(name):
+                if name in self._portfolios and self._pending.get(name):
+                    self._write_snapshot(name)
+
+    def close(self):
+        """Writes snapshots for all changed portfolios and closes the journals."""
+        self.snapshot()
+        for name in list(self._journals):
+            with self._bot_lock(name):
+                self._journals.pop(name).close()
+
+
+def _apply(portfolio: dict, entry: dict):
+    """Replays one journal entry onto `portfolio`."""
+    if 'fria_pengar' in entry:
+        portfolio['fria_pengar'] = entry['fria_pengar']
+    shares = portfolio.setdefault('aktier', {})
+    for ticker, amount in entry.get('aktier', {}).items():
+        if amount is None:
+            shares.pop(ticker, None)
+        else:
+            shares[ticker] = amount
@@ -0,0 +1,88 @@
+"""
+Värderar alla bottars portföljer på en gång och skriver värdena till `portfolio-logg-<datum>.csv`.
+
+Innehaven läggs i en matris (bottar × aktier) som multipliceras med en vektor av senaste priserna,
+och alla rader för en körning skrivs med en enda skrivning av en loggfil som hålls öppen hela dagen.
+"""
+
+import csv
+import datetime as dt
+import os
+import threading
+
+import numpy as np
+
+from utils import PATH_TILL_LOGGAR
+import clock
+
+# analysis.py läser tiderna med det här formatet, så mikrosekunderna skrivs även när de är 0
+LOG_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def holdings_matrix(portfolios: dict) -> tuple[list, list, np.ndarray, np.ndarray]:
+    """Returns `(bot_names, tickers, cash, holdings)` where `holdings[i, j]` is how many shares bot i owns of ticker j."""
+    bot_names = list(portfolios)
+    tickers = sorted({t for p in portfolios.values() for t in p.get('aktier', {})})
+    column_of = {t: j for j, t in enumerate(tickers)}
+
+    cash = np.array([p.get('fria_pengar', 0) for p in portfolios.values()], dtype=float)
+    holdings = np.zeros((len(bot_names), len(tickers)))
+    for i, p in enumerate(portfolios.values()):
+        for t, amount in p.get('aktier', {}).items():
+            holdings[i, column_of[t]] = amount
+    return bot_names, tickers, cash, holdings
+
+
+def value_portfolios(portfolios: dict, prices: dict) -> dict:
+    """
+    Total value (cash + holdings) of each portfolio in `{bot_name: portfolio}` given `{ticker: price}`.\n
+    A bot that owns shares in a ticker without a price gets None, since its value would be incomplete.
+    """
+    bot_names, tickers, cash, holdings = holdings_matrix(portfolios)
+    price_vector = np.array([prices.get(t, np.nan) for t in tickers], dtype=float)
+    missing = np.isnan(price_vector)
+
+    values = cash + holdings @ np.where(missing, 0.0, price_vector)
+    incomplete = (holdings[:, missing] != 0).any(axis=1)
+    return {name: None if incomplete[i] else float(values[i]) for i, name in enumerate(bot_names)}
+
+
+class PortfolioValueLog():
+    """Long-lived writer for `portfolio-logg-<date>.csv`. The file is kept open and switched when the date changes."""
+
+    def __init__(self, directory: str = PATH_TILL_LOGGAR):
+        self.directory = directory
+        self._file = None
+        self._writer = None
+        self._date = None
+        self._lock = threading.Lock()
+
+    def _open(self, date: dt.date):
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, "portfolio-logg-" + date.strftime("%Y-%m-%d") + ".csv")
+        self._file = open(path, "a", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        if self._file.tell() == 0:
+            self._writer.writerow(["TIMESTAMP", "BOT", "VALUE"])
+        self._date = date
+
+    def write_values(self, values: dict, timestamp: dt.datetime | None = None):
+        """Appends one `TIMESTAMP,BOT,VALUE` row per bot in `{bot_name: value}` and flushes them together."""
+        if timestamp is None:
+            timestamp = clock.now()
+        with self._lock:
+            if self._date != timestamp.date():
+                self._open(timestamp.date())
+            stamp = timestamp.strftime(LOG_TIMESTAMP_FORMAT)
+            self._writer.writerows([stamp, name, value] for name, value in values.items())
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self._file = self._writer = self._date = None
+
+
+PORTFOLIO_VALUE_LOG = PortfolioValueLog()
@@ -0,0 +1,70 @@
+"""
+Cacher för senaste pris och för vilka tickers som finns, så att prisuppslag inte behöver gå mot nätverket.
+
+`LAST_PRICES` matas av `hämta_aktiepriser.data_writer` med varje tick från websocketen.
+`VALID_TICKERS` kommer ihåg om yfinance kände till en ticker i `ttl` sekunder, så `handla_aktie._get_stock_price`
+bara behöver fråga yfinance om tickers som inte har setts på ett tag.
+"""
+
+import time
+
+
+class LastPriceCache():
+    """Latest traded price per ticker.\n
+    Only the data writer thread writes, and a single dict assignment is atomic, so no lock is needed."""
+
+    def __init__(self):
+        self._prices: dict[str, tuple[float, int]] = {}  # ticker -> (pris, tid i ms från yfinance)
+
+    def __contains__(self, ticker):
+        return ticker in self._prices
+
+    def __len__(self):
+        return len(self._prices)
+
+    def update(self, ticker: str, price, time_ms=0):
+        if price is None or price != price:  # NaN
+            return
+        self._prices[ticker] = (float(price), int(time_ms))
+
+    def get(self, ticker: str) -> float | None:
+        entry = self._prices.get(ticker)
+        return None if entry is None else entry[0]
+
+    def get_time(self, ticker: str) -> int | None:
+        """Timestamp (epoch milliseconds) of the latest price."""
+        entry = self._prices.get(ticker)
+        return None if entry is None else entry[1]
+
+    def clear(self):
+        self._prices.clear()
+
+
+class TickerValidityCache():
+    """Remembers whether a ticker is valid for `ttl` seconds."""
+
+    def __init__(self, ttl: float = 60 * 60, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._checked: dict[str, tuple[bool, float]] = {}  # ticker -> (giltig, tidpunkt)
+
+    def is_valid(self, ticker: str) -> bool | None:
+        """True/False if the ticker has been checked within `ttl` seconds, otherwise None."""
+        entry = self._checked.get(ticker)
+        if entry is None:
+            return None
+        valid, checked_at = entry
+        if self._clock() - checked_at > self.ttl:
+            self._checked.pop(ticker, None)
+            return None
+        return valid
+
+    def set(self, ticker: str, valid: bool):
+        self._checked[ticker] = (valid, self._clock())
+
+    def clear(self):
+        self._checked.clear()
+
+
+LAST_PRICES = LastPriceCache()
+VALID_TICKERS = TickerValidityCache()
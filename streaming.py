@@ -0,0 +1,399 @@
+"""
+Inkrementella (strömmande) indikatorer för bottarna.
+
+Istället för att räkna om en indikator över hela prisfönstret varje minut sparar varje bot ett
+tillstånd per aktie och matar bara in de nya staplarna. Kostnaden per minut blir då konstant
+oavsett fönstrets längd, likt `TMFBot.calculate_tmf`.
+
+Alla indikatorer har två metoder:
+- `update(...)` lägger till en färdig stapel och returnerar det nya värdet.
+- `peek(...)` returnerar värdet indikatorn skulle få med stapeln, utan att ändra tillståndet.
+  Används för den sista stapeln i fönstret som fortfarande bildas.
+Båda returnerar None tills det finns tillräckligt med data, där pandas_ta skulle ge NaN.
+
+EMA, RSI och MACD startar från den första stapeln som matas in och följer därför pandas_ta på hela
+dagens data, inte på ett glidande fönster som bottarna räknade på tidigare.
+
+Tillstånden ersätter panelen som räknade varje indikator för alla aktier på en gång (tid × aktie): med en ny
+stapel per minut kostar ett steg per aktie mindre än att räkna om hela fönstret, även vektoriserat. Bottarnas
+signaler jämförs med pandas_ta för varje aktie för sig i test_bot_family.py.
+"""
+
+import math
+import sys
+from collections import deque
+
+import numpy as np
+import pandas
+
+
+class SMA():
+    """Simple moving average over a ring buffer with a running sum."""
+
+    def __init__(self, length: int):
+        self.length = length
+        self.values = deque(maxlen=length)
+        self.total = 0.0
+        self._updates_since_sum = 0
+
+    def update(self, x: float) -> float | None:
+        if len(self.values) == self.length:
+            self.total -= self.values[0]
+        self.values.append(x)
+        self.total += x
+        # Summera om fönstret då och då så att avrundningsfel inte växer, O(1) i snitt
+        self._updates_since_sum += 1
+        if self._updates_since_sum >= self.length:
+            self.total = math.fsum(self.values)
+            self._updates_since_sum = 0
+        return self.value
+
+    @property
+    def value(self) -> float | None:
+        return self.total / self.length if len(self.values) == self.length else None
+
+    def peek(self, x: float) -> float | None:
+        if len(self.values) < self.length - 1:
+            return None
+        if self._updates_since_sum + 1 >= self.length:
+            # Samma omsummering som update skulle göra, så att värdena blir identiska
+            return math.fsum(list(self.values)[-(self.length - 1):] + [x]) / self.length
+        dropped = self.values[0] if len(self.values) == self.length else 0.0
+        return (self.total - dropped + x) / self.length
+
+
+class EWM():
+    """`pandas.Series.ewm(com=com, adjust=False).mean()`, one value at a time.
+    Uses the same arithmetic as pandas so that the results are identical."""
+
+    def __init__(self, com: float):
+        self.alpha = 1. / (1. + com)
+        self.value = None
+
+    def _next(self, x: float) -> float:
+        if self.value is None:
+            return x
+        if x == self.value:
+            return x
+        old_wt = 1. - self.alpha
+        return (old_wt * self.value + self.alpha * x) / (old_wt + self.alpha)
+
+    def update(self, x: float) -> float:
+        self.value = self._next(x)
+        return self.value
+
+    def peek(self, x: float) -> float:
+        return self._next(x)
+
+
+class EMA():
+    """`pandas_ta.ema`: seeded with the mean of the first `length` values, then an ewm with span `length`."""
+
+    def __init__(self, length: int):
+        self.length = length
+        self._seed = []
+        self._ewm = EWM((length - 1) / 2)
+
+    def update(self, x: float) -> float | None:
+        if self._seed is None:
+            return self._ewm.update(x)
+        self._seed.append(x)
+        if len(self._seed) < self.length:
+            return None
+        seed = float(np.mean(self._seed))  # Samma summering som Series.mean
+        self._seed = None
+        return self._ewm.update(seed)
+
+    @property
+    def value(self) -> float | None:
+        return self._ewm.value
+
+    def peek(self, x: float) -> float | None:
+        if self._seed is None:
+            return self._ewm.peek(x)
+        if len(self._seed) < self.length - 1:
+            return None
+        return float(np.mean(self._seed + [x]))
+
+
+class RSI():
+    """`pandas_ta.rsi` with Wilder smoothing (rma) of gains and losses.
+    Like pandas_ta, there is no value until `length + 1` prices have been seen."""
+
+    def __init__(self, length: int):
+        self.length = length
+        com = (1 - 1. / length) / (1. / length)
+        self._positive = EWM(com)
+        self._negative = EWM(com)
+        self._prev = None
+        self._count = 0
+
+    def _rsi(self, positive_avg: float, negative_avg: float, count: int) -> float | None:
+        if count < self.length + 1:
+            return None
+        total = positive_avg + abs(negative_avg)
+        if total == 0:
+            return math.nan
+        return 100 * positive_avg / total
+
+    def update(self, close: float) -> float | None:
+        self._count += 1
+        if self._prev is None:
+            self._prev = close
+            return None
+        change = close - self._prev
+        self._prev = close
+        positive = self._positive.update(max(change, 0.))
+        negative = self._negative.update(min(change, 0.))
+        return self._rsi(positive, negative, self._count)
+
+    def peek(self, close: float) -> float | None:
+        if self._prev is None:
+            return None
+        change = close - self._prev
+        return self._rsi(self._positive.peek(max(change, 0.)), self._negative.peek(min(change, 0.)), self._count + 1)
+
+
+class MACDLines():
+    """The MACD and signal line from the values of a fast and a slow EMA, returns `(macd, signal)`.\n
+    Like pandas_ta, `peek` gives no values until `min_bars` bars have been seen."""
+
+    def __init__(self, signal: int, min_bars: int):
+        self.min_bars = min_bars
+        self._signal = EMA(signal)
+        self._count = 0
+
+    def update(self, fast: float | None, slow: float | None):
+        self._count += 1
+        if fast is None or slow is None:
+            return None, None
+        macd = fast - slow
+        return macd, self._signal.update(macd)
+
+    def peek(self, fast: float | None, slow: float | None):
+        if fast is None or slow is None or self._count + 1 < self.min_bars:
+            return None, None
+        macd = fast - slow
+        return macd, self._signal.peek(macd)
+
+
+class MACD():
+    """`pandas_ta.macd`, returns `(macd, signal)`. The signal line starts at the first MACD value.
+    Like pandas_ta, `peek` gives no values until `slow + signal - 1` bars have been seen."""
+
+    def __init__(self, fast: int, slow: int, signal: int):
+        if slow < fast:
+            fast, slow = slow, fast
+        self._fast = EMA(fast)
+        self._slow = EMA(slow)
+        self._lines = MACDLines(signal, slow + signal - 1)
+
+    def update(self, close: float):
+        return self._lines.update(self._fast.update(close), self._slow.update(close))
+
+    def peek(self, close: float):
+        return self._lines.peek(self._fast.peek(close), self._slow.peek(close))
+
+
+class RollingExtreme():
+    """Rolling max (or min with `lowest=True`) over `length` values with a monotonic deque."""
+
+    def __init__(self, length: int, lowest: bool = False):
+        self.length = length
+        self.sign = -1. if lowest else 1.
+        self._deque = deque()  # (index, sign * value), strikt avtagande
+        self._count = 0
+
+    def update(self, x: float) -> float | None:
+        x = self.sign * x
+        while self._deque and self._deque[-1][1] <= x:
+            self._deque.pop()
+        self._deque.append((self._count, x))
+        self._count += 1
+        if self._deque[0][0] <= self._count - 1 - self.length:
+            self._deque.popleft()
+        return self.value
+
+    @property
+    def value(self) -> float | None:
+        if self._count < self.length:
+            return None
+        return self.sign * self._deque[0][1]
+
+    def peek(self, x: float) -> float | None:
+        if self._count < self.length - 1:
+            return None
+        x = self.sign * x
+        # Det äldsta värdet faller ur fönstret när x läggs till
+        for index, value in self._deque:
+            if index > self._count - self.length:
+                return self.sign * max(value, x)
+        return self.sign * x
+
+
+def _stoch(close: float, lowest: float, highest: float) -> float:
+    span = highest - lowest
+    if span == 0:
+        # pandas_ta lägger till epsilon istället för att dela med 0
+        span = sys.float_info.epsilon
+    return 100 * (close - lowest) / span
+
+
+class Stoch():
+    """`pandas_ta.stoch` with sma smoothing, returns `(stoch_k, stoch_d)`.
+    Like pandas_ta, `peek` gives no values until `k + d + smooth_k` bars have been seen."""
+
+    def __init__(self, k: int, d: int, smooth_k: int):
+        self.min_bars = k + d + smooth_k
+        self._highest = RollingExtreme(k)
+        self._lowest = RollingExtreme(k, lowest=True)
+        self._smooth = SMA(smooth_k) if smooth_k > 1 else None
+        self._d = SMA(d)
+        self._count = 0
+        self.value = (None, None)  # Värdet för den senaste färdiga stapeln
+
+    def _next(self, stoch_k: float, peek: bool):
+        if self._smooth is not None:
+            stoch_k = self._smooth.peek(stoch_k) if peek else self._smooth.update(stoch_k)
+            if stoch_k is None:
+                return None, None
+        return stoch_k, self._d.peek(stoch_k) if peek else self._d.update(stoch_k)
+
+    def update(self, high: float, low: float, close: float):
+        self._count += 1
+        highest, lowest = self._highest.update(high), self._lowest.update(low)
+        if highest is not None:
+            self.value = self._next(_stoch(close, lowest, highest), peek=False)
+        return self.value
+
+    def peek(self, high: float, low: float, close: float):
+        highest, lowest = self._highest.peek(high), self._lowest.peek(low)
+        if highest is None or self._count + 1 < self.min_bars:
+            return None, None
+        return self._next(_stoch(close, lowest, highest), peek=True)
+
+
+class CCI():
+    """CCI the same way as `CCIBot` (hlc3, sma and mean absolute deviation).\n
+    The mean absolute deviation has no running form since the mean moves, so it is O(length)."""
+
+    def __init__(self, length: int):
+        self.length = length
+        self._sma = SMA(length)
+
+    @staticmethod
+    def _cci(typical_price: float, mean: float, values) -> float:
+        mad = sum(abs(v - mean) for v in values) / len(values)
+        if mad == 0:
+            return math.nan
+        return (typical_price - mean) / (0.015 * mad)
+
+    def update(self, high: float, low: float, close: float) -> float | None:
+        typical_price = (high + low + close) / 3.0
+        mean = self._sma.update(typical_price)
+        if mean is None:
+            return None
+        return self._cci(typical_price, mean, self._sma.values)
+
+    def peek(self, high: float, low: float, close: float) -> float | None:
+        typical_price = (high + low + close) / 3.0
+        mean = self._sma.peek(typical_price)
+        if mean is None:
+            return None
+        values = list(self._sma.values)[-(self.length - 1):] + [typical_price]
+        return self._cci(typical_price, mean, values)
+
+
+class OBV():
+    """`pandas_ta.obv`, the first value is None since it has no previous close."""
+
+    def __init__(self):
+        self._prev = None
+        self.value = None
+
+    def _next(self, close: float, volume: float) -> float | None:
+        if self._prev is None:
+            return None
+        direction = 1. if close > self._prev else -1. if close < self._prev else 0.
+        return (self.value or 0.0) + direction * volume
+
+    def update(self, close: float, volume: float) -> float | None:
+        self.value = self._next(close, volume)
+        self._prev = close
+        return self.value
+
+    def peek(self, close: float, volume: float) -> float | None:
+        return self._next(close, volume)
+
+
+class Crossings():
+    """Tracks the most recent crossover of two lines the same way as `find_intersects` in the bots:
+    only a direct change from below (-1) to above (1) counts as 'over', and the reverse as 'under'."""
+
+    def __init__(self):
+        self._prev_position = None
+        self.last = None  # (time, 'over' | 'under')
+
+    def _crossing(self, time, a: float | None, b: float | None):
+        if a is None or b is None or math.isnan(a) or math.isnan(b):
+            return None, self._prev_position
+        position = np.sign(a - b)
+        if self._prev_position is not None and abs(position - self._prev_position) == 2:
+            return (time, 'over' if position > 0 else 'under'), position
+        return None, position
+
+    def update(self, time, a: float | None, b: float | None = 0.0):
+        crossing, self._prev_position = self._crossing(time, a, b)
+        if crossing is not None:
+            self.last = crossing
+        return self.last
+
+    def peek(self, time, a: float | None, b: float | None = 0.0):
+        crossing, _ = self._crossing(time, a, b)
+        return crossing if crossing is not None else self.last
+
+
+class TickerStream():
+    """Indicator states for one ticker together with the time of the last bar they have seen.\n
+    `indicators` is whatever the bot needs, e.g a dict of the classes above."""
+
+    def __init__(self, indicators):
+        self.indicators = indicators
+        self.last_time = None  # Tiden för den senaste färdiga stapeln, i nanosekunder
+
+
+def new_bars(times: np.ndarray, stream: TickerStream | None):
+    """Splits a price window into the finished bars `stream` hasn't seen yet and the last bar, which may still be forming.
+
+    `times` is the window's index as int64 nanoseconds (`DatetimeIndex.asi8`).
+    Returns `(start, reset)`: rows `start` to `len(times) - 2` should be fed with `update` and the last row with `peek`.
+    `reset` is True if the window doesn't continue from `stream.last_time` (first call, a new day or missed bars),
+    then the caller should create new states and feed every row but the last."""
+    if stream is None or stream.last_time is None or stream.last_time >= times[-1]:
+        return 0, True
+    position = int(np.searchsorted(times, stream.last_time))
+    if position >= len(times) or times[position] != stream.last_time:
+        return 0, True
+    return position + 1, False
+
+
+def advance(streams: dict, ticker: str, df: pandas.DataFrame, create, update, columns=('PRICE',)):
+    """Brings `streams[ticker]` up to date with the window `df`.
+
+    The stream is (re)created with `create()` when needed and `update(indicators, time, *values)` is called
+    for every finished bar it hasn't seen, with the values of `columns`.
+    Returns `(stream, last)` where `last` holds the values of `columns` for the last bar, for the caller to `peek`."""
+    times = df.index.asi8
+    stream = streams.get(ticker)
+    start, reset = new_bars(times, stream)
+    if reset:
+        stream = streams[ticker] = TickerStream(create())
+    # Fönstret görs om till numpy en gång (en vy om alla kolumner är float) och bara de nya raderna blir listor,
+    # så kostnaden beror inte på fönstrets längd
+    rows = df.to_numpy(dtype=float)[start:]
+    values = [rows[:, df.columns.get_loc(column)].tolist() for column in columns]
+    for i in range(len(times) - 1 - start):
+        update(stream.indicators, df.index[start + i], *(v[i] for v in values))
+    if len(times) > 1:
+        stream.last_time = int(times[-2])
+    return stream, tuple(v[-1] for v in values)
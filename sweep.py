@@ -0,0 +1,173 @@
+"""
+Parametersvep: backtestar en bot med alla kombinationer av ett parameterrutnät och rankar resultaten.
+
+Parametrarna i `main` (t.ex. `SMABot(short_period=9, long_period=21)`) är valda för hand. `run_sweep` tar en botklass
+och ett rutnät som `{"short_period": [5, 9, 13], "long_period": [21, 35]}` och kör varje kombination genom
+`backtest.Backtest` på inspelade dagar i en processpool.
+
+Staplarna läses in en gång i huvudprocessen och skrivs till delat minne (`bot_pool.SharedPriceData`), som
+arbetsprocesserna bara läser från. Varje uppgift är en bit av kombinationerna på en dag, som körs som en
+`bot_family.BotFamily` i en och samma `Backtest`. Varianterna delar då på fönstren, staplarna och indikatorerna
+(SMA(21) räknas en gång för alla kombinationer med 21) och bara handeln och portföljerna är per kombination.
+
+Uppmätt med 50 aktier × 390 minuter syntetiska staplar och SMABot, 1 kärna: 864 kombinationer tar ~29 s per dag
+(~0,03 s per kombination och dag, mot ~2 s när varje kombination var en egen bot). Ett svep med 1000 kombinationer
+över en månad (21 dagar) blir ~12 CPU-minuter, ~1,5 minut på 8 kärnor.
+
+Kör `python sweep.py <dagmapp> [<dagmapp> ...]` för att svepa SMA-bottens perioder över inspelade dagar,
+där varje dagmapp innehåller en dags `.ticks`-filer (se backtest.load_tick_bars).
+"""
+
+import itertools
+import multiprocessing
+import os
+import traceback
+
+import numpy as np
+import pandas
+
+from backtest import START_CASH, Backtest, load_tick_bars
+from bot_family import BotFamily
+from bot_pool import SharedPriceData, attach_price_data
+
+CHUNK_SIZE = 256  # Antal kombinationer som körs som en BotFamily i samma Backtest
+
+_days = []  # Arbetsprocessens dagar: (datum, {ticker: staplar}), vyer in i det delade minnet
+
+
+def parameter_grid(grid: dict, where=None) -> list[dict]:
+    """Every combination of the values in `grid`, e.g. `{"a": [1, 2], "b": [3]}` -> `[{"a": 1, "b": 3}, {"a": 2, "b": 3}]`.\n
+    `where` is an optional function that gets a combination and returns False for the ones to skip."""
+    names = list(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    if where is not None:
+        combinations = [params for params in combinations if where(params)]
+    return combinations
+
+
+def _attach_days(days: list):
+    """Runs once in each worker process."""
+    global _days
+    _days = []
+    for date, name, meta in days:
+        # Processerna forkas efter att minnet skapats och delar huvudprocessens resource_tracker
+        shm, bars = attach_price_data(name, meta, untrack=False)
+        _days.append((date, bars, shm))
+
+
+def _run_day(bot_class, fixed: dict, chunk: list, day: int, start_cash: float) -> list:
+    """Backtests the combinations in `chunk` on one day. Returns `(index, final value, trades, error)` per combination."""
+    date, bars, _ = _days[day]
+    try:
+        return _run_backtest(bot_class, fixed, chunk, date, bars, start_cash)
+    except Exception:
+        if len(chunk) == 1:
+            return [(chunk[0][0], np.nan, 0, traceback.format_exc(limit=3))]
+    # En kombination gick inte att köra, kör dem en och en så att bara den får ett fel
+    results = []
+    for item in chunk:
+        results.extend(_run_day(bot_class, fixed, [item], day, start_cash))
+    return results
+
+
+def _run_backtest(bot_class, fixed, chunk, date, bars, start_cash) -> list:
+    family = BotFamily(bot_class, bot_class.__name__, list(bars), [params for _, params in chunk], **fixed)
+    backtest = Backtest([family], bars, date, start_cash=start_cash)
+    values = backtest.run()
+    trades = {}
+    for row in backtest.broker.trades:
+        trades[row[1]] = trades.get(row[1], 0) + 1
+    return [(index, values.get(bot.bot_name, start_cash), trades.get(bot.bot_name, 0), None)
+            for (index, _), bot in zip(chunk, family.members)]
+
+
+def _run_task(task):
+    return _run_day(*task)
+
+
+def _rank(combinations: list, returns: np.ndarray, trades: np.ndarray, errors: list, dates: list) -> pandas.DataFrame:
+    """The results table: one row per combination, best total return first."""
+    table = pandas.DataFrame(combinations)
+    with np.errstate(invalid="ignore"):
+        table["total_return"] = np.prod(1 + returns, axis=1) - 1
+        table["mean_daily_return"] = returns.mean(axis=1)
+        table["worst_day"] = returns.min(axis=1)
+        table["winning_days"] = (returns > 0).sum(axis=1)
+    table["days"] = len(dates)
+    table["trades"] = trades
+    table["error"] = errors
+    table = table.sort_values("total_return", ascending=False, na_position="last", kind="stable")
+    table.index = pandas.RangeIndex(1, len(table) + 1, name="RANK")
+    return table
+
+
+def run_sweep(bot_class, grid: dict | list, days: list, fixed: dict | None = None, where=None,
+              processes: int | None = None, start_cash: float = START_CASH,
+              chunk_size: int = CHUNK_SIZE) -> pandas.DataFrame:
+    """
+    Backtests `bot_class(name, tickers, **fixed, **params)` for every combination of `grid` (a dict of lists,
+    or an already made list of parameter dicts) on every day in `days`, a list of `(date, {ticker: bars})`.\n
+    Returns a DataFrame ranked by total return, with the parameters, `total_return`, `mean_daily_return`,
+    `worst_day` (returns as fractions), `winning_days`, `days`, `trades` and `error` (None, or the traceback
+    of a combination that raised).
+    """
+    combinations = grid if isinstance(grid, list) else parameter_grid(grid, where)
+    fixed = fixed or {}
+    processes = processes or os.cpu_count() or 1
+    returns = np.full((len(combinations), len(days)), np.nan)
+    trades = np.zeros(len(combinations), dtype=np.int64)
+    errors = [None] * len(combinations)
+    if not combinations or not days:
+        return _rank(combinations, returns, trades, errors, days)
+
+    shared = [SharedPriceData(bars) for _, bars in days]
+    try:
+        indexed = list(enumerate(combinations))
+        chunks = [indexed[i:i + chunk_size] for i in range(0, len(indexed), chunk_size)]
+        tasks = [(bot_class, fixed, chunk, day, start_cash) for day in range(len(days)) for chunk in chunks]
+        context = multiprocessing.get_context("fork")
+        with context.Pool(processes, initializer=_attach_days,
+                          initargs=([(date, s.name, s.meta) for (date, _), s in zip(days, shared)],)) as pool:
+            for (_, _, chunk, day, _), results in zip(tasks, pool.imap(_run_task, tasks)):
+                for index, value, n_trades, error in results:
+                    returns[index, day] = value / start_cash - 1
+                    trades[index] += n_trades
+                    if error is not None and errors[index] is None:
+                        errors[index] = error
+    finally:
+        for s in shared:
+            s.close()
+    return _rank(combinations, returns, trades, errors, days)
+
+
+def load_days(directories: list[str]) -> list:
+    """Loads one day of bars per directory of `.ticks` files, see `backtest.load_tick_bars`."""
+    days = []
+    for directory in directories:
+        bars, date = load_tick_bars(directory)
+        if bars:
+            days.append((date, bars))
+    return days
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from mäklare import sma
+
+    if len(sys.argv) < 2:
+        print("Användning: python sweep.py <dagmapp> [<dagmapp> ...]")
+        sys.exit(1)
+    days = load_days(sys.argv[1:])
+    if not days:
+        print("Hittade inga tickfiler.")
+        sys.exit(1)
+
+    grid = {"short_period": range(3, 21), "long_period": range(10, 61, 2), "risk": [0.02, 0.05]}
+    start = time.perf_counter()
+    table = run_sweep(sma.SMABot, grid, days, where=lambda p: p["short_period"] < p["long_period"])
+    elapsed = time.perf_counter() - start
+    print(f"{len(table)} kombinationer, {len(days)} dagar på {elapsed:.1f} s")
+    with pandas.option_context("display.width", 200):
+        print(table.drop(columns="error").head(20))
@@ -0,0 +1,129 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import analysis
+from leaderboard import TradeLeaderboard
+
+LOG_HEADER = "TIMESTAMP,BOT,TICKER,ACTION,AMOUNT,PRICE,TOTAL\n"
+LOG_ROWS = [
+    "2026-01-14 15:31:00.000000,sma_bot,AAPL,BUY,10,100.0,1000.0",
+    "2026-01-14 15:45:10.500000,rsi_bot,MSFT,BUY,5,200.0,1000.0",
+    "trasig rad",
+    "2026-01-14 16:02:00.000000,sma_bot,AAPL,SELL,10,110.0,1100.0",
+    "2026-01-14 16:30:00,rsi_bot,MSFT,SELL,5,190.0,950.0",
+    "2026-01-14 16:40:00.000000,sma_bot,NVDA,BUY,4,50.0,200.0",
+    "2026-01-14 16:41:00.000000,sma_bot,NVDA,BUY,2,60.0,120.0",
+    "2026-01-14 16:50:00.000000,sma_bot,NVDA,SELL,5,70.0,350.0",
+]
+PORTFOLIO_ROWS = [
+    "2026-01-14 15:31:00.000000,sma_bot,100000.0",
+    "2026-01-14 15:31:00.000000,rsi_bot,100000.0",
+    "2026-01-14 15:59:00.000000,sma_bot,100050.0",
+    "2026-01-14 16:01:00.000000,sma_bot,100100.0",
+    "2026-01-14 16:59:00.000000,rsi_bot,99950.0",
+]
+
+
+class TestStreamingAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        # Statistiken är globala variabler i analysis, varje test börjar om från noll
+        patcher = patch.multiple(analysis, total_quantity_discrapencies=0, trades_profit_by_bot={},
+                                 trades_loss_by_bot={}, trade_leaderboard=TradeLeaderboard(10),
+                                 ticker_profit_by_bot={}, trade_volume_by_hour={}, portfolio_value_by_hour={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _write(self, name, header, rows):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(header + "\n".join(rows) + "\n")
+        return path
+
+    def test_trade_metrics(self):
+        path = self._write("logg-2026-01-14.csv", LOG_HEADER, LOG_ROWS)
+        trades, total_return = analysis.update_performance_metrics(path, chunksize=2)
+
+        self.assertEqual(total_return, {"sma_bot": 100.0 + (350.0 - 320.0), "rsi_bot": -50.0})
+        self.assertEqual(analysis.trades_profit_by_bot, {"sma_bot": {"count": 2, "total": 130.0}})
+        self.assertEqual(analysis.trades_loss_by_bot, {"rsi_bot": {"count": 1, "total": -50.0}})
+        self.assertEqual(analysis.ticker_profit_by_bot,
+                         {"sma_bot": {"AAPL": 100.0, "NVDA": 30.0}, "rsi_bot": {"MSFT": -50.0}})
+        # 6 köpta NVDA men 5 sålda
+        self.assertEqual(analysis.total_quantity_discrapencies, 1)
+        self.assertEqual([trade[3] for trade in analysis.trade_leaderboard.best.items()], [100.0, 30.0])
+        self.assertEqual([trade[3] for trade in analysis.trade_leaderboard.worst.items()], [-50.0])
+        self.assertEqual(analysis.trade_leaderboard.best_by_ticker["NVDA"].items()[0][:2], ["sma_bot", "NVDA"])
+        self.assertEqual(trades["sma_bot"][0][:2], (dt.datetime(2026, 1, 14, 16, 2), "AAPL"))
+
+        hour = dt.datetime(2026, 1, 14, 16)
+        self.assertEqual(analysis.trade_volume_by_hour[dt.datetime(2026, 1, 14, 15)],
+                         {"sma_bot": 1000.0, "rsi_bot": 1000.0})
+        self.assertEqual(analysis.trade_volume_by_hour[hour], {"sma_bot": 1100.0 + 200.0 + 120.0 + 350.0,
+                                                               "rsi_bot": 950.0})
+
+    def test_chunk_size_does_not_change_the_result(self):
+        path = self._write("logg-2026-01-14.csv", LOG_HEADER, LOG_ROWS)
+        _, small_chunks = analysis.update_performance_metrics(path, chunksize=1)
+        volumes = dict(analysis.trade_volume_by_hour)
+        analysis.trade_volume_by_hour.clear()
+        _, one_chunk = analysis.update_performance_metrics(path)
+        self.assertEqual(small_chunks, one_chunk)
+        self.assertEqual(volumes, analysis.trade_volume_by_hour)
+
+    def test_portfolio_values_per_hour(self):
+        path = self._write("portfolio-logg-2026-01-14.csv", "TIMESTAMP,BOT,VALUE\n", PORTFOLIO_ROWS)
+        analysis.update_portfolio_values(path, chunksize=2)
+        self.assertEqual(analysis.portfolio_value_by_hour, {
+            dt.datetime(2026, 1, 14, 15): {"sma_bot": 100050.0, "rsi_bot": 100000.0},
+            dt.datetime(2026, 1, 14, 16): {"sma_bot": 100100.0, "rsi_bot": 99950.0},
+        })
+
+    def test_plot_portfolio_values(self):
+        path = self._write("portfolio-logg-2026-01-14.csv", "TIMESTAMP,BOT,VALUE\n",
+                           PORTFOLIO_ROWS[:3] + ["trasig rad", "2026-01-14 15:59:00.000000,sma_bot,100070.0"]
+                           + PORTFOLIO_ROWS[3:])
+        with patch.object(analysis, "read_log_chunks", wraps=analysis.read_log_chunks) as read_log_chunks, \
+                patch.object(analysis, "plt") as plt:
+            first, final = analysis.plot_portfolio_values(path)
+        read_log_chunks.assert_called_once_with(path)
+        self.assertEqual((first, final), (dt.datetime(2026, 1, 14, 15, 31), dt.datetime(2026, 1, 14, 16, 59)))
+        plotted = {call.kwargs["label"]: (list(call.args[0]), list(call.args[1])) for call in plt.plot.call_args_list}
+        self.assertEqual(plotted, {
+            "sma_bot": ([dt.datetime(2026, 1, 14, 15, 31), dt.datetime(2026, 1, 14, 15, 59), dt.datetime(2026, 1, 14, 16, 1)],
+                        [100000.0, 100070.0, 100100.0]),
+            "rsi_bot": ([dt.datetime(2026, 1, 14, 15, 31), dt.datetime(2026, 1, 14, 16, 59)], [100000.0, 99950.0]),
+        })
+
+    def test_leaderboards_of_separate_files_can_be_merged(self):
+        first = self._write("logg-2026-01-14.csv", LOG_HEADER, LOG_ROWS[:4])
+        second = self._write("logg-2026-01-15.csv", LOG_HEADER, LOG_ROWS[4:])
+        sequential = TradeLeaderboard(10)
+        for path in (first, second):
+            analysis.update_performance_metrics(path, leaderboard=sequential)
+
+        merged = TradeLeaderboard(10)
+        for path in (first, second):
+            per_file = TradeLeaderboard(10)
+            analysis.update_performance_metrics(path, leaderboard=per_file)
+            merged.merge(per_file)
+        self.assertEqual(merged.best.items(), sequential.best.items())
+        self.assertEqual(merged.worst.items(), sequential.worst.items())
+        self.assertEqual(len(analysis.trade_leaderboard.best), 0)
+
+    def test_missing_and_empty_files(self):
+        empty = self._write("logg-2026-01-15.csv", "", [])
+        with patch("builtins.print"):
+            self.assertEqual(analysis.update_performance_metrics(os.path.join(self.temp_dir.name, "saknas.csv")),
+                             ({}, {}))
+        self.assertEqual(analysis.update_performance_metrics(empty), ({}, {}))
+        header_only = self._write("logg-2026-01-16.csv", LOG_HEADER, [])
+        self.assertEqual(analysis.update_performance_metrics(header_only), ({}, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import csv
+import datetime as dt
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pandas
+
+import clock
+from backtest import Backtest, SimulatedBroker, load_tick_bars, plan_transactions
+from bot_family import BotFamily
+from mäklare.sma import SMABot
+from tick_storage import TICK_FILE_SUFFIX, TickWriter
+
+DATE = dt.date(2026, 1, 14)
+# Ner, upp (korsning uppåt) och ner igen (korsning nedåt)
+PRICES = [20.0 - i for i in range(8)] + [13.0 + 2 * i for i in range(10)] + [30.0 - 2 * i for i in range(12)]
+
+
+def _bars(prices, start="10:00"):
+    index = pandas.date_range("1900-01-01 " + start, periods=len(prices), freq="1min", name="TIME")
+    prices = np.asarray(prices, dtype=float)
+    return pandas.DataFrame({'OPEN': prices, 'HIGH': prices, 'LOW': prices, 'PRICE': prices,
+                             'VOLUME': np.full(len(prices), 100.0)}, index=index)
+
+
+class TestBacktest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def _run(self, bars, **kwargs):
+        bot = SMABot("sma_bot", list(bars), risk=0.5, short_period=2, long_period=4)
+        backtest = Backtest([bot], bars, DATE, **kwargs)
+        return backtest, backtest.run()
+
+    def test_trades_at_simulated_times(self):
+        with patch("time.sleep", side_effect=AssertionError("a backtest must not sleep")):
+            backtest, final = self._run({"AAPL": _bars(PRICES)})
+
+        trades = backtest.broker.trades
+        self.assertEqual([row[3] for row in trades], ["BUY", "SELL"])
+        buy, sell = trades
+        # Bottarna körs minuten efter stapeln där korsningen skedde
+        self.assertEqual(buy[0], dt.datetime(2026, 1, 14, 10, 10))
+        self.assertEqual(buy[5], PRICES[9])
+        self.assertEqual(buy[4], int(100_000 / PRICES[9] * 0.5))
+        self.assertEqual(sell[0], dt.datetime(2026, 1, 14, 10, 20))
+        self.assertEqual(sell[4], buy[4])
+        self.assertAlmostEqual(final["sma_bot"], 100_000 + buy[4] * (sell[5] - buy[5]))
+        self.assertEqual(backtest.broker.portfolios["sma_bot"]["aktier"], {})
+
+        self.assertEqual(backtest.minutes, len(PRICES))
+        self.assertEqual(backtest.values[0][0], dt.datetime(2026, 1, 14, 10, 1))
+        self.assertEqual(backtest.values[-1][0], dt.datetime(2026, 1, 14, 10, len(PRICES)))
+        self.assertIsInstance(clock.CLOCK, clock.SystemClock)
+
+    def test_no_buys_just_before_close(self):
+        # Samma korsning uppåt, men bara 5 minuter före sista stapeln
+        backtest, final = self._run({"AAPL": _bars(PRICES[:14])})
+        self.assertEqual(backtest.broker.trades, [])
+        self.assertEqual(final["sma_bot"], 100_000)
+
+    def test_sells_everything_at_the_end(self):
+        backtest, _ = self._run({"AAPL": _bars(PRICES[:18] + [32.0, 32.0])})
+        self.assertEqual([row[3] for row in backtest.broker.trades], ["BUY", "SELL"])
+        self.assertEqual(backtest.broker.trades[-1][5], 32.0)
+        self.assertEqual(backtest.broker.trades[-1][0], dt.datetime(2026, 1, 14, 10, 20))
+
+    def test_tickers_with_different_start_times(self):
+        bars = {"AAPL": _bars(PRICES), "MSFT": _bars(PRICES, start="10:05")}
+        backtest, _ = self._run(bars)
+        buys = {row[2]: row[0] for row in backtest.broker.trades if row[3] == "BUY"}
+        self.assertEqual(buys, {"AAPL": dt.datetime(2026, 1, 14, 10, 10),
+                                "MSFT": dt.datetime(2026, 1, 14, 10, 15)})
+        self.assertEqual(backtest.minutes, len(PRICES) + 5)
+
+    def test_family_variants_trade_like_separate_bots(self):
+        bars = {"AAPL": _bars(PRICES), "MSFT": _bars(PRICES[::-1], start="10:03")}
+        param_sets = [{"short_period": 2, "long_period": 4, "risk": r} for r in (0.2, 0.5)] + [
+            {"short_period": 3, "long_period": 5, "risk": 0.5}]
+        family = BotFamily(SMABot, "sma", list(bars), param_sets)
+        family_values = Backtest([family], bars, DATE).run()
+        separate = [SMABot(bot.bot_name, list(bars), **params) for bot, params in zip(family.members, param_sets)]
+        self.assertEqual(family_values, Backtest(separate, bars, DATE).run())
+        self.assertEqual(len(set(family_values.values())), 3)
+
+    def test_window_limits_the_bars_each_bot_sees(self):
+        seen = []
+
+        class RecordingBot():
+            bot_name = "recording_bot"
+            risk = 0.1
+
+            def find_options(self, price_data):
+                seen.append((clock.now(), len(price_data["AAPL"])))
+                return {}
+
+        Backtest([RecordingBot()], {"AAPL": _bars(PRICES)}, DATE, window=5).run()
+        self.assertEqual([n for _, n in seen], [1, 2, 3, 4] + [5] * (len(PRICES) - 4))
+        self.assertEqual(seen[0][0], dt.datetime(2026, 1, 14, 10, 1))
+
+    def test_logs_are_readable_by_analysis(self):
+        backtest, _ = self._run({"AAPL": _bars(PRICES)})
+        backtest.write_logs(self.temp_dir.name)
+        backtest.write_logs(self.temp_dir.name)  # En ny körning skriver över, lägger inte till
+
+        with open(os.path.join(self.temp_dir.name, "logg-2026-01-14.csv"), encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([row["ACTION"] for row in rows], ["BUY", "SELL"])
+        self.assertEqual(dt.datetime.strptime(rows[0]["TIMESTAMP"], "%Y-%m-%d %H:%M:%S.%f"),
+                         dt.datetime(2026, 1, 14, 10, 10))
+
+        with open(os.path.join(self.temp_dir.name, "portfolio-logg-2026-01-14.csv"), encoding="utf-8") as f:
+            header, *values = csv.reader(f)
+        self.assertEqual(header, ["TIMESTAMP", "BOT", "VALUE"])
+        self.assertEqual(len(values), len(PRICES))
+        self.assertEqual(dt.datetime.strptime(values[0][0], "%Y-%m-%d %H:%M:%S.%f"),
+                         dt.datetime(2026, 1, 14, 10, 1))
+        self.assertEqual(values[0][1:], ["sma_bot", "100000.0"])
+
+    def test_load_tick_bars(self):
+        start = int(dt.datetime(2026, 1, 14, 10, 0).timestamp() * 1000)
+        writer = TickWriter.open(os.path.join(self.temp_dir.name, "AAPL" + TICK_FILE_SUFFIX))
+        for i, price in enumerate([10.0, 11.0, 12.0, 9.0]):
+            writer.writerow(start + i * 30_000, price, 0, 0, 100 * (i + 1))
+        writer.close()
+
+        bars, date = load_tick_bars(self.temp_dir.name)
+        self.assertEqual(date, DATE)
+        self.assertEqual(list(bars), ["AAPL"])
+        self.assertEqual(list(bars["AAPL"]["PRICE"]), [11.0, 9.0])
+        self.assertEqual(list(bars["AAPL"]["HIGH"]), [11.0, 12.0])
+        self.assertEqual(bars["AAPL"].index[0], pandas.Timestamp("1900-01-01 10:00"))
+
+
+class TestSimulatedBroker(unittest.TestCase):
+    def test_trades_at_known_prices_only(self):
+        sim_clock = clock.SimulatedClock(dt.datetime(2026, 1, 14, 15, 0))
+        broker = SimulatedBroker(sim_clock, start_cash=1000)
+        broker.prices["AAPL"] = 10.0
+        results = broker.utför_flera_transaktioner("bot", [
+            {"ticker": "AAPL", "action": "BUY", "amount": 5},
+            {"ticker": "MSFT", "action": "BUY", "amount": 1}])
+        self.assertEqual(broker.portfolio("bot"), {"fria_pengar": 950.0, "aktier": {"AAPL": 5}})
+        self.assertEqual(broker.trades, [[dt.datetime(2026, 1, 14, 15, 0), "bot", "AAPL", "BUY", 5, 10.0, 50.0]])
+        self.assertEqual(len(results), 2)
+
+    def test_plan_transactions_follows_main(self):
+        bot = SMABot("bot", ["AAPL", "MSFT"], risk=0.1)
+        portfolio = {"fria_pengar": 1000, "aktier": {"MSFT": 3}}
+        prices = {"AAPL": 10.0, "MSFT": 20.0, "GOOG": 5.0}
+        suggestions = {"AAPL": "BUY", "MSFT": "BUY", "GOOG": "SELL", "TSLA": "BUY"}
+        self.assertEqual(plan_transactions(bot, suggestions, portfolio, prices),
+                         [{"ticker": "AAPL", "action": "BUY", "amount": 10, "allow_add": False, "price": 10.0}])
+        self.assertEqual(plan_transactions(bot, {"AAPL": "BUY", "MSFT": "SELL"}, portfolio, prices, may_buy=False),
+                         [{"ticker": "MSFT", "action": "SELL", "amount": 3, "price": 20.0}])
+
+
+if __name__ == '__main__':
+    unittest.main()
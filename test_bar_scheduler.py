@@ -0,0 +1,71 @@
+import datetime as dt
+import unittest
+
+import clock
+from bar_scheduler import BarCloseScheduler
+from bar_store import BarStore, local_minute, minute_end
+
+
+def _ms(hour, minute, second):
+    """Epoch milliseconds for a local wall clock time, the same format as yfinance ticks."""
+    return int(dt.datetime(2026, 1, 14, hour, minute, second).timestamp() * 1000)
+
+
+class TestBarCloseScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = clock.SimulatedClock(dt.datetime(2026, 1, 14, 11, 1, 0, 500000))
+        use_clock = clock.use_clock(self.clock)
+        use_clock.__enter__()
+        self.addCleanup(use_clock.__exit__, None, None, None)
+        self.store = BarStore()
+        self.scheduler = BarCloseScheduler(self.store, batch_window=0.01, grace=1.0)
+        self.addCleanup(self.scheduler.close)
+
+    def test_batches_bars_closed_together(self):
+        for ticker in ("A", "B", "C"):
+            self.store.add_tick(ticker, _ms(11, 0, 10), 10, 100)
+        self.store.add_tick("A", _ms(11, 1, 0), 11, 200)
+        self.store.add_tick("B", _ms(11, 1, 0), 21, 200)
+
+        batch = self.scheduler.next_batch(timeout=1)
+        self.assertEqual(sorted(batch), ["A", "B"])
+        self.assertEqual(batch["A"].minute, local_minute(_ms(11, 0, 0)))
+        self.assertEqual(self.scheduler.batches, 1)
+
+    def test_quiet_tickers_close_after_grace(self):
+        self.store.add_tick("A", _ms(11, 0, 10), 10, 100)
+        self.store.add_tick("B", _ms(11, 0, 20), 20, 100)
+        self.store.add_tick("B", _ms(11, 1, 0), 21, 200)
+        self.assertEqual(list(self.scheduler.next_batch(timeout=1)), ["B"])
+
+        # A får ingen ny tick, dess stapel stängs när minuten 11:01 + grace har passerat
+        self.clock.set(dt.datetime(2026, 1, 14, 11, 2, 1, 500000))
+        batch = self.scheduler.next_batch(timeout=1)
+        self.assertEqual(sorted(batch), ["A", "B"])
+        self.assertEqual(batch["A"].minute, local_minute(_ms(11, 0, 0)))
+        self.assertEqual(batch["B"].minute, local_minute(_ms(11, 1, 0)))
+
+    def test_timeout_returns_empty_batch(self):
+        self.assertEqual(self.scheduler.next_batch(timeout=0.01), {})
+
+    def test_record_orders(self):
+        self.store.add_tick("A", _ms(11, 0, 10), 10, 100)
+        self.store.add_tick("A", _ms(11, 1, 0), 11, 200)
+        batch = self.scheduler.next_batch(timeout=1)
+        # Räknas från minutskiftet 11:01:00, inte från när lagret märkte stängningen
+        self.scheduler.record_orders(batch)
+        summary = self.scheduler.latency.summary()
+        self.assertEqual(summary["count"], 1)
+        self.assertAlmostEqual(summary["mean_ms"], 500, places=3)
+        self.assertEqual(self.scheduler.late_bars, 0)
+        self.assertEqual(minute_end(batch["A"].minute), _ms(11, 1, 0) / 1000)
+
+        # Bottarna hann inte köra förrän minuten efter
+        self.clock.set(dt.datetime(2026, 1, 14, 11, 2, 5))
+        self.scheduler.record_orders(batch)
+        self.assertEqual(self.scheduler.late_bars, 1)
+        self.assertAlmostEqual(self.scheduler.latency.summary()["max_ms"], 65_000, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
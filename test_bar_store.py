@@ -0,0 +1,254 @@
+import unittest
+import os
+import shutil
+import tempfile
+import datetime as dt
+import importlib.util
+
+import numpy as np
+import pandas
+
+from bar_store import BarStore, MINUTES_PER_DAY
+
+
+def _ms(hour, minute, second):
+    """Epoch milliseconds for a local wall clock time, the same format as yfinance ticks."""
+    return int(dt.datetime(2026, 1, 14, hour, minute, second).timestamp() * 1000)
+
+
+def _at(seconds):
+    """`_ms` for a number of seconds after 10:00."""
+    return _ms(10 + seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class TestBarStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Load the real utils module so that test_main's mocking doesn't interfere
+        spec = importlib.util.spec_from_file_location(
+            "utils_real_bar_store",
+            os.path.join(os.path.dirname(__file__), "utils.py")
+        )
+        cls.utils_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.utils_module)
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.original_path = self.utils_module.PATH_TILL_PRISER
+        self.utils_module.PATH_TILL_PRISER = self.test_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        self.utils_module.PATH_TILL_PRISER = self.original_path
+
+    def test_unknown_ticker_returns_none(self):
+        store = BarStore()
+        self.assertIsNone(store.window("NOPE", 5))
+
+    def test_not_enough_bars_returns_none(self):
+        store = BarStore()
+        store.add_tick("T", _ms(10, 0, 0), 100, 1000)
+        self.assertIsNone(store.window("T", 5))
+        self.assertIsNotNone(store.window("T", 0))
+
+    def test_bars_match_disk_reader(self):
+        """Bars built from ticks should equal the resampled CSV for the same ticks."""
+        ticks = [
+            ((10, 0, 0), 100, 1000),
+            ((10, 0, 15), 95, 1100),
+            ((10, 0, 30), 98, 1200),
+            ((10, 1, 0), 105, 1300),
+            # 10:02 and 10:03 have no ticks and should be forward-filled
+            ((10, 4, 10), 101, 1600),
+            ((10, 4, 50), 103, 1700),
+            ((10, 5, 5), 102, 1750),
+        ]
+        store = BarStore()
+        with open(os.path.join(self.test_dir, "T.csv"), "w") as f:
+            f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n")
+            for (h, m, s), price, volume in ticks:
+                f.write(f"{h:02}:{m:02}:{s:02},{price},0,0,{volume}\n")
+                store.add_tick("T", _ms(h, m, s), price, volume)
+
+        _, expected = self.utils_module._read_and_process_ticker("T", 60)
+        actual = store.window("T", 5)
+
+        self.assertEqual(list(actual.index), list(expected.index))
+        for col in ["OPEN", "HIGH", "LOW", "PRICE", "VOLUME"]:
+            self.assertEqual(list(actual[col]), list(expected[col]), col)
+
+    def test_rolling_window_is_bounded(self):
+        store = BarStore(max_bars=10)
+        for i in range(30):
+            store.add_tick("T", _ms(10, i, 0), 100 + i, 1000 + i)
+        df = store.window("T", 5)
+        # 10 färdiga staplar + den som fortfarande bildas
+        self.assertEqual(len(df), 11)
+        self.assertEqual(df['PRICE'].iloc[-1], 129)
+
+    def test_seed_prepends_older_history(self):
+        store = BarStore()
+        store.add_tick("T", _ms(10, 3, 0), 103, 1300)
+        with open(os.path.join(self.test_dir, "T.csv"), "w") as f:
+            f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n")
+            for m in range(4):
+                f.write(f"10:0{m}:00,{100 + m},0,0,{1000 + 100 * m}\n")
+
+        _, disk_df = self.utils_module._read_and_process_ticker("T", 60)
+        store.seed("T", disk_df)
+        df = store.window("T", 10)
+        self.assertEqual(list(df['PRICE']), [100, 101, 102, 103])
+
+    def test_timeframe_bars_match_resample(self):
+        """Bars of longer timeframes should equal the 1-minute window rolled up with utils.resample_bars."""
+        rng = np.random.default_rng(4)
+        store = BarStore(max_bars=1000)
+        store.add_tick("T", _ms(9, 58, 0), 100, 1000)
+        store.window("T", 0, 15)  # 15 minuter följs från början, de andra skapas senare från minutstaplarna
+        seconds = np.sort(rng.integers(0, 80 * 60, 400))
+        seconds = seconds[(seconds < 20 * 60) | (seconds > 27 * 60)]  # Sju minuter utan ticks
+        volume = 1000
+        for i, second in enumerate(seconds):
+            volume += int(rng.integers(1, 50))
+            store.add_tick("T", _at(int(second)), round(100 + rng.normal(0, 1), 2), volume)
+            if i % 40 == 0:
+                # Sen tick för en minut som redan har stängts
+                store.add_tick("T", _at(max(int(second) - 90, 0)), 99.5, volume)
+            if i % 25 == 0 or i == len(seconds) - 1:
+                minute_bars = store.window("T", 0)
+                for timeframe in (5, 15, 60):
+                    pandas.testing.assert_frame_equal(store.window("T", 0, timeframe),
+                                                      self.utils_module.resample_bars(minute_bars, timeframe), check_freq=False)
+        self.assertEqual(len(store.window("T", 0, 60)), 3)
+
+        with self.assertRaises(ValueError):
+            store.window("T", 0, 7)
+
+    def test_retrieve_data_seeds_timeframe_from_disk(self):
+        store = self.utils_module.BAR_STORE
+        store.clear()
+        try:
+            with open(os.path.join(self.test_dir, "T.csv"), "w") as f:
+                f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n")
+                for m in range(20):
+                    f.write(f"10:{m:02}:10,{100 + m},0,0,{1000 + 100 * m}\n")
+            for m in range(20, 23):
+                store.add_tick("T", _ms(10, m, 10), 100 + m, 1000 + 100 * m)
+
+            self.assertIsNone(store.window("T", 3, 5))
+            data = self.utils_module.retrieve_data(["T"], 3, 5)
+            self.assertEqual(list(data["T"]['PRICE']), [104, 109, 114, 119])
+            # Historiken finns nu i lagret, tillsammans med de levande staplarna
+            df = store.window("T", 3, 5)
+            self.assertEqual(list(df.index.strftime("%H:%M")), ["10:00", "10:05", "10:10", "10:15", "10:20"])
+            self.assertEqual(list(df['PRICE']), [104, 109, 114, 119, 122])
+            # Den första levande stapeln har ingen tidigare ackumulerad volym, precis som i minutfönstret
+            self.assertEqual(df['VOLUME'].iloc[-1], 200)
+        finally:
+            store.clear()
+
+    def test_retrieve_data_grows_the_store(self):
+        """A period longer than the store holds should be read from disk once, then served from the store."""
+        store = self.utils_module.BAR_STORE
+        store.clear()
+        max_bars = store.max_bars
+        try:
+            length = max_bars + 30
+            with open(os.path.join(self.test_dir, "T.csv"), "w") as f:
+                f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n")
+                for m in range(length + 10):
+                    f.write(f"{8 + m // 60:02}:{m % 60:02}:10,{100 + m},0,0,{1000 + m}\n")
+            live = [_ms(8 + (length + 10 + i) // 60, (length + 10 + i) % 60, 10) for i in range(3)]
+            for i, time_ms in enumerate(live):
+                store.add_tick("T", time_ms, 200 + i, 5000 + i)
+
+            data = self.utils_module.retrieve_data(["T"], length)
+            self.assertGreater(store.max_bars, length)
+            df = store.window("T", length)
+            self.assertIsNotNone(df)
+            # max_bars färdiga staplar och den som fortfarande bildas
+            self.assertEqual(len(df), store.max_bars + 1)
+            self.assertEqual(list(df['PRICE'].iloc[-4:]), [data["T"]['PRICE'].iloc[-1], 200, 201, 202])
+
+            # Lagret blir inte mindre igen
+            store.reserve(10)
+            self.assertGreater(store.max_bars, length)
+        finally:
+            store.clear()
+            store.max_bars = max_bars
+
+    def test_listeners_get_closed_bars(self):
+        store = BarStore()
+        events = []
+        store.add_tick("A", _ms(11, 0, 5), 10, 100)  # Utan lyssnare skickas inget
+        store.add_listener(events.append)
+        store.add_tick("A", _ms(11, 0, 30), 11, 200)
+        self.assertEqual(events, [])
+        store.add_tick("A", _ms(11, 1, 2), 12, 300)
+        self.assertEqual([(e.ticker, e.minute % MINUTES_PER_DAY) for e in events], [("A", 11 * 60)])
+
+        store.remove_listener(events.append)
+        store.add_tick("A", _ms(11, 2, 0), 13, 400)
+        self.assertEqual(len(events), 1)
+
+    def test_close_due_announces_each_bar_once(self):
+        store = BarStore()
+        events = []
+        store.add_listener(events.append)
+        store.add_tick("A", _ms(11, 0, 5), 10, 100)
+        store.add_tick("B", _ms(11, 1, 5), 20, 100)
+
+        self.assertEqual(store.close_due(_ms(11, 0, 50)), 0)  # Minuten är inte slut än
+        self.assertEqual(store.close_due(_ms(11, 1, 10)), 1)
+        self.assertEqual(store.close_due(_ms(11, 1, 20)), 0)
+        # Nästa tick stänger stapeln på riktigt, men den har redan skickats
+        store.add_tick("A", _ms(11, 1, 30), 11, 200)
+        self.assertEqual(store.close_due(_ms(11, 2, 1)), 2)
+        self.assertEqual([(e.ticker, e.minute % 60) for e in events], [("A", 0), ("A", 1), ("B", 1)])
+
+    def test_sequence_changes_with_the_bars(self):
+        store = BarStore()
+        self.assertIsNone(store.sequence("A"))
+        store.add_tick("A", _ms(11, 0, 5), 10, 100)
+        store.add_tick("B", _ms(11, 0, 5), 20, 100)
+        first = store.sequence("A")
+        self.assertEqual(store.sequence("A"), first)
+        store.add_tick("A", _ms(11, 0, 6), 11, 200)
+        self.assertNotEqual(store.sequence("A"), first)
+        # Numren är gemensamma för hela lagret, så de återanvänds inte efter clear()
+        second = store.sequence("A")
+        store.clear()
+        store.add_tick("A", _ms(11, 0, 5), 10, 100)
+        self.assertNotIn(store.sequence("A"), (first, second))
+
+    def test_data_sequences(self):
+        store = self.utils_module.BAR_STORE
+        store.clear()
+        try:
+            store.add_tick("LIVE", _ms(11, 0, 0), 50, 100)
+            with open(os.path.join(self.test_dir, "DISK.csv"), "w") as f:
+                f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n11:00:00,10,0,0,100\n")
+            sequences = self.utils_module.data_sequences(["LIVE", "DISK", "NONE"])
+            self.assertEqual(set(sequences), {"LIVE", "DISK"})
+            with open(os.path.join(self.test_dir, "DISK.csv"), "a") as f:
+                f.write("11:00:01,11,0,0,200\n")
+            self.assertNotEqual(self.utils_module.data_sequences(["DISK"])["DISK"], sequences["DISK"])
+        finally:
+            store.clear()
+
+    def test_retrieve_data_prefers_store(self):
+        """retrieve_data should not touch disk for tickers the store covers."""
+        store = self.utils_module.BAR_STORE
+        store.clear()
+        try:
+            for i in range(6):
+                store.add_tick("LIVE", _ms(11, i, 0), 50 + i, 100 * i)
+            data = self.utils_module.retrieve_data(["LIVE"], 5)
+            self.assertIn("LIVE", data)
+            self.assertEqual(data["LIVE"]['PRICE'].iloc[-1], 55)
+        finally:
+            store.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,235 @@
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas
+
+import clock
+from bot_family import BotFamily, variant_name
+from mäklare import cci, ema, macd, obv, random_trader, rsi, sma, stoch, tmf, uppner
+from test_helpers import random_bars
+
+try:
+    import pandas_ta as ta
+except ImportError:  # pandas_ta kräver Python 3.12
+    ta = None
+
+TICKERS = ["A", "B", "C"]
+MINUTES = 120
+
+
+def _last_intersect(s0, s1=None):
+    """The most recent crossover the same way as find_intersects in the bots, against the 0-line without `s1`."""
+    df = pandas.DataFrame({'s0': s0, 's1': 0.0 if s1 is None else s1}).dropna()
+    diff = np.sign(df['s0'] - df['s1']).diff()
+    crossings = diff[diff.abs() == 2]
+    if crossings.empty:
+        return None
+    return crossings.index[-1], 'over' if crossings.iloc[-1] > 0 else 'under'
+
+
+def _crossover_rule(lines):
+    """The crossover bots as they were with pandas_ta, `lines(df)` gives the series they cross."""
+    def rule(df, target, state):
+        series = lines(df)
+        if not series or any(line is None for line in series):
+            return None  # pandas_ta ger None när fönstret är för kort
+        crossing = _last_intersect(*series)
+        if crossing is not None and crossing[0] == target:
+            return "BUY" if crossing[1] == 'over' else "SELL"
+    return rule
+
+
+def _threshold_rule(line, lower, upper):
+    """The RSI and CCI bots as they were with pandas_ta."""
+    def rule(df, target, state):
+        values = line(df)
+        if values is None or values.empty:
+            return None
+        value = values.iloc[-1]
+        if state['state'] == 'NEUTRAL':
+            if value > upper:
+                state['state'] = 'SELL'
+            elif value < lower:
+                state['state'] = 'BUY'
+        elif state['state'] == 'BUY' and value > lower:
+            state['state'] = 'NEUTRAL'
+            return 'BUY'
+        elif state['state'] == 'SELL' and value < upper:
+            state['state'] = 'NEUTRAL'
+            return 'SELL'
+    return rule
+
+
+def _cci(df, length):
+    if len(df) < length:
+        return None
+    typical_price = ta.hlc3(high=df['HIGH'], low=df['LOW'], close=df['PRICE'], talib=False)
+    return (typical_price - ta.sma(typical_price, length=length, talib=False)) / (0.015 * ta.mad(typical_price, length=length))
+
+
+def _stoch_rule(df, target, state):
+    """StochBot(k_period=5) as it was with pandas_ta."""
+    values = ta.stoch(df['HIGH'], df['LOW'], df['PRICE'], k=5, d=3, smooth_k=3)
+    if values is None or values.empty:
+        return None
+    (k_prev, k_now), (d_prev, d_now) = values['STOCHk_5_3_3'].iloc[-2:], values['STOCHd_5_3_3'].iloc[-2:]
+    if state['state'] == 'WAITING_FOR_BUY_CROSS':
+        if k_now > d_now and k_prev <= d_prev:
+            state['state'] = 'NEUTRAL'
+            return 'BUY'
+        elif k_now > 20 and d_now > 20:
+            state['state'] = 'NEUTRAL'
+    elif state['state'] == 'WAITING_FOR_SELL_CROSS':
+        if k_now < d_now and k_prev >= d_prev:
+            state['state'] = 'NEUTRAL'
+            return 'SELL'
+        elif k_now < 80 and d_now < 80:
+            state['state'] = 'NEUTRAL'
+    elif k_now < 20 and d_now < 20:
+        state['state'] = 'WAITING_FOR_BUY_CROSS'
+    elif k_now > 80 and d_now > 80:
+        state['state'] = 'WAITING_FOR_SELL_CROSS'
+
+
+def _obv_rule(df, target, state):
+    """OBVBot(sample_long=10, sample_short=5) as it was with pandas_ta."""
+    values = ta.obv(df['PRICE'], df['VOLUME'])
+    price, volume = df['PRICE'], df['VOLUME']
+    obv_ma = values.rolling(5).mean()
+    if (price.iloc[-1] > price.rolling(10).max().shift(1).iloc[-1] and values.iloc[-1] > obv_ma.iloc[-1]
+            and volume.iloc[-1] > volume.rolling(10).mean().iloc[-1]):
+        return "BUY"
+    if values.iloc[-1] < obv_ma.iloc[-1] and price.iloc[-1] < price.rolling(10).min().shift(1).iloc[-1]:
+        return "SELL"
+
+
+def _macd_lines(df, fast, slow, signal):
+    values = ta.macd(df['PRICE'], fast, slow, signal)
+    if values is None:
+        return ()
+    return values[f'MACD_{fast}_{slow}_{signal}'], values[f'MACDs_{fast}_{slow}_{signal}']
+
+
+FAMILIES = [
+    (sma.SMABot, [{"short_period": s, "long_period": l} for s in (3, 5, 9) for l in (8, 13, 21)], {}),
+    (ema.EMABot, [{"short_period": s, "long_period": l} for s in (3, 5) for l in (8, 13)], {}),
+    (macd.MACDCrossoverBot, [{"short_period": 3, "long_period": l, "signal_period": s} for l in (8, 13) for s in (3, 5)], {}),
+    (rsi.RSIBot, [{"length": n, "upper": u, "lower": 100 - u} for n in (5, 9) for u in (55, 60, 70)], {}),
+    (cci.CCIBot, [{"length": n, "upper": u, "lower": -u} for n in (6, 10) for u in (50, 100)], {}),
+    (stoch.StochBot, [{"k_period": k} for k in (5, 9)], {"d_period": 3}),
+]
+
+
+class TestBotFamily(unittest.TestCase):
+    def setUp(self):
+        self.clock = clock.SimulatedClock(dt.datetime(2026, 1, 14, 10, 0, 30))
+        use_clock = clock.use_clock(self.clock)
+        use_clock.__enter__()
+        self.addCleanup(use_clock.__exit__, None, None, None)
+
+    def test_family_gives_the_same_suggestions_as_separate_bots(self):
+        bars = random_bars(5, TICKERS, MINUTES)
+        for bot_class, param_sets, fixed in FAMILIES:
+            with self.subTest(bot_class.__name__):
+                family = BotFamily(bot_class, "family", TICKERS, param_sets, **fixed)
+                separate = [bot_class(variant_name("family", params), TICKERS, **fixed, **params) for params in param_sets]
+                n_suggestions = 0
+                for minute in range(1, MINUTES):
+                    self.clock.set(dt.datetime(2026, 1, 14, 10, 0, 30) + dt.timedelta(minutes=minute))
+                    # Ett glidande fönster på 40 staplar, som price_data i main
+                    data = {t: df.iloc[max(0, minute - 40):minute + 1] for t, df in bars.items()}
+                    expected = {bot.bot_name: bot.find_options(data) for bot in separate}
+                    self.assertEqual(family.find_options(data), expected, f"minute {minute}")
+                    n_suggestions += sum(len(suggestions) for suggestions in expected.values())
+                self.assertGreater(n_suggestions, 0)
+
+    def test_longer_timeframe(self):
+        bars = {t: df.resample("15min").agg({'OPEN': 'first', 'HIGH': 'max', 'LOW': 'min', 'PRICE': 'last',
+                                             'VOLUME': 'sum'}) for t, df in random_bars(6, TICKERS, MINUTES).items()}
+        param_sets = [{"short_period": 2, "long_period": l} for l in (3, 4)]
+        family = BotFamily(sma.SMABot, "family", TICKERS, param_sets, timeframe=15)
+        self.assertEqual(family.timeframe, 15)
+        separate = [sma.SMABot(variant_name("family", params), TICKERS, timeframe=15, **params) for params in param_sets]
+        n_suggestions = 0
+        for minute in range(0, MINUTES, 5):
+            self.clock.set(dt.datetime(2026, 1, 14, 10, 0, 30) + dt.timedelta(minutes=minute))
+            data = {t: df.iloc[:minute // 15 + 1] for t, df in bars.items()}
+            expected = {bot.bot_name: bot.find_options(data) for bot in separate}
+            self.assertEqual(family.find_options(data), expected, f"minute {minute}")
+            n_suggestions += sum(len(suggestions) for suggestions in expected.values())
+        self.assertGreater(n_suggestions, 0)
+
+    def test_only_minute_bars(self):
+        """Bots that don't take a `timeframe` always run on 1-minute bars and refuse another one."""
+        bots = [rsi.RSIBot("rsi", TICKERS, 5, 70, 30), cci.CCIBot("cci", TICKERS), stoch.StochBot("stoch", TICKERS),
+                obv.OBVBot("obv", TICKERS), tmf.TMFBot("tmf", TICKERS), uppner.UppDownBot("uppner", TICKERS),
+                random_trader.RandomBot("random", TICKERS)]
+        for bot in bots:
+            with self.subTest(bot=bot.bot_name):
+                bot.timeframe = 1
+                self.assertEqual(bot.timeframe, 1)
+                with self.assertRaises(ValueError):
+                    bot.timeframe = 15
+                self.assertEqual(bot.timeframe, 1)
+        with self.assertRaises(TypeError):
+            rsi.RSIBot("rsi", TICKERS, 5, 70, 30, timeframe=15)
+
+    def test_shares_indicators_between_variants(self):
+        family = BotFamily(sma.SMABot, "sma_family", TICKERS, [{"short_period": s, "long_period": 21} for s in (5, 9, 13)])
+        self.assertEqual([bot.bot_name for bot in family.members], ["sma_family_5_21", "sma_family_9_21", "sma_family_13_21"])
+        self.assertEqual(len(family._create), 4)
+
+        family.tickers = ["A"]
+        self.assertTrue(all(bot.tickers == ["A"] for bot in family.members))
+        self.assertTrue(family.signals_on_previous_minute)
+        self.assertEqual(BotFamily(rsi.RSIBot, "rsi", TICKERS, [{"length": 5, "upper": 70, "lower": 30}]).unchanged_runs, 2)
+
+        with self.assertRaises(ValueError):
+            BotFamily(sma.SMABot, "sma_family", TICKERS, [{"short_period": 5}, {"short_period": 5}])
+
+
+@unittest.skipIf(ta is None, "pandas_ta is not installed")
+class TestBotParity(unittest.TestCase):
+    """The bots' signals should be the ones they gave when they called pandas_ta once per ticker on every window."""
+
+    def test_bots_match_pandas_ta_per_ticker(self):
+        tickers = ["A", "B", "C", "D"]
+        bars = random_bars(4, tickers, 90)
+        checks = [
+            (sma.SMABot("sma", tickers, short_period=3, long_period=8),
+             _crossover_rule(lambda df: (ta.sma(df['PRICE'], 3), ta.sma(df['PRICE'], 8)))),
+            (ema.EMABot("ema", tickers, short_period=3, long_period=8),
+             _crossover_rule(lambda df: (ta.ema(df['PRICE'], 3), ta.ema(df['PRICE'], 8)))),
+            (macd.MACDCrossoverBot("macd", tickers, short_period=3, long_period=8, signal_period=3),
+             _crossover_rule(lambda df: _macd_lines(df, 3, 8, 3))),
+            (macd.MACDZerolineBot("macd_zero", tickers),
+             _crossover_rule(lambda df: _macd_lines(df, 12, 26, 9)[:1])),
+            (rsi.RSIBot("rsi", tickers, length=5, upper=60, lower=40),
+             _threshold_rule(lambda df: ta.rsi(df['PRICE'], 5), 40, 60)),
+            (cci.CCIBot("cci", tickers, length=6, lower=-50, upper=50), _threshold_rule(lambda df: _cci(df, 6), -50, 50)),
+            (stoch.StochBot("stoch", tickers, k_period=5), _stoch_rule),
+            (obv.OBVBot("obv", tickers, sample_long=10, sample_short=5), _obv_rule),
+        ]
+        start = dt.datetime(2026, 1, 14, 10, 0, 30)
+        for bot, rule in checks:
+            with self.subTest(bot.bot_name), clock.use_clock(clock.SimulatedClock(start)) as simulated:
+                states = {t: {'state': 'NEUTRAL'} for t in tickers}
+                n_suggestions = 0
+                for minute in range(1, len(bars["A"])):
+                    simulated.set(start + dt.timedelta(minutes=minute))
+                    # Fönstren börjar alltid från början, så att EMA:erna i pandas_ta startar på samma stapel
+                    data = {t: df.iloc[:minute + 1] for t, df in bars.items()}
+                    target = data["A"].index[-2]
+                    expected = {}
+                    for t, df in data.items():
+                        suggestion = rule(df, target, states[t])
+                        if suggestion is not None:
+                            expected[t] = suggestion
+                    self.assertEqual(bot.find_options(data), expected, f"minute {minute}")
+                    n_suggestions += len(expected)
+                self.assertGreater(n_suggestions, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
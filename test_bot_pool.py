@@ -0,0 +1,125 @@
+import os
+import subprocess
+import sys
+import textwrap
+import unittest
+
+import pandas
+
+from bot_pool import BotPool, SharedPriceData, attach_price_data
+from mäklare import ema, macd
+from test_helpers import random_bars
+
+
+def _price_data(tickers=("A", "B", "C"), end=None):
+    return {t: df.iloc[:end] for t, df in random_bars(0, tickers, 60).items()}
+
+
+class CountingBot():
+    """Remembers how many times it has been run, which only works if it stays in the same process."""
+
+    def __init__(self, bot_name, tickers):
+        self.bot_name = bot_name
+        self.tickers = tickers
+        self.runs = 0
+
+    def find_options(self, price_data=None):
+        self.runs += 1
+        return {t: self.runs for t in self.tickers if t in price_data}
+
+
+class FailingBot(CountingBot):
+    def find_options(self, price_data=None):
+        raise ValueError("trasig bot")
+
+
+class TestSharedPriceData(unittest.TestCase):
+    def test_roundtrip(self):
+        price_data = _price_data()
+        price_data["B"] = price_data["B"].iloc[-10:]
+        price_data["D"] = pandas.DataFrame()
+        shared = SharedPriceData(price_data)
+        try:
+            shm, attached = attach_price_data(shared.name, shared.meta, untrack=False)
+            for t in ("A", "B", "C"):
+                pandas.testing.assert_frame_equal(attached[t], price_data[t], check_freq=False)
+            self.assertTrue(attached["D"].empty)
+            del attached
+            shm.close()
+        finally:
+            shared.close()
+
+
+class TestBotPool(unittest.TestCase):
+    def test_state_persists_in_worker(self):
+        pool = BotPool([CountingBot("a", ["A"]), CountingBot("b", ["B", "C"])], processes=2)
+        try:
+            for _ in range(3):
+                suggestions = pool.find_options(_price_data())
+            self.assertEqual(suggestions, {"a": {"A": 3}, "b": {"B": 3, "C": 3}})
+            # Nya tickerlistor från huvudprocessen ska gälla i processerna
+            suggestions = pool.find_options(_price_data(), {"a": ["A", "B"]})
+            self.assertEqual(suggestions["a"], {"A": 4, "B": 4})
+        finally:
+            pool.close()
+
+    def test_bots_get_their_timeframe(self):
+        slow = CountingBot("slow", ["A", "B"])
+        slow.timeframe = 15
+        pool = BotPool([CountingBot("a", ["A", "B"]), slow], processes=2)
+        try:
+            suggestions = pool.find_options(_price_data(), timeframes={15: _price_data(tickers=("B",))})
+            self.assertEqual(suggestions, {"a": {"A": 1, "B": 1}, "slow": {"B": 1}})
+        finally:
+            pool.close()
+
+    def test_error_is_raised_in_main_process(self):
+        pool = BotPool([CountingBot("a", ["A"]), FailingBot("trasig", ["A"])], processes=2)
+        try:
+            with self.assertRaisesRegex(RuntimeError, "trasig bot"):
+                pool.find_options(_price_data())
+        finally:
+            pool.close()
+
+    def test_same_suggestions_as_threads(self):
+        """Streaming bots in the pool must give the same suggestions as the same bots run in this process."""
+        def make_bots():
+            tickers = ["A", "B", "C"]
+            return [ema.EMABot("ema", tickers, short_period=3, long_period=8),
+                    macd.MACDCrossoverBot("macd", tickers, short_period=3, long_period=8, signal_period=3)]
+
+        local = make_bots()
+        pool = BotPool(make_bots(), processes=2)
+        try:
+            for end in range(20, 60, 5):
+                price_data = _price_data(end=end)
+                expected = {bot.bot_name: bot.find_options(price_data) for bot in local}
+                self.assertEqual(pool.find_options(price_data), expected)
+        finally:
+            pool.close()
+
+    def test_no_resource_tracker_errors(self):
+        """The workers share the main process' resource_tracker, so they must not unregister the memory it unlinks."""
+        script = textwrap.dedent("""
+            import sys
+            from bot_pool import BotPool, SharedPriceData
+            from test_bot_pool import CountingBot, _price_data
+            if sys.argv[1] == "started":
+                SharedPriceData(_price_data()).close()
+            pool = BotPool([CountingBot("a", ["A"]), CountingBot("b", ["B"])], processes=2)
+            for _ in range(3):
+                pool.find_options(_price_data(), timeframes={15: _price_data()})
+            pool.close()
+        """)
+        # Både när resource_tracker redan körs då processerna startas och när den inte har behövts än
+        for tracker in ("started", "not started"):
+            with self.subTest(tracker=tracker):
+                # resource_tracker skriver bara ut sina fel, så de syns i stderr från en egen process
+                result = subprocess.run([sys.executable, "-c", script, tracker], capture_output=True, text=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__)), timeout=60)
+                self.assertEqual(result.returncode, 0, result.stderr)
+                self.assertNotIn("resource_tracker", result.stderr)
+                self.assertNotIn("KeyError", result.stderr)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import datetime as dt
+import unittest
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+import clock
+
+
+class TestClock(unittest.TestCase):
+    def test_simulated_clock(self):
+        simulated = clock.SimulatedClock(dt.datetime(2026, 1, 14, 15, 30))
+        with clock.use_clock(simulated), patch("time.sleep") as mock_sleep:
+            self.assertEqual(clock.now(), dt.datetime(2026, 1, 14, 15, 30))
+            self.assertEqual(clock.today(), dt.date(2026, 1, 14))
+            start = clock.time()
+            clock.sleep(90)
+            clock.sleep(-1)  # Som time.sleep ska en negativ väntan inte flytta klockan bakåt
+            self.assertEqual(clock.time() - start, 90)
+            self.assertEqual(clock.now(), dt.datetime(2026, 1, 14, 15, 31, 30))
+        mock_sleep.assert_not_called()
+        self.assertIsInstance(clock.CLOCK, clock.SystemClock)
+
+    def test_simulated_clock_in_other_time_zone(self):
+        ny_tz = ZoneInfo("America/New_York")
+        simulated = clock.SimulatedClock(dt.datetime(2026, 1, 14, 10, 0, tzinfo=ny_tz))
+        self.assertEqual(simulated.now(ZoneInfo("Europe/Stockholm")),
+                         dt.datetime(2026, 1, 14, 16, 0, tzinfo=ZoneInfo("Europe/Stockholm")))
+
+    def test_clock_is_restored_after_error(self):
+        with self.assertRaises(ValueError):
+            with clock.use_clock(clock.SimulatedClock(dt.datetime(2026, 1, 14))):
+                raise ValueError
+        self.assertIsInstance(clock.CLOCK, clock.SystemClock)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import datetime as dt
+import unittest
+
+import numpy as np
+import pandas
+
+import clock
+from dirty_tracker import DirtyTracker
+from mäklare import cci, ema, macd, random_trader, rsi, sma, stoch, uppner
+from test_helpers import random_bars
+
+TICKERS = ["A", "B", "Q"]
+MINUTES = 90
+
+
+def _new_bots():
+    return [sma.SMABot("sma", TICKERS, short_period=3, long_period=8),
+            ema.EMABot("ema", TICKERS, short_period=3, long_period=8),
+            macd.MACDCrossoverBot("macd", TICKERS, short_period=3, long_period=8, signal_period=3),
+            rsi.RSIBot("rsi", TICKERS, length=5, upper=60, lower=40),
+            cci.CCIBot("cci", TICKERS, length=6, lower=-50, upper=50),
+            stoch.StochBot("stoch", TICKERS, k_period=5),
+            uppner.UppDownBot("uppner", TICKERS)]
+
+
+class TestDirtyTracker(unittest.TestCase):
+    def setUp(self):
+        self.clock = clock.SimulatedClock(dt.datetime(2026, 1, 14, 10, 0, 30))
+        use_clock = clock.use_clock(self.clock)
+        use_clock.__enter__()
+        self.addCleanup(use_clock.__exit__, None, None, None)
+
+    def test_skipping_unchanged_tickers_gives_the_same_suggestions(self):
+        # Q handlas bara ibland och fylls i däremellan som i BarStore
+        bars = random_bars(3, TICKERS, MINUTES, sparse=("Q",))
+        traded = {t: np.flatnonzero(df['VOLUME'].to_numpy() > 0) for t, df in bars.items()}
+        plain, tracked = _new_bots(), _new_bots()
+        tracker = DirtyTracker()
+        n_suggestions = 0
+        for minute in range(1, MINUTES):
+            # Mitt i minuten: fönstret slutar med den senaste minuten aktien har handlats i
+            self.clock.set(dt.datetime(2026, 1, 14, 10, 0, 30) + dt.timedelta(minutes=minute))
+            data, sequences = {}, {}
+            for t in TICKERS:
+                last = traded[t][traded[t] <= minute][-1]
+                data[t] = bars[t].iloc[:last + 1]
+                sequences[t] = int(last)
+            for plain_bot, tracked_bot in zip(plain, tracked):
+                expected = plain_bot.find_options(data)
+                self.assertEqual(tracked_bot.find_options(tracker.select(tracked_bot, data, sequences)), expected,
+                                 f"{plain_bot.bot_name} at minute {minute}")
+                n_suggestions += len(expected)
+
+        self.assertGreater(n_suggestions, 0)
+        stats = tracker.stats()
+        self.assertGreater(stats["skipped"], 0)
+        self.assertEqual(stats["selected"] + stats["skipped"], (MINUTES - 1) * len(TICKERS) * len(plain))
+
+    def test_longer_timeframe(self):
+        """A 15-minute crossover bot is run again when the clock passes the bar, even without new data."""
+        tracker = DirtyTracker()
+        bot = sma.SMABot("sma", ["A"], short_period=2, long_period=4, timeframe=15)
+        df = pandas.DataFrame({'PRICE': [1.0, 2.0]},
+                              index=pandas.DatetimeIndex(["1900-01-01 10:00", "1900-01-01 10:15"], name="TIME"))
+        selected = []
+        for minute in (20, 25, 30, 35):
+            self.clock.set(dt.datetime(2026, 1, 14, 10, minute, 30))
+            selected.append(len(tracker.select(bot, {"A": df}, {"A": 1})))
+        # Stapeln 10:15 blir färdig 10:30, då letar boten efter signaler i den
+        self.assertEqual(selected, [1, 0, 1, 0])
+
+    def test_select(self):
+        tracker = DirtyTracker()
+        bot = uppner.UppDownBot("uppner", ["A", "B"])
+        df = pandas.DataFrame({'PRICE': [1.0]}, index=pandas.DatetimeIndex(["1900-01-01 10:00"], name="TIME"))
+        data = {"A": df, "B": df, "C": df}
+
+        self.assertEqual(list(tracker.select(bot, data, {"A": 1, "B": 1, "C": 1})), ["A", "B", "C"])
+        self.assertEqual(list(tracker.select(bot, data, {"A": 2, "B": 1, "C": 1})), ["A"])
+        # Aktier utan sekvensnummer körs alltid
+        self.assertEqual(list(tracker.select(bot, data, {"B": 1})), ["A", "C"])
+        tracker.forget("uppner")
+        self.assertEqual(list(tracker.select(bot, data, {"A": 2, "B": 1, "C": 1})), ["A", "B", "C"])
+
+        # RSI-boten körs två gånger på samma data innan den hoppas över
+        rsi_bot = rsi.RSIBot("rsi", ["A"], length=5, upper=70, lower=30)
+        self.assertEqual([len(tracker.select(rsi_bot, {"A": df}, {"A": 1})) for _ in range(3)], [1, 1, 0])
+
+        random_bot = random_trader.RandomBot("random", ["A"])
+        self.assertEqual(len(tracker.select(random_bot, data, {"A": 1, "B": 1, "C": 1})), 3)
+        self.assertEqual(len(tracker.select(random_bot, data, {"A": 1, "B": 1, "C": 1})), 3)
+
+    def test_forgets_tickers_the_bot_no_longer_has(self):
+        tracker = DirtyTracker()
+        bot = uppner.UppDownBot("uppner", ["A", "B"])
+        df = pandas.DataFrame({'PRICE': [1.0]}, index=pandas.DatetimeIndex(["1900-01-01 10:00"], name="TIME"))
+        tracker.select(bot, {"A": df, "B": df}, {"A": 1, "B": 1})
+        bot.tickers = ["A"]
+        tracker.select(bot, {"A": df}, {"A": 1})
+        self.assertEqual(list(tracker.select(bot, {"A": df, "B": df}, {"A": 1, "B": 1})), ["B"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,50 @@
+import threading
 import unittest
-from unittest.mock import patch, mock_open
+from unittest.mock import patch
 import json
 import os
+import tempfile
+import datetime as dt
+import pandas
+from yfinance.exceptions import YFTzMissingError
 from utils import ERROR_CODES
+from portfolio_store import PortfolioStore
+from price_cache import LastPriceCache, TickerValidityCache
+import clock
 # The file to be tested
 import handla_aktie as ha
 
 class TestAktieHandel(unittest.TestCase):
 
     def setUp(self):
-        """Set up a mock portfolio for each test."""
+        """Set up a mock portfolio in a temporary portfolio store for each test."""
         self.bot_name = "test_bot"
-        self.portfolio_path = os.path.join(ha.PATH_TILL_PORTFÖLJER, self.bot_name + ".json")
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.portfolio_path = os.path.join(self.temp_dir.name, self.bot_name + ".json")
         self.mock_portfolio_data = {
             "fria_pengar": 10000.0,
             "aktier": {
                 "AAPL": 10
             }
         }
-        self.mock_portfolio_json = json.dumps(self.mock_portfolio_data)
+        with open(self.portfolio_path, 'w') as f:
+            json.dump(self.mock_portfolio_data, f)
+
+        self.store = PortfolioStore(self.temp_dir.name)
+        store_patcher = patch.object(ha, 'PORTFOLIOS', self.store)
+        store_patcher.start()
+        self.addCleanup(store_patcher.stop)
+        # Loggkön behövs inte i testerna
+        log_patcher = patch.object(ha, 'log')
+        self.mock_log = log_patcher.start()
+        self.addCleanup(log_patcher.stop)
+
+    def tearDown(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def _portfolio(self):
+        return self.store.get(self.bot_name)
 
     def _get_price_side_effect(self, ticker):
         """A side effect function for the mocked _get_stock_price."""
@@ -33,201 +59,169 @@ class TestAktieHandel(unittest.TestCase):
 
     # --- Tests for köp() ---
 
-    @patch('os.path.exists', return_value=False)
-    def test_köp_portfolio_does_not_exist(self, mock_exists):
-        """Test buying when the portfolio file doesn't exist."""
+    def test_köp_portfolio_does_not_exist(self):
+        """Test buying when the portfolio doesn't exist."""
         # The function prints to stdout, which we suppress during tests
         with patch('builtins.print'):
-            result = ha.köp(self.bot_name, "MSFT", 5) 
+            result = ha.köp("missing_bot", "MSFT", 5)
         self.assertEqual(result, ERROR_CODES.PORTFOLIO_NOEXIST)
-        mock_exists.assert_called_once_with(self.portfolio_path)
 
     @patch.object(ha, '_get_stock_price', return_value=(None, ERROR_CODES.INVALID_TICKER))
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open, read_data='{}')
-    def test_köp_invalid_ticker(self, mock_file, mock_exists, mock_get_price):
+    def test_köp_invalid_ticker(self, mock_get_price):
         """Test buying a stock with an invalid ticker (price is None)."""
         with patch('builtins.print'):
-            result = ha.köp(self.bot_name, "BADTICKER", 5) 
+            result = ha.köp(self.bot_name, "BADTICKER", 5)
         self.assertEqual(result, ERROR_CODES.INVALID_TICKER)
         mock_get_price.assert_called_with("BADTICKER")
-        mock_file().write.assert_not_called()
+        self.assertEqual(self._portfolio(), self.mock_portfolio_data)
 
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_köp_insufficient_funds(self, mock_file, mock_exists, mock_get_price):
+    def test_köp_insufficient_funds(self, mock_get_price):
         """Test buying a stock with not enough money."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         mock_get_price.side_effect = self._get_price_side_effect
 
         # Try to buy 100 MSFT shares at $200 each ($20,000) with only $10,000
         with patch('builtins.print'):
             result = ha.köp(self.bot_name, "MSFT", 100)
-        
+
         self.assertEqual(result, ERROR_CODES.INSUFFICIENT_AMOUNT)
-        mock_file.assert_called_once_with(self.portfolio_path, 'r')
-        mock_file().write.assert_not_called()
+        self.assertEqual(self._portfolio(), self.mock_portfolio_data)
 
-    @patch('json.dump')
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_köp_successful_new_stock(self, mock_file, mock_exists, mock_get_price, mock_json_dump):
+    def test_köp_successful_new_stock(self, mock_get_price):
         """Test successfully buying a stock not currently in the portfolio."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         mock_get_price.side_effect = self._get_price_side_effect
 
         with patch('builtins.print'):
             result = ha.köp(self.bot_name, "MSFT", 10) # Buy 10 MSFT @ $200
-        
+
         self.assertEqual(result, ERROR_CODES.SUCCESS)
-        
-        # Verify file was opened for reading then writing
-        mock_file.assert_any_call(self.portfolio_path, 'r')
-        mock_file.assert_any_call(self.portfolio_path, 'w')
-
-        # Check what was written to the file
-        written_data = mock_json_dump.call_args[0][0]
-        
-        self.assertEqual(written_data['fria_pengar'], 8000.0) # 10000 - (10 * 200)
-        self.assertEqual(written_data['aktier']['MSFT'], 10)
-        self.assertEqual(written_data['aktier']['AAPL'], 10) # Unchanged
-
-    @patch('json.dump')
+        self.mock_log.assert_called_once_with(self.bot_name, "MSFT", 'BUY', 10, 200.0)
+
+        portfolio = self._portfolio()
+        self.assertEqual(portfolio['fria_pengar'], 8000.0) # 10000 - (10 * 200)
+        self.assertEqual(portfolio['aktier']['MSFT'], 10)
+        self.assertEqual(portfolio['aktier']['AAPL'], 10) # Unchanged
+
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_köp_successful_existing_stock(self, mock_file, mock_exists, mock_get_price, mock_json_dump):
+    def test_köp_successful_existing_stock(self, mock_get_price):
         """Test successfully buying more of an existing stock."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         mock_get_price.side_effect = self._get_price_side_effect
 
         with patch('builtins.print'):
             result = ha.köp(self.bot_name, "AAPL", 5) # Buy 5 AAPL @ $150
-        
+
         self.assertEqual(result, ERROR_CODES.SUCCESS)
-        
-        written_data = mock_json_dump.call_args[0][0]
-        
-        self.assertEqual(written_data['fria_pengar'], 9250.0) # 10000 - (5 * 150)
-        self.assertEqual(written_data['aktier']['AAPL'], 15) # 10 + 5
+
+        portfolio = self._portfolio()
+        self.assertEqual(portfolio['fria_pengar'], 9250.0) # 10000 - (5 * 150)
+        self.assertEqual(portfolio['aktier']['AAPL'], 15) # 10 + 5
 
     @patch('handla_aktie._get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_köp_negative_antal(self, mock_file, mock_exists, mock_get_price):
+    def test_köp_negative_antal(self, mock_get_price):
         """Test buying a negative number of shares."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
-        
         with patch('builtins.print'):
             result = ha.köp(self.bot_name, "MSFT", -5)
         self.assertEqual(result, ERROR_CODES.INVALID_AMOUNT)
         mock_get_price.assert_not_called() # Should fail before price check
-        mock_file().write.assert_not_called()
+        self.assertEqual(self._portfolio(), self.mock_portfolio_data)
 
     # --- Tests for sälj() ---
 
-    @patch('os.path.exists', return_value=False)
-    def test_sälj_portfolio_does_not_exist(self, mock_exists):
-        """Test selling when the portfolio file doesn't exist."""
+    def test_sälj_portfolio_does_not_exist(self):
+        """Test selling when the portfolio doesn't exist."""
         with patch('builtins.print'):
-            result = ha.sälj(self.bot_name, "AAPL", 5)
+            result = ha.sälj("missing_bot", "AAPL", 5)
         self.assertEqual(result, ERROR_CODES.PORTFOLIO_NOEXIST)
-        mock_exists.assert_called_once_with(self.portfolio_path)
 
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_sälj_stock_not_owned(self, mock_file, mock_exists, mock_get_price):
+    def test_sälj_stock_not_owned(self, mock_get_price):
         """Test selling a stock that is not in the portfolio."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         mock_get_price.side_effect = self._get_price_side_effect
 
         with patch('builtins.print'):
             result = ha.sälj(self.bot_name, "MSFT", 5)
-        
+
         self.assertEqual(result, ERROR_CODES.NO_SHARES)
         mock_get_price.assert_not_called() # Should fail before price check
-        mock_file().write.assert_not_called()
+        self.assertEqual(self._portfolio(), self.mock_portfolio_data)
 
-    @patch('json.dump')
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_sälj_successful_partial(self, mock_file, mock_exists, mock_get_price, mock_json_dump):
+    def test_sälj_successful_partial(self, mock_get_price):
         """Test successfully selling some shares of a stock."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         mock_get_price.side_effect = self._get_price_side_effect
 
         with patch('builtins.print'):
             result = ha.sälj(self.bot_name, "AAPL", 4) # Sell 4 of 10 AAPL @ $150
-        
+
         self.assertEqual(result, ERROR_CODES.SUCCESS)
-        
-        written_data = mock_json_dump.call_args[0][0]
-        
-        self.assertEqual(written_data['fria_pengar'], 10600.0) # 10000 + (4 * 150)
-        self.assertEqual(written_data['aktier']['AAPL'], 6) # 10 - 4
 
-    @patch('json.dump')
+        portfolio = self._portfolio()
+        self.assertEqual(portfolio['fria_pengar'], 10600.0) # 10000 + (4 * 150)
+        self.assertEqual(portfolio['aktier']['AAPL'], 6) # 10 - 4
+
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_sälj_successful_all(self, mock_file, mock_exists, mock_get_price, mock_json_dump):
+    def test_sälj_successful_all(self, mock_get_price):
         """Test successfully selling all shares of a stock."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         mock_get_price.side_effect = self._get_price_side_effect
 
         with patch('builtins.print'):
             result = ha.sälj(self.bot_name, "AAPL", 10) # Sell all 10 AAPL @ $150
-        
+
         self.assertEqual(result, ERROR_CODES.SUCCESS)
-        
-        written_data = mock_json_dump.call_args[0][0]
-        
-        self.assertEqual(written_data['fria_pengar'], 11500.0) # 10000 + (10 * 150)
-        self.assertNotIn('AAPL', written_data['aktier'])
 
-    @patch('json.dump')
+        portfolio = self._portfolio()
+        self.assertEqual(portfolio['fria_pengar'], 11500.0) # 10000 + (10 * 150)
+        self.assertNotIn('AAPL', portfolio['aktier'])
+
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_sälj_more_than_owned(self, mock_file, mock_exists, mock_get_price, mock_json_dump):
+    def test_sälj_more_than_owned(self, mock_get_price):
         """Test selling more shares than owned (should sell all)."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         mock_get_price.side_effect = self._get_price_side_effect
 
         with patch('builtins.print'):
             result = ha.sälj(self.bot_name, "AAPL", 20) # Try to sell 20, own 10
-        
+
         self.assertEqual(result, ERROR_CODES.SUCCESS)
-        
-        written_data = mock_json_dump.call_args[0][0]
-        
-        self.assertEqual(written_data['fria_pengar'], 11500.0) # 10000 + (10 * 150)
-        self.assertNotIn('AAPL', written_data['aktier'])
+
+        portfolio = self._portfolio()
+        self.assertEqual(portfolio['fria_pengar'], 11500.0) # 10000 + (10 * 150)
+        self.assertNotIn('AAPL', portfolio['aktier'])
 
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_sälj_negative_antal(self, mock_file, mock_exists, mock_get_price):
+    def test_sälj_price_is_fetched_without_the_lock(self, mock_get_price):
+        """Another thread can change the portfolio while the price is fetched, the sale uses the shares left then."""
+        def get_price(ticker):
+            sold = threading.Thread(target=self._sell_in_store, args=(7,))
+            sold.start()
+            sold.join(timeout=2)
+            self.assertFalse(sold.is_alive())  # Hade väntat på låset om priset hämtats i edit
+            return 150.0, ERROR_CODES.SUCCESS
+        mock_get_price.side_effect = get_price
+
+        with patch('builtins.print'):
+            result = ha.sälj(self.bot_name, "AAPL", 5)
+
+        self.assertEqual(result, ERROR_CODES.SUCCESS)
+        self.assertNotIn('AAPL', self._portfolio()['aktier'])
+        self.assertEqual(self._portfolio()['fria_pengar'], 10000.0 + 3 * 150.0)
+
+    def _sell_in_store(self, amount):
+        with self.store.edit(self.bot_name) as portfolio:
+            portfolio['aktier']['AAPL'] -= amount
+
+    @patch.object(ha, '_get_stock_price')
+    def test_sälj_negative_antal(self, mock_get_price):
         """Test selling a negative number of shares."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
-        
         with patch('builtins.print'):
             result = ha.sälj(self.bot_name, "AAPL", -5)
         self.assertEqual(result, ERROR_CODES.INVALID_AMOUNT)
         mock_get_price.assert_not_called()
-        mock_file().write.assert_not_called()
+        self.assertEqual(self._portfolio(), self.mock_portfolio_data)
 
-    @patch('json.dump')
     @patch.object(ha, '_get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_utför_flera_transaktioner(self, mock_file, mock_exists, mock_get_price, mock_json_dump):
+    def test_utför_flera_transaktioner(self, mock_get_price):
         """Test executing multiple transactions in a batch."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
         # Prices: MSFT=200, AAPL=150
         mock_get_price.side_effect = self._get_price_side_effect
 
@@ -238,36 +232,126 @@ class TestAktieHandel(unittest.TestCase):
 
         with patch('builtins.print'):
             results = ha.utför_flera_transaktioner(self.bot_name, transactions)
-        
+
         self.assertEqual(results, [ERROR_CODES.SUCCESS, ERROR_CODES.SUCCESS])
-        
-        # Verify file opened read once, write once
-        mock_file.assert_any_call(self.portfolio_path, 'r')
-        mock_file.assert_any_call(self.portfolio_path, 'w')
-        
+
         # Verify portfolio state
-        written_data = mock_json_dump.call_args[0][0]
+        portfolio = self._portfolio()
         # Start: 10000. Buy MSFT (5*200=1000) -> 9000. Sell AAPL (5*150=750) -> 9750.
-        self.assertEqual(written_data['fria_pengar'], 9750.0)
-        self.assertEqual(written_data['aktier']['MSFT'], 5)
-        self.assertEqual(written_data['aktier']['AAPL'], 5) # Started with 10, sold 5
+        self.assertEqual(portfolio['fria_pengar'], 9750.0)
+        self.assertEqual(portfolio['aktier']['MSFT'], 5)
+        self.assertEqual(portfolio['aktier']['AAPL'], 5) # Started with 10, sold 5
 
     @patch('handla_aktie._get_stock_price')
-    @patch('os.path.exists', return_value=True)
-    @patch('builtins.open', new_callable=mock_open)
-    def test_utför_flera_transaktioner_with_provided_price(self, mock_file, mock_exists, mock_get_price):
+    def test_utför_flera_transaktioner_with_provided_price(self, mock_get_price):
         """Test batch transaction with pre-supplied price."""
-        mock_file.return_value.read.return_value = self.mock_portfolio_json
-        
         transactions = [
             {'ticker': 'MSFT', 'action': 'BUY', 'amount': 5, 'allow_add': True, 'price': 100.0}
         ]
-        
+
         with patch('builtins.print'):
             ha.utför_flera_transaktioner(self.bot_name, transactions)
-            
+
         # Should not call _get_stock_price because price is provided
         mock_get_price.assert_not_called()
 
+    @patch.object(ha, '_get_stock_price')
+    def test_trades_reach_json_file_after_close(self, mock_get_price):
+        """The JSON file keeps the old format and is up to date once the store is closed."""
+        mock_get_price.side_effect = self._get_price_side_effect
+        with patch('builtins.print'):
+            ha.köp(self.bot_name, "MSFT", 10)
+        self.store.close()
+        with open(self.portfolio_path) as f:
+            self.assertEqual(json.load(f), {"fria_pengar": 8000.0, "aktier": {"AAPL": 10, "MSFT": 10}})
+
+
+class TestPrisuppslag(unittest.TestCase):
+    """Price lookups should only use the network for tickers that are neither cached nor known to be invalid."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        for target, value in (('LAST_PRICES', LastPriceCache()), ('VALID_TICKERS', TickerValidityCache()),
+                              ('PATH_TILL_PRISER', self.temp_dir.name)):
+            patcher = patch.object(ha, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        download_patcher = patch.object(ha.yf, 'download')
+        self.mock_download = download_patcher.start()
+        self.addCleanup(download_patcher.stop)
+        ticker_patcher = patch.object(ha.yf, 'Ticker')
+        self.mock_ticker = ticker_patcher.start()
+        self.addCleanup(ticker_patcher.stop)
+        self.mock_ticker.return_value.history.side_effect = YFTzMissingError("GONE")
+        print_patcher = patch('handla_aktie.thread_safe_print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def _history(self, closes: dict):
+        columns = pandas.MultiIndex.from_product([['Close'], list(closes)], names=['Price', 'Ticker'])
+        return pandas.DataFrame([list(closes.values())], columns=columns)
+
+    def test_cached_price_does_not_use_network(self):
+        ha.LAST_PRICES.update("AAPL", 150.0, 1000)
+        self.assertEqual(ha._get_stock_price("AAPL"), (150.0, ERROR_CODES.SUCCESS))
+        self.mock_download.assert_not_called()
+
+    def test_csv_fallback(self):
+        with open(os.path.join(self.temp_dir.name, "MSFT.csv"), 'w') as f:
+            f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n")
+            for i in range(500):
+                f.write(f"10:{i % 60:02d}:00,{200 + i},0,0,{i}\n")
+        self.assertEqual(ha._get_stock_price("MSFT"), (699.0, ERROR_CODES.SUCCESS))
+        self.mock_download.assert_not_called()
+
+    def test_invalid_ticker_is_remembered(self):
+        self.mock_download.return_value = self._history({"AAPL": 150.0, "BAD": float('nan')})
+        self.assertEqual(ha._get_stock_prices(["AAPL", "BAD"]), {"AAPL": 150.0})
+        self.assertEqual(ha._get_stock_price("BAD"), (None, ERROR_CODES.INVALID_TICKER))
+        self.mock_download.assert_called_once()
+
+    def test_empty_download_is_not_remembered(self):
+        # Nätverksfel eller före öppning: tickern kan mycket väl finnas
+        self.mock_download.return_value = pandas.DataFrame()
+        self.assertEqual(ha._get_stock_price("AAPL"), (None, ERROR_CODES.HISTORY_NOEXIST))
+        self.mock_download.side_effect = ConnectionError("offline")
+        self.assertEqual(ha._get_stock_price("AAPL"), (None, ERROR_CODES.HISTORY_NOEXIST))
+        self.assertEqual(self.mock_download.call_count, 2)
+        self.assertIsNone(ha.VALID_TICKERS.is_valid("AAPL"))
+        self.mock_ticker.assert_not_called()
+
+    def test_ticker_without_prices_today(self):
+        self.mock_download.return_value = self._history({"AAPL": 150.0, "HALT": float('nan')})
+        self.mock_ticker.return_value.history.side_effect = None
+        self.mock_ticker.return_value.history.return_value = pandas.DataFrame({'Close': [10.0]})
+        self.assertEqual(ha._get_stock_price("HALT"), (None, ERROR_CODES.HISTORY_NOEXIST))
+        self.assertTrue(ha.VALID_TICKERS.is_valid("HALT"))
+
+        # Går det inte att avgöra sparas ingenting
+        ha.VALID_TICKERS.clear()
+        self.mock_ticker.return_value.history.side_effect = ConnectionError("offline")
+        self.assertEqual(ha._get_stock_price("HALT"), (None, ERROR_CODES.HISTORY_NOEXIST))
+        self.assertIsNone(ha.VALID_TICKERS.is_valid("HALT"))
+
+    def test_missing_prices_are_fetched_in_one_request(self):
+        ha.LAST_PRICES.update("AAPL", 150.0, 1000)
+        ha.VALID_TICKERS.set("BAD", False)
+        self.mock_download.return_value = self._history({"MSFT": 200.0, "NVDA": 100.0, "GONE": float('nan')})
+        prices = ha._get_stock_prices(["AAPL", "MSFT", "NVDA", "GONE", "BAD"])
+        self.assertEqual(prices, {"AAPL": 150.0, "MSFT": 200.0, "NVDA": 100.0})
+        self.mock_download.assert_called_once()
+        self.assertEqual(self.mock_download.call_args[0][0], ["MSFT", "NVDA", "GONE"])
+        self.assertFalse(ha.VALID_TICKERS.is_valid("GONE"))
+
+
+class TestLog(unittest.TestCase):
+    def test_log_uses_the_clock(self):
+        simulated = clock.SimulatedClock(dt.datetime(2026, 1, 14, 15, 31))
+        with clock.use_clock(simulated), patch.object(ha, 'log_queue') as mock_queue:
+            ha.log("test_bot", "AAPL", "BUY", 2, 10.5)
+        mock_queue.put.assert_called_once_with(
+            ["2026-01-14 15:31:00.000000", "test_bot", "AAPL", "BUY", 2, 10.5, 21.0])
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
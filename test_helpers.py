@@ -0,0 +1,27 @@
+"""Gemensamma testdata: slumpvandrande 1-minutsstaplar som BarStore och retrieve_data ger dem."""
+
+import numpy as np
+import pandas
+
+
+def random_bars(seed, tickers=("A", "B"), length=90, start="10:00", flat=None, sparse=()):
+    """OHLCV bars from a random walk for each ticker in `tickers`, indexed by minute from `start` on 1900-01-01.\n
+    `flat` is a slice of minutes where every price stands still. Tickers in `sparse` only trade in about
+    a third of the minutes and are forward-filled with no volume in between, like in BarStore."""
+    rng = np.random.default_rng(seed)
+    index = pandas.date_range(f"1900-01-01 {start}", periods=length, freq="1min", name="TIME")
+    bars = {}
+    for t in tickers:
+        close = 100 + np.cumsum(rng.normal(0, 0.4, length)).round(2)
+        if flat is not None:
+            close[flat] = close[flat.start]
+        high, low = rng.random(length).round(2), rng.random(length).round(2)
+        volume = rng.integers(100, 1000, length).astype(float)
+        if t in sparse:
+            active = rng.random(length) < 0.3
+            active[0] = True
+            close = pandas.Series(np.where(active, close, np.nan)).ffill().to_numpy()
+            volume[~active] = 0
+        bars[t] = pandas.DataFrame({'OPEN': close, 'HIGH': close + high, 'LOW': close - low, 'PRICE': close,
+                                    'VOLUME': volume}, index=index)
+    return bars
@@ -3,9 +3,13 @@ import tempfile
 import shutil
 import os
 import importlib.util
+import threading
 import time
-from threading import Thread
-from unittest.mock import Mock
+from concurrent.futures import Future
+from threading import Thread, Event
+from unittest.mock import Mock, patch
+
+from tick_storage import read_ticks
 
 
 class TestHamtaAktiepriser(unittest.TestCase):
@@ -59,7 +63,7 @@ class TestHamtaAktiepriser(unittest.TestCase):
         self.assertGreaterEqual(self.module.last_ticker_update, start)
         self.assertLessEqual(self.module.last_ticker_update, time.time())
 
-    def test_data_writer_creates_csv_and_writes_rows(self):
+    def test_data_writer_creates_tick_file_and_writes_rows(self):
         # Prepare a message and place it on the queue
         now_ms = int(time.time() * 1000)
         msg = {
@@ -87,18 +91,33 @@ class TestHamtaAktiepriser(unittest.TestCase):
         self.module.STOP_EVENT.set()
         writer_thread.join(timeout=2)
 
-        # Verify file exists and contains header + one data row
-        csv_path = os.path.join(self.test_dir, "TESTTICK.csv")
-        self.assertTrue(os.path.exists(csv_path), "CSV file was not created by data_writer")
+        # Verify file exists and contains one record
+        tick_path = os.path.join(self.test_dir, "TESTTICK.ticks")
+        self.assertTrue(os.path.exists(tick_path), "Tick file was not created by data_writer")
+
+        ticks = read_ticks(tick_path)
+        self.assertEqual(len(ticks), 1)
+        self.assertEqual(ticks[0]['TIME'], now_ms)
+        self.assertEqual(ticks[0]['PRICE'], 123.45)
+        self.assertEqual(ticks[0]['CUM_VOLUME'], 1000)
+
+    def test_data_writer_drops_duplicates_and_sorts(self):
+        now_ms = int(time.time() * 1000)
+        messages = [{"id": "TESTTICK", "time": str(now_ms + offset), "price": price, "day_volume": "10",
+                     "market_hours": 1}
+                    for offset, price in [(0, 1.0), (200, 3.0), (100, 2.0), (200, 3.0)]]
+        with self.module.QUEUE_LOCK:
+            self.module.DATA_QUEUE.extend(messages)
 
-        with open(csv_path, "r", encoding="utf-8") as f:
-            lines = [l.strip() for l in f.readlines() if l.strip()]
+        writer_thread = Thread(target=self.module.data_writer, daemon=True)
+        writer_thread.start()
+        time.sleep(0.2)
+        self.module.STOP_EVENT.set()
+        writer_thread.join(timeout=2)
 
-        # Expect at least header + 1 row
-        self.assertGreaterEqual(len(lines), 2)
-        self.assertTrue(lines[0].startswith("TIME,PRICE,CHANGE_PERCENT"))
-        # Data row should contain the price we wrote
-        self.assertIn("123.45", lines[1])
+        ticks = read_ticks(os.path.join(self.test_dir, "TESTTICK.ticks"))
+        self.assertEqual(list(ticks['PRICE']), [1.0, 2.0, 3.0])
+        self.assertEqual(list(ticks['TIME']), [now_ms, now_ms + 100, now_ms + 200])
 
     def test_websocket_watchdog_calls_stop_and_monitor(self):
         # Arrange
@@ -136,5 +155,225 @@ class TestHamtaAktiepriser(unittest.TestCase):
             self.module.monitor_stocks = original_monitor
 
 
+class FakeWebSocket():
+    """Stands in for yf.WebSocket: listen() blocks until close() is called."""
+    instances = []
+
+    fail_subscribe = False
+    connect_delay = 0
+
+    def __init__(self):
+        time.sleep(FakeWebSocket.connect_delay)
+        self.subscribed = []
+        self.unsubscribed = []
+        self.handler = None
+        self.closed = Event()
+        FakeWebSocket.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def subscribe(self, tickers):
+        if self.fail_subscribe and self.handler is not None:
+            raise ConnectionError("connection lost")
+        self.subscribed.extend(tickers)
+
+    def unsubscribe(self, tickers):
+        self.unsubscribed.extend(tickers)
+
+    def listen(self, handler):
+        self.handler = handler
+        self.closed.wait()
+
+    def close(self):
+        self.closed.set()
+
+
+class TestWebSocketShards(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        spec = importlib.util.spec_from_file_location(
+            "hamta_real_shards",
+            os.path.join(os.path.dirname(__file__), "hämta_aktiepriser.py"),
+        )
+        cls.module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.module)
+
+    def setUp(self):
+        FakeWebSocket.instances = []
+        self.module.STOP_EVENT.clear()
+        with self.module.QUEUE_LOCK:
+            self.module.DATA_QUEUE.clear()
+        patcher = patch.object(self.module, "yf", Mock(WebSocket=FakeWebSocket))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        print_patcher = patch.object(self.module, "thread_safe_print")
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def tearDown(self):
+        self.module.STOP_EVENT.set()
+        for ws in FakeWebSocket.instances:
+            ws.close()
+
+    def _wait_for(self, condition, timeout=2):
+        start = time.time()
+        while not condition():
+            if time.time() - start > timeout:
+                self.fail("timed out")
+            time.sleep(0.01)
+
+    def _start(self, tickers, n_shards):
+        shards = self.module.create_shards(tickers, n_shards)
+        for shard in shards:
+            shard.start()
+        self._wait_for(lambda: all(shard.is_connected for shard in shards))
+        self._wait_for(lambda: len(FakeWebSocket.instances) == len(shards)
+                       and all(ws.handler for ws in FakeWebSocket.instances))
+        return shards
+
+    def test_tickers_are_split_over_shards(self):
+        tickers = [f"T{i}" for i in range(10)]
+        shards = self.module.create_shards(tickers, 3)
+        self.assertEqual([shard.tickers for shard in shards],
+                         [tickers[0::3], tickers[1::3], tickers[2::3]])
+        self.assertEqual(len(self.module.create_shards(["A", "B"], 5)), 2)
+        # Första rotationen sprids ut över sessionstiden
+        rotations = [shard.rotate_at for shard in shards]
+        self.assertEqual(rotations, sorted(rotations))
+        self.assertAlmostEqual(rotations[1] - rotations[0], self.module.MAX_WEBSOCKET_SESSION_TIME / 3, delta=1)
+
+    def test_each_shard_subscribes_its_tickers_and_forwards_messages(self):
+        shards = self._start(["A", "B", "C", "D"], 2)
+        self.assertEqual(sorted(ws.subscribed for ws in FakeWebSocket.instances), [["A", "C"], ["B", "D"]])
+        ws = next(ws for ws in FakeWebSocket.instances if ws.subscribed == ["B", "D"])
+        ws.handler({"id": "B", "time": "1", "price": 1.0, "market_hours": 1})
+        with self.module.QUEUE_LOCK:
+            self.assertEqual([msg["id"] for msg in self.module.DATA_QUEUE], ["B"])
+        self.assertGreater(shards[1].last_message, shards[0].last_message)
+
+    def test_stalled_shard_reconnects_alone(self):
+        shards = self._start(["A", "B", "C"], 3)
+        now = time.time()
+        shards[0].last_message = shards[2].last_message = now
+        shards[1].last_message = now - 10
+        first_connections = list(FakeWebSocket.instances)
+
+        self.module.check_shards(shards, timeout=5, now=now)
+        self._wait_for(lambda: len(FakeWebSocket.instances) == 4 and FakeWebSocket.instances[-1].handler)
+
+        self.assertEqual([ws.closed.is_set() for ws in first_connections], [False, True, False])
+        self.assertEqual(FakeWebSocket.instances[-1].subscribed, ["B"])
+        self.assertEqual([shard.reconnects for shard in shards], [0, 1, 0])
+
+    def test_rotation_is_one_shard_at_a_time(self):
+        shards = self._start(["A", "B", "C"], 3)
+        now = time.time()
+        for shard in shards:
+            shard.last_message = now
+            shard.rotate_at = now - 1
+
+        self.module.check_shards(shards, timeout=5, now=now)
+        self.assertEqual([shard.reconnects for shard in shards], [1, 0, 0])
+        self.assertGreater(shards[0].rotate_at, now)
+
+        # Nästa rotation väntar tills den roterade anslutningen är uppe igen
+        self._wait_for(lambda: len(FakeWebSocket.instances) == 4 and FakeWebSocket.instances[-1].handler)
+        shards[0]._ws = None
+        self.module.check_shards(shards, timeout=5, now=now)
+        self.assertEqual([shard.reconnects for shard in shards], [1, 0, 0])
+
+    def _monitor(self, tickers, n_shards):
+        shards = self._start(tickers, n_shards)
+        patchers = [patch.object(self.module, "_shards", shards),
+                    patch.object(self.module, "_tickers_to_monitor", list(tickers)),
+                    patch.object(self.module, "INGESTION_MODE", "thread")]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return shards
+
+    def test_update_monitored_tickers_keeps_connections(self):
+        shards = self._monitor(["A", "B", "C"], 2)  # [A, C], [B]
+        connections = list(FakeWebSocket.instances)
+
+        report = self.module.update_monitored_tickers(["A", "B", "D", "E"])
+
+        self.assertEqual(report, {"added": ["D", "E"], "removed": ["C"], "reconnected_shards": [], "dropped_ticks": 0})
+        self.assertEqual(FakeWebSocket.instances, connections)
+        self.assertFalse(any(ws.closed.is_set() for ws in connections))
+        # Nya tickers går till anslutningen med minst tickers
+        self.assertEqual([shard.tickers for shard in shards], [["A", "E"], ["B", "D"]])
+        self.assertEqual(connections[0].unsubscribed, ["C"])
+        self.assertEqual(self.module._tickers_to_monitor, ["A", "B", "D", "E"])
+
+        # Sena ticks för borttagna tickers skrivs inte, nya tickers skrivs
+        connections[0].handler({"id": "C", "time": "1", "price": 1.0, "market_hours": 1})
+        connections[1].handler({"id": "D", "time": "1", "price": 1.0, "market_hours": 1})
+        with self.module.QUEUE_LOCK:
+            self.assertEqual([msg["id"] for msg in self.module.DATA_QUEUE], ["D"])
+        self.assertEqual(shards[0].ignored["C"], 1)
+
+    def test_failed_update_reopens_only_that_shard(self):
+        shards = self._monitor(["A", "B"], 2)
+        FakeWebSocket.fail_subscribe = True
+        self.addCleanup(setattr, FakeWebSocket, "fail_subscribe", False)
+        report = self.module.update_monitored_tickers(["A", "B", "C"])
+        self.assertEqual(report["reconnected_shards"], [0])
+        self._wait_for(lambda: len(FakeWebSocket.instances) == 3 and FakeWebSocket.instances[-1].handler)
+        self.assertEqual(FakeWebSocket.instances[-1].subscribed, ["A", "C"])
+        self.assertFalse(FakeWebSocket.instances[1].closed.is_set())
+
+    def test_failed_update_counts_dropped_ticks(self):
+        shards = self._monitor(["A", "B"], 2)
+        # Anslutningen har tagit emot 1000 ticks per sekund när prenumerationen misslyckas
+        shards[0].gaps.connected(now=time.monotonic() - 1)
+        for i in range(1000):
+            FakeWebSocket.instances[0].handler({"id": "A", "time": str(i), "price": 1.0, "market_hours": 1})
+        FakeWebSocket.fail_subscribe = True
+        self.addCleanup(setattr, FakeWebSocket, "fail_subscribe", False)
+        FakeWebSocket.connect_delay = 0.2
+        self.addCleanup(setattr, FakeWebSocket, "connect_delay", 0)
+
+        report = self.module.update_monitored_tickers(["A", "B", "C"])
+        self.assertEqual(report["reconnected_shards"], [0])
+        self.assertTrue(shards[0].is_connected)
+        self.assertAlmostEqual(report["dropped_ticks"], 200, delta=100)
+
+    def test_failed_pipeline_update_counts_dropped_ticks(self):
+        gaps = self.module.TickGaps()
+        gaps.connected(now=time.monotonic() - 1)
+        for _ in range(1000):
+            gaps.tick()
+
+        def update_tickers(tickers):
+            # Anslutningen var stängd, pipelinen återansluter efter 0.2 s
+            gaps.disconnected()
+            threading.Timer(0.2, gaps.connected).start()
+            sent = Future()
+            sent.set_result(False)
+            return sent
+
+        pipeline = Mock(gaps=gaps, update_tickers=Mock(side_effect=update_tickers))
+        for name, value in (("_pipeline", pipeline), ("_tickers_to_monitor", ["A"]), ("INGESTION_MODE", "asyncio")):
+            patcher = patch.object(self.module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        report = self.module.update_monitored_tickers(["A", "B"])
+        pipeline.update_tickers.assert_called_once_with(["A", "B"])
+        self.assertEqual(report["reconnected_shards"], [0])
+        self.assertAlmostEqual(report["dropped_ticks"], 200, delta=100)
+
+    def test_stop_closes_every_shard(self):
+        shards = self._start(["A", "B"], 2)
+        self.module.STOP_EVENT.set()
+        for shard in shards:
+            shard.close()
+        self.assertTrue(all(shard.join(timeout=2) for shard in shards))
+
+
 if __name__ == "__main__":
     unittest.main()
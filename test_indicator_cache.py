@@ -0,0 +1,102 @@
+import datetime as dt
+import unittest
+
+import pandas
+
+import clock
+from indicator_cache import INDICATOR_CACHE, crossover_entries, price_line
+from mäklare import ema, macd, sma
+from streaming import SMA
+from test_helpers import random_bars
+
+TICKERS = ["A", "B"]
+START = dt.datetime(2026, 1, 14, 10, 0, 30)
+
+
+class TestIndicatorCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = clock.SimulatedClock(START)
+        use_clock = clock.use_clock(self.clock)
+        use_clock.__enter__()
+        self.addCleanup(use_clock.__exit__, None, None, None)
+        INDICATOR_CACHE.clear()
+        self.addCleanup(INDICATOR_CACHE.clear)
+        self.bars = random_bars(7, TICKERS, 90)
+
+    def _run(self, bots, minutes, window=40):
+        """Every bot's suggestions for each minute, on a sliding window like price_data in main."""
+        suggestions = []
+        for minute in minutes:
+            self.clock.set(START + dt.timedelta(minutes=minute))
+            data = {t: df.iloc[max(0, minute - window):minute + 1] for t, df in self.bars.items()}
+            suggestions.append([bot.find_options(data) for bot in bots])
+        return suggestions
+
+    def test_identical_bots_share_indicators(self):
+        first, second = ema.EMABot("a", TICKERS), ema.EMABot("b", TICKERS)
+        suggestions = self._run([first, second], range(1, 90))
+        self.assertTrue(all(a == b for a, b in suggestions))
+        self.assertTrue(any(a for a, _ in suggestions))
+        # Den andra boten får alla sina tre värden (två linjer och korsningen) från den första
+        self.assertEqual(INDICATOR_CACHE.stats(), {"hits": 3 * 2 * 89, "misses": 3 * 2 * 89, "hit_rate": 0.5})
+
+    def test_macd_shares_emas_with_ema_bot(self):
+        macd_bot = macd.MACDCrossoverBot("macd", TICKERS, short_period=3, long_period=8, signal_period=3)
+        alone = self._run([macd_bot], range(1, 90))
+
+        INDICATOR_CACHE.clear()
+        macd_bot = macd.MACDCrossoverBot("macd", TICKERS, short_period=3, long_period=8, signal_period=3)
+        shared = self._run([ema.EMABot("ema", TICKERS, short_period=3, long_period=8), macd_bot], range(1, 90))
+        self.assertEqual([suggestions[1] for suggestions in shared], [suggestions[0] for suggestions in alone])
+        self.assertTrue(any(suggestions[0] for suggestions in alone))
+        # MACD-boten hittar EMA(3) och EMA(8) från EMA-boten, men räknar MACD-linjerna och korsningen själv.
+        # Första minuten räknas allt om när MACD-linjerna läggs till
+        self.assertEqual(INDICATOR_CACHE.hits, 2 * 2 * 88)
+
+    def test_bot_added_later_gets_the_same_signals(self):
+        """A new indicator recomputes the ticker's indicators from the window, as if every bot had its own."""
+        sma_bot = sma.SMABot("sma", TICKERS, short_period=3, long_period=8)
+        self._run([sma_bot], range(1, 30))
+        late_bot = ema.EMABot("ema", TICKERS, short_period=3, long_period=8)
+        together = self._run([sma_bot, late_bot], range(30, 90))
+
+        INDICATOR_CACHE.clear()
+        separate = [self._run([sma.SMABot("sma", TICKERS, short_period=3, long_period=8)], range(1, 90))[29:]]
+        INDICATOR_CACHE.clear()
+        separate.append(self._run([ema.EMABot("ema", TICKERS, short_period=3, long_period=8)], range(30, 90)))
+        self.assertEqual(together, [[a[0], b[0]] for a, b in zip(*separate)])
+
+    def test_different_data_at_the_same_times(self):
+        entries = [price_line(("SMA", 3), lambda: SMA(3))]
+        INDICATOR_CACHE.peek("A", self.bars["A"].iloc[:20], entries)
+        other = self.bars["B"].iloc[:21]
+        other.index = self.bars["A"].index[:21]
+        [value] = INDICATOR_CACHE.peek("A", other, entries)
+        self.assertAlmostEqual(value, other['PRICE'].iloc[-3:].mean())
+
+    def test_timeframes_are_kept_apart(self):
+        entries = crossover_entries(sma.SMABot("sma", TICKERS, short_period=2, long_period=3).crossover_lines())
+        bars_15 = self.bars["A"].iloc[:46].resample("15min").agg({'PRICE': 'last'})
+        INDICATOR_CACHE.peek("A", self.bars["A"].iloc[:46], entries)
+        INDICATOR_CACHE.peek("A", bars_15, entries, timeframe=15)
+        # En ny minutstapel ändrar inget för 15-minutersstaplarna, deras värden finns kvar
+        minute_values = INDICATOR_CACHE.peek("A", self.bars["A"].iloc[:47], entries)
+        values_15 = INDICATOR_CACHE.peek("A", bars_15, entries, timeframe=15)
+        self.assertEqual(INDICATOR_CACHE.stats()["hits"], 3)
+        self.assertAlmostEqual(minute_values[1], self.bars["A"]['PRICE'].iloc[44:47].mean())
+        self.assertAlmostEqual(values_15[0], bars_15['PRICE'].iloc[-2:].mean())
+
+    def test_stats_and_clear(self):
+        self.assertEqual(INDICATOR_CACHE.stats(), {"hits": 0, "misses": 0, "hit_rate": 0.0})
+        df = pandas.DataFrame({'PRICE': [1.0, 2.0, 3.0]},
+                              index=pandas.date_range("1900-01-01 10:00", periods=3, freq="1min", name="TIME"))
+        entries = [price_line(("SMA", 2), lambda: SMA(2))]
+        self.assertEqual(INDICATOR_CACHE.peek("A", df, entries), [2.5])
+        self.assertEqual(INDICATOR_CACHE.peek("A", df, entries), [2.5])
+        self.assertEqual(INDICATOR_CACHE.stats(), {"hits": 1, "misses": 1, "hit_rate": 0.5})
+        INDICATOR_CACHE.clear()
+        self.assertEqual(INDICATOR_CACHE.stats(), {"hits": 0, "misses": 0, "hit_rate": 0.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+import numpy as np
+import pandas
+
+import kernels
+from utils import _resample_to_bars
+
+try:
+    import pandas_ta as ta
+except ImportError:  # pandas_ta kräver Python 3.12
+    ta = None
+
+
+def _ticks(seed, n=500):
+    """Ticks over about half an hour with gaps, NaN prices and missing volumes."""
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.integers(10 * 3600, 10 * 3600 + 1800, n))
+    seconds[n // 2:] += 600  # Tio minuter utan ticks
+    prices = 100 + np.cumsum(rng.normal(0, 0.05, n)).round(2)
+    prices[rng.random(n) < 0.05] = np.nan
+    volumes = np.cumsum(rng.integers(1, 100, n)).astype(float)
+    volumes[rng.random(n) < 0.05] = np.nan
+    return pandas.DataFrame({'TIME': pandas.Timestamp('1900-01-01') + pandas.to_timedelta(seconds, unit='s'),
+                             'PRICE': prices, 'CUM_VOLUME': volumes})
+
+
+def _groupby_bars(df):
+    """The pandas implementation `_resample_to_bars` used before the kernel."""
+    ohlcv_df = df.groupby(pandas.Grouper(key='TIME', freq='1min')).agg(
+        OPEN=('PRICE', 'first'), HIGH=('PRICE', 'max'), LOW=('PRICE', 'min'), PRICE=('PRICE', 'last'),
+        CUM_VOLUME=('CUM_VOLUME', 'last'))
+    ohlcv_df['VOLUME'] = ohlcv_df['CUM_VOLUME'].diff().fillna(0)
+    ohlcv_df.drop(columns=['CUM_VOLUME'], inplace=True)
+    return ohlcv_df.ffill()
+
+
+class TestKernels(unittest.TestCase):
+    def test_resample_matches_groupby(self):
+        for seed in range(5):
+            ticks = _ticks(seed)
+            pandas.testing.assert_frame_equal(_resample_to_bars(ticks.copy()), _groupby_bars(ticks.copy()))
+
+    def test_resample_unsorted_and_single_tick(self):
+        # Ticks med samma sekund har ingen given ordning efter sorteringen, så bara unika tider
+        ticks = _ticks(0, n=50).drop_duplicates('TIME').reset_index(drop=True)
+        shuffled = ticks.sample(frac=1, random_state=0)
+        pandas.testing.assert_frame_equal(_resample_to_bars(shuffled.copy()), _groupby_bars(ticks.copy()))
+        one = ticks.iloc[:1].copy()
+        pandas.testing.assert_frame_equal(_resample_to_bars(one.copy()), _groupby_bars(one.copy()))
+
+    @unittest.skipIf(ta is None, "pandas_ta is not installed")
+    def test_tmf_sums_match_pandas_ta(self):
+        rng = np.random.default_rng(2)
+        n = 60
+        close = 50 + np.cumsum(rng.normal(0, 0.2, n))
+        high = close + rng.random(n).round(2)
+        low = close - rng.random(n).round(2)
+        high[10] = low[10]  # pandas_ta lägger då till epsilon på alla
+        volume = rng.integers(0, 1000, n).astype(float)
+        df = pandas.DataFrame({'HIGH': high, 'LOW': low, 'PRICE': close, 'VOLUME': volume})
+
+        for length in (5, 21, 60):
+            ad_sum, volume_sum = kernels.tmf_sums(high, low, close, volume, length)
+            ad = ta.ad(df['HIGH'], df['LOW'], df['PRICE'], df['VOLUME'], talib=False)
+            self.assertAlmostEqual(ad_sum, ad.rolling(length).sum().iloc[-1], delta=1e-9 * abs(ad_sum))
+            self.assertEqual(volume_sum, df['VOLUME'].rolling(length).sum().iloc[-1])
+        self.assertTrue(np.isnan(kernels.tmf_sums(high, low, close, volume, n + 1)[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import random
+import unittest
+
+from leaderboard import TopK, TradeLeaderboard
+
+
+class TestTopK(unittest.TestCase):
+    def test_matches_sorting(self):
+        rng = random.Random(0)
+        values = [rng.uniform(-100, 100) for _ in range(1000)]
+        largest, smallest = TopK(10), TopK(10, largest=False)
+        for i, value in enumerate(values):
+            largest.push(value, ("trade", i))
+            smallest.push(value, ("trade", i))
+        self.assertEqual([values[i] for _, i in largest.items()], sorted(values, reverse=True)[:10])
+        self.assertEqual([values[i] for _, i in smallest.items()], sorted(values)[:10])
+        self.assertEqual(len(largest), 10)
+
+    def test_earlier_items_win_ties(self):
+        top = TopK(2)
+        for name in ["a", "b", "c"]:
+            top.push(1.0, name)
+        self.assertEqual(top.items(), ["a", "b"])
+
+    def test_merge(self):
+        rng = random.Random(1)
+        values = [rng.uniform(-100, 100) for _ in range(300)]
+        parts = [TopK(5, largest=False) for _ in range(3)]
+        for i, value in enumerate(values):
+            parts[i % 3].push(value, value)
+        merged = TopK(5, largest=False)
+        for part in parts:
+            merged.merge(part)
+        self.assertEqual(merged.items(), sorted(values)[:5])
+
+    def test_zero_length(self):
+        top = TopK(0)
+        self.assertFalse(top.push(1.0, "a"))
+        self.assertEqual(top.items(), [])
+
+
+class TestTradeLeaderboard(unittest.TestCase):
+    def test_per_bot_and_ticker(self):
+        board = TradeLeaderboard(2)
+        trades = [("sma", "AAPL", 10.0), ("sma", "MSFT", 30.0), ("rsi", "AAPL", 20.0),
+                  ("sma", "AAPL", -5.0), ("rsi", "MSFT", -15.0), ("sma", "NVDA", 5.0)]
+        for t, (bot, ticker, trade_return) in enumerate(trades):
+            board.add(t, bot, ticker, trade_return)
+
+        self.assertEqual([trade[3] for trade in board.best.items()], [30.0, 20.0])
+        self.assertEqual([trade[3] for trade in board.worst.items()], [-15.0, -5.0])
+        self.assertEqual([trade[3] for trade in board.best_by_bot["sma"].items()], [30.0, 10.0])
+        self.assertEqual([trade[3] for trade in board.best_by_ticker["AAPL"].items()], [20.0, 10.0])
+        self.assertEqual(board.worst_by_bot["sma"].items(), [["sma", "AAPL", 3, -5.0]])
+        self.assertNotIn("NVDA", board.worst_by_ticker)
+
+    def test_merge(self):
+        first, second, both = TradeLeaderboard(3), TradeLeaderboard(3), TradeLeaderboard(3)
+        rng = random.Random(2)
+        for t in range(200):
+            trade = (t, rng.choice(["sma", "rsi", "ema"]), rng.choice(["AAPL", "MSFT"]), rng.uniform(-50, 50))
+            (first if t < 100 else second).add(*trade)
+            both.add(*trade)
+        first.merge(second)
+        self.assertEqual(first.best.items(), both.best.items())
+        self.assertEqual(first.worst.items(), both.worst.items())
+        for bot in ["sma", "rsi", "ema"]:
+            self.assertEqual(first.best_by_bot[bot].items(), both.best_by_bot[bot].items())
+            self.assertEqual(first.worst_by_bot[bot].items(), both.worst_by_bot[bot].items())
+        self.assertEqual(first.best_by_ticker["MSFT"].items(), both.best_by_ticker["MSFT"].items())
+
+
+if __name__ == '__main__':
+    unittest.main()
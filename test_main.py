@@ -60,36 +60,46 @@ class TestMain(unittest.TestCase):
         delta = main.get_time_to_market_close(now)
         self.assertEqual(delta.total_seconds(), 3600)
 
-    @patch('os.path.exists')
-    @patch('builtins.open')
-    @patch('json.load')
-    def test_is_ticker_owned(self, mock_json, mock_open, mock_exists):
+    def test_market_hours_follow_the_clock(self):
+        """Without an explicit time the market checks ask clock, so they work in simulated time."""
+        ny_tz = ZoneInfo("America/New_York")
+        simulated = main.clock.SimulatedClock(datetime.datetime(2023, 1, 23, 15, 50, 0, tzinfo=ny_tz))
+        with main.clock.use_clock(simulated):
+            self.assertTrue(main.us_market_open())
+            self.assertEqual(main.get_time_to_market_close().total_seconds(), 600)
+            simulated.advance(datetime.timedelta(minutes=11))
+            self.assertFalse(main.us_market_open())
+
+    @patch('main.log_portfolio_values')
+    @patch('main.retrieve_data')
+    def test_scheduler_sleeps_on_the_clock(self, mock_retrieve_data, mock_log_values):
+        """The scheduler waits with clock.sleep, so a simulated clock runs it without real waiting."""
+        # Lördag, börsen öppnar aldrig och schemaläggaren ger upp efter 20 försök
+        start = datetime.datetime(2023, 1, 21, 12, 0, 0)
+        simulated = main.clock.SimulatedClock(start)
+        with main.clock.use_clock(simulated), patch('time.sleep') as mock_sleep:
+            main.run_bots_periodically([], interval_seconds=60)
+        mock_sleep.assert_not_called()
+        self.assertGreaterEqual(simulated.now() - start, datetime.timedelta(minutes=40))
+        self.assertEqual(simulated.now().second, 0)
+
+    @patch('main.ha')
+    def test_is_ticker_owned(self, mock_ha):
         """Test checking if a ticker is owned by any bot."""
-        mock_exists.return_value = True
-        # Mock portfolio: AAPL is owned (10), MSFT is 0 (not really owned)
-        mock_json.return_value = {"aktier": {"AAPL": 10, "MSFT": 0}}
-        
-        # Inject a mock bot into main.bots
-        # main.bots is usually populated in __main__, so it's empty on import
-        Bot = MagicMock()
-        Bot.bot_name = "test_bot"
-        main.bots = [Bot]
-        
+        # Ownership index: only AAPL is owned by anyone
+        mock_ha.PORTFOLIOS.is_owned.side_effect = lambda ticker: ticker == "AAPL"
+
         self.assertTrue(main.is_ticker_owned("AAPL"))
-        self.assertFalse(main.is_ticker_owned("MSFT")) # Amount is 0
-        self.assertFalse(main.is_ticker_owned("GOOG")) # Not in dict
+        self.assertFalse(main.is_ticker_owned("MSFT"))
+        mock_ha.PORTFOLIOS.get.assert_not_called() # No portfolio is read
 
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_get_all_owned_tickers(self, mock_json_load, mock_open, mock_exists):
+    @patch('main.ha')
+    def test_get_all_owned_tickers(self, mock_ha):
         """Test retrieving all unique tickers owned across multiple bots."""
-        mock_exists.return_value = True
-
         # Mock portfolios for two bots
-        mock_json_load.side_effect = [
-            {"fria_pengar": 1000, "aktier": {"AAPL": 5, "GOOG": 2}},
-            {"fria_pengar": 2000, "aktier": {"MSFT": 3, "AAPL": 0}} # AAPL amount is 0 here
+        mock_ha.PORTFOLIOS.owned_by.side_effect = [
+            {"AAPL": 5, "GOOG": 2},
+            {"MSFT": 3}
         ]
 
         # Setup mock bots
@@ -101,15 +111,12 @@ class TestMain(unittest.TestCase):
 
         owned = main.get_all_owned_tickers(bots)
         self.assertEqual(owned, {"AAPL", "GOOG", "MSFT"})
-        self.assertEqual(mock_open.call_count, 2) # Called once for each bot
+        self.assertEqual(mock_ha.PORTFOLIOS.owned_by.call_count, 2) # Called once for each bot
 
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_get_bot_owned_tickers(self, mock_json_load, mock_open, mock_exists):
+    @patch('main.ha')
+    def test_get_bot_owned_tickers(self, mock_ha):
         """Test retrieving tickers owned by a single bot."""
-        mock_exists.return_value = True
-        mock_json_load.return_value = {"fria_pengar": 1000, "aktier": {"AAPL": 5, "MSFT": 0, "GOOG": 2}}
+        mock_ha.PORTFOLIOS.owned_by.return_value = {"AAPL": 5, "GOOG": 2}
 
         mock_bot = MagicMock()
         mock_bot.bot_name = "test_bot"
@@ -119,14 +126,10 @@ class TestMain(unittest.TestCase):
 
     @patch('main.get_time_to_market_close')
     @patch('main.ha')
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_trade_suggestions_buy(self, mock_json_load, mock_open, mock_exists, mock_ha, mock_time_close):
+    def test_trade_suggestions_buy(self, mock_ha, mock_time_close):
         """Test executing a BUY suggestion."""
-        mock_exists.return_value = True
         # Portfolio has money
-        mock_json_load.return_value = {"fria_pengar": 10000, "aktier": {}}
+        mock_ha.load_portfolio.return_value = {"fria_pengar": 10000, "aktier": {}}
         
         # Mock time to close > 10 mins
         mock_time_close.return_value = datetime.timedelta(minutes=30)
@@ -156,14 +159,10 @@ class TestMain(unittest.TestCase):
         mock_ha.utför_flera_transaktioner.assert_called_with("test_bot", expected_transactions)
 
     @patch('main.ha')
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_trade_suggestions_sell(self, mock_json_load, mock_open, mock_exists, mock_ha):
+    def test_trade_suggestions_sell(self, mock_ha):
         """Test executing a SELL suggestion."""
-        mock_exists.return_value = True
         # Portfolio has shares
-        mock_json_load.return_value = {"fria_pengar": 1000, "aktier": {"AAPL": 5}}
+        mock_ha.load_portfolio.return_value = {"fria_pengar": 1000, "aktier": {"AAPL": 5}}
         
         # Setup price data
         main.price_data = {}
@@ -187,14 +186,10 @@ class TestMain(unittest.TestCase):
 
     @patch('main.get_time_to_market_close')
     @patch('main.ha')
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_trade_suggestions_buy_insufficient_funds(self, mock_json_load, mock_open, mock_exists, mock_ha, mock_time_close):
+    def test_trade_suggestions_buy_insufficient_funds(self, mock_ha, mock_time_close):
         """Test BUY suggestion with insufficient funds."""
-        mock_exists.return_value = True
         # Portfolio has little money
-        mock_json_load.return_value = {"fria_pengar": 500, "aktier": {}}
+        mock_ha.load_portfolio.return_value = {"fria_pengar": 500, "aktier": {}}
         
         mock_time_close.return_value = datetime.timedelta(minutes=30)
         
@@ -216,13 +211,9 @@ class TestMain(unittest.TestCase):
 
     @patch('main.get_time_to_market_close')
     @patch('main.ha')
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_trade_suggestions_buy_already_owned(self, mock_json_load, mock_open, mock_exists, mock_ha, mock_time_close):
+    def test_trade_suggestions_buy_already_owned(self, mock_ha, mock_time_close):
         """Test BUY suggestion for already owned ticker (allow_add=False)."""
-        mock_exists.return_value = True
-        mock_json_load.return_value = {"fria_pengar": 10000, "aktier": {"AAPL": 5}}
+        mock_ha.load_portfolio.return_value = {"fria_pengar": 10000, "aktier": {"AAPL": 5}}
         
         mock_time_close.return_value = datetime.timedelta(minutes=30)
         
@@ -244,13 +235,9 @@ class TestMain(unittest.TestCase):
 
     @patch('main.get_time_to_market_close')
     @patch('main.ha')
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_trade_suggestions_buy_market_closing(self, mock_json_load, mock_open, mock_exists, mock_ha, mock_time_close):
+    def test_trade_suggestions_buy_market_closing(self, mock_ha, mock_time_close):
         """Test BUY suggestion when market is closing soon."""
-        mock_exists.return_value = True
-        mock_json_load.return_value = {"fria_pengar": 10000, "aktier": {}}
+        mock_ha.load_portfolio.return_value = {"fria_pengar": 10000, "aktier": {}}
         
         # Market closing in 5 minutes (<10)
         mock_time_close.return_value = datetime.timedelta(minutes=5)
@@ -272,13 +259,9 @@ class TestMain(unittest.TestCase):
         mock_ha.utför_flera_transaktioner.assert_not_called()
 
     @patch('main.ha')
-    @patch('os.path.exists')
-    @patch('builtins.open', new_callable=MagicMock)
-    @patch('json.load')
-    def test_trade_suggestions_sell_not_owned(self, mock_json_load, mock_open, mock_exists, mock_ha):
+    def test_trade_suggestions_sell_not_owned(self, mock_ha):
         """Test SELL suggestion for unowned ticker."""
-        mock_exists.return_value = True
-        mock_json_load.return_value = {"fria_pengar": 1000, "aktier": {}}
+        mock_ha.load_portfolio.return_value = {"fria_pengar": 1000, "aktier": {}}
         
         main.price_data = {}
         mock_df = MagicMock()
@@ -295,6 +278,60 @@ class TestMain(unittest.TestCase):
         # Should not call due to not owned
         mock_ha.utför_flera_transaktioner.assert_not_called()
 
+    @patch('main.trade_suggestions')
+    def test_run_bot_on_batch_data(self, mock_trade):
+        """run_bot uses the data it is given instead of all of price_data."""
+        main.price_data = {"AAPL": "alla", "MSFT": "alla"}
+        batch_data = {"MSFT": "stängd stapel"}
+        mock_bot = MagicMock()
+        mock_bot.bot_name = "test_bot"
+        mock_bot.find_options = lambda price_data: {t: "BUY" for t in price_data}
+
+        self.assertEqual(main.run_bot(mock_bot, batch_data), ("test_bot", {"MSFT": "BUY"}))
+        self.assertEqual(main.run_bot(mock_bot)[1], {"AAPL": "BUY", "MSFT": "BUY"})
+        mock_trade.assert_called_with(mock_bot, {"AAPL": "BUY", "MSFT": "BUY"})
+
+    @patch('main.trade_suggestions')
+    def test_run_bots_with_family(self, mock_trade):
+        """A BotFamily is run once and every variant trades its own suggestions."""
+        variants = [MagicMock(), MagicMock()]
+        variants[0].bot_name, variants[1].bot_name = "sma_family_5_21", "sma_family_9_21"
+        family = MagicMock(spec=main.BotFamily)
+        family.bot_name = "sma_family"
+        family.members = variants
+        family.find_options.return_value = {"sma_family_5_21": {"MSFT": "BUY"}, "sma_family_9_21": {}}
+        bot = MagicMock()
+        bot.bot_name = "test_bot"
+        bot.find_options = lambda price_data: {"AAPL": "SELL"}
+
+        suggestions = main.run_bots([family, bot], {"AAPL": "data", "MSFT": "data"})
+        self.assertEqual(suggestions, {"sma_family_5_21": {"MSFT": "BUY"}, "sma_family_9_21": {}, "test_bot": {"AAPL": "SELL"}})
+        family.find_options.assert_called_once()
+        mock_trade.assert_any_call(variants[0], {"MSFT": "BUY"})
+        mock_trade.assert_any_call(variants[1], {})
+        self.assertEqual(main.portfolio_bots([family, bot]), [*variants, bot])
+
+    @patch('main.trade_suggestions')
+    def test_run_bots_with_timeframes(self, mock_trade):
+        """Bots with a longer timeframe are run on those bars instead of the 1-minute bars."""
+        def make_bot(name, timeframe):
+            bot = MagicMock()
+            bot.bot_name = name
+            bot.timeframe = timeframe
+            bot.find_options = lambda price_data: {t: df for t, df in price_data.items()}
+            return bot
+
+        suggestions = main.run_bots([make_bot("fast", 1), make_bot("slow", 15)], {"AAPL": "1m"},
+                                    timeframes={15: {"AAPL": "15m"}})
+        self.assertEqual(suggestions, {"fast": {"AAPL": "1m"}, "slow": {"AAPL": "15m"}})
+
+    @patch('main.retrieve_data')
+    def test_retrieve_timeframes(self, mock_retrieve_data):
+        bots = [MagicMock(timeframe=1), MagicMock(timeframe=15, required_period=20),
+                MagicMock(timeframe=15, required_period=8), MagicMock(timeframe=60, required_period=5)]
+        mock_retrieve_data.side_effect = lambda tickers, length, timeframe: (length, timeframe)
+        self.assertEqual(main.retrieve_timeframes(bots, ["AAPL"]), {15: (20, 15), 60: (5, 60)})
+
     @patch.object(inspect, 'signature')
     @patch('main.price_data')
     def test_run_bot_insufficient_data(self, mock_price_data, mock_signature):
@@ -0,0 +1,165 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from portfolio_store import PortfolioStore, JOURNAL_SUFFIX
+
+
+class TestPortfolioStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.directory = self.temp_dir.name
+        print_patcher = patch('portfolio_store.thread_safe_print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def _read_json(self, bot_name="bot"):
+        with open(os.path.join(self.directory, bot_name + ".json")) as f:
+            return json.load(f)
+
+    def _journal_lines(self, bot_name="bot"):
+        with open(os.path.join(self.directory, bot_name + JOURNAL_SUFFIX)) as f:
+            return f.readlines()
+
+    def _buy(self, store, ticker, amount, price, bot_name="bot"):
+        with store.edit(bot_name) as portfolio:
+            portfolio['fria_pengar'] -= amount * price
+            portfolio['aktier'][ticker] = portfolio['aktier'].get(ticker, 0) + amount
+
+    def test_create_and_get(self):
+        store = PortfolioStore(self.directory)
+        self.assertFalse(store.exists("bot"))
+        self.assertIsNone(store.get("bot"))
+        store.create("bot", 1000)
+        self.assertTrue(store.exists("bot"))
+        self.assertEqual(self._read_json(), {"fria_pengar": 1000, "aktier": {}})
+        # get ger en kopia, den får inte ändra portföljen
+        store.get("bot")['aktier']['AAPL'] = 5
+        self.assertEqual(store.get("bot")['aktier'], {})
+
+    def test_edits_are_journaled_not_snapshotted(self):
+        store = PortfolioStore(self.directory, snapshot_every=100)
+        store.create("bot", 1000)
+        self._buy(store, "AAPL", 2, 100)
+        with store.edit("bot") as portfolio:
+            del portfolio['aktier']['AAPL']
+        self.assertEqual(self._read_json(), {"fria_pengar": 1000, "aktier": {}})
+        self.assertEqual([json.loads(line) for line in self._journal_lines()],
+                         [{"fria_pengar": 800, "aktier": {"AAPL": 2}}, {"aktier": {"AAPL": None}}])
+
+    def test_recovers_from_journal_after_crash(self):
+        store = PortfolioStore(self.directory)
+        store.create("bot", 1000)
+        self._buy(store, "AAPL", 2, 100)
+        self._buy(store, "MSFT", 1, 50)
+        # Ingen close(), som om programmet kraschade
+        recovered = PortfolioStore(self.directory)
+        self.assertEqual(recovered.get("bot"), {"fria_pengar": 750, "aktier": {"AAPL": 2, "MSFT": 1}})
+        # Återställningen skriver en ny snapshot och tömmer journalen
+        self.assertEqual(self._read_json(), recovered.get("bot"))
+        self.assertEqual(self._journal_lines(), [])
+
+    def test_replay_over_newer_snapshot_is_harmless(self):
+        """A crash between writing the snapshot and emptying the journal must not apply trades twice."""
+        store = PortfolioStore(self.directory)
+        store.create("bot", 1000)
+        self._buy(store, "AAPL", 2, 100)
+        journal = self._journal_lines()
+        store.close()
+        with open(os.path.join(self.directory, "bot" + JOURNAL_SUFFIX), 'w') as f:
+            f.writelines(journal)
+        self.assertEqual(PortfolioStore(self.directory).get("bot"), {"fria_pengar": 800, "aktier": {"AAPL": 2}})
+
+    def test_torn_last_line_is_ignored(self):
+        store = PortfolioStore(self.directory)
+        store.create("bot", 1000)
+        self._buy(store, "AAPL", 2, 100)
+        with open(os.path.join(self.directory, "bot" + JOURNAL_SUFFIX), 'a') as f:
+            f.write('{"fria_pengar": 1')
+        self.assertEqual(PortfolioStore(self.directory).get("bot"), {"fria_pengar": 800, "aktier": {"AAPL": 2}})
+
+    def test_snapshot_every(self):
+        store = PortfolioStore(self.directory, snapshot_every=3)
+        store.create("bot", 1000)
+        for _ in range(3):
+            self._buy(store, "AAPL", 1, 10)
+        self.assertEqual(self._read_json(), {"fria_pengar": 970, "aktier": {"AAPL": 3}})
+        self.assertEqual(self._journal_lines(), [])
+        self._buy(store, "AAPL", 1, 10)
+        self.assertEqual(len(self._journal_lines()), 1)
+
+    def test_exception_rolls_back(self):
+        store = PortfolioStore(self.directory)
+        store.create("bot", 1000)
+        with self.assertRaises(RuntimeError):
+            with store.edit("bot") as portfolio:
+                portfolio['fria_pengar'] -= 500
+                portfolio['aktier']['AAPL'] = 5
+                raise RuntimeError
+        self.assertEqual(store.get("bot"), {"fria_pengar": 1000, "aktier": {}})
+
+    def test_edit_missing_portfolio(self):
+        store = PortfolioStore(self.directory)
+        with store.edit("bot") as portfolio:
+            self.assertIsNone(portfolio)
+
+    def test_concurrent_edits_do_not_lose_updates(self):
+        store = PortfolioStore(self.directory, snapshot_every=50)
+        store.create("bot", 10_000)
+
+        def worker():
+            for _ in range(200):
+                self._buy(store, "AAPL", 1, 1)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.get("bot"), {"fria_pengar": 9200, "aktier": {"AAPL": 800}})
+        self.assertEqual(PortfolioStore(self.directory).get("bot"), store.get("bot"))
+
+    def test_ownership_index(self):
+        store = PortfolioStore(self.directory)
+        store.create("a", 1000)
+        store.create("b", 1000)
+        self._buy(store, "AAPL", 2, 10, bot_name="a")
+        self._buy(store, "AAPL", 3, 10, bot_name="b")
+        self._buy(store, "MSFT", 1, 10, bot_name="b")
+        self.assertEqual(store.owners("AAPL"), {"a": 2, "b": 3})
+        self.assertEqual(store.owned_by("b"), {"AAPL": 3, "MSFT": 1})
+
+        with store.edit("b") as portfolio:
+            del portfolio['aktier']['MSFT']
+        self.assertFalse(store.is_owned("MSFT"))
+        with store.edit("a") as portfolio:
+            portfolio['aktier']['AAPL'] = 0
+        self.assertEqual(store.owners("AAPL"), {"b": 3})
+        self.assertEqual(store.owned_by("a"), {})
+        self.assertEqual(store.owned_by("missing"), {})
+
+    def test_ownership_index_after_load(self):
+        with open(os.path.join(self.directory, "a.json"), 'w') as f:
+            json.dump({"fria_pengar": 0, "aktier": {"AAPL": 4, "GOOG": 0}}, f)
+        store = PortfolioStore(self.directory)
+        self.assertFalse(store.is_owned("AAPL"))
+        store.load(["a", "missing"])
+        self.assertEqual(store.owners("AAPL"), {"a": 4})
+        self.assertFalse(store.is_owned("GOOG"))
+
+    def test_rolled_back_edit_does_not_touch_index(self):
+        store = PortfolioStore(self.directory)
+        store.create("a", 1000)
+        with self.assertRaises(RuntimeError):
+            with store.edit("a") as portfolio:
+                portfolio['aktier']['AAPL'] = 5
+                raise RuntimeError
+        self.assertFalse(store.is_owned("AAPL"))
+
+
+if __name__ == '__main__':
+    unittest.main()
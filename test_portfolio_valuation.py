@@ -0,0 +1,74 @@
+import csv
+import datetime as dt
+import os
+import tempfile
+import unittest
+
+from portfolio_valuation import PortfolioValueLog, holdings_matrix, value_portfolios
+
+
+class TestValuation(unittest.TestCase):
+    def test_holdings_matrix(self):
+        bot_names, tickers, cash, holdings = holdings_matrix({
+            "a": {"fria_pengar": 100, "aktier": {"MSFT": 2}},
+            "b": {"fria_pengar": 50, "aktier": {"AAPL": 1, "MSFT": 3}},
+        })
+        self.assertEqual(bot_names, ["a", "b"])
+        self.assertEqual(tickers, ["AAPL", "MSFT"])
+        self.assertEqual(cash.tolist(), [100, 50])
+        self.assertEqual(holdings.tolist(), [[0, 2], [1, 3]])
+
+    def test_value_portfolios(self):
+        portfolios = {
+            "a": {"fria_pengar": 100, "aktier": {"MSFT": 2}},
+            "b": {"fria_pengar": 50, "aktier": {"AAPL": 1, "MSFT": 3}},
+            "empty": {"fria_pengar": 1000, "aktier": {}},
+        }
+        values = value_portfolios(portfolios, {"AAPL": 10.0, "MSFT": 20.0})
+        self.assertEqual(values, {"a": 140.0, "b": 120.0, "empty": 1000.0})
+
+    def test_missing_price_gives_none(self):
+        portfolios = {
+            "a": {"fria_pengar": 100, "aktier": {"MSFT": 2}},
+            "b": {"fria_pengar": 50, "aktier": {"AAPL": 1}},
+        }
+        self.assertEqual(value_portfolios(portfolios, {"AAPL": 10.0}), {"a": None, "b": 60.0})
+
+    def test_no_portfolios(self):
+        self.assertEqual(value_portfolios({}, {}), {})
+
+
+class TestPortfolioValueLog(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.log = PortfolioValueLog(self.temp_dir.name)
+        self.addCleanup(self.log.close)
+
+    def _rows(self, date):
+        with open(os.path.join(self.temp_dir.name, f"portfolio-logg-{date}.csv"), newline="") as f:
+            return list(csv.reader(f))
+
+    def test_rows_are_appended_with_one_header(self):
+        first = dt.datetime(2024, 5, 2, 15, 30)
+        self.log.write_values({"a": 1.5, "b": 2.0}, first)
+        self.log.write_values({"a": 3.0}, first + dt.timedelta(minutes=1))
+        self.assertEqual(self._rows("2024-05-02"), [
+            ["TIMESTAMP", "BOT", "VALUE"],
+            ["2024-05-02 15:30:00.000000", "a", "1.5"], ["2024-05-02 15:30:00.000000", "b", "2.0"],
+            ["2024-05-02 15:31:00.000000", "a", "3.0"]])
+
+        # Loggen fortsätter i samma fil om programmet startas om
+        self.log.close()
+        PortfolioValueLog(self.temp_dir.name).write_values({"b": 4.0}, first)
+        self.assertEqual(len(self._rows("2024-05-02")), 5)
+
+    def test_new_day_gives_new_file(self):
+        self.log.write_values({"a": 1.0}, dt.datetime(2024, 5, 2, 15, 59))
+        self.log.write_values({"a": 2.0}, dt.datetime(2024, 5, 3, 9, 30))
+        self.assertEqual(len(self._rows("2024-05-02")), 2)
+        self.assertEqual(self._rows("2024-05-03")[1][2], "2.0")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from price_cache import LastPriceCache, TickerValidityCache
+
+
+class TestLastPriceCache(unittest.TestCase):
+    def test_update_and_get(self):
+        cache = LastPriceCache()
+        self.assertIsNone(cache.get("AAPL"))
+        cache.update("AAPL", 150.5, 1000)
+        cache.update("AAPL", 151, 2000)
+        self.assertEqual(cache.get("AAPL"), 151.0)
+        self.assertEqual(cache.get_time("AAPL"), 2000)
+        self.assertIn("AAPL", cache)
+
+    def test_missing_price_is_ignored(self):
+        cache = LastPriceCache()
+        cache.update("AAPL", 150, 1000)
+        cache.update("AAPL", None, 2000)
+        cache.update("AAPL", float('nan'), 3000)
+        self.assertEqual(cache.get("AAPL"), 150.0)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class TestTickerValidityCache(unittest.TestCase):
+    def test_ttl(self):
+        now = [0.0]
+        cache = TickerValidityCache(ttl=60, clock=lambda: now[0])
+        self.assertIsNone(cache.is_valid("AAPL"))
+        cache.set("AAPL", True)
+        cache.set("BAD", False)
+        now[0] = 59
+        self.assertTrue(cache.is_valid("AAPL"))
+        self.assertFalse(cache.is_valid("BAD"))
+        now[0] = 61
+        self.assertIsNone(cache.is_valid("AAPL"))
+        self.assertIsNone(cache.is_valid("BAD"))
+
+
+if __name__ == '__main__':
+    unittest.main()
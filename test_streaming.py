@@ -0,0 +1,158 @@
+import unittest
+
+import numpy as np
+
+import streaming
+from test_helpers import random_bars
+
+try:
+    import pandas_ta as ta
+    from pandas_ta import hlc3, sma, mad
+except ImportError:  # pandas_ta kräver Python 3.12
+    ta = None
+
+
+def _run(indicator, *columns):
+    """Feeds every row with `update` and checks that `peek` gives the same value first (unless it holds back a short history)."""
+    values = []
+    for row in zip(*columns):
+        peeked = indicator.peek(*row)
+        value = indicator.update(*row)
+        if peeked is not None and peeked != (None, None):
+            np.testing.assert_array_equal(np.array(peeked, dtype=float), np.array(value, dtype=float))
+        values.append(value)
+    return values
+
+
+def _series(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+@unittest.skipIf(ta is None, "pandas_ta is not installed")
+class TestStreamingParity(unittest.TestCase):
+    """Fed bar by bar from the start, the indicators should match pandas_ta on the whole series."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = random_bars(0, ["T"], 150, flat=slice(40, 55))["T"]  # Platt period, som när minuter saknar ticks
+        cls.close = cls.df['PRICE'].tolist()
+
+    def assertMatches(self, values, expected, exact=False):
+        if exact:
+            np.testing.assert_array_equal(_series(values), expected.to_numpy())
+        else:
+            np.testing.assert_allclose(_series(values), expected.to_numpy(), rtol=1e-9, atol=1e-9, equal_nan=True)
+
+    def test_sma(self):
+        self.assertMatches(_run(streaming.SMA(9), self.close), ta.sma(self.df['PRICE'], 9))
+
+    def test_ema(self):
+        self.assertMatches(_run(streaming.EMA(21), self.close), ta.ema(self.df['PRICE'], 21), exact=True)
+
+    def test_rsi(self):
+        expected = ta.rsi(self.df['PRICE'], 7)
+        # pandas_ta ger None för serier kortare än length + 1, så de första värdena används inte
+        expected.iloc[:7] = np.nan
+        self.assertMatches(_run(streaming.RSI(7), self.close), expected, exact=True)
+
+    def test_macd(self):
+        values = _run(streaming.MACD(5, 35, 5), self.close)
+        expected = ta.macd(self.df['PRICE'], 5, 35, 5)
+        self.assertMatches([v[0] for v in values], expected['MACD_5_35_5'], exact=True)
+        self.assertMatches([v[1] for v in values], expected['MACDs_5_35_5'], exact=True)
+
+    def test_rolling_extremes(self):
+        highest = _run(streaming.RollingExtreme(5), self.close)
+        lowest = _run(streaming.RollingExtreme(5, lowest=True), self.close)
+        self.assertMatches(highest, self.df['PRICE'].rolling(5).max(), exact=True)
+        self.assertMatches(lowest, self.df['PRICE'].rolling(5).min(), exact=True)
+
+    def test_stoch(self):
+        df = self.df
+        values = _run(streaming.Stoch(5, 3, 3), df['HIGH'], df['LOW'], df['PRICE'])
+        expected = ta.stoch(df['HIGH'], df['LOW'], df['PRICE'], k=5, d=3, smooth_k=3)
+        self.assertMatches([v[0] for v in values], expected['STOCHk_5_3_3'])
+        self.assertMatches([v[1] for v in values], expected['STOCHd_5_3_3'])
+
+    def test_cci(self):
+        df = self.df
+        typical_price = hlc3(high=df['HIGH'], low=df['LOW'], close=df['PRICE'], talib=False)
+        expected = (typical_price - sma(typical_price, length=14, talib=False)) / (0.015 * mad(typical_price, length=14))
+        values = _run(streaming.CCI(14), df['HIGH'], df['LOW'], df['PRICE'])
+        self.assertMatches(values, expected)
+
+    def test_obv(self):
+        values = _run(streaming.OBV(), self.close, self.df['VOLUME'])
+        self.assertMatches(values, ta.obv(self.df['PRICE'], self.df['VOLUME']), exact=True)
+
+
+class TestStreaming(unittest.TestCase):
+    def test_short_history_gives_none(self):
+        rsi = streaming.RSI(7)
+        self.assertEqual(_run(rsi, [1., 2., 3.]), [None, None, None])
+        self.assertIsNone(streaming.EMA(3).peek(1.))
+        # pandas_ta.macd(close, 3, 8, 3) ger None för färre än 10 priser, fast MACD-linjen finns från det åttonde
+        macd = streaming.MACD(3, 8, 3)
+        for price in range(8):
+            macd.update(float(price))
+        self.assertEqual(macd.peek(8.), (None, None))
+        macd.update(8.)
+        self.assertIsNotNone(macd.peek(9.)[1])
+
+    def test_sma_running_sum_does_not_drift(self):
+        sma_state = streaming.SMA(10)
+        for x in np.random.default_rng(1).normal(1e6, 1000, 10_000):
+            sma_state.update(float(x))
+        self.assertAlmostEqual(sma_state.value, np.mean(list(sma_state.values)), places=6)
+
+    def test_crossings(self):
+        crossings = streaming.Crossings()
+        for time, (a, b) in enumerate([(1, 2), (3, 2), (2, 2), (1, 2), (0, 2), (3, 2)]):
+            crossings.update(time, a, b)
+        # 3 -> 2 -> 1 passes through 0 and is not a crossover, like find_intersects
+        self.assertEqual(crossings.last, (5, 'over'))
+        self.assertEqual(crossings.peek(6, 1, 2), (6, 'under'))
+        self.assertEqual(crossings.last, (5, 'over'))
+
+    def test_advance_only_feeds_new_bars(self):
+        df = random_bars(0, ["T"], 60)["T"]
+        fed = []
+        streams = {}
+
+        def update(indicators, time, price):
+            fed.append(time)
+            indicators.update(price)
+
+        streaming.advance(streams, 'T', df.iloc[:30], lambda: streaming.SMA(5), update)
+        self.assertEqual(len(fed), 29)  # Den sista stapeln kan fortfarande bildas
+        # Nästa minut har fönstret flyttats fram, bara den nu färdiga stapeln ska matas in
+        streaming.advance(streams, 'T', df.iloc[1:31], lambda: streaming.SMA(5), update)
+        self.assertEqual(fed[-1], df.index[29])
+        self.assertEqual(len(fed), 30)
+        self.assertEqual(streams['T'].indicators.value, df['PRICE'].iloc[25:30].mean())
+
+    def test_advance_resets_when_bars_are_missing(self):
+        df = random_bars(0, ["T"], 60)["T"]
+        streams = {}
+        streaming.advance(streams, 'T', df.iloc[:10], lambda: streaming.SMA(5), lambda s, time, p: s.update(p))
+        first = streams['T']
+        # Fönstret hänger inte ihop med det förra (t.ex. en ny dag), börja om
+        streaming.advance(streams, 'T', df.iloc[20:40], lambda: streaming.SMA(5), lambda s, time, p: s.update(p))
+        self.assertIsNot(streams['T'], first)
+        self.assertEqual(streams['T'].last_time, df.index[38].value)
+
+    def test_sliding_window_matches_full_history(self):
+        """A bot that only ever sees a 20 bar window should get the same EMA as one fed the whole day."""
+        df = random_bars(0, ["T"], 120)["T"]
+        streams = {}
+        for end in range(20, len(df) + 1):
+            stream, _ = streaming.advance(streams, 'T', df.iloc[end - 20:end], lambda: streaming.EMA(9),
+                                       lambda ema, time, p: ema.update(p))
+        full = streaming.EMA(9)
+        for p in df['PRICE'].iloc[:-1]:
+            full.update(p)
+        self.assertEqual(stream.indicators.value, full.value)
+
+
+if __name__ == '__main__':
+    unittest.main()
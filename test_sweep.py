@@ -0,0 +1,70 @@
+import datetime as dt
+import unittest
+
+import numpy as np
+
+from backtest import Backtest
+from mäklare.sma import SMABot
+from sweep import parameter_grid, run_sweep
+from test_helpers import random_bars
+
+DAYS = [(dt.date(2026, 1, 14), random_bars(0)), (dt.date(2026, 1, 15), random_bars(1))]
+
+
+class PickyBot(SMABot):
+    """Refuses one of the combinations, like a bot with invalid parameters."""
+
+    def find_options(self, price_data=None):
+        if self.short_period == 4:
+            raise ValueError("ogiltig period")
+        return super().find_options(price_data)
+
+
+class TestSweep(unittest.TestCase):
+    def test_parameter_grid(self):
+        grid = {"short_period": [3, 5, 9], "long_period": [5, 21]}
+        self.assertEqual(len(parameter_grid(grid)), 6)
+        self.assertEqual(parameter_grid(grid, where=lambda p: p["short_period"] < p["long_period"]),
+                         [{"short_period": 3, "long_period": 5}, {"short_period": 3, "long_period": 21},
+                          {"short_period": 5, "long_period": 21}, {"short_period": 9, "long_period": 21}])
+
+    def test_matches_single_backtests(self):
+        grid = {"short_period": [2, 3, 5], "long_period": [8, 13]}
+        table = run_sweep(SMABot, grid, DAYS, fixed={"risk": 0.5}, processes=2, chunk_size=4)
+
+        self.assertEqual(len(table), 6)
+        self.assertEqual(list(table.index), list(range(1, 7)))
+        self.assertTrue(table["total_return"].is_monotonic_decreasing)
+        self.assertTrue(table["error"].isna().all())
+
+        for _, row in table.iterrows():
+            returns = []
+            trades = 0
+            for date, bars in DAYS:
+                bot = SMABot("bot", list(bars), risk=0.5, short_period=row["short_period"],
+                             long_period=row["long_period"])
+                backtest = Backtest([bot], bars, date)
+                returns.append(backtest.run()["bot"] / 100_000 - 1)
+                trades += len(backtest.broker.trades)
+            self.assertAlmostEqual(row["total_return"], (1 + returns[0]) * (1 + returns[1]) - 1)
+            self.assertAlmostEqual(row["worst_day"], min(returns))
+            self.assertEqual(row["trades"], trades)
+        self.assertGreater(table["trades"].sum(), 0)
+
+    def test_failing_combination_gets_an_error(self):
+        table = run_sweep(PickyBot, {"short_period": [2, 3, 4], "long_period": [8]}, DAYS, processes=1)
+        failed = table[table["error"].notna()]
+        self.assertEqual(list(failed["short_period"]), [4])
+        self.assertIn("ogiltig period", failed["error"].iloc[0])
+        self.assertTrue(np.isnan(failed["total_return"].iloc[0]))
+        self.assertEqual(table.index[-1], failed.index[0])  # Misslyckade kombinationer hamnar sist
+        self.assertTrue(table["total_return"].iloc[:2].notna().all())
+
+    def test_empty_grid(self):
+        table = run_sweep(SMABot, [], DAYS)
+        self.assertEqual(len(table), 0)
+        self.assertIn("total_return", table.columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
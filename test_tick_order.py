@@ -0,0 +1,92 @@
+import unittest
+from unittest.mock import patch
+
+from tick_order import TickOrderer
+
+
+def _tick(time_ms, price=1.0, day_volume=100, ticker="AAPL"):
+    # yfinance ger int64-fälten som strängar
+    return {"id": ticker, "time": str(time_ms), "price": price, "day_volume": str(day_volume), "market_hours": 1}
+
+
+def _times(ticks):
+    return [int(tick["time"]) for tick in ticks]
+
+
+class TestTickOrderer(unittest.TestCase):
+    def test_releases_in_time_order_after_watermark(self):
+        orderer = TickOrderer(watermark_ms=1000)
+        released = []
+        for t in [1000, 1500, 1200, 2100, 1900, 3000]:
+            released.extend(orderer.push(_tick(t)))
+        self.assertEqual(_times(released), [1000, 1200, 1500, 1900])
+        self.assertEqual(len(orderer), 2)
+        self.assertEqual(_times(orderer.flush()), [2100, 3000])
+        self.assertEqual(len(orderer), 0)
+
+    def test_drops_exact_duplicates(self):
+        orderer = TickOrderer(watermark_ms=0)
+        released = []
+        for tick in [_tick(1000, 10.0, 5), _tick(1000, 10.0, 5), _tick(1000, 10.5, 6), _tick(1000, 10.0, 5)]:
+            released.extend(orderer.push(tick))
+        self.assertEqual([(tick["price"], tick["day_volume"]) for tick in released], [(10.0, "5"), (10.5, "6")])
+        self.assertEqual(orderer.stats["duplicates"], 2)
+
+    def test_drops_ticks_behind_the_watermark(self):
+        orderer = TickOrderer(watermark_ms=500)
+        orderer.push(_tick(1000))
+        released = orderer.push(_tick(2000))
+        self.assertEqual(_times(released), [1000])
+        # 800 har redan passerats av vattenmärket och skulle hamna i fel ordning i filen
+        self.assertEqual(orderer.push(_tick(800, 2.0)), [])
+        self.assertEqual(orderer.stats["late"], 1)
+        # Men en sen tick inom vattenmärket sorteras in
+        orderer.push(_tick(1800, 3.0))
+        self.assertEqual(_times(orderer.flush()), [1800, 2000])
+
+    def test_same_time_keeps_arrival_order(self):
+        orderer = TickOrderer(watermark_ms=10)
+        for price in [1.0, 2.0, 3.0]:
+            orderer.push(_tick(1000, price))
+        self.assertEqual([tick["price"] for tick in orderer.flush()], [1.0, 2.0, 3.0])
+
+    def test_flags_decreasing_day_volume(self):
+        orderer = TickOrderer(watermark_ms=0)
+        released = []
+        with patch("tick_order.logging.warning") as mock_warning:
+            for t, volume in [(1000, 100), (2000, 90), (3000, 120)]:
+                released.extend(orderer.push(_tick(t, day_volume=volume)))
+        self.assertEqual([int(tick["day_volume"]) for tick in released], [100, 100, 120])
+        self.assertEqual(orderer.stats["volume_decreases"], 1)
+        mock_warning.assert_called_once()
+
+    def test_release_expired_for_quiet_tickers(self):
+        orderer = TickOrderer(watermark_ms=1000)
+        orderer.push(_tick(5000, ticker="AAPL"), now=100.0)
+        orderer.push(_tick(5200, ticker="AAPL"), now=100.2)
+        orderer.push(_tick(1000, ticker="MSFT"), now=100.5)
+        self.assertEqual(orderer.release_expired(now=101.1), [])
+        self.assertEqual(_times(orderer.release_expired(now=101.2)), [5000, 5200])
+        self.assertEqual([tick["id"] for tick in orderer.release_expired(now=101.5)], ["MSFT"])
+
+    def test_tickers_are_independent(self):
+        orderer = TickOrderer(watermark_ms=100)
+        orderer.push(_tick(5000, ticker="AAPL"))
+        # En sen tick för MSFT är inte sen bara för att AAPL har kommit längre
+        self.assertEqual(orderer.push(_tick(1000, ticker="MSFT")), [])
+        self.assertEqual(orderer.stats["late"], 0)
+
+    def test_memory_is_bounded(self):
+        orderer = TickOrderer(watermark_ms=10**9, max_pending=8, history=4)
+        released = []
+        for t in range(100):
+            released.extend(orderer.push(_tick(t, price=float(t))))
+        self.assertEqual(len(orderer), 8)
+        self.assertEqual(_times(released), list(range(92)))
+        state = orderer._tickers["AAPL"]
+        self.assertEqual(len(state.recent), 4)
+        self.assertEqual(len(state.recent_keys), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import asyncio
+import base64
+import datetime as dt
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from websockets.asyncio.server import serve
+from yfinance.pricing_pb2 import PricingData
+
+from bar_store import BarStore
+from price_cache import LastPriceCache
+from tick_pipeline import TickGaps, TickPipeline, decode_message
+from tick_storage import TICK_FILE_SUFFIX, read_ticks
+
+
+def _ms(hour, minute, second):
+    return int(dt.datetime(2026, 1, 14, hour, minute, second).timestamp() * 1000)
+
+
+def _frame(ticker, time_ms, price, day_volume=100, market_hours=1):
+    pricing = PricingData(id=ticker, time=time_ms, price=price, day_volume=day_volume,
+                          market_hours=market_hours, change=0.5, change_percent=0.1)
+    return json.dumps({"type": "pricing", "message": base64.b64encode(pricing.SerializeToString()).decode()})
+
+
+class TestTickPipeline(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        print_patcher = patch('tick_pipeline.thread_safe_print')
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def _run(self, frames, **kwargs):
+        """Serves `frames` from a local websocket server once the pipeline has subscribed, then closes."""
+        subscriptions = []
+
+        async def handler(ws):
+            subscriptions.append(json.loads(await ws.recv()))
+            for frame in frames:
+                await ws.send(frame)
+
+        async def main():
+            async with serve(handler, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                pipeline = TickPipeline(["AAPL", "MSFT"], url=f"ws://127.0.0.1:{port}",
+                                        directory=self.temp_dir.name, bar_store=BarStore(),
+                                        last_prices=LastPriceCache(), reconnect=False, **kwargs)
+                await asyncio.wait_for(pipeline.run(), timeout=10)
+                return pipeline
+
+        pipeline = asyncio.run(main())
+        self.assertEqual(subscriptions, [{"subscribe": ["AAPL", "MSFT"]}])
+        return pipeline
+
+    def _ticks(self, ticker):
+        return read_ticks(os.path.join(self.temp_dir.name, ticker + TICK_FILE_SUFFIX))
+
+    def test_ticks_reach_disk_bars_and_prices(self):
+        frames = [_frame("AAPL", _ms(10, 0, 1), 100.0, 10),
+                  _frame("MSFT", _ms(10, 0, 2), 200.0, 20),
+                  _frame("AAPL", _ms(10, 0, 30), 101.0, 15),
+                  _frame("AAPL", _ms(10, 1, 5), 102.0, 18)]
+        seen = []
+        pipeline = self._run(frames, on_tick=seen.append)
+
+        aapl = self._ticks("AAPL")
+        self.assertEqual(list(aapl['PRICE']), [100.0, 101.0, 102.0])
+        self.assertEqual(list(aapl['CUM_VOLUME']), [10.0, 15.0, 18.0])
+        self.assertEqual(list(self._ticks("MSFT")['TIME']), [_ms(10, 0, 2)])
+
+        self.assertEqual(pipeline.last_prices.get("AAPL"), 102.0)
+        self.assertEqual(pipeline.last_prices.get_time("MSFT"), _ms(10, 0, 2))
+        self.assertEqual(list(pipeline.bar_store.window("AAPL", 1)["PRICE"]), [101.0, 102.0])
+
+        self.assertEqual([tick['id'] for tick in seen], ["AAPL", "MSFT", "AAPL", "AAPL"])
+        self.assertEqual(pipeline.processed, 4)
+        self.assertEqual(pipeline.latency["bars"].summary()["count"], 4)
+        self.assertEqual(pipeline.latency["disk"].summary()["count"], 4)
+
+    def test_drops_ticks_outside_market_hours_and_broken_frames(self):
+        frames = [_frame("AAPL", _ms(9, 0, 0), 99.0, market_hours=0),
+                  "not json",
+                  json.dumps({"message": "bm90IHByb3RvYnVm!"}),
+                  _frame("AAPL", _ms(10, 0, 0), 100.0)]
+        pipeline = self._run(frames)
+        self.assertEqual(list(self._ticks("AAPL")['PRICE']), [100.0])
+        self.assertEqual(pipeline.processed, 1)
+
+    def test_duplicates_and_out_of_order_ticks(self):
+        frames = [_frame("AAPL", _ms(10, 0, 2), 101.0, 20),
+                  _frame("AAPL", _ms(10, 0, 1), 100.0, 10),
+                  _frame("AAPL", _ms(10, 0, 2), 101.0, 20)]
+        pipeline = self._run(frames)
+        self.assertEqual(list(self._ticks("AAPL")['PRICE']), [100.0, 101.0])
+        self.assertEqual(pipeline.orderer.stats["duplicates"], 1)
+
+    def test_small_queues_keep_every_tick(self):
+        frames = [_frame("AAPL", _ms(10, 0, 0) + i, 100.0 + i, i) for i in range(200)]
+        pipeline = self._run(frames, queue_size=2)
+        self.assertEqual(len(self._ticks("AAPL")), 200)
+        self.assertEqual(pipeline.processed, 200)
+
+    def test_update_tickers_on_live_connection(self):
+        received = []
+
+        async def main():
+            pipeline = None
+
+            async def handler(ws):
+                received.append(json.loads(await ws.recv()))
+                pipeline.update_tickers(["MSFT", "GOOG"])
+                received.append(json.loads(await ws.recv()))
+                received.append(json.loads(await ws.recv()))
+                await ws.send(_frame("GOOG", _ms(10, 0, 0), 300.0))
+
+            async with serve(handler, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                pipeline = TickPipeline(["AAPL", "MSFT"], url=f"ws://127.0.0.1:{port}",
+                                        directory=self.temp_dir.name, bar_store=BarStore(),
+                                        last_prices=LastPriceCache(), reconnect=False)
+                await asyncio.wait_for(pipeline.run(), timeout=10)
+
+        asyncio.run(main())
+        self.assertEqual(received, [{"subscribe": ["AAPL", "MSFT"]},
+                                    {"subscribe": ["MSFT", "GOOG"]},
+                                    {"unsubscribe": ["AAPL"]}])
+        self.assertEqual(list(self._ticks("GOOG")['PRICE']), [300.0])
+
+    def test_stop_before_run(self):
+        pipeline = TickPipeline(["AAPL"], url="ws://127.0.0.1:1", directory=self.temp_dir.name,
+                                bar_store=BarStore(), last_prices=LastPriceCache())
+        pipeline.stop()
+        asyncio.run(asyncio.wait_for(pipeline.run(), timeout=5))
+        self.assertEqual(pipeline.processed, 0)
+
+
+class TestTickGaps(unittest.TestCase):
+    def test_estimate_from_rate_before_outage(self):
+        gaps = TickGaps()
+        gaps.disconnected(now=0)  # Ingen anslutning än, inget avbrott
+        self.assertEqual(gaps.estimate(now=5), 0)
+        gaps.connected(now=10)
+        for _ in range(50):
+            gaps.tick()
+        gaps.disconnected(now=20)  # 5 ticks per sekund
+        self.assertFalse(gaps.wait_connected(0))
+        self.assertEqual(gaps.estimate(now=22), 10)
+        gaps.connected(now=24)
+        self.assertTrue(gaps.wait_connected(0))
+        self.assertEqual(gaps.estimate(now=100), 20)
+
+
+class TestDecodeMessage(unittest.TestCase):
+    def test_decode(self):
+        tick = decode_message(_frame("AAPL", 1768381200000, 100.5, 42))
+        self.assertEqual(tick["id"], "AAPL")
+        self.assertEqual(tick["price"], 100.5)
+        self.assertEqual(int(tick["time"]), 1768381200000)
+        self.assertEqual(int(tick["day_volume"]), 42)
+        self.assertEqual(tick["market_hours"], 1)
+
+    def test_broken_frame(self):
+        self.assertIsNone(decode_message("{"))
+        self.assertIsNone(decode_message(json.dumps({"message": "@@@"})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import unittest
+import unittest.mock
+import os
+import shutil
+import tempfile
+import datetime as dt
+import importlib.util
+
+import numpy as np
+
+import tick_storage
+
+
+def _ms(hour, minute, second):
+    return int(dt.datetime(2026, 1, 14, hour, minute, second).timestamp() * 1000)
+
+
+class TestTickStorage(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Load the real utils module so that test_main's mocking doesn't interfere
+        spec = importlib.util.spec_from_file_location(
+            "utils_real_tick_storage",
+            os.path.join(os.path.dirname(__file__), "utils.py")
+        )
+        cls.utils_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(cls.utils_module)
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.original_path = self.utils_module.PATH_TILL_PRISER
+        self.utils_module.PATH_TILL_PRISER = self.test_dir
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+        self.utils_module.PATH_TILL_PRISER = self.original_path
+
+    def _write_ticks(self, ticker, rows):
+        path = os.path.join(self.test_dir, ticker + tick_storage.TICK_FILE_SUFFIX)
+        with open(path, "ab") as f:
+            writer = tick_storage.TickWriter(f)
+            for row in rows:
+                writer.writerow(*row)
+        return path
+
+    def test_write_and_read_roundtrip(self):
+        path = self._write_ticks("T", [(_ms(10, 0, 0), 100.5, 0.1, 0.2, 1000), (str(_ms(10, 0, 1)), 101, None, None, None)])
+        ticks = tick_storage.read_ticks(path)
+        self.assertEqual(len(ticks), 2)
+        self.assertEqual(ticks[1]['TIME'], _ms(10, 0, 1))
+        self.assertEqual(ticks[0]['PRICE'], 100.5)
+        self.assertTrue(np.isnan(ticks[1]['CUM_VOLUME']))
+
+    def test_partial_record_is_ignored(self):
+        path = self._write_ticks("T", [(_ms(10, 0, 0), 100, 0, 0, 1000)])
+        with open(path, "ab") as f:
+            f.write(b"\x00" * 7)
+        self.assertEqual(len(tick_storage.read_ticks(path)), 1)
+
+    def test_tail_ticks_binary_search(self):
+        rows = [(_ms(10, m, 0), 100 + m, 0, 0, 1000 + m) for m in range(30)]
+        path = self._write_ticks("T", rows)
+        tail = tick_storage.tail_ticks(path, 5)
+        # 10:24 är sista ticken vid eller före 10:29 - 5 minuter
+        self.assertEqual(len(tail), 6)
+        self.assertEqual(tail[0]['TIME'], _ms(10, 24, 0))
+
+    def _write_indexed(self, ticker, rows, start=0, end=None):
+        path = os.path.join(self.test_dir, ticker + tick_storage.TICK_FILE_SUFFIX)
+        writer = tick_storage.TickWriter.open(path)
+        for row in rows[start:end]:
+            writer.writerow(*row)
+        writer.close()
+        return path
+
+    def _index(self, path):
+        return np.fromfile(tick_storage.index_path(path), dtype=tick_storage.INDEX_DTYPE)
+
+    def test_writer_indexes_first_tick_of_each_minute(self):
+        rows = [(_ms(10, 0, 5), 1, 0, 0, 1), (_ms(10, 0, 40), 2, 0, 0, 2), (_ms(10, 2, 0), 3, 0, 0, 3)]
+        path = self._write_indexed("T", rows)
+        index = self._index(path)
+        self.assertEqual(list(index['MINUTE']), [_ms(10, 0, 0) // 60_000, _ms(10, 2, 0) // 60_000])
+        self.assertEqual(list(index['OFFSET']), [0, 2 * tick_storage.TICK_DTYPE.itemsize])
+
+    def test_reopened_writer_continues_index(self):
+        rows = [(_ms(10, m, s), m * 10 + s, 0, 0, m) for m in range(3) for s in (0, 30)]
+        path = self._write_indexed("T", rows, end=3)  # Slutar mitt i minut 10:01
+        self._write_indexed("T", rows, start=3)
+        index = self._index(path)
+        self.assertEqual(list(index['MINUTE']), [_ms(10, m, 0) // 60_000 for m in range(3)])
+        self.assertEqual(list(index['OFFSET'] // tick_storage.TICK_DTYPE.itemsize), [0, 2, 4])
+
+    def test_indexed_tail_matches_binary_search(self):
+        # Ojämna luckor, så att sista ticken före cutoff ibland ligger i en tidigare minut
+        seconds = [0, 20, 50, 65, 130, 135, 300, 301, 302, 420, 600, 610, 615, 700, 1000, 1012]
+        rows = [(_ms(10, 0, 0) + s * 1000, float(s), 0, 0, s) for s in seconds]
+        indexed = self._write_indexed("IDX", rows)
+        plain = self._write_ticks("PLAIN", rows)
+        for minutes in range(0, 20):
+            with self.subTest(minutes=minutes):
+                self.assertEqual(tick_storage.tail_ticks(indexed, minutes).tolist(),
+                                 tick_storage.tail_ticks(plain, minutes).tolist())
+
+    def test_tail_reads_only_indexed_range(self):
+        rows = [(_ms(10, 0, 0) + s * 1000, float(s), 0, 0, s) for s in range(0, 3600, 5)]
+        path = self._write_indexed("T", rows)
+        with unittest.mock.patch.object(tick_storage, "read_ticks", side_effect=AssertionError("read whole file")):
+            tail = tick_storage.tail_ticks(path, 2)
+        self.assertEqual(tail[0]['TIME'], rows[-1][0] - 2 * 60_000)
+        self.assertEqual(len(tail), 25)
+
+    def test_index_missing_or_too_short_falls_back(self):
+        rows = [(_ms(10, m, 0), m, 0, 0, m) for m in range(10)]
+        path = self._write_ticks("T", rows[:5])
+        self._write_indexed("T", rows, start=5)  # Indexet börjar först vid 10:05
+        self.assertEqual(len(tick_storage.tail_ticks(path, 8)), 9)
+        self.assertEqual(len(tick_storage.tail_ticks(path, 2)), 3)
+        os.remove(tick_storage.index_path(path))
+        self.assertEqual(len(tick_storage.tail_ticks(path, 8)), 9)
+
+    def test_binary_matches_csv_reader(self):
+        """The same ticks stored as CSV and binary should give identical bars."""
+        ticks = [((10, 0, 0), 100, 1000), ((10, 0, 15), 95, 1100), ((10, 0, 30), 98, 1200),
+                 ((10, 1, 0), 105, 1300), ((10, 3, 20), 101, 1600)]
+        with open(os.path.join(self.test_dir, "CSV.csv"), "w") as f:
+            f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n")
+            for (h, m, s), price, volume in ticks:
+                f.write(f"{h:02}:{m:02}:{s:02},{price},0,0,{volume}\n")
+        self._write_ticks("BIN", [(_ms(*t), price, 0, 0, volume) for t, price, volume in ticks])
+
+        _, csv_df = self.utils_module._read_and_process_ticker("CSV", 60)
+        _, bin_df = self.utils_module._read_and_process_ticker("BIN", 60)
+        self.assertTrue(csv_df.equals(bin_df))
+
+    def test_convert_csv_testtabell(self):
+        """The old test tables (without CUM_VOLUME) should convert and load."""
+        source = os.path.join(os.path.dirname(__file__), "aktiepriser", "TESTTABELL3.csv")
+        shutil.copy(source, os.path.join(self.test_dir, "TESTTABELL3.csv"))
+        _, csv_df = self.utils_module._read_and_process_ticker("TESTTABELL3", 600)
+
+        tick_path = tick_storage.convert_csv(os.path.join(self.test_dir, "TESTTABELL3.csv"), dt.date(2026, 1, 14))
+        self.assertTrue(tick_path.endswith("TESTTABELL3.ticks"))
+        _, bin_df = self.utils_module._read_and_process_ticker("TESTTABELL3", 600)
+
+        self.assertFalse(bin_df.empty)
+        self.assertTrue(csv_df[['OPEN', 'HIGH', 'LOW', 'PRICE']].equals(bin_df[['OPEN', 'HIGH', 'LOW', 'PRICE']]))
+
+    def test_convert_csv_sorts_and_indexes(self):
+        """Rows appended out of order should come out sorted, with the same index a TickWriter would write."""
+        rows = [("10:00:30", 1), ("10:00:10", 2), ("10:02:05", 3), ("10:01:00", 4), ("10:00:10", 5), ("bad", 6)]
+        csv_path = os.path.join(self.test_dir, "OOO.csv")
+        with open(csv_path, "w") as f:
+            f.write("TIME,PRICE,CHANGE_PERCENT,CHANGE,CUM_VOLUME\n")
+            for time_of_day, price in rows:
+                f.write(f"{time_of_day},{price},0,0,{price * 100}\n")
+        tick_path = tick_storage.convert_csv(csv_path, dt.date(2026, 1, 14))
+
+        ticks = tick_storage.read_ticks(tick_path)
+        self.assertEqual(list(ticks['PRICE']), [2, 5, 1, 4, 3])
+        self.assertTrue(np.all(np.diff(ticks['TIME']) >= 0))
+
+        expected_path = os.path.join(self.test_dir, "EXPECTED.ticks")
+        writer = tick_storage.TickWriter.open(expected_path)
+        for tick in ticks:
+            writer.writerow(*tick)
+        writer.close()
+        with open(tick_storage.index_path(tick_path), "rb") as f, \
+                open(tick_storage.index_path(expected_path), "rb") as g:
+            self.assertEqual(f.read(), g.read())
+        self.assertEqual(len(tick_storage.tail_ticks(tick_path, 1)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Rensar och sorterar ticks från websocketen innan de skrivs till tickfilerna och BAR_STORE.
+
+Efter en återanslutning kan Yahoo skicka samma tick igen eller ticks i fel ordning. Tickfilerna måste vara
+sorterade på tid (tick_storage binärsöker på tidskolumnen) och `VOLUME = CUM_VOLUME.diff()` blir fel om
+dagsvolymen minskar, så varje ticker går igenom en `TickOrderer` först:
+
+- exakta dubbletter av (time, price, day_volume) tas bort
+- ticks hålls kvar tills tickerns senaste tid har kommit `watermark_ms` millisekunder längre, och släpps sorterade
+  på tid (eller när tickern inte har fått någon ny tick på `watermark_ms` millisekunder)
+- ticks som kommer efter att vattenmärket redan har passerat deras tid slängs (de skulle hamna i fel ordning)
+- minskande dagsvolym flaggas och ersätts med den senaste dagsvolymen, så att diffen blir 0 och inte negativ
+
+Minnet per ticker är begränsat av `max_pending` och `history`, oavsett hur länge programmet körs.
+"""
+
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+WATERMARK_MS = 1000
+MAX_PENDING = 256  # Max antal ticks som väntar per ticker, de äldsta släpps direkt om det blir fler
+DEDUP_HISTORY = 64  # Antal senaste ticks per ticker som dubbletter jämförs mot
+
+
+def _to_int(value) -> int | None:
+    """yfinance gives int64 fields as strings."""
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _TickerState():
+    __slots__ = ("pending", "recent", "recent_keys", "max_time", "released_time", "last_volume", "last_push")
+
+    def __init__(self, history: int):
+        self.pending = []  # Heap med (tid, löpnummer, tick)
+        self.recent = deque(maxlen=history)
+        self.recent_keys = set()
+        self.max_time = None
+        self.released_time = None
+        self.last_volume = None
+        self.last_push = 0.0
+
+
+class TickOrderer():
+    """Per-ticker dedup and reordering stage. Feed ticks with `push` and write what it returns, in order.\n
+    Not thread-safe, it is meant to be used by the single thread or task that writes the ticks."""
+
+    def __init__(self, watermark_ms: int = WATERMARK_MS, max_pending: int = MAX_PENDING,
+                 history: int = DEDUP_HISTORY):
+        self.watermark_ms = watermark_ms
+        self.max_pending = max_pending
+        self.history = history
+        self.stats = {"duplicates": 0, "late": 0, "volume_decreases": 0}
+        self._tickers: dict[str, _TickerState] = {}
+        self._sequence = itertools.count()  # Ticks med samma tid släpps i den ordning de kom
+
+    def __len__(self):
+        """Number of ticks currently held back."""
+        return sum(len(state.pending) for state in self._tickers.values())
+
+    def clear(self):
+        self._tickers.clear()
+
+    def push(self, tick: dict, now: float | None = None) -> list[dict]:
+        """Adds a tick and returns the ticks (of the same ticker) that are now older than the watermark, sorted by time."""
+        ticker = tick["id"]
+        time_ms = _to_int(tick.get("time"))
+        if time_ms is None:
+            return []
+        state = self._tickers.get(ticker)
+        if state is None:
+            state = self._tickers[ticker] = _TickerState(self.history)
+
+        key = (time_ms, tick.get("price"), _to_int(tick.get("day_volume")))
+        if key in state.recent_keys:
+            self.stats["duplicates"] += 1
+            return []
+        if state.released_time is not None and time_ms < state.released_time:
+            self.stats["late"] += 1
+            return []
+
+        if len(state.recent) == state.recent.maxlen:
+            state.recent_keys.discard(state.recent[0])
+        state.recent.append(key)
+        state.recent_keys.add(key)
+
+        heapq.heappush(state.pending, (time_ms, next(self._sequence), tick))
+        state.last_push = time.monotonic() if now is None else now
+        if state.max_time is None or time_ms > state.max_time:
+            state.max_time = time_ms
+
+        released = self._release(state, state.max_time - self.watermark_ms)
+        while len(state.pending) > self.max_pending:
+            released.append(self._pop(state))
+        return released
+
+    def release_expired(self, now: float | None = None) -> list[dict]:
+        """Releases the held ticks of every ticker that hasn't received a tick in `watermark_ms`, so quiet tickers
+        aren't held forever. `now` is `time.monotonic()` seconds; Yahoo's clock isn't compared with ours."""
+        if now is None:
+            now = time.monotonic()
+        released = []
+        for state in self._tickers.values():
+            if state.pending and now - state.last_push >= self.watermark_ms / 1000:
+                while state.pending:
+                    released.append(self._pop(state))
+        return released
+
+    def flush(self) -> list[dict]:
+        """Releases every held tick, e.g. when the writer stops."""
+        released = []
+        for state in self._tickers.values():
+            while state.pending:
+                released.append(self._pop(state))
+        return released
+
+    def _release(self, state: _TickerState, up_to: int) -> list[dict]:
+        released = []
+        while state.pending and state.pending[0][0] <= up_to:
+            released.append(self._pop(state))
+        return released
+
+    def _pop(self, state: _TickerState) -> dict:
+        time_ms, _, tick = heapq.heappop(state.pending)
+        state.released_time = time_ms
+
+        volume = _to_int(tick.get("day_volume"))
+        if volume is not None:
+            if state.last_volume is not None and volume < state.last_volume:
+                self.stats["volume_decreases"] += 1
+                logging.warning("Decreasing day_volume for %s at %d (%d < %d).",
+                                tick["id"], time_ms, volume, state.last_volume)
+                tick = dict(tick, day_volume=state.last_volume)
+            else:
+                state.last_volume = volume
+        return tick
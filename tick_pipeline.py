@@ -0,0 +1,321 @@
+"""
+Asyncio-variant av datainsamlingen i hämta_aktiepriser (`INGESTION_MODE = "asyncio"`).
+
+Istället för en lyssnartråd, en deque med lås och en skrivartråd som vaknar en gång per sekund
+går varje tick genom en kedja av asyncio-steg med begränsade köer emellan:
+
+    mottagning -> avkodning -> sortering (tick_order) och staplar (BAR_STORE, LAST_PRICES) -> skrivning till tickfilerna
+
+Varje steg väntar på nästa tick istället för att polla, så en tick når bottarna så fort den har avkodats.
+När en kö är full väntar steget före (backpressure), och till slut slutar mottagningen läsa från websocketen.
+Tiden från att en tick tas emot tills den finns i staplarna och på disk mäts i `TickPipeline.latency`.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from google.protobuf.message import DecodeError
+from google.protobuf.json_format import MessageToDict
+from websockets.asyncio.client import connect
+from websockets import exceptions as ws_exceptions
+from yfinance.pricing_pb2 import PricingData
+
+from bar_store import BAR_STORE
+from price_cache import LAST_PRICES
+from tick_order import TickOrderer
+from tick_storage import TICK_FILE_SUFFIX, TickWriter
+from utils import PATH_TILL_PRISER, thread_safe_print
+
+YAHOO_URL = "wss://streamer.finance.yahoo.com/?version=2"
+SUBSCRIBE_INTERVAL = 15  # Yahoo vill att prenumerationen skickas om med jämna mellanrum, som i yfinance
+QUEUE_SIZE = 10_000
+REPORT_INTERVAL = 10  # Sekunder mellan utskrifterna om antal ticks och latens
+
+_DONE = None  # Skickas genom köerna när pipelinen ska stängas
+
+
+def decode_message(raw: str) -> dict | None:
+    """Decodes one websocket frame from Yahoo (JSON with a base64 encoded protobuf `PricingData`).\n
+    Returns the same dict as yfinance's websocket gives to its message handler, or None if the frame is broken."""
+    try:
+        pricing = PricingData()
+        pricing.ParseFromString(base64.b64decode(json.loads(raw).get("message", "")))
+    except (ValueError, AttributeError, DecodeError):
+        return None
+    if not pricing.id:
+        return None
+    return MessageToDict(pricing, preserving_proto_field_name=True)
+
+
+class LatencyStats():
+    """Keeps the latest `max_samples` latencies (in seconds) and summarizes them in milliseconds."""
+
+    def __init__(self, max_samples: int = 10_000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {"count": self.count}
+        ms = np.array(self.samples) * 1000
+        return {"count": self.count, "mean_ms": float(ms.mean()), "p50_ms": float(np.percentile(ms, 50)),
+                "p99_ms": float(np.percentile(ms, 99)), "max_ms": float(ms.max())}
+
+
+class TickGaps():
+    """Estimates how many ticks a websocket connection lost while it was down, from its tick rate before it went down.
+
+    Yahoo doesn't number its ticks, so the ones that never arrived can't be counted exactly. `now` is time.monotonic()."""
+
+    def __init__(self):
+        self.lost = 0.0  # Uppskattat antal ticks som förlorats i avslutade avbrott
+        self._received = 0
+        self._connected_at = None
+        self._down_since = None  # Inte ansluten än räknas inte som ett avbrott
+        self._rate = 0.0
+        self._connected = threading.Event()
+
+    def tick(self):
+        self._received += 1
+
+    def connected(self, now: float | None = None):
+        """The connection is up and subscribed."""
+        now = time.monotonic() if now is None else now
+        if self._down_since is not None:
+            self.lost += self._rate * (now - self._down_since)
+        self._down_since = None
+        self._connected_at, self._received = now, 0
+        self._connected.set()
+
+    def disconnected(self, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        self._connected.clear()
+        if self._connected_at is None or self._down_since is not None:
+            return
+        elapsed = now - self._connected_at
+        self._rate = self._received / elapsed if elapsed > 0 else 0.0
+        self._down_since = now
+
+    def estimate(self, now: float | None = None) -> int:
+        """Ticks lost so far, including an outage that is still going on."""
+        lost = self.lost
+        if self._down_since is not None:
+            lost += self._rate * ((time.monotonic() if now is None else now) - self._down_since)
+        return round(lost)
+
+    def wait_connected(self, timeout: float | None = None) -> bool:
+        return self._connected.wait(timeout)
+
+
+class TickPipeline():
+    """Websocket ingestion as asyncio stages connected by bounded queues. Run it with `asyncio.run(pipeline.run())`."""
+
+    def __init__(self, tickers: list[str], url: str = YAHOO_URL, directory: str = PATH_TILL_PRISER,
+                 queue_size: int = QUEUE_SIZE, bar_store=BAR_STORE, last_prices=LAST_PRICES,
+                 on_tick=None, reconnect: bool = True, orderer: TickOrderer | None = None):
+        self.tickers = list(tickers)
+        self.url = url
+        self.directory = directory
+        self.queue_size = queue_size
+        self.bar_store = bar_store
+        self.last_prices = last_prices
+        self.on_tick = on_tick  # Anropas för varje avkodad tick, t.ex. för websocket-vakthunden
+        self.reconnect = reconnect
+        self.orderer = TickOrderer() if orderer is None else orderer
+        self.latency = {"bars": LatencyStats(), "disk": LatencyStats()}
+        self.processed = 0
+        self.gaps = TickGaps()
+        self._loop = None
+        self._receiver = None
+        self._ws = None
+        self._stop_requested = False
+
+    async def run(self):
+        """Runs all stages until the connection ends (with `reconnect=False`) or `stop()` is called."""
+        self._loop = asyncio.get_running_loop()
+        raw_queue = asyncio.Queue(self.queue_size)
+        tick_queue = asyncio.Queue(self.queue_size)
+        persist_queue = asyncio.Queue(self.queue_size)
+        self._receiver = asyncio.create_task(self._receive(raw_queue))
+        await asyncio.gather(self._receiver,
+                             self._decode(raw_queue, tick_queue),
+                             self._aggregate(tick_queue, persist_queue),
+                             self._persist(persist_queue))
+
+    def stop(self):
+        """Stops receiving and lets the stages drain their queues. Can be called from any thread."""
+        self._stop_requested = True
+        if self._loop is not None and self._receiver is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._receiver.cancel)
+            except RuntimeError:
+                pass  # Pipelinen har redan stannat
+
+    async def _receive(self, out: asyncio.Queue):
+        try:
+            while not self._stop_requested:
+                delay = 1
+                try:
+                    async with connect(self.url) as ws:
+                        self._ws = ws
+                        heartbeat = asyncio.create_task(self._subscribe_periodically(ws))
+                        self.gaps.connected()  # Heartbeat-uppgiften prenumererar direkt
+                        try:
+                            async for frame in ws:
+                                self.gaps.tick()
+                                # Väntar här om kön är full
+                                await out.put((time.perf_counter(), frame))
+                        finally:
+                            self._ws = None
+                            self.gaps.disconnected()
+                            heartbeat.cancel()
+                    logging.info("WebSocket closed normally.")
+                except ws_exceptions.ConnectionClosedError as e:
+                    logging.warning("WebSocket closed with error (%s).", e)
+                    delay = 5
+                except OSError:
+                    logging.exception("Could not connect to the WebSocket.")
+                    delay = 5
+                if not self.reconnect:
+                    break
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            thread_safe_print("WebSocket listener has stopped.")
+            await out.put(_DONE)
+
+    def update_tickers(self, tickers: list[str]):
+        """Changes the subscription on the live connection without reconnecting. Can be called from any thread.\n
+        Returns a concurrent.futures.Future that is True if the subscription was sent and False if the connection
+        had closed, or None if there is no connection. The next connection subscribes to `tickers` in both cases."""
+        tickers = list(tickers)
+        keep = set(tickers)
+        removed = [t for t in self.tickers if t not in keep]
+        self.tickers = tickers
+        if self._loop is not None and self._ws is not None:
+            try:
+                return asyncio.run_coroutine_threadsafe(self._send_subscription(removed), self._loop)
+            except RuntimeError:
+                pass  # Pipelinen har redan stannat, nästa anslutning prenumererar på self.tickers
+        return None
+
+    async def _send_subscription(self, removed: list[str]) -> bool:
+        ws = self._ws
+        if ws is None:
+            return False
+        try:
+            # Prenumerera på de nya först så att inga ticks missas
+            await ws.send(json.dumps({"subscribe": self.tickers}))
+            if removed:
+                await ws.send(json.dumps({"unsubscribe": removed}))
+        except ws_exceptions.ConnectionClosed:
+            self.gaps.disconnected()
+            return False  # Återanslutningen prenumererar på self.tickers
+        return True
+
+    async def _subscribe_periodically(self, ws):
+        while True:
+            await ws.send(json.dumps({"subscribe": self.tickers}))
+            await asyncio.sleep(SUBSCRIBE_INTERVAL)
+
+    async def _decode(self, source: asyncio.Queue, out: asyncio.Queue):
+        while (item := await source.get()) is not _DONE:
+            received, frame = item
+            tick = decode_message(frame)
+            if tick is None:
+                continue
+            # market_hours 1 means normal market hours, which is what we want. Discard anything else.
+            if tick.get("market_hours") != 1:
+                thread_safe_print("datapoint not in regular market:", tick)
+                continue
+            if self.on_tick is not None:
+                self.on_tick(tick)
+            await out.put((received, tick))
+        await out.put(_DONE)
+
+    async def _aggregate(self, source: asyncio.Queue, out: asyncio.Queue):
+        done = False
+        while not done:
+            item = None
+            try:
+                # Vakna minst en gång per vattenmärke så att ticks för tysta tickers släpps
+                async with asyncio.timeout(self.orderer.watermark_ms / 1000):
+                    item = await source.get()
+            except TimeoutError:
+                pass
+
+            if item is _DONE:
+                done = True
+                ready = self.orderer.flush()
+            elif item is not None:
+                received, tick = item
+                tick["_received"] = received
+                ready = self.orderer.push(tick)
+            else:
+                ready = []
+            ready.extend(self.orderer.release_expired())
+
+            for tick in ready:
+                received = tick.pop("_received")
+                ticker = tick['id']
+                self.bar_store.add_tick(ticker, tick["time"], tick.get("price"), tick.get("day_volume"))
+                self.last_prices.update(ticker, tick.get("price"), tick["time"])
+                self.latency["bars"].add(time.perf_counter() - received)
+                await out.put((received, tick))
+        await out.put(_DONE)
+
+    async def _persist(self, source: asyncio.Queue):
+        open_files = {}
+        last_report = time.monotonic()
+        reported = 0
+        done = False
+        try:
+            while not done:
+                batch = [await source.get()]
+                # Ta allt som redan ligger i kön och flusha filerna en gång för hela omgången
+                while not source.empty():
+                    batch.append(source.get_nowait())
+                if batch[-1] is _DONE:
+                    done = True
+                    batch.pop()
+
+                touched = set()
+                for _, tick in batch:
+                    ticker = tick['id']
+                    if ticker not in open_files:
+                        open_files[ticker] = TickWriter.open(os.path.join(self.directory, f"{ticker}{TICK_FILE_SUFFIX}"))
+                    writer = open_files[ticker]
+                    writer.writerow(tick["time"], tick.get("price"), tick.get("change_percent"),
+                                    tick.get("change"), tick.get("day_volume"))
+                    touched.add(writer)
+                for writer in touched:
+                    writer.flush()
+
+                now = time.perf_counter()
+                for received, _ in batch:
+                    self.latency["disk"].add(now - received)
+                self.processed += len(batch)
+
+                if time.monotonic() - last_report >= REPORT_INTERVAL:
+                    disk = self.latency["disk"].summary()
+                    thread_safe_print(time.strftime("%H:%M:%S"), "Antal prisändringar:", self.processed - reported,
+                                      f"(latens till disk: median {disk.get('p50_ms', 0):.1f} ms, "
+                                      f"p99 {disk.get('p99_ms', 0):.1f} ms)", flush=True)
+                    reported = self.processed
+                    last_report = time.monotonic()
+        finally:
+            for writer in open_files.values():
+                writer.close()
+            thread_safe_print("Data writer stopped and files closed.")
@@ -0,0 +1,238 @@
+"""
+Binärt format för tickdata i aktiepriser/.
+
+Varje tick sparas som en post med fast storlek (se `TICK_DTYPE`) i `<TICKER>.ticks`.
+Filerna kan läsas med memory-mapping och slutet på filen hittas med binärsökning på tidskolumnen,
+istället för att tolka text rad för rad.
+
+Bredvid varje tickfil skriver `TickWriter` ett index (`<TICKER>.idx`, se `INDEX_DTYPE`) med byte-offseten för
+den första ticken i varje minut. `tail_ticks` slår upp starten i indexet och läser bara de poster som behövs,
+så kostnaden beror på hur många minuter som läses och inte på hur stor filen är.
+
+Kör filen direkt för att konvertera gamla CSV-filer: `python tick_storage.py [datum]`
+"""
+
+import datetime as dt
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+import pandas
+
+TICK_FILE_SUFFIX = ".ticks"
+INDEX_FILE_SUFFIX = ".idx"
+
+# int64 epoch-ms, float64 pris, float64 förändring i procent, float64 förändring, float64 ackumulerad dagsvolym
+TICK_DTYPE = np.dtype([
+    ('TIME', '<i8'),
+    ('PRICE', '<f8'),
+    ('CHANGE_PERCENT', '<f8'),
+    ('CHANGE', '<f8'),
+    ('CUM_VOLUME', '<f8'),
+])
+_RECORD = struct.Struct('<qdddd')
+assert _RECORD.size == TICK_DTYPE.itemsize
+
+# int64 minut sedan epoch, int64 byte-offset till minutens första post i tickfilen
+INDEX_DTYPE = np.dtype([
+    ('MINUTE', '<i8'),
+    ('OFFSET', '<i8'),
+])
+_INDEX_RECORD = struct.Struct('<qq')
+
+# Samma datum som pandas ger tider utan datum, se bar_store.BASE_DATE
+BASE_DATE = pandas.Timestamp(1900, 1, 1)
+
+
+def _float(value) -> float:
+    return float('nan') if value is None else float(value)
+
+
+def index_path(tick_path: str) -> str:
+    return os.path.splitext(tick_path)[0] + INDEX_FILE_SUFFIX
+
+
+class TickWriter():
+    """
+    Appends tick records to an open binary file, used like a `csv.writer`.\n
+    If `index` (a file opened with "ab") is given, an `INDEX_DTYPE` entry is appended to it every time a tick
+    starts a new minute. Ticks must then be written in time order, see tick_order.
+    """
+
+    def __init__(self, f, index=None):
+        self.f = f
+        self.index = index
+        self._last_minute = None
+        if index is not None:
+            self._offset = os.fstat(f.fileno()).st_size
+            self._last_minute = _last_indexed_minute(f, index)
+
+    @classmethod
+    def open(cls, tick_path: str) -> "TickWriter":
+        """Opens (or creates) a tick file and its minute index for appending."""
+        return cls(open(tick_path, "ab"), open(index_path(tick_path), "ab"))
+
+    def writerow(self, time_ms, price, change_percent, change, cum_volume):
+        time_ms = int(float(time_ms))
+        if self.index is not None:
+            minute = time_ms // 60_000
+            if self._last_minute is None or minute > self._last_minute:
+                self.index.write(_INDEX_RECORD.pack(minute, self._offset))
+                self._last_minute = minute
+            self._offset += _RECORD.size
+        self.f.write(_RECORD.pack(time_ms, _float(price), _float(
+            change_percent), _float(change), _float(cum_volume)))
+
+    def flush(self):
+        # Tickarna först, så att indexet aldrig pekar på poster som inte finns på disk
+        self.f.flush()
+        if self.index is not None:
+            self.index.flush()
+
+    def close(self):
+        self.f.close()
+        if self.index is not None:
+            self.index.close()
+
+
+def _last_indexed_minute(f, index) -> int | None:
+    """The minute a writer that continues an existing file must not index again.\n
+    If the file was written without an index (or the index is behind), the minute of the last tick is used,
+    since the first tick of that minute is further back in the file than the next record."""
+    minutes = []
+    index_size = os.fstat(index.fileno()).st_size
+    if index_size >= _INDEX_RECORD.size:
+        with open(index.name, "rb") as r:
+            r.seek(index_size - index_size % _INDEX_RECORD.size - _INDEX_RECORD.size)
+            minutes.append(_INDEX_RECORD.unpack(r.read(_INDEX_RECORD.size))[0])
+    tick_size = os.fstat(f.fileno()).st_size
+    if tick_size >= _RECORD.size:
+        with open(f.name, "rb") as r:
+            r.seek(tick_size - tick_size % _RECORD.size - _RECORD.size)
+            minutes.append(_RECORD.unpack(r.read(_RECORD.size))[0] // 60_000)
+    return max(minutes) if minutes else None
+
+
+def read_ticks(path: str) -> np.ndarray:
+    """Memory-maps all complete records in a tick file. Returns an empty array for empty files."""
+    n_records = os.path.getsize(path) // TICK_DTYPE.itemsize
+    if n_records == 0:
+        return np.empty(0, dtype=TICK_DTYPE)
+    # En halvskriven sista post (om skrivaren avbröts) hoppas över
+    return np.memmap(path, dtype=TICK_DTYPE, mode='r', shape=(n_records,))
+
+
+def tail_ticks(path: str, minutes: int) -> np.ndarray:
+    """Returns the records covering the last `minutes` minutes of a tick file.\n
+    The start includes the last tick at or before the cutoff so that the full interval is covered.
+    It is looked up in the minute index if there is one that reaches back far enough, otherwise it is
+    found with a binary search on the timestamp column."""
+    n_records = os.path.getsize(path) // TICK_DTYPE.itemsize
+    if n_records == 0:
+        return np.empty(0, dtype=TICK_DTYPE)
+    with open(path, "rb") as f:
+        f.seek((n_records - 1) * _RECORD.size)
+        last_time = _RECORD.unpack(f.read(_RECORD.size))[0]
+    cutoff = last_time - minutes * 60_000
+
+    # Sista ticken före cutoff kan ligga i minuten innan, om cutoff-minutens första tick kom efter cutoff
+    offset = _indexed_offset(index_path(path), cutoff // 60_000 - 1, n_records)
+    if offset is None:
+        ticks = read_ticks(path)
+    else:
+        # Mappa bara posterna från minutens början, inte hela filen
+        ticks = np.memmap(path, dtype=TICK_DTYPE, mode='r', offset=offset,
+                          shape=(n_records - offset // _RECORD.size,))
+    times = ticks['TIME']
+    start = max(int(np.searchsorted(times, cutoff, side='right')) - 1, 0)
+    return ticks[start:]
+
+
+def _indexed_offset(path: str, minute: int, n_records: int) -> int | None:
+    """Byte offset of the first tick of the last indexed minute at or before `minute`.\n
+    Returns None if there is no usable index, or if it doesn't reach back to `minute` (unless it starts at the
+    beginning of the file, in which case there are no earlier ticks)."""
+    try:
+        n_entries = os.path.getsize(path) // INDEX_DTYPE.itemsize
+    except OSError:
+        return None
+    if n_entries == 0:
+        return None
+    index = np.fromfile(path, dtype=INDEX_DTYPE, count=n_entries)  # En post per minut, filen är liten
+    i = int(np.searchsorted(index['MINUTE'], minute, side='right')) - 1
+    offset = int(index['OFFSET'][max(i, 0)])
+    if i < 0 and offset != 0:
+        return None
+    if offset % _RECORD.size or offset >= n_records * _RECORD.size:
+        return None  # Indexet stämmer inte med filen
+    return offset
+
+
+def last_tick(path: str) -> np.void | None:
+    """Returns the last record in a tick file, or None if the file is empty."""
+    ticks = read_ticks(path)
+    return ticks[-1] if len(ticks) else None
+
+
+def to_time_of_day(time_ms: np.ndarray) -> pandas.DatetimeIndex:
+    """Converts epoch-ms timestamps to local times of day with the date 1900-01-01, truncated to whole seconds.
+    This is the same format as the TIME column of the old CSV files once parsed by pandas."""
+    time_ms = np.asarray(time_ms, dtype=np.int64)
+    if len(time_ms) == 0:
+        return pandas.DatetimeIndex([])
+    # En fil innehåller bara en dag, så samma UTC-offset gäller för alla poster
+    offset = time.localtime(time_ms[-1] / 1000).tm_gmtoff
+    seconds_of_day = (time_ms // 1000 + offset) % 86400
+    return pandas.DatetimeIndex(BASE_DATE + pandas.to_timedelta(seconds_of_day, unit='s'))
+
+
+def convert_csv(csv_path: str, date: dt.date | None = None, tick_path: str | None = None) -> str:
+    """Converts an old per-ticker CSV file to the binary tick format.\n
+    The CSV files only contain a time of day, so `date` (today by default) is used to build the timestamps.
+    Rows with invalid times are skipped and missing columns are stored as NaN. The CSV rows were appended in the
+    order they arrived, so the records are sorted by time (ticks with the same time keep their order) and written
+    together with a minute index, like `TickWriter.open`. Returns the path of the new file."""
+    if date is None:
+        date = dt.date.today()
+    if tick_path is None:
+        tick_path = os.path.splitext(csv_path)[0] + TICK_FILE_SUFFIX
+
+    df = pandas.read_csv(csv_path, header=0, dtype=str)
+    times = pandas.to_datetime(df.iloc[:, 0], format="%H:%M:%S", errors="coerce")
+    valid = times.notna()
+
+    records = np.empty(int(valid.sum()), dtype=TICK_DTYPE)
+    local_times = [dt.datetime.combine(date, t.time()) for t in times[valid]]
+    records['TIME'] = [int(t.timestamp() * 1000) for t in local_times]
+    for i, column in enumerate(['PRICE', 'CHANGE_PERCENT', 'CHANGE', 'CUM_VOLUME'], start=1):
+        if i < df.shape[1]:
+            records[column] = pandas.to_numeric(df.iloc[:, i][valid], errors="coerce").to_numpy()
+        else:
+            records[column] = np.nan
+
+    records = records[np.argsort(records['TIME'], kind='stable')]
+    minutes = records['TIME'] // 60_000
+    first = np.flatnonzero(np.diff(minutes, prepend=minutes[:1] - 1))  # Första posten i varje minut
+    index = np.empty(len(first), dtype=INDEX_DTYPE)
+    index['MINUTE'] = minutes[first]
+    index['OFFSET'] = first * TICK_DTYPE.itemsize
+
+    with open(tick_path, "wb") as f:
+        f.write(records.tobytes())
+    with open(index_path(tick_path), "wb") as f:
+        f.write(index.tobytes())
+    return tick_path
+
+
+if __name__ == "__main__":
+    from utils import PATH_TILL_PRISER
+
+    # Konvertera alla CSV-filer i aktiepriser/ som inte redan har en binär fil
+    date = dt.date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+    for filename in os.listdir(PATH_TILL_PRISER):
+        name, ext = os.path.splitext(filename)
+        if ext != ".csv" or os.path.exists(os.path.join(PATH_TILL_PRISER, name + TICK_FILE_SUFFIX)):
+            continue
+        print("Konverterar", filename, "->", convert_csv(os.path.join(PATH_TILL_PRISER, filename), date))
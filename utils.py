@@ -3,11 +3,15 @@ Kodfil med olika hjälpfunktioner och konstanter för att hålla ordning på sak
 """
 
 from enum import Enum
+import numpy as np
 import pandas
 import os
 from io import StringIO
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from threading import Lock
+from bar_store import BAR_STORE
+import kernels
+import tick_storage
 
 
 class ERROR_CODES(Enum):
@@ -32,114 +36,194 @@ PATH_TILL_PORTFÖLJER = os.path.join(BASE_DIR, "portföljer")
 PATH_TILL_LOGGAR = os.path.join(BASE_DIR, "portföljer", "loggar")
 
 
+def _read_csv_tail(price_path: str, length: int) -> pandas.DataFrame:
+    """Reads enough rows from the end of an old text CSV price file to cover the last `length` minutes."""
+    # This logic efficiently reads the end of a potentially large CSV file
+    # without loading the entire file into memory. It starts by reading a small
+    # chunk from the end and doubles the chunk size until it has enough data
+    # to cover the `long_period` for the EMA calculation.
+    chunk_size = 1024 * 8  # Start with 8KB
+    df = pandas.DataFrame()
+
+    with open(price_path, 'rb') as f:
+        # Get the total file size to read from the end
+        f.seek(0, os.SEEK_END)
+        file_size = f.tell()
+
+        while True:
+            # Calculate start position for reading, ensuring it's not negative
+            read_pos = max(0, file_size - chunk_size)
+            f.seek(read_pos)
+
+            # Read and decode the chunk of the file
+            tail_data = f.read().decode('utf-8')
+
+            # If we didn't start at the beginning, the first line might be partial.
+            # To avoid a parsing error, we find the first full newline and skip to it.
+            if read_pos > 0:
+                first_newline = tail_data.find('\n')
+                if first_newline != -1:
+                    tail_data = tail_data[first_newline + 1:]
+
+            # Read the text chunk into a pandas DataFrame
+            df = pandas.read_csv(StringIO(tail_data), names=[
+                                 "TIME", "PRICE", "CHANGE_PERCENT", "CHANGE", "CUM_VOLUME"], header=None)
+
+            # ta bort första rad om det är header
+            if read_pos == 0:
+                if not df.empty and df.iloc[0]["TIME"] == "TIME":
+                    df = df.iloc[1:]
+
+            # Convert time strings to datetime objects. Invalid formats become NaT (Not a Time).
+            df['TIME'] = pandas.to_datetime(
+                df['TIME'], format="%H:%M:%S", errors="coerce")
+            df.dropna(subset=['TIME'], inplace=True)
+
+            if df.empty:  # If chunk is empty or all times were invalid
+                if read_pos == 0:
+                    break
+                chunk_size *= 2  # Not enough valid data, increase chunk size
+                continue
+
+            # Check if the data we've read covers the required time window
+            latest_time = df['TIME'].iloc[-1]
+            earliest_needed = latest_time - \
+                pandas.Timedelta(minutes=length)
+            earliest_in_df = df['TIME'].iloc[0]
+
+            if earliest_in_df <= earliest_needed or read_pos == 0:
+                break  # We have enough data or have read the whole file
+
+            chunk_size *= 2  # Not enough data, double the chunk size and retry
+
+    return df
+
+
+def _read_tick_file_tail(tick_path: str, length: int) -> pandas.DataFrame:
+    """Reads the last `length` minutes from a binary tick file, see `tick_storage`."""
+    ticks = tick_storage.tail_ticks(tick_path, length)
+    return pandas.DataFrame({
+        'TIME': tick_storage.to_time_of_day(ticks['TIME']),
+        'PRICE': ticks['PRICE'],
+        'CUM_VOLUME': ticks['CUM_VOLUME'],
+    })
+
+
+def _resample_to_bars(df: pandas.DataFrame) -> pandas.DataFrame:
+    """Resamples ticks with the columns TIME, PRICE and CUM_VOLUME to 1-minute OHLCV bars."""
+    if df['TIME'].isna().any():
+        df = df.dropna(subset=['TIME'])
+
+    # Se till att alla kolumner finns även om ingen data finns för att förhindra KeyErrors
+    if df.empty:
+        return pandas.DataFrame(
+            columns=['OPEN', 'HIGH', 'LOW', 'PRICE', 'VOLUME'])
+
+    # Ensure the 'PRICE' column is numeric, converting non-numeric values to NaN
+    prices = pandas.to_numeric(df['PRICE'], errors='coerce').to_numpy(dtype=float)
+    cum_volumes = pandas.to_numeric(df['CUM_VOLUME'], errors='coerce').to_numpy(dtype=float)
+    times = df['TIME'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+    # Group by 1-minute intervals and calculate OHLCV, in a compiled loop (kernels.resample_ticks)
+    # instead of df.groupby(pandas.Grouper(key='TIME', freq='1min')).agg(...)
+    if len(times) > 1 and (np.diff(times) < 0).any():
+        order = np.argsort(times, kind='stable')
+        times, prices, cum_volumes = times[order], prices[order], cum_volumes[order]
+    first, bars = kernels.resample_ticks(times, prices, cum_volumes)
+    # 'PRICE' column is the 'Close', VOLUME is the volume per minute instead of cumulative
+    return pandas.DataFrame(
+        bars, columns=['OPEN', 'HIGH', 'LOW', 'PRICE', 'VOLUME'],
+        index=pandas.date_range(pandas.Timestamp(first), periods=len(bars), freq='1min', name='TIME'))
+
+
 def _read_and_process_ticker(ticker: str, length: int):
-    """Reads and processes the data for a single ticker from its CSV file.\n
+    """Reads and processes the data for a single ticker from its price file.\n
+    The binary tick file (`<ticker>.ticks`) is used if it exists, otherwise the old text CSV.\n
     `length` is the amount of minutes from the end to read.
     Data is resampled to be in 1-minute intervals, where each datapoint is the last value during that time
     """
+    tick_path = os.path.join(PATH_TILL_PRISER, f"{ticker}{tick_storage.TICK_FILE_SUFFIX}")
     price_path = os.path.join(PATH_TILL_PRISER, f"{ticker}.csv")
-    if not os.path.isfile(price_path):
+    if os.path.isfile(tick_path):
+        price_path, read_tail = tick_path, _read_tick_file_tail
+    elif os.path.isfile(price_path):
+        read_tail = _read_csv_tail
+    else:
         print(f"Couldn't find file: {price_path}")
         return ticker, None
 
     try:
-        # This logic efficiently reads the end of a potentially large CSV file
-        # without loading the entire file into memory. It starts by reading a small
-        # chunk from the end and doubles the chunk size until it has enough data
-        # to cover the `long_period` for the EMA calculation.
-        chunk_size = 1024 * 8  # Start with 8KB
-        df = pandas.DataFrame()
-
-        with open(price_path, 'rb') as f:
-            # Get the total file size to read from the end
-            f.seek(0, os.SEEK_END)
-            file_size = f.tell()
-
-            while True:
-                # Calculate start position for reading, ensuring it's not negative
-                read_pos = max(0, file_size - chunk_size)
-                f.seek(read_pos)
-
-                # Read and decode the chunk of the file
-                tail_data = f.read().decode('utf-8')
-
-                # If we didn't start at the beginning, the first line might be partial.
-                # To avoid a parsing error, we find the first full newline and skip to it.
-                if read_pos > 0:
-                    first_newline = tail_data.find('\n')
-                    if first_newline != -1:
-                        tail_data = tail_data[first_newline + 1:]
-
-                # Read the text chunk into a pandas DataFrame
-                df = pandas.read_csv(StringIO(tail_data), names=[
-                                     "TIME", "PRICE", "CHANGE_PERCENT", "CHANGE", "CUM_VOLUME"], header=None)
-
-                # ta bort första rad om det är header
-                if read_pos == 0:
-                    if not df.empty and df.iloc[0]["TIME"] == "TIME":
-                        df = df.iloc[1:]
-
-                # Convert time strings to datetime objects. Invalid formats become NaT (Not a Time).
-                df['TIME'] = pandas.to_datetime(
-                    df['TIME'], format="%H:%M:%S", errors="coerce")
-                df.dropna(subset=['TIME'], inplace=True)
-
-                if df.empty:  # If chunk is empty or all times were invalid
-                    if read_pos == 0:
-                        break
-                    chunk_size *= 2  # Not enough valid data, increase chunk size
-                    continue
+        df = read_tail(price_path, length)
+        return ticker, _resample_to_bars(df)
+
+    except Exception as e:
+        print(f"Error reading or processing {price_path}: {e}")
+        return ticker, None
 
-                # Check if the data we've read covers the required time window
-                latest_time = df['TIME'].iloc[-1]
-                earliest_needed = latest_time - \
-                    pandas.Timedelta(minutes=length)
-                earliest_in_df = df['TIME'].iloc[0]
 
-                if earliest_in_df <= earliest_needed or read_pos == 0:
-                    break  # We have enough data or have read the whole file
+def resample_bars(df: pandas.DataFrame, timeframe: int) -> pandas.DataFrame:
+    """Rolls 1-minute bars up to `timeframe`-minute bars starting at minutes divisible by `timeframe`,
+    the same way as `BarStore.window`."""
+    return df.resample(f"{timeframe}min").agg(
+        {'OPEN': 'first', 'HIGH': 'max', 'LOW': 'min', 'PRICE': 'last', 'VOLUME': 'sum'})
 
-                chunk_size *= 2  # Not enough data, double the chunk size and retry
 
-        # Ensure the 'PRICE' column is numeric, converting non-numeric values to NaN
-        df['PRICE'] = pandas.to_numeric(df['PRICE'], errors='coerce')
-        df['CUM_VOLUME'] = pandas.to_numeric(df['CUM_VOLUME'], errors='coerce')
+class OneMinuteBars():
+    """`timeframe` of a bot that only runs on 1-minute bars: it is always 1 and setting another timeframe raises ValueError.
+    The bots that support longer bars take `timeframe` as an argument instead, see mäklare/sma.py"""
 
-        # Group by 1-minute intervals and calculate OHLCV
-        ohlcv_df = df.groupby(pandas.Grouper(key='TIME', freq='1min')).agg(
-            OPEN=('PRICE', 'first'),
-            HIGH=('PRICE', 'max'),
-            LOW=('PRICE', 'min'),
-            PRICE=('PRICE', 'last'),  # 'PRICE' column becomes the 'Close'
-            # Take the last cumulative volume for the minute
-            CUM_VOLUME=('CUM_VOLUME', 'last')
-        )
+    def __get__(self, bot, owner=None) -> int:
+        return 1
 
-        # Get volume per trade instead of cumulative
-        ohlcv_df['VOLUME'] = ohlcv_df['CUM_VOLUME'].diff().fillna(0)
-        ohlcv_df.drop(columns=['CUM_VOLUME'], inplace=True)
+    def __set__(self, bot, timeframe: int):
+        if timeframe != 1:
+            raise ValueError(f"{type(bot).__name__} only runs on 1-minute bars, not {timeframe}-minute bars")
 
-        # Se till att alla kolumner finns även om ingen data finns för att förhindra KeyErrors
-        if ohlcv_df.empty:
-            df = pandas.DataFrame(
-                columns=['OPEN', 'HIGH', 'LOW', 'PRICE', 'VOLUME'])
-        else:
-            df = ohlcv_df.ffill()
 
-        return ticker, df
+def data_sequences(tickers: list[str]) -> dict:
+    """Returns a value per ticker that changes whenever the data `retrieve_data` would return for it changes:
+    the `BAR_STORE` sequence number, or the size and modification time of its price file.
+    Tickers without any data are left out.
 
-    except Exception as e:
-        print(f"Error reading or processing {price_path}: {e}")
-        return ticker, None
+    Call it before `retrieve_data`, so that a tick arriving in between makes the data look changed rather than unchanged."""
+    sequences = {}
+    for t in tickers:
+        sequence = BAR_STORE.sequence(t)
+        if sequence is None:
+            for suffix in (tick_storage.TICK_FILE_SUFFIX, ".csv"):
+                try:
+                    stat = os.stat(os.path.join(PATH_TILL_PRISER, f"{t}{suffix}"))
+                except OSError:
+                    continue
+                sequence = (stat.st_size, stat.st_mtime_ns)
+                break
+        if sequence is not None:
+            sequences[t] = sequence
+    return sequences
 
 
-def retrieve_data(tickers: list[str], length: int):
+def retrieve_data(tickers: list[str], length: int, timeframe: int = 1):
     """Retrieves latest data from all stocks defined in tickers.
-    This method uses a ThreadPoolExecutor to parallelize file reading.\n
-    `length` is the amount of minutes from the end to read.\n
+    Bars are taken from the in-memory `BAR_STORE` when it covers the interval, the rest are read from disk
+    using a ThreadPoolExecutor to parallelize file reading.\n
+    `length` is the amount of bars from the end to read, and `timeframe` the length of a bar in minutes.\n
     returns a dictionary with dataframes containing all available data within the provided interval for each ticker.
-    Data is resampled to be in 1-minute intervals, where each datapoint is the last value during that time"""
+    Data is resampled to be in 1-minute intervals, where each datapoint is the last value during that time,
+    and then rolled up to `timeframe` minutes"""
     dataframes = {}
+    tickers_to_read = []
+    # Bottar med längre perioder än lagret rymmer gör det större, annars skulle de läsa från disk varje gång
+    BAR_STORE.reserve(length + 1)
+    for t in tickers:
+        df = BAR_STORE.window(t, length, timeframe)
+        if df is None:
+            tickers_to_read.append(t)
+        elif not df.empty:
+            dataframes[t] = df
+
+    if not tickers_to_read:
+        return dataframes
+
     # Use a thread pool to read and process multiple CSV files concurrently.
     # This is highly effective for I/O-bound tasks like reading from disk.
     # `max_workers=None` lets the library choose an optimal number of threads.
@@ -147,13 +231,15 @@ def retrieve_data(tickers: list[str], length: int):
         # Submit all file reading tasks to the pool.
         # `future_to_ticker` maps each running task (future) back to its stock ticker.
         future_to_ticker = {executor.submit(
-            _read_and_process_ticker, t, length): t for t in tickers}
+            _read_and_process_ticker, t, length * timeframe): t for t in tickers_to_read}
 
         # `as_completed` yields futures as they finish, allowing us to process results immediately.
         for future in as_completed(future_to_ticker):
             ticker, df = future.result()
             if df is not None and not df.empty:
-                dataframes[ticker] = df
+                # Fyll i historiken i BAR_STORE så att nästa anrop inte behöver läsa från disk
+                BAR_STORE.seed(ticker, df, timeframe)
+                dataframes[ticker] = df if timeframe == 1 else resample_bars(df, timeframe)
 
     return dataframes
 